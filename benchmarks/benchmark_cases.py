@@ -0,0 +1,177 @@
+#
+# Workloads of the shadow4 benchmark suite (see run_benchmarks.py).
+#
+# Each case is a function setup(nrays) that prepares the inputs (not timed) and returns a function without
+# arguments that runs the timed work. All the cases run offline: the material constants are given by the user
+# (refraction index, attenuation coefficient) or calculated with xraylib (crystals, skipped if not installed).
+#
+import numpy
+from collections import OrderedDict
+
+from syned.beamline.element_coordinates import ElementCoordinates
+from syned.beamline.shape import Rectangle
+from syned.storage_ring.electron_beam import ElectronBeam
+
+from shadow4.sources.source_geometrical.source_geometrical import SourceGeometrical
+
+#
+# sources
+#
+def setup_source_geometrical(nrays):
+    light_source = _get_geometrical_source(nrays)
+    return light_source.get_beam
+
+def setup_source_undulator(nrays):
+    from shadow4.sources.undulator.s4_undulator import S4Undulator
+    from shadow4.sources.undulator.s4_undulator_light_source import S4UndulatorLightSource
+
+    electron_beam = ElectronBeam(energy_in_GeV=6.0, energy_spread=0.0, current=0.2,
+                                 moment_xx=(30e-6)**2, moment_xpxp=(4e-6)**2,
+                                 moment_yy=(5e-6)**2, moment_ypyp=(2e-6)**2)
+    undulator = S4Undulator(K_vertical=0.25, period_length=0.032, number_of_periods=50,
+                            emin=10490.0, emax=10510.0, ng_e=3, maxangle=0.015,
+                            ng_t=100, ng_p=11, ng_j=20,
+                            code_undul_phot="internal", flag_emittance=1, flag_size=2)
+    undulator.set_energy_monochromatic(undulator.resonance_energy(electron_beam.gamma()))
+    light_source = S4UndulatorLightSource(name="", electron_beam=electron_beam, magnetic_structure=undulator,
+                                          nrays=nrays, seed=5655452)
+    return light_source.get_beam
+
+def setup_source_wiggler(nrays):
+    from shadow4.sources.wiggler.s4_wiggler import S4Wiggler
+    from shadow4.sources.wiggler.s4_wiggler_light_source import S4WigglerLightSource
+
+    electron_beam = ElectronBeam(energy_in_GeV=1.9, current=0.4,
+                                 moment_xx=(39e-6)**2, moment_xpxp=(2000e-12 / 51e-6)**2,
+                                 moment_yy=(31e-6)**2, moment_ypyp=(30e-12 / 31e-6)**2)
+    wiggler = S4Wiggler(magnetic_field_periodic=1, K_vertical=10.0, period_length=0.1, number_of_periods=10,
+                        emin=10000.0, emax=10100.0, ng_e=11, ng_j=51, flag_emittance=1)
+    light_source = S4WigglerLightSource(name="", electron_beam=electron_beam, magnetic_structure=wiggler,
+                                        nrays=nrays, seed=12345)
+    return light_source.get_beam
+
+def setup_source_bending_magnet(nrays):
+    from shadow4.sources.bending_magnet.s4_bending_magnet import S4BendingMagnet
+    from shadow4.sources.bending_magnet.s4_bending_magnet_light_source import S4BendingMagnetLightSource
+
+    electron_beam = ElectronBeam(energy_in_GeV=1.9, current=0.4,
+                                 moment_xx=(39e-6)**2, moment_xpxp=(2000e-12 / 51e-6)**2,
+                                 moment_yy=(31e-6)**2, moment_ypyp=(30e-12 / 31e-6)**2)
+    bending_magnet = S4BendingMagnet.initialize_from_magnetic_field_divergence_and_electron_energy(
+                                 magnetic_field=-1.26754, divergence=69e-3, electron_energy_in_GeV=1.9,
+                                 emin=1000.0, emax=1001.0, ng_e=200, ng_j=100, flag_emittance=1)
+    light_source = S4BendingMagnetLightSource(electron_beam=electron_beam, magnetic_structure=bending_magnet,
+                                              nrays=nrays, seed=123456)
+    return light_source.get_beam
+
+#
+# beamline elements
+#
+def setup_mirror_conic(nrays):
+    from shadow4.beamline.optical_elements.mirrors.s4_ellipsoid_mirror import S4EllipsoidMirror, S4EllipsoidMirrorElement
+
+    element = S4EllipsoidMirrorElement(
+        optical_element=S4EllipsoidMirror(boundary_shape=Rectangle(-0.01, 0.01, -0.1, 0.1), surface_calculation=0,
+                                          is_cylinder=0, convexity=1, p_focus=10.0, q_focus=6.0,
+                                          grazing_angle=0.003, f_reflec=1, f_refl=1,
+                                          refraction_index=1.0 - 1.5e-5 + 1.0e-7j),
+        coordinates=ElementCoordinates(p=10.0, q=6.0, angle_radial=numpy.pi / 2 - 0.003),
+        input_beam=_get_geometrical_source(nrays).get_beam())
+    return element.trace_beam
+
+def setup_mirror_toroid(nrays):
+    from shadow4.beamline.optical_elements.mirrors.s4_toroid_mirror import S4ToroidMirror, S4ToroidMirrorElement
+
+    element = S4ToroidMirrorElement(
+        optical_element=S4ToroidMirror(boundary_shape=Rectangle(-0.01, 0.01, -0.1, 0.1),
+                                       min_radius=0.1, maj_radius=100.0, f_torus=0),
+        coordinates=ElementCoordinates(p=10.0, q=6.0, angle_radial=numpy.pi / 2 - 0.003),
+        input_beam=_get_geometrical_source(nrays).get_beam())
+    return element.trace_beam
+
+def setup_mirror_mesh(nrays):
+    from shadow4.beamline.optical_elements.mirrors.s4_numerical_mesh_mirror import S4NumericalMeshMirror, S4NumericalMeshMirrorElement
+
+    xx = numpy.linspace(-0.02, 0.02, 101)
+    yy = numpy.linspace(-0.2, 0.2, 501)
+    zz = 1e-7 * numpy.outer(numpy.sin(2 * numpy.pi * yy / 0.05), numpy.cos(2 * numpy.pi * xx / 0.04)) # shape (ny, nx)
+    element = S4NumericalMeshMirrorElement(
+        optical_element=S4NumericalMeshMirror(boundary_shape=Rectangle(-0.01, 0.01, -0.1, 0.1), xx=xx, yy=yy, zz=zz),
+        coordinates=ElementCoordinates(p=10.0, q=6.0, angle_radial=numpy.pi / 2 - 0.003),
+        input_beam=_get_geometrical_source(nrays).get_beam())
+    return element.trace_beam
+
+def setup_crystal(nrays):
+    import xraylib # the material constants are calculated with xraylib (offline)
+    from shadow4.beamline.optical_elements.crystals.s4_plane_crystal import S4PlaneCrystal, S4PlaneCrystalElement
+
+    photon_energy = 8000.0
+    bragg_angle = numpy.arcsin(12398.42 / photon_energy / 2 / 3.1356)
+    light_source = _get_geometrical_source(nrays, photon_energy=photon_energy, divergence=1e-5)
+    element = S4PlaneCrystalElement(
+        optical_element=S4PlaneCrystal(material="Si", miller_index_h=1, miller_index_k=1, miller_index_l=1,
+                                       is_thick=1, f_central=True, f_phot_cent=0, phot_cent=photon_energy,
+                                       material_constants_library_flag=0),
+        coordinates=ElementCoordinates(p=10.0, q=1.0, angle_radial=numpy.pi / 2 - bragg_angle,
+                                       angle_radial_out=numpy.pi / 2 - bragg_angle),
+        input_beam=light_source.get_beam())
+    return element.trace_beam
+
+def setup_grating(nrays):
+    from shadow4.beamline.optical_elements.gratings.s4_plane_grating import S4PlaneGrating, S4PlaneGratingElement
+
+    element = S4PlaneGratingElement(
+        optical_element=S4PlaneGrating(boundary_shape=None, ruling=600000.0,
+                                       ruling_coeff_linear=260818.35944225, ruling_coeff_quadratic=260818.35944225,
+                                       ruling_coeff_cubic=13648.21037618, ruling_coeff_quartic=0.0,
+                                       f_central=False, order=0, f_ruling=0),
+        coordinates=ElementCoordinates(p=10.0, q=6.0,
+                                       angle_radial=88.840655 * numpy.pi / 180,
+                                       angle_radial_out=87.588577 * numpy.pi / 180),
+        input_beam=_get_geometrical_source(nrays, photon_energy=1000.0).get_beam())
+    return element.trace_beam
+
+def setup_crl(nrays):
+    from shadow4.beamline.optical_elements.refractors.s4_crl import S4CRL, S4CRLElement
+
+    element = S4CRLElement(
+        optical_element=S4CRL(n_lens=10, piling_thickness=2.5e-3, boundary_shape=None, thickness=50e-6,
+                              surface_shape=2, convex_to_the_beam=1, cylinder_angle=0,
+                              ri_calculation_mode=0, refraction_index=1.0 - 1.4e-5, attenuation_coefficient=0.5,
+                              radius=200e-6),
+        coordinates=ElementCoordinates(p=10.0, q=20.0, angle_radial=0.0, angle_azimuthal=0.0, angle_radial_out=numpy.pi),
+        input_beam=_get_geometrical_source(nrays, photon_energy=10000.0).get_beam())
+    return element.trace_beam
+
+def setup_screen(nrays):
+    from shadow4.beamline.optical_elements.absorbers.s4_screen import S4Screen, S4ScreenElement
+
+    element = S4ScreenElement(
+        optical_element=S4Screen(boundary_shape=Rectangle(-1e-4, 1e-4, -1e-4, 1e-4), i_stop=False),
+        coordinates=ElementCoordinates(p=10.0, q=0.0),
+        input_beam=_get_geometrical_source(nrays).get_beam())
+    return element.trace_beam
+
+#
+# registry: name -> setup function
+#
+CASES = OrderedDict([
+    ("source_geometrical",     setup_source_geometrical),
+    ("source_undulator",       setup_source_undulator),
+    ("source_wiggler",         setup_source_wiggler),
+    ("source_bending_magnet",  setup_source_bending_magnet),
+    ("mirror_conic",           setup_mirror_conic),
+    ("mirror_toroid",          setup_mirror_toroid),
+    ("mirror_mesh",            setup_mirror_mesh),
+    ("crystal",                setup_crystal),
+    ("grating",                setup_grating),
+    ("crl",                    setup_crl),
+    ("screen",                 setup_screen),
+    ])
+
+def _get_geometrical_source(nrays, photon_energy=10000.0, divergence=1e-4):
+    light_source = SourceGeometrical(nrays=nrays, seed=5676561)
+    light_source.set_spatial_type_gaussian(sigma_h=5e-6, sigma_v=1e-6)
+    light_source.set_angular_distribution_gaussian(sigdix=divergence, sigdiz=0.1 * divergence)
+    light_source.set_energy_distribution_singleline(photon_energy, unit='eV')
+    return light_source
@@ -0,0 +1,248 @@
+#
+# shadow4 benchmark suite.
+#
+# Times the light sources and the beamline elements defined in benchmark_cases.py for several numbers of rays,
+# and reports the throughput (rays/s) and the peak memory (increase of the resident set size in an untimed run).
+# The results can be stored as a baseline and compared with later runs to flag slowdowns.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.run_benchmarks                                    # all cases, 1e3...1e6 rays
+#     python -m benchmarks.run_benchmarks --cases mirror_conic screen --nrays 1e3 1e7 --max-rays 1e7
+#     python -m benchmarks.run_benchmarks --save-baseline baseline.json
+#     python -m benchmarks.run_benchmarks --baseline baseline.json --threshold 0.2   # exit code 1 if slower
+#
+# Note: 1e7 rays need several GB of memory (each beam copy is 1.44 GB).
+#
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import threading
+import contextlib
+
+import numpy
+
+from benchmarks.benchmark_cases import CASES
+
+DEFAULT_NRAYS = [1e3, 1e4, 1e5, 1e6, 1e7]
+
+def run_case(name, nrays, repeat=3, measure_memory=True, verbose=False):
+    """
+    Runs a benchmark case.
+
+    Parameters
+    ----------
+    name : str
+        The case name (see benchmark_cases.CASES).
+
+    nrays : int
+        The number of rays.
+
+    repeat : int, optional
+        The number of timed runs (the minimum time is reported). Only one run is done if it takes more than 10 s.
+
+    measure_memory : boolean, optional
+        If True, measure the peak memory (increase of the resident set size, sampled every 2 ms during a first
+        untimed run; Linux only).
+
+    verbose : boolean, optional
+        If False, the output printed by shadow4 is suppressed.
+
+    Returns
+    -------
+    dict
+        With keys 'time' (s), 'rays_per_second', 'peak_memory' (bytes, or None), or 'skipped' (the reason).
+
+    """
+    setup = CASES[name]
+    with _quiet(verbose):
+        try:
+            run = setup(nrays)
+            # first run: warm up, check that the case runs, and measure the memory
+            with _PeakMemory(enabled=measure_memory) as memory:
+                run()
+        except ImportError as e:
+            return {"skipped": "missing dependency: %s" % e}
+        except Exception as e:
+            return {"skipped": "error: %s" % repr(e)}
+
+        times = []
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - t0)
+            if times[-1] > 10.0: break
+
+    return {"time": min(times), "rays_per_second": nrays / min(times), "peak_memory": memory.peak_memory}
+
+def run_benchmarks(cases=None, nrays_list=DEFAULT_NRAYS, max_rays=1e6, repeat=3, measure_memory=True, verbose=False):
+    """
+    Runs several benchmark cases.
+
+    Parameters
+    ----------
+    cases : list, optional
+        The case names (default: all).
+
+    nrays_list : list, optional
+        The numbers of rays.
+
+    max_rays : float, optional
+        The maximum number of rays (the larger values of nrays_list are ignored).
+
+    repeat : int, optional
+        The number of timed runs.
+
+    measure_memory : boolean, optional
+        If True, measure the peak memory.
+
+    verbose : boolean, optional
+        If False, the output printed by shadow4 is suppressed.
+
+    Returns
+    -------
+    dict
+        The results: {'info': {...}, 'results': {case: {nrays: result}}}.
+
+    """
+    if cases is None: cases = list(CASES.keys())
+
+    results = {}
+    print("%-24s %10s %10s %14s %12s" % ("case", "nrays", "time [s]", "rays/s", "peak [MB]"))
+    for name in cases:
+        if name not in CASES: raise Exception("Unknown benchmark case: %s (available: %s)" % (name, ", ".join(CASES.keys())))
+        results[name] = {}
+        for nrays in nrays_list:
+            nrays = int(nrays)
+            if nrays > max_rays: continue
+
+            result = run_case(name, nrays, repeat=repeat, measure_memory=measure_memory, verbose=verbose)
+            results[name][str(nrays)] = result
+            if "skipped" in result:
+                print("%-24s %10d   skipped (%s)" % (name, nrays, result["skipped"]))
+                break
+            print("%-24s %10d %10.4f %14.4g %12s" % (name, nrays, result["time"], result["rays_per_second"],
+                  "-" if result["peak_memory"] is None else "%.1f" % (result["peak_memory"] / 2**20)))
+            sys.stdout.flush()
+
+    return {"info": get_machine_info(), "results": results}
+
+def compare_with_baseline(results, baseline, threshold=0.2):
+    """
+    Compares results with a baseline.
+
+    Parameters
+    ----------
+    results : dict
+        The results of run_benchmarks().
+
+    baseline : dict
+        The baseline (results of a previous run_benchmarks()).
+
+    threshold : float, optional
+        The relative loss of throughput (rays/s) flagged as slowdown.
+
+    Returns
+    -------
+    list
+        The slowdowns: a list of (case, nrays, rays_per_second, baseline_rays_per_second).
+
+    """
+    slowdowns = []
+    print("\n%-24s %10s %14s %14s %8s" % ("case", "nrays", "rays/s", "baseline", "ratio"))
+    for name, case_results in results["results"].items():
+        for nrays, result in case_results.items():
+            reference = baseline["results"].get(name, {}).get(nrays, {})
+            if "rays_per_second" not in result or "rays_per_second" not in reference: continue
+            ratio = result["rays_per_second"] / reference["rays_per_second"]
+            flag = ""
+            if ratio < 1.0 - threshold:
+                flag = "SLOWER"
+                slowdowns.append((name, int(nrays), result["rays_per_second"], reference["rays_per_second"]))
+            print("%-24s %10s %14.4g %14.4g %8.2f %s" % (name, nrays, result["rays_per_second"],
+                                                        reference["rays_per_second"], ratio, flag))
+
+    if baseline.get("info", {}).get("machine") != results["info"]["machine"]:
+        print("Warning: the baseline was obtained in a different machine (%s)" % baseline.get("info", {}).get("machine"))
+
+    return slowdowns
+
+def get_machine_info():
+    """
+    Returns a description of the machine and versions (stored with the results).
+    """
+    return {"machine": "%s %s (%d cpus)" % (platform.node(), platform.processor() or platform.machine(), os.cpu_count()),
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+class _PeakMemory(object):
+    # samples the resident set size (from /proc/self/statm) in a thread
+    def __init__(self, enabled=True, interval=0.002):
+        self._enabled = enabled and os.path.exists("/proc/self/statm")
+        self._interval = interval
+        self.peak_memory = None
+
+    def __enter__(self):
+        if self._enabled:
+            self._rss_start = self._rss_max = self._get_rss()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._enabled:
+            self._stop.set()
+            self._thread.join()
+            self.peak_memory = max(self._rss_max, self._get_rss()) - self._rss_start
+        return False
+
+    def _sample(self):
+        while not self._stop.wait(self._interval):
+            self._rss_max = max(self._rss_max, self._get_rss())
+
+    @classmethod
+    def _get_rss(cls):
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+@contextlib.contextmanager
+def _quiet(verbose):
+    if verbose:
+        yield
+    else:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="shadow4 benchmark suite")
+    parser.add_argument("--cases", nargs="+", default=None, help="cases to run (default: all): %s" % ", ".join(CASES.keys()))
+    parser.add_argument("--nrays", nargs="+", type=float, default=DEFAULT_NRAYS, help="numbers of rays")
+    parser.add_argument("--max-rays", type=float, default=1e6, help="maximum number of rays (default 1e6)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs (the minimum time is used)")
+    parser.add_argument("--no-memory", action="store_true", help="do not measure the peak memory")
+    parser.add_argument("--verbose", action="store_true", help="do not suppress the shadow4 output")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--save-baseline", default=None, help="write the results as baseline to this JSON file")
+    parser.add_argument("--baseline", default=None, help="compare with the baseline in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative throughput loss flagged as slowdown")
+    args = parser.parse_args()
+
+    results = run_benchmarks(cases=args.cases, nrays_list=args.nrays, max_rays=args.max_rays, repeat=args.repeat,
+                             measure_memory=not args.no_memory, verbose=args.verbose)
+
+    for filename in (args.output, args.save_baseline):
+        if filename is not None:
+            with open(filename, "w") as f: json.dump(results, f, indent=2)
+            print("File written to disk: %s" % filename)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f: baseline = json.load(f)
+        slowdowns = compare_with_baseline(results, baseline, threshold=args.threshold)
+        if len(slowdowns) > 0:
+            print("%d slowdown(s) beyond %d%%" % (len(slowdowns), 100 * args.threshold))
+            sys.exit(1)
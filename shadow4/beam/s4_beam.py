@@ -5,12 +5,19 @@ from numpy.testing import assert_almost_equal
 import h5py
 import time
 import os
+from collections import OrderedDict
 
 from syned.beamline.shape import Rectangle, Ellipse, TwoEllipses, Circle
 
+from shadow4.beam.s4_columnar_rays import S4ColumnarRays
+from shadow4.beam.s4_tracked_array import S4TrackedArray
+from shadow4.tools.profiler import profile_copy
+
 # IMPORTANT: Column 11 (index 10) is wavenumber (cm^-1) as internally in Shadow.
 #            Photon energy in eV is now column 26 (index 25).
 
+_VECTOR_COLUMNS = (0, 3, 6, 15) # first column of position, direction, Es and Ep vectors (zero-based)
+
 class S4Beam(object):
     """
     Implements a beam. Internally it is an array of N rays and 18 columns.
@@ -23,6 +30,23 @@ class S4Beam(object):
     array numpy array, optional
         The numpy array (N,18) with the data.
 
+    storage : str, optional
+        'rows' (default): the rays are stored in a numpy array (N,18).
+        'columns': each column is stored in a contiguous array (see S4ColumnarRays), with integer flag and
+        index columns.
+
+    precision : str, optional
+        For storage='columns': 'float64' (default) or 'float32' for positions, directions and electric vectors.
+
+    Notes
+    -----
+    The attribute rays gives write access to the stored data with item assignment (e.g. beam.rays[:, 0] = x,
+    beam.rays[:, 0] *= 2) and ufuncs (out=...). These writes are counted (see S4TrackedArray), also through
+    references kept by the caller, and the quantities cached by the beam (e.g., the good/lost masks, the
+    calculated columns) are recalculated after a write. Other writes (e.g. numpy.asarray(beam.rays)[:, 0] = x,
+    numpy.copyto(), beam.rays.sort()) raise a ValueError. A plain array assigned to rays is copied. Read-only
+    access without copies is available via get_rays_view(), get_column_view() and get_columns_view().
+
     See Also
     --------
     shadow4.S4Beam.column_names :
@@ -31,17 +55,31 @@ class S4Beam(object):
 
     """
 
-    def __init__(self, N=1000, array=None):
+    _CACHE_MAX_BYTES = 2**28 # memory limit for the cached columns and masks of each beam
+
+    def __init__(self, N=1000, array=None, storage="rows", precision="float64"):
+        self._cache = OrderedDict()
         if array is not None:
             N, ncol = array.shape
             if ncol != 18:
                 raise Exception ("Bad array shape: must be (npoints,18)")
-            self.rays = array.copy()
+
+        if storage == "rows":
+            if precision != "float64": raise Exception("Precision %s only available with storage='columns'" % precision)
+            if array is not None:
+                self.rays = S4TrackedArray(numpy.array(array))
+            else:
+                self.rays = S4TrackedArray(numpy.zeros((N,18)))
+        elif storage == "columns":
+            if isinstance(array, S4ColumnarRays) and array.get_precision() == precision:
+                self.rays = array.copy()
+            else:
+                self.rays = S4ColumnarRays(N=N, array=array, precision=precision)
         else:
-            self.rays = numpy.zeros((N,18))
+            raise Exception("Storage must be 'rows' or 'columns'")
 
     @classmethod
-    def initialize_from_array(cls, array):
+    def initialize_from_array(cls, array, storage="rows", precision="float64"):
         """
         Creates an S4Beam instance from an array.
 
@@ -50,6 +88,12 @@ class S4Beam(object):
         array : numpy array
             array to initialize the S4beam.
 
+        storage : str, optional
+            'rows' or 'columns' (see S4Beam).
+
+        precision : str, optional
+            'float64' or 'float32' (only for storage='columns').
+
         Returns
         -------
             an instance of S4Beam.
@@ -57,7 +101,35 @@ class S4Beam(object):
         """
         if array.shape[1] != 18:
             raise Exception("Bad array shape: must be (npoints,18)")
-        return S4Beam(array=array)
+        return S4Beam(array=array, storage=storage, precision=precision)
+
+    @classmethod
+    def initialize_from_beams(cls, beams, sort_by_index=False):
+        """
+        Creates an S4Beam instance joining the rays of several beams (e.g., a beam and the lost rays removed
+        by S4Beam.compact()).
+
+        Parameters
+        ----------
+        beams : list
+            The S4Beam instances (None elements are ignored).
+
+        sort_by_index : boolean, optional
+            If True, sort the rays by the ray index (column 12).
+
+        Returns
+        -------
+            an instance of S4Beam (with the storage of the first beam).
+
+        """
+        beams = [beam for beam in beams if beam is not None]
+        if len(beams) == 0: raise Exception("No beams to join")
+
+        rays = numpy.vstack([beam.get_rays_view() for beam in beams])
+        if sort_by_index:
+            rays = rays[numpy.argsort(rays[:, 11], kind="stable")]
+
+        return S4Beam(array=rays, storage=beams[0].get_storage(), precision=beams[0].get_precision())
 
     @classmethod
     def initialize_as_pencil(cls, N=1000):
@@ -94,7 +166,123 @@ class S4Beam(object):
             A copy of the S4Beam instance.
 
         """
-        return S4Beam.initialize_from_array(self.rays.copy())
+        profile_copy(self._rays.nbytes)
+        return S4Beam.initialize_from_array(self._rays, storage=self.get_storage(), precision=self.get_precision())
+
+    @property
+    def rays(self):
+        # the writes to the stored data are counted (see S4TrackedArray): the cache is checked on lookup.
+        return self._rays
+
+    @rays.setter
+    def rays(self, value):
+        # a plain array is copied, as the writes through the caller's reference would not be counted
+        if not isinstance(value, (S4TrackedArray, S4ColumnarRays)): value = S4TrackedArray(numpy.array(value, dtype=float))
+        self._rays = value
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        """
+        Removes the quantities cached by the beam (good/lost masks and calculated columns). It is done
+        automatically when the rays are replaced or written (see S4TrackedArray).
+
+        """
+        self._cache.clear()
+        self._cache_write_count = self._rays.write_count
+
+    def _check_cache(self):
+        # the cached quantities are valid while the rays are not written
+        if self._rays.write_count != self._cache_write_count: self.invalidate_cache()
+
+    @classmethod
+    def set_cache_size(cls, max_bytes=2**28):
+        """
+        Sets the maximum memory used by each beam to cache the calculated columns (19 to 38) and the good/lost
+        masks. The least recently used entries are removed when the limit is reached.
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            The memory limit in bytes (0 disables the cache of calculated columns).
+
+        """
+        cls._CACHE_MAX_BYTES = max_bytes
+
+    def get_storage(self):
+        """
+        Returns the storage type.
+
+        Returns
+        -------
+        str
+            'rows' or 'columns'.
+
+        """
+        return "columns" if isinstance(self._rays, S4ColumnarRays) else "rows"
+
+    def get_precision(self):
+        """
+        Returns the precision used to store positions, directions and electric vectors.
+
+        Returns
+        -------
+        str
+            'float64' or 'float32'.
+
+        """
+        return self._rays.get_precision() if isinstance(self._rays, S4ColumnarRays) else "float64"
+
+    def set_storage(self, storage="columns", precision="float64"):
+        """
+        Changes the storage of the rays.
+
+        Parameters
+        ----------
+        storage : str, optional
+            'rows' or 'columns' (see S4Beam).
+
+        precision : str, optional
+            'float64' or 'float32' (only for storage='columns').
+
+        """
+        if storage == self.get_storage() and precision == self.get_precision(): return
+        self.rays = S4Beam(array=self.rays, storage=storage, precision=precision).rays
+
+    def compact(self, return_lost_rays=False):
+        """
+        Removes the lost rays (flag < 0) from the beam. The ray index (column 12) is kept, so the
+        rays can be identified with the ones of the original beam.
+
+        Parameters
+        ----------
+        return_lost_rays : boolean, optional
+            If True, return a beam with the removed rays.
+
+        Returns
+        -------
+        S4Beam instance or None
+            The removed rays (if return_lost_rays=True and rays are removed), otherwise None.
+
+        """
+        lost = self.get_flag_mask(nolost=2)
+        n_lost = numpy.count_nonzero(lost)
+        if n_lost == 0: return None
+
+        lost_beam = None
+        if return_lost_rays:
+            lost_beam = S4Beam(N=0, storage=self.get_storage(), precision=self.get_precision())
+            lost_beam.rays = self._take_rays(lost)
+
+        self.rays = self._take_rays(~lost)
+        return lost_beam
+
+    def _take_rays(self, rows):
+        if isinstance(self._rays, S4ColumnarRays):
+            rays = self._rays.take(rows)
+        else:
+            rays = S4TrackedArray(self._rays[rows])
+        profile_copy(rays.nbytes)
+        return rays
 
     #
     # getters
@@ -117,22 +305,141 @@ class S4Beam(object):
         """
 
         if nolost == 0:
-            return self.rays.copy()
+            return numpy.array(self._rays)
         elif nolost == 1:
-            f  = numpy.where(self.rays[:,9] > 0.0)
-            if len(f[0])==0:
+            mask = self.get_flag_mask(nolost=1)
+            if not mask.any():
                 print ('S4Beam.get_rays: no GOOD rays, returning empty array')
                 return numpy.empty(0)
             else:
-                return self.rays[f[0],:].copy()
+                return numpy.array(self._rays[mask])
         elif nolost == 2:
-            f  = numpy.where(self.rays[:,9] < 0.0)
-            if len(f[0])==0:
+            mask = self.get_flag_mask(nolost=2)
+            if not mask.any():
                 print ('S4Beam.get_rays: no BAD rays, returning empty array')
                 return numpy.empty(0)
             else:
-                return self.rays[f[0],:].copy()
+                return numpy.array(self._rays[mask])
+
+    def get_flag_mask(self, nolost=1):
+        """
+        Returns the (cached) mask of good or lost rays.
+
+        Parameters
+        ----------
+        nolost : int, optional
+            1=mask of good rays (flag > 0), 2=mask of lost rays (flag < 0).
+
+        Returns
+        -------
+        numpy array (npoints)
+            A read-only boolean array.
+
+        """
+        key = ("mask", nolost)
+        self._check_cache()
+        if key not in self._cache:
+            if nolost == 1:
+                mask = self._rays[:, 9] > 0.0
+            elif nolost == 2:
+                mask = self._rays[:, 9] < 0.0
+            else:
+                raise Exception("nolost must be 1 (good rays) or 2 (lost rays)")
+            mask.flags.writeable = False
+            self._cache[key] = mask
+        return self._cache[key]
+
+    def get_rays_view(self, nolost=0):
+        """
+        Returns the rays for reading.
+
+        For storage='rows' and nolost=0, it is a view of the stored data (no copy is done).
+
+        Parameters
+        ----------
+        nolost : int, optional
+            0=return all rays, 1=Return only good rays (non-lost rays), 2=Return only lost rays.
+
+        Returns
+        -------
+        numpy array (npoints,18)
+            A read-only array. It must be copied (e.g., with .copy()) to be modified. Note that a view reflects
+            further modifications of the beam.
 
+        """
+        if nolost == 0 and self.get_storage() == "rows":
+            out = self._rays
+        elif nolost == 0:
+            out = numpy.array(self._rays)
+        else:
+            out = self._rays[self.get_flag_mask(nolost=nolost)]
+        return _read_only(out)
+
+    def get_column_view(self, column, nolost=0):
+        """
+        Returns the values of a given column for reading.
+
+        For the stored columns (1 to 18) and nolost=0, it is a view of the stored data (no copy is done), except
+        for columns stored with a type different from float64 (see S4ColumnarRays).
+
+        Parameters
+        ----------
+        column : int
+            Number of column (starting with 1). See S4Beam.get_column.
+
+        nolost : int, optional
+            0=return all rays, 1=Return only good rays (non-lost rays), 2=Return only lost rays.
+
+        Returns
+        -------
+        numpy array (npoints)
+            A read-only array. It must be copied (e.g., with .copy()) to be modified. Note that a view reflects
+            further modifications of the beam.
+
+        """
+        if column == -11: column = 26
+
+        if column <= 18:
+            out = self._rays[:, column - 1]
+        else:
+            out = self._get_derived_column(column, nolost=nolost)
+
+        if nolost != 0:
+            out = out[self.get_flag_mask(nolost=nolost)]
+
+        return _read_only(out)
+
+    def get_columns_view(self, columns, nolost=0):
+        """
+        Returns the values of several columns for reading.
+
+        For storage='rows', nolost=0, and consecutive stored columns (e.g. [1,2,3]) it is a view of the stored
+        data (no copy is done).
+
+        Parameters
+        ----------
+        columns : list
+            The number of the columns (column numbers start from 1).
+
+        nolost : int, optional
+            0=return all rays, 1=Return only good rays (non-lost rays), 2=Return only lost rays.
+
+        Returns
+        -------
+        numpy array
+            A read-only array (len(columns), N). It must be copied (e.g., with .copy()) to be modified. Note
+            that a view reflects further modifications of the beam.
+
+        """
+        if isinstance(columns, int): return self.get_column_view(columns, nolost=nolost)
+
+        columns = list(columns)
+        consecutive = (len(columns) > 0) and (columns == list(range(columns[0], columns[0] + len(columns))))
+        if nolost == 0 and consecutive and columns[0] >= 1 and columns[-1] <= 18 and self.get_storage() == "rows":
+            out = self._rays[:, (columns[0] - 1):columns[-1]].T
+        else:
+            out = numpy.array([self.get_column_view(c, nolost=nolost) for c in columns])
+        return _read_only(out)
 
     def get_number_of_rays(self, nolost=0):
         """
@@ -150,7 +457,7 @@ class S4Beam(object):
 
         """
         try:
-            w = self.get_column(10)
+            w = self.get_column_view(10)
         except Exception:
             print("Error: Empty beam...")
             return 0
@@ -158,9 +465,9 @@ class S4Beam(object):
         if nolost == 0:
             return w.size
         if nolost == 1:
-            return numpy.array(numpy.where(w >= 0)).size
+            return numpy.count_nonzero(w >= 0)
         if nolost == 2:
-            return numpy.array(numpy.where(w < 0)).size
+            return numpy.count_nonzero(self.get_flag_mask(nolost=2))
 
         return self.rays.shape[0]
 
@@ -292,95 +599,124 @@ class S4Beam(object):
         if column == -11: column = 26
 
         if column <= 18:
-            out = self.rays[:,column-1]
+            out = self._rays[:,column-1]
         else:
-            A2EV = 2.0*numpy.pi/(codata.h*codata.c/codata.e*1e2)
-            column_index = column - 1
-            ray = self.rays
-
-             # if colu mn_index==10: out =  ray[:,column_index]/A2EV
-            if column == 19: out =  2*numpy.pi*1.0e8/ray[:,10]
-            if column == 20: out =  numpy.sqrt(ray[:,0]*ray[:,0]+ray[:,1]*ray[:,1]+ray[:,2]*ray[:,2])
-            if column == 21: out =  numpy.arccos(ray[:,4])
-            if column == 22: out =  numpy.sqrt(numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8,15,16,17] ]),axis=0))
-            if column == 23: out =  numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8,15,16,17] ]),axis=0)
-            if column == 24: out =  numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
-            if column == 25: out =  numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
-            if column == 26: out =  ray[:,10]/A2EV
-            if column == 27: out =  ray[:,3]*ray[:,10]*1.0e8
-            if column == 28: out =  ray[:,4]*ray[:,10]*1.0e8
-            if column == 29: out =  ray[:,5]*ray[:,10]*1.0e8
-            if column == 30:
-                E2s = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
-                E2p = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
-                out =  E2p+E2s
-            if column ==31:
-                E2s = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
-                E2p = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
-                out =  E2p-E2s
-            if column == 32:
-                E2s = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
-                E2p = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
-                Cos = numpy.cos(ray[:,13]-ray[:,14])
-                out =  2*numpy.sqrt(E2s*E2p)*Cos
-            if column == 33:
-                E2s = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
-                E2p = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
-                Sin = numpy.sin(ray[:,13]-ray[:,14])
-                out =  2*numpy.sqrt(E2s*E2p)*Sin
-
-            if column == 34:
-                out =  numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8,15,16,17] ]),axis=0) *\
-                ray[:,10]/A2EV
-
-            if column == 35:
-                out = numpy.abs(numpy.arcsin(ray[:,3]))
-            if column == 36:
-                out = numpy.abs(numpy.arcsin(ray[:,5]))
-            if column == 37:
-                f = self.getshonecol(10)
-                w = self.getshonecol(23)
-                xp = self.getshonecol(4)
-                if nolost == 1:
-                    findices  = numpy.where(f > 0.0)
-                    if len(findices[0])==0:
-                        col_mean = numpy.average(xp, weights=w)
-                    else:
-                        col_mean = numpy.average(xp[findices], weights=w[findices])
-                else:
-                    col_mean = numpy.average(xp, weights=w)
-                out = numpy.abs(numpy.arcsin(xp - col_mean))
-            if column == 38:
-                f = self.getshonecol(10)
-                w = self.getshonecol(23)
-                zp = self.getshonecol(6)
-                if nolost == 1:
-                    findices  = numpy.where(f > 0.0)
-                    if len(findices[0])==0:
-                        col_mean = numpy.average(zp, weights=w)
-                    else:
-                        col_mean = numpy.average(zp[findices], weights=w[findices])
-                else:
-                    col_mean = numpy.average(zp, weights=w)
-
-                out = numpy.abs(numpy.arcsin(zp - col_mean))
+            out = self._get_derived_column(column, nolost=nolost)
 
         if nolost == 0:
             return out.copy()
 
         if nolost == 1:
-            f  = numpy.where(self.rays[:,9] > 0.0)
-            if len(f[0])==0:
+            f = self.get_flag_mask(nolost=1)
+            if not f.any():
                 print ('Beam.get_column: no GOOD rays, returning empty array')
                 return numpy.empty(0)
-            return out[f].copy()
+            return out[f]
 
         if nolost == 2:
-            f  = numpy.where(self.rays[:,9] < 0.0)
-            if len(f[0])==0:
+            f = self.get_flag_mask(nolost=2)
+            if not f.any():
                 print ('Beam.get_column: no BAD rays, returning empty array')
                 return numpy.empty(0)
-            return out[f].copy()
+            return out[f]
+
+    def _get_derived_column(self, column, nolost=0):
+        # the calculated columns (>18) are cached until the beam is modified.
+        if column in (37, 38): # they depend on the selected rays
+            key = ("column", column, int(nolost == 1))
+        else:
+            key = ("column", column, 0)
+
+        self._check_cache()
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        out = self._calculate_derived_column(column, nolost=nolost)
+        out.flags.writeable = False
+        self._cache[key] = out
+        self._limit_cache_size()
+        return out
+
+    def _limit_cache_size(self):
+        nbytes = sum([value.nbytes for value in self._cache.values()])
+        while nbytes > self._CACHE_MAX_BYTES and len(self._cache) > 0:
+            key, value = self._cache.popitem(last=False)
+            nbytes -= value.nbytes
+
+    def _calculate_derived_column(self, column, nolost=0):
+        A2EV = 2.0*numpy.pi/(codata.h*codata.c/codata.e*1e2)
+        column_index = column - 1
+        ray = self._rays
+
+         # if colu mn_index==10: out =  ray[:,column_index]/A2EV
+        if column == 19: out =  2*numpy.pi*1.0e8/ray[:,10]
+        if column == 20: out =  numpy.sqrt(ray[:,0]*ray[:,0]+ray[:,1]*ray[:,1]+ray[:,2]*ray[:,2])
+        if column == 21: out =  numpy.arccos(ray[:,4])
+        if column == 22: out =  numpy.sqrt(numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8,15,16,17] ]),axis=0))
+        if column == 23: out =  numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8,15,16,17] ]),axis=0)
+        if column == 24: out =  numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
+        if column == 25: out =  numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
+        if column == 26: out =  ray[:,10]/A2EV
+        if column == 27: out =  ray[:,3]*ray[:,10]*1.0e8
+        if column == 28: out =  ray[:,4]*ray[:,10]*1.0e8
+        if column == 29: out =  ray[:,5]*ray[:,10]*1.0e8
+        if column == 30:
+            E2s = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
+            E2p = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
+            out =  E2p+E2s
+        if column ==31:
+            E2s = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
+            E2p = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
+            out =  E2p-E2s
+        if column == 32:
+            E2s = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
+            E2p = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
+            Cos = numpy.cos(ray[:,13]-ray[:,14])
+            out =  2*numpy.sqrt(E2s*E2p)*Cos
+        if column == 33:
+            E2s = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
+            E2p = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
+            Sin = numpy.sin(ray[:,13]-ray[:,14])
+            out =  2*numpy.sqrt(E2s*E2p)*Sin
+
+        if column == 34:
+            out =  numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8,15,16,17] ]),axis=0) *\
+            ray[:,10]/A2EV
+
+        if column == 35:
+            out = numpy.abs(numpy.arcsin(ray[:,3]))
+        if column == 36:
+            out = numpy.abs(numpy.arcsin(ray[:,5]))
+        if column == 37:
+            f = self.get_column_view(10)
+            w = self.get_column_view(23)
+            xp = self.get_column_view(4)
+            if nolost == 1:
+                findices  = numpy.where(f > 0.0)
+                if len(findices[0])==0:
+                    col_mean = numpy.average(xp, weights=w)
+                else:
+                    col_mean = numpy.average(xp[findices], weights=w[findices])
+            else:
+                col_mean = numpy.average(xp, weights=w)
+            out = numpy.abs(numpy.arcsin(xp - col_mean))
+        if column == 38:
+            f = self.get_column_view(10)
+            w = self.get_column_view(23)
+            zp = self.get_column_view(6)
+            if nolost == 1:
+                findices  = numpy.where(f > 0.0)
+                if len(findices[0])==0:
+                    col_mean = numpy.average(zp, weights=w)
+                else:
+                    col_mean = numpy.average(zp[findices], weights=w[findices])
+            else:
+                col_mean = numpy.average(zp, weights=w)
+
+            out = numpy.abs(numpy.arcsin(zp - col_mean))
+
+        return out
 
     def get_columns(self, columns, nolost=0):
         """
@@ -1116,27 +1452,18 @@ class S4Beam(object):
 
         T_REFLECTION = numpy.pi / 2 - theta1
 
-        a1 = self.rays.copy()
-
-        nrays = self.rays.shape[0]
-        UXIM_x = numpy.ones(nrays)
-        UXIM_y = numpy.zeros(nrays)
-        UXIM_z = numpy.zeros(nrays)
-
-        VZIM_x = numpy.zeros(nrays)
-        VZIM_y = numpy.zeros(nrays) - numpy.cos(T_REFLECTION)
-        VZIM_z = numpy.zeros(nrays) + numpy.sin(T_REFLECTION)
+        rays = self.rays
 
-        VNIMAG_x = numpy.zeros(nrays)
-        VNIMAG_y = numpy.zeros(nrays) + numpy.sin(T_REFLECTION)
-        VNIMAG_z = numpy.zeros(nrays) + numpy.cos(T_REFLECTION)
+        # versors of the image plane
+        UXIM   = numpy.array([1.0, 0.0, 0.0])
+        VZIM   = numpy.array([0.0, -numpy.cos(T_REFLECTION), numpy.sin(T_REFLECTION)])
+        VNIMAG = numpy.array([0.0,  numpy.sin(T_REFLECTION), numpy.cos(T_REFLECTION)])
 
        # ABOVE = T_IMAGE - P_MIR(1) * C_STAR(1) - P_MIR(2) * C_STAR(2) - P_MIR(3) * C_STAR(3)
        # BELOW = C_STAR(1) * V_OUT(1) + C_STAR(2) * V_OUT(2) + C_STAR(3) * V_OUT(3)
 
-        ABOVE = T_IMAGE - a1[:,0] * VNIMAG_x - a1[:,1] * VNIMAG_y - a1[:,2] * VNIMAG_z
-        BELOW = VNIMAG_x * a1[:,3] + VNIMAG_y * a1[:,4] + VNIMAG_z * a1[:,5]
-
+        ABOVE = T_IMAGE - rays[:,1] * VNIMAG[1] - rays[:,2] * VNIMAG[2]
+        BELOW = VNIMAG[1] * rays[:,4] + VNIMAG[2] * rays[:,5]
 
         # IF (BELOW.NE.0.0D0) THEN
         #    DIST	=   ABOVE/BELOW
@@ -1146,34 +1473,22 @@ class S4Beam(object):
         # END IF
 
         DIST = ABOVE / BELOW
-
         failure = numpy.argwhere(BELOW == 0)
         if len(failure) > 0:
-            a1[failure, 9] = -3.0e-6
+            rays[failure, 9] = -3.0e-6
 
         # ! ** Computes now the intersections onto TRUE image plane.
-
-        a1[:, 0]  +=   DIST * a1[:, 3]
-        a1[:, 1]  +=   DIST * a1[:, 4]
-        a1[:, 2]  +=   DIST * a1[:, 5]
+        rays[:, 0]  +=   DIST * rays[:, 3]
+        rays[:, 1]  +=   DIST * rays[:, 4]
+        rays[:, 2]  +=   DIST * rays[:, 5]
 
         #!  ** Rotate now the results in the STAR (or TRUE image) reference plane.
         #!  ** Computes the projection of P_MIR onto the image plane versors.
-        #
-        RIMCEN_x = VNIMAG_x * T_IMAGE
-        RIMCEN_y = VNIMAG_y * T_IMAGE
-        RIMCEN_z = VNIMAG_z * T_IMAGE
-
-        a1[:, 0]  -=   RIMCEN_x
-        a1[:, 1]  -=   RIMCEN_y
-        a1[:, 2]  -=   RIMCEN_z
-
-        #! ** Computes now the new vectors for the beam in the U,V,N ref.
-        for i in [1,4,7,16]: # position, direction, Es, Ep
-            # dot product
-            self.rays[:, i - 1 + 0] = a1[:, i - 1 + 0] * UXIM_x   + a1[:, i - 1 + 1] * UXIM_y   + a1[:, i - 1 + 2] * UXIM_z
-            self.rays[:, i - 1 + 1] = a1[:, i - 1 + 0] * VNIMAG_x + a1[:, i - 1 + 1] * VNIMAG_y + a1[:, i - 1 + 2] * VNIMAG_z
-            self.rays[:, i - 1 + 2] = a1[:, i - 1 + 0] * VZIM_x   + a1[:, i - 1 + 1] * VZIM_y   + a1[:, i - 1 + 2] * VZIM_z
+        #! ** Computes now the new vectors for the beam in the U,V,N ref (position, direction, Es, Ep),
+        #!    i.e., translation by -RIMCEN followed by the rotation to the U,V,N versors.
+        RIMCEN = VNIMAG * T_IMAGE
+        matrix = numpy.array([UXIM, VNIMAG, VZIM])
+        self.apply_affine_transform(matrix, -numpy.dot(matrix, RIMCEN))
 
         # optical path col 13
         self.rays[:, 12] += numpy.abs(DIST) * refraction_index
@@ -1493,6 +1808,200 @@ class S4Beam(object):
         self.rays[:, 18-1] = AP_OUT_3
 
 
+    #
+    # fused affine transforms
+    #
+    # An affine transform is a tuple (matrix, offset): positions P are transformed as matrix @ P + offset, and
+    # directions and electric vectors V as matrix @ V. Several transforms (rotate, translation, rot_for,
+    # rot_back) can be composed and applied to the beam in a single pass.
+    #
+
+    @classmethod
+    def get_affine_transform_rotate(cls, theta, axis=1, rad=True):
+        """
+        Returns the affine transform equivalent to S4Beam.rotate().
+
+        Parameters
+        ----------
+        theta: float
+            the rotation angle radians (of degress if rad=False).
+
+        axis: int
+            The axis number (Shadow's column) for the rotation (i.e, 1:x (default), 2:y, 3:z)
+
+        rad: boolean, optional
+            set False if theta is given in degrees.
+
+        Returns
+        -------
+        tuple
+            (matrix, offset) with the 3x3 matrix and the 3 elements offset.
+
+        """
+        if rad:
+            theta1 = theta
+        else:
+            theta1 = theta * numpy.pi / 180
+
+        if axis == 1:
+            torot = [1,2]
+        elif axis == 2:
+            torot = [0,2]
+        elif axis == 3:
+            torot = [0,1]
+
+        costh = numpy.cos(theta1)
+        sinth = numpy.sin(theta1)
+
+        matrix = numpy.eye(3)
+        matrix[torot[0], torot[0]] =  costh
+        matrix[torot[0], torot[1]] =  sinth
+        matrix[torot[1], torot[0]] = -sinth
+        matrix[torot[1], torot[1]] =  costh
+        return matrix, numpy.zeros(3)
+
+    @classmethod
+    def get_affine_transform_translation(cls, qdist1):
+        """
+        Returns the affine transform equivalent to S4Beam.translation().
+
+        Parameters
+        ----------
+        qdist1 : 3 elements list or tuple
+            The distances to translate the X,Y and Z components.
+
+        Returns
+        -------
+        tuple
+            (matrix, offset) with the 3x3 matrix and the 3 elements offset.
+
+        """
+        if numpy.array(qdist1).size != 3:
+            raise Exception("Input must be a vector [x,y,z]")
+        return numpy.eye(3), numpy.array(qdist1, dtype=float)
+
+    @classmethod
+    def get_affine_transform_rot_for(cls, OFFX=0, OFFY=0, OFFZ=0, X_ROT=0, Y_ROT=0, Z_ROT=0):
+        """
+        Returns the affine transform equivalent to S4Beam.rot_for().
+
+        Parameters
+        ----------
+        OFFX, OFFY, OFFZ : float
+            translation distances in m along the X, Y and Z axes.
+
+        X_ROT, Y_ROT, Z_ROT : float
+            rotation angles in rad around the X, Y and Z axes.
+
+        Returns
+        -------
+        tuple
+            (matrix, offset) with the 3x3 matrix and the 3 elements offset.
+
+        """
+        U_MIR_1, U_MIR_2, U_MIR_3, V_MIR_1, V_MIR_2, V_MIR_3, W_MIR_1, W_MIR_2, W_MIR_3 = \
+            cls.get_UVW(X_ROT=X_ROT, Y_ROT=Y_ROT, Z_ROT=Z_ROT)
+        matrix = numpy.array([[U_MIR_1, U_MIR_2, U_MIR_3],
+                              [V_MIR_1, V_MIR_2, V_MIR_3],
+                              [W_MIR_1, W_MIR_2, W_MIR_3]])
+        return matrix, -numpy.dot(matrix, [OFFX, OFFY, OFFZ])
+
+    @classmethod
+    def get_affine_transform_rot_back(cls, OFFX=0, OFFY=0, OFFZ=0, X_ROT=0, Y_ROT=0, Z_ROT=0):
+        """
+        Returns the affine transform equivalent to S4Beam.rot_back().
+
+        Parameters
+        ----------
+        OFFX, OFFY, OFFZ : float
+            translation distances in m along the X, Y and Z axes.
+
+        X_ROT, Y_ROT, Z_ROT : float
+            rotation angles in rad around the X, Y and Z axes.
+
+        Returns
+        -------
+        tuple
+            (matrix, offset) with the 3x3 matrix and the 3 elements offset.
+
+        """
+        matrix, _ = cls.get_affine_transform_rot_for(X_ROT=X_ROT, Y_ROT=Y_ROT, Z_ROT=Z_ROT)
+        return matrix.T.copy(), numpy.array([OFFX, OFFY, OFFZ], dtype=float)
+
+    @classmethod
+    def compose_affine_transforms(cls, transforms):
+        """
+        Composes several affine transforms into a single one.
+
+        Parameters
+        ----------
+        transforms : list
+            A list of (matrix, offset) tuples, in the order they are applied to the beam.
+
+        Returns
+        -------
+        tuple
+            (matrix, offset) with the 3x3 matrix and the 3 elements offset.
+
+        """
+        matrix = numpy.eye(3)
+        offset = numpy.zeros(3)
+        for matrix_i, offset_i in transforms:
+            matrix = numpy.dot(matrix_i, matrix)
+            offset = numpy.dot(matrix_i, offset) + offset_i
+        return matrix, offset
+
+    def apply_affine_transform(self, matrix, offset=None):
+        """
+        Applies an affine transform to the positions, directions and electric vectors (s and p) of the beam
+        in a single pass.
+
+        Parameters
+        ----------
+        matrix : numpy array
+            The 3x3 matrix.
+
+        offset : numpy array, optional
+            The 3 elements offset added to the positions.
+
+        """
+        matrix = numpy.array(matrix, dtype=float)
+        rays = self.rays
+        for start in _VECTOR_COLUMNS:
+            if self.get_storage() == "rows":
+                out = numpy.dot(rays[:, start:(start + 3)], matrix.T)
+                if start == 0 and offset is not None: out += offset
+                rays[:, start:(start + 3)] = out
+            else:
+                x = [rays[:, start + i] for i in range(3)]
+                out = [matrix[i, 0] * x[0] + matrix[i, 1] * x[1] + matrix[i, 2] * x[2] for i in range(3)]
+                for i in range(3):
+                    if start == 0 and offset is not None: out[i] += offset[i]
+                    rays[:, start + i] = out[i]
+
+    def apply_affine_transforms(self, transforms):
+        """
+        Composes several affine transforms and applies the result to the beam in a single pass.
+
+        Parameters
+        ----------
+        transforms : list
+            A list of (matrix, offset) tuples, in the order they are applied to the beam.
+
+        Examples
+        --------
+        The beam in the reference frame of an optical element at distance p, grazing angle theta and azimuthal
+        angle alpha:
+
+        >>> beam.apply_affine_transforms([S4Beam.get_affine_transform_rotate(alpha, axis=2),
+        ...                               S4Beam.get_affine_transform_rotate(theta, axis=1),
+        ...                               S4Beam.get_affine_transform_translation([0.0, -p * numpy.cos(theta), p * numpy.sin(theta)])])
+
+        """
+        matrix, offset = self.compose_affine_transforms(transforms)
+        self.apply_affine_transform(matrix, offset)
+
+
     #
     # crop & boundaries
     #
@@ -1951,7 +2460,7 @@ class S4Beam(object):
         """
         try:
             tmp = source_object.get_beam()
-            self.rays = tmp.get_rays()
+            self.rays = tmp.rays
             return tmp
         except:
             raise Exception("shadow4 source class must implement get_rays method")
@@ -2386,6 +2895,10 @@ class S4Beam(object):
                 print("col %d, std: beam_tocheck %g, beam %g " % (i + 1, std0, std1))
 
 
+def _read_only(array):
+    out = array.view()
+    out.flags.writeable = False
+    return out
 
 if __name__ == "__main__":
     pass
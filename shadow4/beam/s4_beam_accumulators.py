@@ -0,0 +1,464 @@
+#
+# Accumulators reduce the rays of successive beams (e.g. chunks of rays traced by
+# S4Beamline.run_beamline_in_chunks) into results of bounded size: histograms, moments, or files.
+#
+import numpy
+import h5py
+
+from shadow4.beam.s4_beam import S4Beam
+
+class S4BeamAccumulator(object):
+    """
+    Base class of the accumulators.
+
+    An accumulator receives beams with accumulate(), and two accumulators of the same kind and settings can be
+    combined with merge() (e.g. to join the results of several processes).
+
+    """
+    def accumulate(self, beam):
+        """
+        Adds the rays of a beam.
+
+        Parameters
+        ----------
+        beam : instance of S4Beam
+            The beam (or chunk of beam).
+
+        """
+        raise NotImplementedError()
+
+    def merge(self, accumulator):
+        """
+        Adds the results of another accumulator of the same kind and settings.
+
+        Parameters
+        ----------
+        accumulator : instance of S4BeamAccumulator
+            The accumulator to merge.
+
+        """
+        raise NotImplementedError()
+
+    def reset(self):
+        """
+        Removes the accumulated results.
+
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def _get_weights(cls, beam, x, ref, nolost):
+        if ref == 0:
+            return numpy.ones(x.size)
+        else:
+            return beam.get_column_view(ref, nolost=nolost)
+
+
+class S4BeamHistogramAccumulator(S4BeamAccumulator):
+    """
+    Accumulates the histogram of a column, as in S4Beam.histo1().
+
+    Parameters
+    ----------
+    col : int
+        the number of the chosen column.
+
+    xrange : 2 elements tuple or list
+        the interval of the histogram (it cannot be calculated from the data, that are not known in advance).
+
+    nbins : int, optional
+        number of bins of the histogram.
+
+    nolost : int, optional
+        0=use all rays, 1=use only good rays (non-lost rays), 2=use only lost rays.
+
+    ref : int, optional
+        0: only count the rays, 23: weight with intensity, other value: use that column as weight.
+
+    factor : float, optional
+        a scalar factor to multiply the selected column before histogramming.
+
+    """
+    def __init__(self, col, xrange, nbins=50, nolost=1, ref=23, factor=1.0):
+        self._col = col
+        self._xrange = list(xrange)
+        self._nbins = nbins
+        self._nolost = nolost
+        self._ref = ref
+        self._factor = factor
+        self.reset()
+
+    def reset(self):
+        self._histogram = numpy.zeros(self._nbins)
+        self._histogram2 = numpy.zeros(self._nbins)
+        self._nrays = 0
+        self._good_rays = 0
+        self._selected_rays = 0
+        self._intensity = 0.0
+
+    def accumulate(self, beam):
+        x = beam.get_column_view(self._col, nolost=self._nolost) * self._factor
+        w = self._get_weights(beam, x, self._ref, self._nolost)
+        h, _ = numpy.histogram(x, bins=self._nbins, range=self._xrange, weights=w)
+        h2, _ = numpy.histogram(x, bins=self._nbins, range=self._xrange, weights=(w * w))
+        self._histogram += h
+        self._histogram2 += h2
+        self._nrays += beam.get_number_of_rays(nolost=0)
+        self._good_rays += beam.get_number_of_rays(nolost=1)
+        self._selected_rays += x.size
+        self._intensity += beam.intensity(nolost=self._nolost)
+
+    def merge(self, accumulator):
+        self._histogram += accumulator._histogram
+        self._histogram2 += accumulator._histogram2
+        self._nrays += accumulator._nrays
+        self._good_rays += accumulator._good_rays
+        self._selected_rays += accumulator._selected_rays
+        self._intensity += accumulator._intensity
+
+    def get_ticket(self):
+        """
+        Returns the accumulated histogram.
+
+        Returns
+        -------
+        dict
+            a python dictionary with the same main keys as the one of S4Beam.histo1():
+                 'col', 'nolost', 'nbins', 'xrange', 'factor', 'ref',
+                 'histogram', 'bins', 'histogram_sigma', 'bin_center', 'bin_left', 'bin_right',
+                 'intensity', 'fwhm', 'nrays', 'good_rays'.
+
+        """
+        h = self._histogram
+        bins = numpy.linspace(self._xrange[0], self._xrange[1], self._nbins + 1)
+        bin_center = bins[:-1] + (bins[1] - bins[0]) * 0.5
+
+        if self._selected_rays > 0:
+            h_sigma = numpy.sqrt(numpy.abs(self._histogram2 - h * h / float(self._selected_rays)))
+        else:
+            h_sigma = numpy.zeros_like(h)
+
+        ticket = {'error': 0,
+                  'col': self._col,
+                  'nolost': self._nolost,
+                  'nbins': self._nbins,
+                  'xrange': self._xrange,
+                  'factor': self._factor,
+                  'ref': self._ref,
+                  'histogram': h.copy(),
+                  'bins': bins,
+                  'histogram_sigma': h_sigma,
+                  'bin_center': bin_center,
+                  'bin_left': bins[:-1],
+                  'bin_right': bins[:-1] + (bins[1] - bins[0]),
+                  'intensity': self._intensity,
+                  'fwhm': None,
+                  'nrays': self._nrays,
+                  'good_rays': self._good_rays,
+                  }
+
+        tt = numpy.where(h >= h.max() * 0.5)
+        if h.max() > 0 and h[tt].size > 1:
+            ticket['fwhm'] = (bins[1] - bins[0]) * (tt[0][-1] - tt[0][0])
+            ticket['fwhm_coordinates'] = (bin_center[tt[0][0]], bin_center[tt[0][-1]])
+
+        return ticket
+
+
+class S4BeamHistogram2DAccumulator(S4BeamAccumulator):
+    """
+    Accumulates the 2D histogram of two columns, as in S4Beam.histo2().
+
+    Parameters
+    ----------
+    col_h : int
+        the horizontal column.
+
+    col_v : int
+        the vertical column.
+
+    xrange : 2 elements tuple or list
+        the interval of the horizontal column.
+
+    yrange : 2 elements tuple or list
+        the interval of the vertical column.
+
+    nbins_h : int, optional
+        number of bins of the horizontal axis.
+
+    nbins_v : int, optional
+        number of bins of the vertical axis.
+
+    nolost : int, optional
+        0=use all rays, 1=use only good rays (non-lost rays), 2=use only lost rays.
+
+    ref : int, optional
+        0: only count the rays, 23: weight with intensity, other value: use that column as weight.
+
+    """
+    def __init__(self, col_h, col_v, xrange, yrange, nbins_h=25, nbins_v=25, nolost=1, ref=23):
+        self._col_h = col_h
+        self._col_v = col_v
+        self._xrange = list(xrange)
+        self._yrange = list(yrange)
+        self._nbins_h = nbins_h
+        self._nbins_v = nbins_v
+        self._nolost = nolost
+        self._ref = ref
+        self.reset()
+
+    def reset(self):
+        self._histogram = numpy.zeros((self._nbins_h, self._nbins_v))
+        self._nrays = 0
+        self._good_rays = 0
+        self._intensity = 0.0
+
+    def accumulate(self, beam):
+        x = beam.get_column_view(self._col_h, nolost=self._nolost)
+        y = beam.get_column_view(self._col_v, nolost=self._nolost)
+        w = self._get_weights(beam, x, self._ref, self._nolost)
+        h, _, _ = numpy.histogram2d(x, y, bins=[self._nbins_h, self._nbins_v],
+                                    range=[self._xrange, self._yrange], weights=w)
+        self._histogram += h
+        self._nrays += beam.get_number_of_rays(nolost=0)
+        self._good_rays += beam.get_number_of_rays(nolost=1)
+        self._intensity += beam.intensity(nolost=self._nolost)
+
+    def merge(self, accumulator):
+        self._histogram += accumulator._histogram
+        self._nrays += accumulator._nrays
+        self._good_rays += accumulator._good_rays
+        self._intensity += accumulator._intensity
+
+    def get_ticket(self):
+        """
+        Returns the accumulated histogram.
+
+        Returns
+        -------
+        dict
+            a python dictionary with the same main keys as the one of S4Beam.histo2():
+                 'col_h', 'col_v', 'nolost', 'nbins_h', 'nbins_v', 'ref', 'xrange', 'yrange',
+                 'bin_h_edges', 'bin_v_edges', 'bin_h_center', 'bin_v_center', 'histogram',
+                 'histogram_h', 'histogram_v', 'intensity', 'nrays', 'good_rays'.
+
+        """
+        bin_h_edges = numpy.linspace(self._xrange[0], self._xrange[1], self._nbins_h + 1)
+        bin_v_edges = numpy.linspace(self._yrange[0], self._yrange[1], self._nbins_v + 1)
+        return {'error': 0,
+                'col_h': self._col_h,
+                'col_v': self._col_v,
+                'nolost': self._nolost,
+                'nbins_h': self._nbins_h,
+                'nbins_v': self._nbins_v,
+                'ref': self._ref,
+                'xrange': self._xrange,
+                'yrange': self._yrange,
+                'bin_h_edges': bin_h_edges,
+                'bin_v_edges': bin_v_edges,
+                'bin_h_center': 0.5 * (bin_h_edges[:-1] + bin_h_edges[1:]),
+                'bin_v_center': 0.5 * (bin_v_edges[:-1] + bin_v_edges[1:]),
+                'histogram': self._histogram.copy(),
+                'histogram_h': self._histogram.sum(axis=1),
+                'histogram_v': self._histogram.sum(axis=0),
+                'intensity': self._intensity,
+                'nrays': self._nrays,
+                'good_rays': self._good_rays,
+                }
+
+
+class S4BeamMomentsAccumulator(S4BeamAccumulator):
+    """
+    Accumulates the (weighted) mean and standard deviation of several columns.
+
+    The partial results are combined with the pairwise algorithm of Chan, Golub and LeVeque, which avoids
+    the loss of precision of accumulating the sums of squares.
+
+    Parameters
+    ----------
+    columns : list, optional
+        the column numbers.
+
+    nolost : int, optional
+        0=use all rays, 1=use only good rays (non-lost rays), 2=use only lost rays.
+
+    ref : int, optional
+        0: no weight, 23: weight with intensity, other value: use that column as weight.
+
+    """
+    def __init__(self, columns=[1, 3, 4, 6], nolost=1, ref=0):
+        self._columns = list(columns)
+        self._nolost = nolost
+        self._ref = ref
+        self.reset()
+
+    def reset(self):
+        ncol = len(self._columns)
+        self._weight = 0.0
+        self._mean = numpy.zeros(ncol)
+        self._m2 = numpy.zeros(ncol)
+        self._nrays = 0
+        self._good_rays = 0
+        self._selected_rays = 0
+        self._intensity = 0.0
+
+    def accumulate(self, beam):
+        x = numpy.array([beam.get_column_view(col, nolost=self._nolost) for col in self._columns])
+        w = self._get_weights(beam, x[0], self._ref, self._nolost)
+
+        weight = w.sum()
+        if weight > 0:
+            mean = numpy.dot(x, w) / weight
+            m2 = numpy.dot((x - mean[:, numpy.newaxis]) ** 2, w)
+            self._combine(weight, mean, m2)
+
+        self._nrays += beam.get_number_of_rays(nolost=0)
+        self._good_rays += beam.get_number_of_rays(nolost=1)
+        self._selected_rays += x.shape[1]
+        self._intensity += beam.intensity(nolost=self._nolost)
+
+    def merge(self, accumulator):
+        if accumulator._weight > 0:
+            self._combine(accumulator._weight, accumulator._mean, accumulator._m2)
+        self._nrays += accumulator._nrays
+        self._good_rays += accumulator._good_rays
+        self._selected_rays += accumulator._selected_rays
+        self._intensity += accumulator._intensity
+
+    def _combine(self, weight, mean, m2):
+        total = self._weight + weight
+        delta = mean - self._mean
+        self._mean = self._mean + delta * weight / total
+        self._m2 = self._m2 + m2 + delta ** 2 * self._weight * weight / total
+        self._weight = total
+
+    def get_mean(self, col):
+        """
+        Returns the mean of a column.
+
+        Parameters
+        ----------
+        col : int
+            the column number (must be one of the accumulated columns).
+
+        Returns
+        -------
+        float
+
+        """
+        return self._mean[self._columns.index(col)]
+
+    def get_standard_deviation(self, col):
+        """
+        Returns the standard deviation of a column (like S4Beam.get_standard_deviation()).
+
+        Parameters
+        ----------
+        col : int
+            the column number (must be one of the accumulated columns).
+
+        Returns
+        -------
+        float
+
+        """
+        if self._weight == 0: return numpy.nan
+        return numpy.sqrt(self._m2[self._columns.index(col)] / self._weight)
+
+    def get_intensity(self):
+        """
+        Returns the accumulated intensity of the selected rays.
+
+        Returns
+        -------
+        float
+
+        """
+        return self._intensity
+
+    def get_number_of_rays(self, nolost=0):
+        """
+        Returns the accumulated number of rays.
+
+        Parameters
+        ----------
+        nolost : int, optional
+            0=all rays, 1=good rays.
+
+        Returns
+        -------
+        int
+
+        """
+        if nolost == 0:
+            return self._nrays
+        else:
+            return self._good_rays
+
+
+class S4BeamFileSink(S4BeamAccumulator):
+    """
+    Writes the rays of the successive beams in an hdf5 file, appending them to an extensible dataset.
+
+    Parameters
+    ----------
+    filename : str
+        the file name (it is overwritten).
+
+    nolost : int, optional
+        0=write all rays, 1=write only good rays (non-lost rays), 2=write only lost rays.
+
+    dataset_name : str, optional
+        the name of the (N,18) dataset.
+
+    """
+    def __init__(self, filename, nolost=0, dataset_name="rays"):
+        self._filename = filename
+        self._nolost = nolost
+        self._dataset_name = dataset_name
+        self.reset()
+
+    def reset(self):
+        with h5py.File(self._filename, 'w') as f:
+            f.attrs['creator'] = "shadow4"
+            f.create_dataset(self._dataset_name, shape=(0, 18), maxshape=(None, 18), dtype=float, chunks=True)
+
+    def accumulate(self, beam):
+        rays = beam.get_rays_view(nolost=self._nolost)
+        if rays.shape[0] == 0: return
+        with h5py.File(self._filename, 'a') as f:
+            ds = f[self._dataset_name]
+            n = ds.shape[0]
+            ds.resize((n + rays.shape[0], 18))
+            ds[n:, :] = rays
+
+    def merge(self, accumulator):
+        beam = accumulator.get_beam()
+        if beam is not None: self.accumulate(beam)
+
+    def get_number_of_rays(self):
+        """
+        Returns the number of rays written.
+
+        Returns
+        -------
+        int
+
+        """
+        with h5py.File(self._filename, 'r') as f:
+            return f[self._dataset_name].shape[0]
+
+    def get_beam(self):
+        """
+        Loads the written rays.
+
+        Returns
+        -------
+        instance of S4Beam or None
+            The beam with all written rays (None if there are no rays).
+
+        """
+        with h5py.File(self._filename, 'r') as f:
+            rays = f[self._dataset_name][:]
+        if rays.shape[0] == 0: return None
+        return S4Beam.initialize_from_array(rays)
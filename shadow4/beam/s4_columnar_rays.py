@@ -0,0 +1,211 @@
+import numpy
+
+from shadow4.beam.s4_tracked_array import S4TrackedArray
+
+class S4ColumnarRays(object):
+    """
+    Columnar storage for the rays of a S4Beam.
+
+    It behaves like the (N,18) numpy array of rays for the indexing used by S4Beam (e.g., rays[:, i],
+    rays[index, i], rays[:, i] *= value), but each column is stored in its own contiguous array.
+    Reading a column always returns float64 values (the stored array itself for float64 columns, a
+    converted copy otherwise), so that the calculations are done in double precision.
+    The lost-ray flag (column 10) and the ray index (column 12) are stored as integers, and
+    positions, directions and electric vectors (columns 1-9 and 16-18) can be stored in single
+    precision (float32) to halve the memory.
+
+    Parameters
+    ----------
+    N : int, optional
+        The number of rays.
+
+    array : numpy array or S4ColumnarRays, optional
+        The (N,18) data to initialize the columns.
+
+    precision : str, optional
+        'float64' (default) or 'float32' for the columns 1-9 and 16-18.
+
+    Notes
+    -----
+    float32 gives ~7 significant digits: positions (in m) are resolved to ~1e-7 of their magnitude.
+    The wavenumber, optical path and phases (columns 11, 13, 14, 15) are always stored in float64.
+
+    """
+    NCOLUMNS = 18
+    INTEGER_COLUMNS = (9, 11) # lost flag, ray index (zero-based)
+    REDUCIBLE_COLUMNS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 15, 16, 17) # positions, directions, electric vectors (zero-based)
+
+    def __init__(self, N=0, array=None, precision="float64"):
+        if precision not in ("float64", "float32"):
+            raise Exception("precision must be 'float64' or 'float32'")
+        self._precision = precision
+
+        if array is not None:
+            N = array.shape[0]
+            if array.shape[1] != self.NCOLUMNS:
+                raise Exception("Bad array shape: must be (npoints,18)")
+
+        self._counter = [0] # writes to the columns (shared by the S4TrackedArray of the columns)
+        self._columns = [self._track(numpy.zeros(N, dtype=self.get_column_dtype(i))) for i in range(self.NCOLUMNS)]
+
+        if array is not None:
+            for i in range(self.NCOLUMNS):
+                self._set_column_values(i, slice(None), array[:, i])
+
+    def get_precision(self):
+        return self._precision
+
+    @property
+    def write_count(self):
+        """
+        The number of writes done to the columns (see S4TrackedArray).
+        """
+        return self._counter[0]
+
+    def get_column_dtype(self, index):
+        """
+        Returns the storage type of a column.
+
+        Parameters
+        ----------
+        index : int
+            The column index (starting from zero).
+
+        Returns
+        -------
+        numpy dtype
+            The type.
+
+        """
+        if index in self.INTEGER_COLUMNS:
+            return numpy.dtype(numpy.int32)
+        elif index in self.REDUCIBLE_COLUMNS:
+            return numpy.dtype(self._precision)
+        else:
+            return numpy.dtype(numpy.float64)
+
+    #
+    # array-like interface
+    #
+    @property
+    def shape(self):
+        return (self._columns[0].size, self.NCOLUMNS)
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def size(self):
+        return self._columns[0].size * self.NCOLUMNS
+
+    @property
+    def dtype(self):
+        return numpy.dtype(numpy.float64)
+
+    @property
+    def nbytes(self):
+        return sum([column.nbytes for column in self._columns])
+
+    def __len__(self):
+        return self._columns[0].size
+
+    def __array__(self, dtype=None, copy=None):
+        out = self._assemble(slice(None))
+        if dtype is not None: out = out.astype(dtype)
+        return out
+
+    def copy(self):
+        out = S4ColumnarRays(N=0, precision=self._precision)
+        out._columns = [out._track(column.copy()) for column in self._columns]
+        return out
+
+    def __setstate__(self, state): # pickle and deepcopy: the columns share again one counter
+        self.__dict__.update(state)
+        self._counter = [0]
+        self._columns = [self._track(column) for column in self._columns]
+
+    def take(self, rows):
+        """
+        Returns a new S4ColumnarRays with the selected rays.
+
+        Parameters
+        ----------
+        rows : numpy array
+            The indices or boolean mask of the selected rays.
+
+        Returns
+        -------
+        S4ColumnarRays instance
+
+        """
+        out = S4ColumnarRays(N=0, precision=self._precision)
+        out._columns = [out._track(column[rows]) for column in self._columns]
+        return out
+
+    def column(self, index):
+        """
+        Returns the array with the data of a column (not a copy, modifying it modifies the storage).
+
+        Parameters
+        ----------
+        index : int
+            The column index (starting from zero).
+
+        Returns
+        -------
+        numpy array
+            The column data.
+
+        """
+        return self._columns[index]
+
+    def __getitem__(self, key):
+        rows, columns = self._split_key(key)
+        if isinstance(columns, (int, numpy.integer)):
+            column = self._columns[columns]
+            if column.dtype != numpy.float64: # computations are always done in double precision
+                return column[rows].astype(numpy.float64)
+            if isinstance(rows, slice) and rows == slice(None):
+                return column
+            return column[rows]
+        elif isinstance(columns, slice) and columns == slice(None):
+            return self._assemble(rows)
+        else:
+            return self._assemble(rows)[:, columns]
+
+    def __setitem__(self, key, value):
+        rows, columns = self._split_key(key)
+        if isinstance(columns, (int, numpy.integer)):
+            self._set_column_values(columns, rows, value)
+        else:
+            indices = numpy.arange(self.NCOLUMNS)[columns]
+            rows_shape = numpy.arange(self.shape[0])[rows].shape # () for a single row
+            value = numpy.broadcast_to(value, rows_shape + indices.shape)
+            for j, i in enumerate(indices):
+                self._set_column_values(i, rows, value[..., j])
+
+    #
+    # internal
+    #
+    def _track(self, column):
+        return S4TrackedArray(column, counter=self._counter)
+
+    def _split_key(self, key):
+        if isinstance(key, tuple) and len(key) == 2:
+            return key
+        return key, slice(None)
+
+    def _assemble(self, rows):
+        nrays = numpy.arange(self.shape[0])[rows].size
+        out = numpy.empty((nrays, self.NCOLUMNS), dtype=numpy.float64)
+        for i, column in enumerate(self._columns):
+            out[:, i] = column[rows]
+        return out
+
+    def _set_column_values(self, index, rows, value):
+        column = self._columns[index]
+        if value is column: return # in-place operation already done (e.g. rays[:, i] *= x)
+        if column.dtype.kind == 'i':
+            value = numpy.floor(value) # e.g. flag -3e-6 must remain negative (lost)
+        column[rows] = value
@@ -0,0 +1,95 @@
+#
+# Array that counts the writes to its data (used by S4Beam to invalidate its cached columns and masks).
+#
+import numpy
+
+class S4TrackedArray(numpy.ndarray):
+    """
+    A read-only view of a numpy array that counts the writes done through it or through its views, so that the
+    quantities calculated from its data (e.g. the cached columns of S4Beam) can be invalidated.
+
+    The allowed (and counted) writes are item assignments (a[...] = value, including a[:, i] *= x), a.fill(),
+    in-place operators (a += x) and ufuncs with out=a or ufunc.at(a, ...). Any other write raises a ValueError
+    (assignment destination is read-only), e.g. numpy.asarray(a)[0] = x, a.view(numpy.ndarray)[0] = x,
+    numpy.copyto(a, b), numpy.put(a, ...) or a.sort().
+
+    The views (e.g. a[:, 3]) share the counter of the array. The copies (e.g. a[mask], a.copy()) and the results
+    of the calculations with tracked arrays (e.g. a[:, 3] * 2) are plain (writeable) numpy arrays.
+
+    Parameters
+    ----------
+    array : array-like
+        The data (not copied if it is a numpy array; the array itself must not be written after, as these writes
+        are not counted).
+
+    counter : list, optional
+        The counter ([number of writes]), to share it with other arrays (default: a new counter).
+
+    """
+    def __new__(cls, array, counter=None):
+        obj = numpy.asarray(array).view(cls)
+        obj._counter = [0] if counter is None else counter
+        obj.flags.writeable = False
+        return obj
+
+    def __array_finalize__(self, obj):
+        counter = getattr(obj, "_counter", None)
+        if counter is None or not numpy.may_share_memory(self, obj): counter = [0]
+        self._counter = counter
+
+    @property
+    def write_count(self):
+        """
+        The number of writes done through the array and its views.
+        """
+        return self._counter[0]
+
+    def __getitem__(self, key):
+        out = super().__getitem__(key)
+        if isinstance(out, S4TrackedArray) and out._counter is not self._counter: # a copy
+            return out.view(numpy.ndarray)
+        return out
+
+    def __setitem__(self, key, value):
+        _writeable(self)[key] = _untracked(value)
+        self._counter[0] += 1
+
+    def fill(self, value):
+        _writeable(self).fill(value)
+        self._counter[0] += 1
+
+    def copy(self, order='C'):
+        return self.view(numpy.ndarray).copy(order=order)
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return S4TrackedArray(self.copy())
+
+    def __array_ufunc__(self, ufunc, method, *inputs, out=None, **kwargs):
+        if method == "at" and isinstance(inputs[0], S4TrackedArray): # in-place
+            inputs[0]._counter[0] += 1
+            inputs = (_writeable(inputs[0]),) + tuple([_untracked(x) for x in inputs[1:]])
+        else:
+            inputs = tuple([_untracked(x) for x in inputs])
+        if out is not None:
+            for x in out:
+                if isinstance(x, S4TrackedArray): x._counter[0] += 1
+            kwargs["out"] = tuple([_writeable(x) if isinstance(x, S4TrackedArray) else x for x in out])
+        results = getattr(ufunc, method)(*inputs, **kwargs)
+        if out is not None and all([x is not None for x in out]): # in-place operations return the tracked array
+            return out[0] if len(out) == 1 else out
+        return results
+
+    def __reduce__(self):
+        return (S4TrackedArray, (self.view(numpy.ndarray).copy(),))
+
+def _untracked(x):
+    return x.view(numpy.ndarray) if isinstance(x, S4TrackedArray) else x
+
+def _writeable(x):
+    # a writeable view of the data (the data owner is writeable, only the tracked views are read-only)
+    out = x.view(numpy.ndarray)
+    out.flags.writeable = True
+    return out
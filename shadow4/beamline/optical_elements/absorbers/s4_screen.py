@@ -156,8 +156,7 @@ class S4ScreenElement(S4BeamlineElement):
                 if oe._file_abs != "":
                     try:
                         pr = PreRefl()
-                        pr.read_preprocessor_file(oe._file_abs)
-                        print(pr.info())
+                        if pr.read_preprocessor_file(oe._file_abs): pr.info() # info only when the file is parsed (not cached)
                     except:
                         raise Exception("Failed to load preprocessor (prerefl) file %s " % oe._file_abs)
 
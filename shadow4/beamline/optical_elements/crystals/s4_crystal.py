@@ -7,6 +7,7 @@ from syned.beamline.shape import Rectangle, Ellipse
 from shadow4.beam.s4_beam import S4Beam
 from shadow4.beamline.s4_beamline_element import S4BeamlineElement
 from shadow4.beamline.s4_beamline_element_movements import S4BeamlineElementMovements
+from shadow4.tools.profiler import profile_phase
 
 from crystalpy.diffraction.DiffractionSetupXraylib import DiffractionSetupXraylib
 from crystalpy.diffraction.DiffractionSetupDabax import DiffractionSetupDabax
@@ -342,9 +343,12 @@ class S4CrystalElement(S4BeamlineElement):
         #
         # put beam in mirror reference system
         #
-        input_beam.rotate(alpha1, axis=2)
-        input_beam.rotate(theta_grazing1, axis=1)
-        input_beam.translation([0.0, -p * numpy.cos(theta_grazing1), p * numpy.sin(theta_grazing1)])
+        with profile_phase("transform"):
+            input_beam.apply_affine_transforms([
+                S4Beam.get_affine_transform_rotate(alpha1, axis=2),
+                S4Beam.get_affine_transform_rotate(theta_grazing1, axis=1),
+                S4Beam.get_affine_transform_translation([0.0, -p * numpy.cos(theta_grazing1), p * numpy.sin(theta_grazing1)]),
+                ])
 
         #
         # reflect beam in the crystal surface and apply crystal reflectivity
@@ -487,7 +491,8 @@ class S4CrystalElement(S4BeamlineElement):
         #
         # apply mirror boundaries
         #
-        footprint.apply_boundaries_syned(soe.get_boundary_shape(), flag_lost_value=flag_lost_value)
+        with profile_phase("boundaries"):
+            footprint.apply_boundaries_syned(soe.get_boundary_shape(), flag_lost_value=flag_lost_value)
 
 
         #
@@ -495,7 +500,8 @@ class S4CrystalElement(S4BeamlineElement):
         #
 
         output_beam = footprint.duplicate()
-        output_beam.change_to_image_reference_system(theta_grazing2, q)
+        with profile_phase("image-plane"):
+            output_beam.change_to_image_reference_system(theta_grazing2, q)
 
         # plot results
         if False:
@@ -687,8 +693,8 @@ class S4CrystalElement(S4BeamlineElement):
         ccc = soe.get_optical_surface_instance()
         footprint = beam.duplicate()
 
-        x1 = footprint.get_columns([1, 2, 3])  # numpy.array(a3.getshcol([1,2,3]))
-        v1 = footprint.get_columns([4, 5, 6])  # numpy.array(a3.getshcol([4,5,6]))
+        x1 = footprint.get_columns_view([1, 2, 3])  # numpy.array(a3.getshcol([1,2,3]))
+        v1 = footprint.get_columns_view([4, 5, 6])  # numpy.array(a3.getshcol([4,5,6]))
         flag = footprint.get_column(10)  # numpy.array(a3.getshonecol(10))
         optical_path = footprint.get_column(13)
 
@@ -696,14 +702,16 @@ class S4CrystalElement(S4BeamlineElement):
         # reference_distance = -footprint.get_column(2).mean() + footprint.get_column(3).mean()
         # t, iflag = ccc.choose_solution(t1, t2, reference_distance=reference_distance)
 
-        reference_distance = -footprint.get_column(2).mean() + footprint.get_column(3).mean()
-        t, iflag = ccc.calculate_intercept_and_choose_solution(x1, v1, reference_distance=reference_distance)
+        reference_distance = -footprint.get_column_view(2).mean() + footprint.get_column_view(3).mean()
+        with profile_phase("intercept"):
+            t, iflag = ccc.calculate_intercept_and_choose_solution(x1, v1, reference_distance=reference_distance)
 
         x2 = x1 + v1 * t
         for i in range(flag.size):
             if iflag[i] < 0: flag[i] = -100
 
-        normal = ccc.get_normal(x2)
+        with profile_phase("normal"):
+            normal = ccc.get_normal(x2)
 
         footprint.set_column(1, x2[0])
         footprint.set_column(2, x2[1])
@@ -781,12 +789,13 @@ class S4CrystalElement(S4BeamlineElement):
 
         # Calculate outgoing Photon.
         # apply_reflectivity = False  # todo set always  True
-        outgoing_complex_amplitude_photon = perfect_crystal._calculatePhotonOut(photons_in,
-                                                                                apply_reflectivity=True,
-                                                                                calculation_method=1,
-                                                                                is_thick=soe._is_thick,
-                                                                                use_transfer_matrix=0
-                                                                                )
+        with profile_phase("reflectivity"):
+            outgoing_complex_amplitude_photon = perfect_crystal._calculatePhotonOut(photons_in,
+                                                                                    apply_reflectivity=True,
+                                                                                    calculation_method=1,
+                                                                                    is_thick=soe._is_thick,
+                                                                                    use_transfer_matrix=0
+                                                                                    )
 
         # if not apply_reflectivity:  # todo delete
         #     coeffs = perfect_crystal.calculateDiffraction(photons_in,
@@ -8,6 +8,7 @@ from syned.beamline.element_coordinates import ElementCoordinates
 from shadow4.beam.s4_beam import S4Beam
 from shadow4.beamline.s4_optical_element_decorators import S4OpticalElementDecorator
 from shadow4.beamline.s4_beamline_element import S4BeamlineElement
+from shadow4.tools.profiler import profile_phase
 
 
 class S4Grating(GratingVLS, S4OpticalElementDecorator):
@@ -125,9 +126,12 @@ class S4GratingElement(S4BeamlineElement):
         #
         # put beam in mirror reference system
         #
-        input_beam.rotate(alpha1, axis=2)
-        input_beam.rotate(theta_grazing1, axis=1)
-        input_beam.translation([0.0, -p * numpy.cos(theta_grazing1), p * numpy.sin(theta_grazing1)])
+        with profile_phase("transform"):
+            input_beam.apply_affine_transforms([
+                S4Beam.get_affine_transform_rotate(alpha1, axis=2),
+                S4Beam.get_affine_transform_rotate(theta_grazing1, axis=1),
+                S4Beam.get_affine_transform_translation([0.0, -p * numpy.cos(theta_grazing1), p * numpy.sin(theta_grazing1)]),
+                ])
 
         #
         # reflect beam in the mirror surface
@@ -140,7 +144,8 @@ class S4GratingElement(S4BeamlineElement):
         #
         # apply mirror boundaries
         #
-        footprint.apply_boundaries_syned(soe.get_boundary_shape(), flag_lost_value=flag_lost_value)
+        with profile_phase("boundaries"):
+            footprint.apply_boundaries_syned(soe.get_boundary_shape(), flag_lost_value=flag_lost_value)
 
         ########################################################################################
         #
@@ -155,7 +160,8 @@ class S4GratingElement(S4BeamlineElement):
         #
 
         output_beam = footprint.duplicate()
-        output_beam.change_to_image_reference_system(theta_grazing2, q)
+        with profile_phase("image-plane"):
+            output_beam.change_to_image_reference_system(theta_grazing2, q)
 
         # plot results
         if False:
@@ -5,6 +5,7 @@ from syned.beamline.element_coordinates import ElementCoordinates
 from shadow4.beamline.s4_optical_element_decorators import S4OpticalElementDecorator
 from shadow4.beamline.s4_beamline_element import S4BeamlineElement
 from shadow4.beam.s4_beam import S4Beam
+from shadow4.tools.profiler import profile_phase
 
 class S4Empty(Screen, S4OpticalElementDecorator):
     def __init__(self, name="Undefined"):
@@ -41,9 +42,12 @@ class S4EmptyElement(S4BeamlineElement):
         #
         # put beam in mirror reference system
         #
-        input_beam.rotate(alpha1, axis=2)
-        input_beam.rotate(theta_grazing1, axis=1)
-        input_beam.translation([0.0, -p * numpy.cos(theta_grazing1), p * numpy.sin(theta_grazing1)])
+        with profile_phase("transform"):
+            input_beam.apply_affine_transforms([
+                S4Beam.get_affine_transform_rotate(alpha1, axis=2),
+                S4Beam.get_affine_transform_rotate(theta_grazing1, axis=1),
+                S4Beam.get_affine_transform_translation([0.0, -p * numpy.cos(theta_grazing1), p * numpy.sin(theta_grazing1)]),
+                ])
 
         #
         # oe does nothing
@@ -54,7 +58,8 @@ class S4EmptyElement(S4BeamlineElement):
         # from oe reference system to image plane
         #
         output_beam = input_beam.duplicate()
-        output_beam.change_to_image_reference_system(theta_grazing2, q)
+        with profile_phase("image-plane"):
+            output_beam.change_to_image_reference_system(theta_grazing2, q)
 
 
         return output_beam, input_beam
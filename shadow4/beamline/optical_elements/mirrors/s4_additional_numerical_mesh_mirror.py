@@ -1,3 +1,4 @@
+import copy
 import numpy
 from syned.beamline.shape import NumericalMesh
 from syned.beamline.element_coordinates import ElementCoordinates
@@ -5,13 +6,19 @@ from shadow4.beam.s4_beam import S4Beam
 from shadow4.beamline.optical_elements.mirrors.s4_mirror import S4MirrorElement, S4Mirror
 from shadow4.beamline.optical_elements.mirrors.s4_numerical_mesh_mirror import S4NumericalMeshMirror
 from shadow4.beamline.s4_beamline_element_movements import S4BeamlineElementMovements
+from shadow4.tools.profiler import profile_phase
 
 
 class S4AdditionalNumericalMeshMirror(S4NumericalMeshMirror):
     def __init__(self,
                  ideal_mirror : S4Mirror = None,
                  numerical_mesh_mirror : S4NumericalMeshMirror = None,
-                 name="Mirror with Additional Numerical Mesh"):
+                 name="Mirror with Additional Numerical Mesh",
+                 f_perturbative=0,  # 0=exact intercept with the mesh (ideal+errors)
+                                    # 1=intercept with the ideal surface corrected by the errors (for small errors)
+                 perturbative_iterations=1, # for f_perturbative=1: number of iterations of the correction
+                 perturbative_tolerance=1e-12, # for f_perturbative=1: max residual height [m], exact solve if larger
+                 ):
         S4NumericalMeshMirror.__init__(self, name=name,
                  boundary_shape=None if ideal_mirror is None else ideal_mirror.get_boundary_shape(),
                  xx=None if numerical_mesh_mirror is None else numerical_mesh_mirror._curved_surface_shape._xx,
@@ -36,11 +43,18 @@ class S4AdditionalNumericalMeshMirror(S4NumericalMeshMirror):
 
         self.__ideal_mirror          = ideal_mirror
         self.__numerical_mesh_mirror = numerical_mesh_mirror
+        self._f_perturbative          = f_perturbative
+        self._perturbative_iterations = perturbative_iterations
+        self._perturbative_tolerance  = perturbative_tolerance
+        self.__result_perturbative_exact_rays = None # calculated (not an input): excluded from the cache keys
 
         self.__inputs = {
             "name": name,
             "ideal_mirror": ideal_mirror,
             "numerical_mesh_mirror": numerical_mesh_mirror,
+            "f_perturbative": f_perturbative,
+            "perturbative_iterations": perturbative_iterations,
+            "perturbative_tolerance": perturbative_tolerance,
         }
 
     def to_python_code(self, **kwargs):
@@ -55,17 +69,43 @@ class S4AdditionalNumericalMeshMirror(S4NumericalMeshMirror):
         txt_pre = """
 
 from shadow4.beamline.optical_elements.mirrors.s4_additional_numerical_mesh_mirror import S4AdditionalNumericalMeshMirror
-optical_element = S4AdditionalNumericalMeshMirror(name='{name:s}', ideal_mirror=ideal_mirror, numerical_mesh_mirror=numerical_mesh_mirror)
+optical_element = S4AdditionalNumericalMeshMirror(name='{name:s}', ideal_mirror=ideal_mirror, numerical_mesh_mirror=numerical_mesh_mirror,
+    f_perturbative={f_perturbative:d}, perturbative_iterations={perturbative_iterations:d}, perturbative_tolerance={perturbative_tolerance:g})
     """
         txt += txt_pre.format(**self.__inputs)
         return txt
 
+    def get_perturbative_exact_rays(self):
+        """
+        Returns the number of rays that failed the tolerance check of the perturbative intercept
+        (f_perturbative=1) in the last reflection, and were calculated with the exact intercept.
+
+        Returns
+        -------
+        int or None
+            The number of rays (None if no perturbative reflection was calculated).
+
+        """
+        return self.__result_perturbative_exact_rays
+
     #
     # overwrite this method combining ideal shape + error shape
     #
     def apply_mirror_reflection(self, beam):
+        if self._f_perturbative:
+            return self._apply_mirror_reflection_perturbative(beam)
+
+        numerical_mesh = self._get_ideal_plus_errors_mesh()
+        # ideal_surface_ccc = self.__ideal_mirror.get_optical_surface_instance() # this mean that every S4Mirror must inherit from S4OpticalElementDecorator
+        footprint, normal, _, _, _, _, _ = numerical_mesh.apply_specular_reflection_on_beam(beam)
+
+        return footprint, normal
+
+    def _get_ideal_plus_errors_mesh(self):
         # numerical_mesh    = self.__numerical_mesh_mirror.get_optical_surface_instance()
-        numerical_mesh = self.get_optical_surface_instance()
+        # the optical surface instances are cached (shared): add the ideal surface to a copy of the error mesh
+        numerical_mesh = copy.copy(self.get_optical_surface_instance())
+        numerical_mesh.mesh_z = numpy.array(numerical_mesh.mesh_z, dtype=float)
         ideal = self.__ideal_mirror.get_optical_surface_instance()
         # here sum ideal surface to numerical mesh, and obtain a new numerical mesh:
         # numerical_mesh = add_mesh_to_ideal_surface(numerical_mesh, ideal_surface_ccc)
@@ -74,8 +114,49 @@ optical_element = S4AdditionalNumericalMeshMirror(name='{name:s}', ideal_mirror=
         Y = numpy.outer(numpy.ones_like(x), y)
         Z = ideal.surface_height(X,Y)
         numerical_mesh.add_to_mesh(Z)
-        # ideal_surface_ccc = self.__ideal_mirror.get_optical_surface_instance() # this mean that every S4Mirror must inherit from S4OpticalElementDecorator
-        footprint, normal, _, _, _, _, _ = numerical_mesh.apply_specular_reflection_on_beam(beam)
+        return numerical_mesh
+
+    def _apply_mirror_reflection_perturbative(self, beam):
+        # intercept with the ideal surface corrected with the error heights and slopes. The rays that do not pass
+        # the tolerance check are calculated with the exact intercept on the mesh ideal+errors.
+        error_mesh = self.get_optical_surface_instance()
+        ideal = self.__ideal_mirror.get_optical_surface_instance()
+
+        footprint = beam.duplicate()
+        x1 = footprint.get_columns_view([1, 2, 3])
+        v1 = footprint.get_columns_view([4, 5, 6])
+        flag = footprint.get_column(10)
+        optical_path = footprint.get_column(13)
+
+        reference_distance = -footprint.get_column_view(2).mean() + footprint.get_column_view(3).mean()
+        with profile_phase("intercept"):
+            t, normal, iflag = error_mesh.calculate_intercept_and_normal_perturbative(ideal, x1, v1,
+                                                        reference_distance=reference_distance,
+                                                        n_iterations=self._perturbative_iterations,
+                                                        tolerance=self._perturbative_tolerance)
+
+        iexact = numpy.where(iflag == 0)[0]
+        self.__result_perturbative_exact_rays = int(iexact.size)
+        if iexact.size > 0:
+            numerical_mesh = self._get_ideal_plus_errors_mesh()
+            t_exact, iflag_exact = numerical_mesh.calculate_intercept(x1[:, iexact], v1[:, iexact])
+            t[iexact] = t_exact
+            iflag[iexact] = iflag_exact
+            normal[:, iexact] = numerical_mesh.get_normal(x1[:, iexact] + v1[:, iexact] * t_exact)
+
+        x2 = x1 + v1 * t
+        flag[iflag < 0] = -100
+
+        v2 = error_mesh.vector_reflection(v1, normal)
+
+        footprint.set_column(1, x2[0])
+        footprint.set_column(2, x2[1])
+        footprint.set_column(3, x2[2])
+        footprint.set_column(4, v2[0])
+        footprint.set_column(5, v2[1])
+        footprint.set_column(6, v2[2])
+        footprint.set_column(10, flag)
+        footprint.set_column(13, optical_path + t)
 
         return footprint, normal
 
@@ -9,6 +9,7 @@ from shadow4.physical_models.prerefl.prerefl import PreRefl
 from shadow4.beamline.s4_beamline_element import S4BeamlineElement
 from shadow4.beam.s4_beam import S4Beam
 from shadow4.beamline.s4_beamline_element_movements import S4BeamlineElementMovements
+from shadow4.tools.profiler import profile_phase
 
 from shadow4.optical_surfaces.s4_conic import S4Conic
 from shadow4.optical_surfaces.s4_toroid import S4Toroid
@@ -149,20 +150,23 @@ class S4MirrorElement(S4BeamlineElement):
         #
         # put beam in mirror reference system
         #
-        input_beam.rotate(alpha1, axis=2)
-        input_beam.rotate(theta_grazing1, axis=1)
-        input_beam.translation([0.0, -p * numpy.cos(theta_grazing1), p * numpy.sin(theta_grazing1)])
+        transforms = [S4Beam.get_affine_transform_rotate(alpha1, axis=2),
+                      S4Beam.get_affine_transform_rotate(theta_grazing1, axis=1),
+                      S4Beam.get_affine_transform_translation([0.0, -p * numpy.cos(theta_grazing1), p * numpy.sin(theta_grazing1)])]
 
         # mirror movement:
         movements = self.get_movements()
         if movements is not None:
             if movements.f_move:
-                input_beam.rot_for(OFFX=movements.offset_x,
-                                   OFFY=movements.offset_y,
-                                   OFFZ=movements.offset_z,
-                                   X_ROT=movements.rotation_x,
-                                   Y_ROT=movements.rotation_y,
-                                   Z_ROT=movements.rotation_z)
+                transforms.append(S4Beam.get_affine_transform_rot_for(OFFX=movements.offset_x,
+                                                                      OFFY=movements.offset_y,
+                                                                      OFFZ=movements.offset_z,
+                                                                      X_ROT=movements.rotation_x,
+                                                                      Y_ROT=movements.rotation_y,
+                                                                      Z_ROT=movements.rotation_z))
+
+        with profile_phase("transform"):
+            input_beam.apply_affine_transforms(transforms)
 
         #
         # reflect beam in the mirror surface
@@ -176,22 +180,63 @@ class S4MirrorElement(S4BeamlineElement):
 
         if movements is not None:
             if movements.f_move:
-                footprint.rot_back(OFFX=movements.offset_x,
-                                   OFFY=movements.offset_y,
-                                   OFFZ=movements.offset_z,
-                                   X_ROT=movements.rotation_x,
-                                   Y_ROT=movements.rotation_y,
-                                   Z_ROT=movements.rotation_z)
+                footprint.apply_affine_transform(*S4Beam.get_affine_transform_rot_back(OFFX=movements.offset_x,
+                                                                                       OFFY=movements.offset_y,
+                                                                                       OFFZ=movements.offset_z,
+                                                                                       X_ROT=movements.rotation_x,
+                                                                                       Y_ROT=movements.rotation_y,
+                                                                                       Z_ROT=movements.rotation_z))
         #
         # apply mirror boundaries
         #
-        footprint.apply_boundaries_syned(soe.get_boundary_shape(), flag_lost_value=flag_lost_value)
+        with profile_phase("boundaries"):
+            footprint.apply_boundaries_syned(soe.get_boundary_shape(), flag_lost_value=flag_lost_value)
 
         #
         # apply mirror reflectivity
         # TODO: add phase
         #
 
+        with profile_phase("reflectivity"):
+            self.apply_mirror_reflectivity(footprint, input_beam, v_in, normal)
+
+
+        #
+        # TODO: write angle.xx for comparison
+        #
+
+
+        #
+        # from mirror reference system to image plane
+        #
+
+        output_beam = footprint.duplicate()
+        with profile_phase("image-plane"):
+            output_beam.change_to_image_reference_system(theta_grazing1, q)
+
+        return output_beam, footprint
+
+    def apply_mirror_reflectivity(self, footprint, input_beam, v_in, normal):
+        """
+        Applies the mirror reflectivity to the footprint beam.
+
+        Parameters
+        ----------
+        footprint : instance of S4Beam
+            The beam in the mirror reference system, after reflection (modified in place).
+
+        input_beam : instance of S4Beam
+            The beam in the mirror reference system, before reflection.
+
+        v_in : numpy array
+            The directions of the incident rays (3, npoints).
+
+        normal : numpy array
+            The normals to the mirror surface at the intercepts (3, npoints).
+
+        """
+        soe = self.get_optical_element()
+
         if soe._f_reflec == 0:
             pass
         elif soe._f_reflec == 1: # full polarization
@@ -213,8 +258,7 @@ class S4MirrorElement(S4BeamlineElement):
             if soe._f_refl == 0: # prerefl
                 prerefl_file = soe._file_refl
                 pr = PreRefl()
-                pr.read_preprocessor_file(prerefl_file)
-                print(pr.info())
+                if pr.read_preprocessor_file(prerefl_file): pr.info() # info only when the file is parsed (not cached)
 
                 Rs, Rp, Ru = pr.reflectivity_fresnel(grazing_angle_mrad=grazing_angle_mrad,
                                                      photon_energy_ev=input_beam.get_column(-11),
@@ -337,22 +381,6 @@ class S4MirrorElement(S4BeamlineElement):
             else:
                 raise Exception("Not implemented source of mirror reflectivity")
 
-
-
-        #
-        # TODO: write angle.xx for comparison
-        #
-
-
-        #
-        # from mirror reference system to image plane
-        #
-
-        output_beam = footprint.duplicate()
-        output_beam.change_to_image_reference_system(theta_grazing1, q)
-
-        return output_beam, footprint
-
     #
     # i/o utilities
     #
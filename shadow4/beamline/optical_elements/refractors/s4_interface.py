@@ -5,6 +5,7 @@ from syned.beamline.optical_elements.refractors.interface import Interface
 
 from shadow4.beam.s4_beam import S4Beam
 from shadow4.beamline.s4_beamline_element import S4BeamlineElement
+from shadow4.tools.profiler import profile_phase
 
 from syned.beamline.shape import Rectangle, Ellipse
 
@@ -177,9 +178,12 @@ class S4InterfaceElement(S4BeamlineElement):
         #
         # put beam in mirror reference system
         #
-        input_beam.rotate(alpha1, axis=2)
-        input_beam.rotate(theta_grazing1, axis=1)
-        input_beam.translation([0.0, -p * numpy.cos(theta_grazing1), p * numpy.sin(theta_grazing1)])
+        with profile_phase("transform"):
+            input_beam.apply_affine_transforms([
+                S4Beam.get_affine_transform_rotate(alpha1, axis=2),
+                S4Beam.get_affine_transform_rotate(theta_grazing1, axis=1),
+                S4Beam.get_affine_transform_translation([0.0, -p * numpy.cos(theta_grazing1), p * numpy.sin(theta_grazing1)]),
+                ])
 
         #
         # refract beam in the mirror surface
@@ -195,7 +199,8 @@ class S4InterfaceElement(S4BeamlineElement):
         #
         # apply mirror boundaries
         #
-        footprint.apply_boundaries_syned(soe.get_boundary_shape(), flag_lost_value=flag_lost_value)
+        with profile_phase("boundaries"):
+            footprint.apply_boundaries_syned(soe.get_boundary_shape(), flag_lost_value=flag_lost_value)
 
         #
         # from element reference system to image plane
@@ -208,10 +213,11 @@ class S4InterfaceElement(S4BeamlineElement):
 
         _, mu2 = oe.get_attenuation_coefficients(energy1) # in m^-1
 
-        output_beam.change_to_image_reference_system(theta_grazing2, q,
-                                                     refraction_index=n2,
-                                                     apply_attenuation=1,
-                                                     linear_attenuation_coefficient=mu2)
+        with profile_phase("image-plane"):
+            output_beam.change_to_image_reference_system(theta_grazing2, q,
+                                                         refraction_index=n2,
+                                                         apply_attenuation=1,
+                                                         linear_attenuation_coefficient=mu2)
 
         return output_beam, footprint
 
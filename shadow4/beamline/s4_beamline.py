@@ -1,5 +1,11 @@
+import numpy
+import concurrent.futures
+
 from syned.beamline.beamline import Beamline
+from shadow4.beam.s4_beam import S4Beam
 from shadow4.beamline.s4_beamline_element import S4BeamlineElement
+from shadow4.beamline.s4_beamline_cache import S4BeamlineCache
+from shadow4.beamline.s4_beamline_profiler import get_active_profiler
 
 
 class S4Beamline(Beamline):
@@ -8,6 +14,7 @@ class S4Beamline(Beamline):
                  light_source=None,
                  beamline_elements_list=[]):
         super().__init__(light_source=light_source, beamline_elements_list=beamline_elements_list)
+        self.__lost_beams = []
 
     def duplicate(self):
         beamline_elements_list = []
@@ -37,22 +44,257 @@ class S4Beamline(Beamline):
 
         return script
 
-    def run_beamline(self, **params):
-        try:
-            output_beam = self.get_light_source().get_beam(**params)
+    def run_beamline(self, compact_lost_rays=False, store_lost_rays=False, cache=None, profiler=None, **params):
+        """
+        Traces the beam from the light source through all the beamline elements.
+
+        Parameters
+        ----------
+        compact_lost_rays : boolean or list, optional
+            Removes the lost rays from the beam, so they are not traced by the downstream elements (the ray
+            index in column 12 is kept). True: after every element, list: after the elements with the given
+            numbers (starting from 1), False: never.
+
+        store_lost_rays : boolean, optional
+            If True, keep the removed rays (see get_lost_beam()).
+
+        cache : instance of S4BeamlineCache, optional
+            If given, the output beams of the light source and of each element are stored in the cache, and
+            the tracing restarts after the last stage (with unchanged light source and upstream elements)
+            found in the cache. Note that in this case get_lost_beam() only contains the rays removed in the
+            traced elements. The cache is not used if the seed of the light source is 0 (non-reproducible).
+
+        profiler : instance of S4BeamlineProfiler, optional
+            If given, records the wall time (split in phases), rays and memory of the light source and of each
+            element (see shadow4.beamline.s4_beamline_profiler).
+
+        params :
+            Other parameters passed to the light source and to the beamline elements.
+
+        Returns
+        -------
+        tuple
+            (output_beam, output_mirr) of the last element.
+
+        """
+        if profiler is not None:
+            with profiler:
+                return self.run_beamline(compact_lost_rays=compact_lost_rays, store_lost_rays=store_lost_rays,
+                                         cache=cache, **params)
+
+        self.__lost_beams = []
+
+        if cache is not None and self.get_light_source().get_seed() == 0: cache = None # a new beam at each run
+
+        keys = None
+        first_element = 0
+        output = None
+        if cache is not None:
+            keys = S4BeamlineCache.get_stage_keys(self, compact_lost_rays=compact_lost_rays, **params)
+            for i in range(len(keys) - 1, -1, -1):
+                output = cache.get(keys[i])
+                if output is not None:
+                    first_element = i
+                    break
+
+        if output is None:
+            profiler = get_active_profiler()
+            if profiler is not None: profiler.start_element(0, self.get_light_source().get_name())
+            try:
+                output = self.get_light_source().get_beam(**params), None
+            except:
+                raise Exception("Error running beamline light source")
+            if profiler is not None: profiler.end_element(output[0])
+            if cache is not None: cache.put(keys[0], output[0])
+
+        return self._trace_beamline_elements(output[0], output[1], compact_lost_rays, store_lost_rays,
+                                             first_element=first_element, cache=cache, keys=keys, **params)
+
+    def run_beamline_in_chunks(self, nrays_chunk=100000, accumulators=None, compact_lost_rays=False, **params):
+        """
+        Traces the beamline in chunks of rays, reducing the beam after each element with accumulators
+        (histograms, moments, files; see shadow4.beam.s4_beam_accumulators). The memory used is limited by
+        the chunk size, independently of the total number of rays of the light source.
+
+        The chunks are created by the light source with nrays=nrays_chunk (the last one with the remaining
+        rays), chunk i using the random sub-stream i of the light source (see S4RandomStreams.random_stream()),
+        so the chunks are independent and reproducible. The ray index (column 12) is shifted to be unique
+        in the whole run.
+
+        Parameters
+        ----------
+        nrays_chunk : int, optional
+            The number of rays of each chunk.
+
+        accumulators : dict, optional
+            Maps element numbers (0 for the light source, 1 for the first element, etc.) to an accumulator
+            or a list of accumulators that receive the output beams of that element.
+
+        compact_lost_rays : boolean or list, optional
+            See run_beamline().
+
+        params :
+            Other parameters passed to the light source and to the beamline elements.
+
+        Returns
+        -------
+        dict
+            The accumulators.
+
+        """
+        if accumulators is None: accumulators = {}
+
+        for beam in self._get_light_source_beam_chunks(nrays_chunk, **params):
+            self._accumulate(accumulators, 0, beam)
+            self._trace_beamline_elements(beam, None, compact_lost_rays, False, accumulators=accumulators, **params)
+
+        return accumulators
+
+    def run_beamline_in_parallel(self, nrays_shard=100000, n_workers=None, compact_lost_rays=False, **params):
+        """
+        Traces the beamline using a pool of processes.
+
+        The rays of the light source are split in shards of nrays_shard rays, created and traced independently
+        exactly as the chunks of run_beamline_in_chunks(). The shards are distributed among the processes and
+        the results are joined in the shard order, so for a given seed (not 0) the result does not depend on
+        the number of processes. The ray index (column 12) is unique in the whole beam.
+
+        Parameters
+        ----------
+        nrays_shard : int, optional
+            The number of rays of each shard.
+
+        n_workers : int, optional
+            The number of processes (default: number of cpus).
+
+        compact_lost_rays : boolean or list, optional
+            See run_beamline().
+
+        params :
+            Other parameters passed to the light source and to the beamline elements.
+
+        Returns
+        -------
+        tuple
+            (output_beam, output_mirr) of the last element.
+
+        """
+        nshards = self._get_number_of_chunks(nrays_shard)
+
+        if n_workers == 1:
+            results = [_trace_shard(self, ishard, nrays_shard, compact_lost_rays, params) for ishard in range(nshards)]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers,
+                                                        initializer=_initialize_worker,
+                                                        initargs=(self,)) as executor:
+                results = list(executor.map(_trace_shard_in_worker,
+                                            range(nshards),
+                                            [nrays_shard] * nshards,
+                                            [compact_lost_rays] * nshards,
+                                            [params] * nshards))
+
+        output_beam = S4Beam.initialize_from_beams([result[0] for result in results])
+        if any([result[1] is None for result in results]):
             output_mirr = None
-        except:
-            raise Exception("Error running beamline light source")
+        else:
+            output_mirr = S4Beam.initialize_from_beams([result[1] for result in results])
+        return output_beam, output_mirr
 
+    def _get_number_of_chunks(self, nrays_chunk):
+        return int(numpy.ceil(self.get_light_source().get_nrays() / nrays_chunk))
+
+    def _get_light_source_beam_chunks(self, nrays_chunk, **params):
+        for ichunk in range(self._get_number_of_chunks(nrays_chunk)):
+            yield self._get_light_source_beam_chunk(ichunk, nrays_chunk, **params)
+
+    def _get_light_source_beam_chunk(self, ichunk, nrays_chunk, **params):
+        # chunk ichunk: rays [ichunk * nrays_chunk, (ichunk + 1) * nrays_chunk) of the light source, sub-stream ichunk
+        light_source = self.get_light_source()
+        nrays = light_source.get_nrays()
+        nrays_done = ichunk * nrays_chunk
+
+        try:
+            light_source.set_nrays(min(nrays_chunk, nrays - nrays_done))
+            with light_source.random_stream(ichunk):
+                try:
+                    beam = light_source.get_beam(**params)
+                except:
+                    raise Exception("Error running beamline light source")
+        finally:
+            light_source.set_nrays(nrays)
+
+        beam.rays[:, 11] += nrays_done
+        return beam
+
+    def _trace_beamline_elements(self, output_beam, output_mirr, compact_lost_rays, store_lost_rays,
+                                 accumulators=None, first_element=0, cache=None, keys=None, **params):
+        profiler = get_active_profiler()
         for i, element in enumerate(self.get_beamline_elements()):
+            if i < first_element: continue
+
+            if profiler is not None: profiler.start_element(i + 1, element.get_optical_element().get_name(), output_beam)
             try:
-                element.input_beam = output_beam
+                element.set_input_beam(output_beam)
                 output_beam, output_mirr = element.trace_beam(**params)
             except:
                 raise Exception("Error running beamline element # %d" % (i+1) )
+            if profiler is not None: profiler.end_element(output_beam)
+
+            if compact_lost_rays is True or (isinstance(compact_lost_rays, (list, tuple)) and (i+1) in compact_lost_rays):
+                self._compact_beam(output_beam, store_lost_rays)
+
+            if accumulators is not None: self._accumulate(accumulators, i + 1, output_beam)
+
+            if cache is not None: cache.put(keys[i + 1], output_beam, output_mirr)
 
         return output_beam, output_mirr
 
+    @classmethod
+    def _accumulate(cls, accumulators, element_number, beam):
+        accumulator_list = accumulators.get(element_number, [])
+        if not isinstance(accumulator_list, (list, tuple)): accumulator_list = [accumulator_list]
+        for accumulator in accumulator_list:
+            accumulator.accumulate(beam)
+
+    def _compact_beam(self, beam, store_lost_rays):
+        if beam.get_number_of_rays(nolost=2) == beam.get_number_of_rays(): return # all lost: the beam is kept as is
+        lost_beam = beam.compact(return_lost_rays=store_lost_rays)
+        if lost_beam is not None: self.__lost_beams.append(lost_beam)
+
+    def get_lost_beam(self):
+        """
+        Returns the rays removed by run_beamline(compact_lost_rays=..., store_lost_rays=True).
+
+        Each ray is given in the reference frame of the element after which it was removed. The full beam
+        can be reassembled with S4Beam.initialize_from_beams([output_beam, beamline.get_lost_beam()],
+        sort_by_index=True).
+
+        Returns
+        -------
+        S4Beam instance or None
+            The lost rays (None if no rays were stored).
+
+        """
+        if len(self.__lost_beams) == 0: return None
+        return S4Beam.initialize_from_beams(self.__lost_beams, sort_by_index=True)
+
+
+#
+# process pool workers
+#
+_WORKER_BEAMLINE = None
+
+def _initialize_worker(beamline):
+    global _WORKER_BEAMLINE
+    _WORKER_BEAMLINE = beamline
+
+def _trace_shard_in_worker(ishard, nrays_shard, compact_lost_rays, params):
+    return _trace_shard(_WORKER_BEAMLINE, ishard, nrays_shard, compact_lost_rays, params)
+
+def _trace_shard(beamline, ishard, nrays_shard, compact_lost_rays, params):
+    beam = beamline._get_light_source_beam_chunk(ishard, nrays_shard, **params)
+    return beamline._trace_beamline_elements(beam, None, compact_lost_rays, False, **params)
+
 
 if __name__ == "__main__":
     from shadow4.beamline.optical_elements.mirrors.s4_mirror import S4Mirror, S4MirrorElement
@@ -0,0 +1,225 @@
+#
+# Cache of the intermediate beams of a beamline, used by S4Beamline.run_beamline(cache=...)
+#
+# Each stage (0: light source, i: beamline element i) is identified by a hash of the light source and the
+# run parameters, chained with the hashes of the elements 1..i (optical element, coordinates, movements).
+# When the beamline is re-run, the tracing restarts after the last stage found in the cache.
+#
+import os
+import inspect
+import hashlib
+from collections import OrderedDict
+
+import numpy
+
+from shadow4.beam.s4_beam import S4Beam
+
+class S4BeamlineCache(object):
+    """
+    Stores the output beams of the stages of a beamline, with least-recently-used eviction.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        The maximum number of stages kept in memory.
+
+    max_bytes : int, optional
+        The maximum memory used by the stored beams (in bytes).
+
+    spill_directory : str, optional
+        If not None, the stages removed from memory are saved in this directory (as .npy files) and loaded
+        again when needed.
+
+    """
+    def __init__(self, max_entries=20, max_bytes=2**30, spill_directory=None):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._spill_directory = spill_directory
+        self._entries = OrderedDict()
+        if spill_directory is not None: os.makedirs(spill_directory, exist_ok=True)
+
+    def clear(self, remove_files=True):
+        """
+        Removes the cached stages.
+
+        Parameters
+        ----------
+        remove_files : boolean, optional
+            If True, remove also the files of the stages saved in the spill directory.
+
+        """
+        self._entries.clear()
+        if remove_files and self._spill_directory is not None:
+            for filename in os.listdir(self._spill_directory):
+                if filename.startswith("s4stage_") and filename.endswith(".npy"):
+                    os.remove(os.path.join(self._spill_directory, filename))
+
+    def __contains__(self, key):
+        return key in self._entries or (self._spill_directory is not None and os.path.exists(self._get_filename(key, 0)))
+
+    def get(self, key):
+        """
+        Returns a stored stage.
+
+        Parameters
+        ----------
+        key : str
+            The stage hash.
+
+        Returns
+        -------
+        tuple
+            (beam, mirr) copies of the stored beams (mirr can be None), or None if the stage is not stored.
+
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            beam, mirr = self._entries[key]
+        elif self._spill_directory is not None and os.path.exists(self._get_filename(key, 0)):
+            beam = S4Beam.initialize_from_array(numpy.load(self._get_filename(key, 0)))
+            mirr = None
+            if os.path.exists(self._get_filename(key, 1)):
+                mirr = S4Beam.initialize_from_array(numpy.load(self._get_filename(key, 1)))
+            self._store(key, beam, mirr)
+        else:
+            return None
+
+        return beam.duplicate(), (None if mirr is None else mirr.duplicate())
+
+    def put(self, key, beam, mirr=None):
+        """
+        Stores a stage (copies of the beams are stored).
+
+        Parameters
+        ----------
+        key : str
+            The stage hash.
+
+        beam : instance of S4Beam
+            The output beam of the stage.
+
+        mirr : instance of S4Beam, optional
+            The footprint of the stage.
+
+        """
+        self._store(key, beam.duplicate(), (None if mirr is None else mirr.duplicate()))
+
+    def _store(self, key, beam, mirr):
+        self._entries[key] = (beam, mirr)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > 1 and (len(self._entries) > self._max_entries or self._get_nbytes() > self._max_bytes):
+            old_key, (old_beam, old_mirr) = self._entries.popitem(last=False)
+            if self._spill_directory is not None and not os.path.exists(self._get_filename(old_key, 0)):
+                numpy.save(self._get_filename(old_key, 0), old_beam.get_rays())
+                if old_mirr is not None: numpy.save(self._get_filename(old_key, 1), old_mirr.get_rays())
+
+    def _get_nbytes(self):
+        nbytes = 0
+        for beam, mirr in self._entries.values():
+            nbytes += beam.get_rays_view().nbytes
+            if mirr is not None: nbytes += mirr.get_rays_view().nbytes
+        return nbytes
+
+    def _get_filename(self, key, index):
+        return os.path.join(self._spill_directory, "s4stage_%s_%d.npy" % (key, index))
+
+    #
+    # hashes
+    #
+    @classmethod
+    def get_hash(cls, *objects):
+        """
+        Returns a hash of the contents of python objects (numbers, strings, numpy arrays, lists, dicts and
+        the attributes of instances, recursively). Beams (S4Beam instances, including the input beams of
+        the beamline elements), attributes with "cache" in their name and the results calculated by the light
+        sources (private attributes __result_*) are ignored. For strings that are names of existing files, the file modification time and
+        size are included.
+
+        Parameters
+        ----------
+        objects :
+            The objects.
+
+        Returns
+        -------
+        str
+            The hash (hexadecimal sha1 digest).
+
+        """
+        h = hashlib.sha1()
+        for obj in objects:
+            _update_hash(h, obj, set())
+        return h.hexdigest()
+
+    @classmethod
+    def get_stage_keys(cls, beamline, compact_lost_rays=False, **params):
+        """
+        Returns the hashes of the stages of a beamline.
+
+        Parameters
+        ----------
+        beamline : instance of S4Beamline
+            The beamline.
+
+        compact_lost_rays : boolean or list, optional
+            See S4Beamline.run_beamline().
+
+        params :
+            The parameters of S4Beamline.run_beamline().
+
+        Returns
+        -------
+        list
+            The hashes of the light source (index 0) and of the elements (index 1, 2, ...).
+
+        """
+        keys = [cls.get_hash(beamline.get_light_source(), params)]
+        for i, element in enumerate(beamline.get_beamline_elements()):
+            compact = compact_lost_rays is True or \
+                      (isinstance(compact_lost_rays, (list, tuple)) and (i + 1) in compact_lost_rays)
+            keys.append(cls.get_hash(keys[-1], element, compact))
+        return keys
+
+
+def _is_derived_attribute(name):
+    # attributes that are not inputs: caches, input beams, results calculated lazily by the light sources
+    # (e.g. _S4WigglerLightSource__result_cdf) and the shared random generator
+    return "cache" in name.lower() or name.endswith("input_beam") or "__result" in name or \
+           name == "_shared_random_generator"
+
+def _update_hash(h, obj, memo):
+    if obj is None or isinstance(obj, (bool, int, float, complex, bytes, numpy.generic)):
+        h.update(repr((type(obj).__name__, obj)).encode())
+    elif isinstance(obj, str):
+        h.update(repr(obj).encode())
+        if len(obj) > 0 and os.path.isfile(obj):
+            stat = os.stat(obj)
+            h.update(repr((stat.st_mtime_ns, stat.st_size)).encode())
+    elif isinstance(obj, numpy.ndarray):
+        h.update(repr((obj.dtype.str, obj.shape)).encode())
+        if obj.dtype == object:
+            for item in obj.ravel(): _update_hash(h, item, memo)
+        else:
+            h.update(numpy.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, S4Beam):
+        pass
+    elif isinstance(obj, (list, tuple)):
+        h.update(repr((type(obj).__name__, len(obj))).encode())
+        for item in obj: _update_hash(h, item, memo)
+    elif isinstance(obj, dict):
+        keys = [key for key in sorted(obj.keys(), key=repr) if not _is_derived_attribute(str(key))]
+        h.update(repr(("dict", len(keys))).encode())
+        for key in keys:
+            _update_hash(h, key, memo)
+            _update_hash(h, obj[key], memo)
+    elif inspect.isroutine(obj) or inspect.isclass(obj) or inspect.ismodule(obj):
+        h.update(repr(getattr(obj, "__qualname__", getattr(obj, "__name__", ""))).encode())
+        if hasattr(obj, "__code__"): h.update(obj.__code__.co_code)
+    elif hasattr(obj, "__dict__"):
+        h.update(repr(type(obj).__module__ + "." + type(obj).__qualname__).encode())
+        if id(obj) in memo: return
+        memo.add(id(obj))
+        _update_hash(h, vars(obj), memo)
+    else:
+        h.update(repr(obj).encode())
@@ -0,0 +1,204 @@
+#
+# Convergence-driven tracing of a S4Beamline.
+#
+# Instead of choosing the number of rays in advance, the beamline is traced in batches of rays (created as the
+# chunks of S4Beamline.run_beamline_in_chunks(), with independent random sub-streams) and the figures of merit
+# (e.g. S4ScanFWHM, S4ScanCentroid, S4ScanTransmission of shadow4.beamline.s4_beamline_scan) are calculated for
+# each batch. The estimate of each figure of merit is the mean over the batches weighted by the batch intensity
+# (see S4ScanFigureOfMerit.get_batch_weight()), and its error is the half width of the confidence interval of the
+# mean (Student t, batch means method). The FWHM is not additive (the mean of the FWHM of small batches is
+# biased), so for S4ScanFWHM the histograms of the batches are accumulated and the estimate is the FWHM of the
+# accumulated histogram; the spread of the batch values is used only for its error. The tracing stops when the errors of all the figures of merit are below the targets
+# (relative, or absolute for the values near zero, e.g. a centroid), or when max_rays are traced.
+#
+import numpy
+from scipy.stats import t as student_t
+
+from shadow4.beam.s4_beam import S4Beam
+from shadow4.beamline.s4_beamline_scan import S4ScanFigureOfMerit, S4ScanFWHM
+
+class S4BeamlineConvergence(object):
+    """
+    Traces a beamline in batches of rays until the figures of merit converge.
+
+    Parameters
+    ----------
+    beamline : instance of S4Beamline
+        The beamline. The number of rays of the light source is ignored (see nrays_batch and max_rays).
+
+    figures_of_merit : dict
+        Maps names to functions f(output_beam, output_mirr) returning a number, calculated for each batch
+        (e.g., S4ScanFWHM, S4ScanCentroid, S4ScanTransmission). The histogram of a S4ScanFWHM is accumulated
+        over the batches; without a fixed xrange, the limits of the first batch are used. The batch values are
+        weighted by S4ScanFigureOfMerit.get_batch_weight(), or by the intensity of the output beam for the other
+        functions.
+
+    target_relative_error : float or dict, optional
+        The target relative error (half width of the confidence interval / absolute value). A dict gives a
+        different target for each figure of merit (a missing name or None: no relative target).
+
+    target_absolute_error : float or dict, optional
+        The target absolute error (half width of the confidence interval), for the values near zero (e.g. a
+        centroid), whose relative error does not converge. A figure of merit converges if it reaches either
+        target. A dict gives a different target for each figure of merit (default: None, no absolute target).
+
+    confidence : float, optional
+        The confidence level of the intervals (e.g. 0.95).
+
+    nrays_batch : int, optional
+        The number of rays of each batch.
+
+    min_batches : int, optional
+        The minimum number of batches (at least 2, to estimate the errors).
+
+    max_rays : int, optional
+        The maximum number of rays.
+
+    """
+    def __init__(self, beamline, figures_of_merit, target_relative_error=0.01, target_absolute_error=None,
+                 confidence=0.95, nrays_batch=10000, min_batches=4, max_rays=10000000):
+        self._beamline = beamline
+        self._figures_of_merit = figures_of_merit
+        self._targets          = self._get_targets(target_relative_error)
+        self._absolute_targets = self._get_targets(target_absolute_error)
+        self._confidence = confidence
+        self._nrays_batch = int(nrays_batch)
+        self._min_batches = max(2, min_batches)
+        self._max_rays = int(max_rays)
+
+    def run(self, compact_lost_rays=False, keep_beam=False, verbose=True, **params):
+        """
+        Runs the batches until convergence.
+
+        Parameters
+        ----------
+        compact_lost_rays : boolean or list, optional
+            See S4Beamline.run_beamline().
+
+        keep_beam : boolean, optional
+            If True, the output beams of all the batches are joined and returned.
+
+        verbose : boolean, optional
+            If True, print the estimates after each batch.
+
+        params :
+            Other parameters passed to the light source and to the beamline elements.
+
+        Returns
+        -------
+        dict
+            With keys:
+            'converged': True if the targets were reached;
+            'nrays': the number of rays traced; 'nbatches': the number of batches;
+            'figures_of_merit': a dict with, for each figure of merit, a dict with keys 'value' (the estimate),
+            'error' (half width of the confidence interval), 'relative_error' and 'batch_values' (array);
+            'beam', 'mirr': the joined output beams (only if keep_beam is True).
+
+        """
+        light_source = self._beamline.get_light_source()
+        nrays = light_source.get_nrays()
+
+        batch_values = []
+        batch_weights = []
+        batch_nrays = []
+        accumulators = {} # histograms of the S4ScanFWHM figures of merit
+        beams = []
+        mirrs = []
+        estimates = {}
+        converged = False
+        try:
+            light_source.set_nrays(self._max_rays) # the batches are chunks of a source with max_rays
+            for ibatch in range(self._beamline._get_number_of_chunks(self._nrays_batch)):
+                beam = self._beamline._get_light_source_beam_chunk(ibatch, self._nrays_batch, **params)
+                batch_nrays.append(beam.get_number_of_rays(nolost=0))
+                beam, mirr = self._beamline._trace_beamline_elements(beam, None, compact_lost_rays, False, **params)
+                batch_values.append([figure_of_merit(beam, mirr) for figure_of_merit in self._figures_of_merit.values()])
+                batch_weights.append(self._get_batch_weights(beam, mirr))
+                self._accumulate_histograms(accumulators, beam, mirr)
+                if keep_beam:
+                    beams.append(beam)
+                    mirrs.append(mirr)
+
+                estimates = self._get_estimates(numpy.array(batch_values, dtype=float),
+                                                numpy.array(batch_weights, dtype=float), accumulators)
+                if verbose:
+                    print(">>>>> S4BeamlineConvergence.run(): batch %d, %d rays: %s" % (ibatch + 1, sum(batch_nrays),
+                          ", ".join(["%s=%g+/-%g" % (name, estimate["value"], estimate["error"])
+                                     for name, estimate in estimates.items()])))
+
+                if len(batch_values) >= self._min_batches:
+                    converged = all([self._is_converged(estimate, target, absolute_target) for estimate, target,
+                                     absolute_target in zip(estimates.values(), self._targets, self._absolute_targets)])
+                    if converged: break
+        finally:
+            light_source.set_nrays(nrays)
+
+        if verbose:
+            if converged: print(">>>>> S4BeamlineConvergence.run(): converged with %d rays" % sum(batch_nrays))
+            else:         print(">>>>> S4BeamlineConvergence.run(): not converged with %d rays" % sum(batch_nrays))
+
+        results = {"converged": converged,
+                   "nrays": int(sum(batch_nrays)),
+                   "nbatches": len(batch_nrays),
+                   "figures_of_merit": estimates}
+        if keep_beam:
+            results["beam"] = S4Beam.initialize_from_beams(beams)
+            results["mirr"] = None if any([mirr is None for mirr in mirrs]) else S4Beam.initialize_from_beams(mirrs)
+        return results
+
+    def _get_targets(self, target):
+        if isinstance(target, dict): return [target.get(name) for name in self._figures_of_merit.keys()]
+        return [target] * len(self._figures_of_merit)
+
+    @classmethod
+    def _is_converged(cls, estimate, target, absolute_target):
+        if target is not None and estimate["relative_error"] <= target: return True
+        return absolute_target is not None and estimate["error"] <= absolute_target
+
+    def _get_batch_weights(self, beam, mirr):
+        weights = []
+        for figure_of_merit in self._figures_of_merit.values():
+            if isinstance(figure_of_merit, S4ScanFigureOfMerit): weights.append(figure_of_merit.get_batch_weight(beam, mirr))
+            else:                                                weights.append(beam.get_intensity(nolost=1))
+        return weights
+
+    def _accumulate_histograms(self, accumulators, beam, mirr):
+        for name, figure_of_merit in self._figures_of_merit.items():
+            if not isinstance(figure_of_merit, S4ScanFWHM): continue
+            if accumulators.get(name) is None:
+                accumulators[name] = figure_of_merit.get_histogram_accumulator(beam, mirr)
+            if accumulators[name] is not None: figure_of_merit.accumulate(accumulators[name], beam, mirr)
+
+    def _get_estimates(self, values, weights, accumulators={}):
+        # values, weights: (nbatches, nfigures), the weights are the batch intensities. Batches with nan values or
+        # zero weight are ignored.
+        # accumulators: the accumulated histograms of the figures of merit that are not the mean of the batch
+        # values (the FWHM); the batch values are then used only for the error.
+        estimates = {}
+        for j, name in enumerate(self._figures_of_merit.keys()):
+            good = numpy.isfinite(values[:, j]) & (weights[:, j] > 0)
+            x = values[good, j]
+            w = weights[good, j]
+            n = x.size
+            if n == 0:
+                value = error = relative_error = numpy.nan
+            else:
+                mean = numpy.average(x, weights=w)
+                if accumulators.get(name) is None:
+                    value = mean
+                else:
+                    fwhm = accumulators[name].get_ticket()['fwhm']
+                    value = numpy.nan if fwhm is None else fwhm
+                if n < 2:
+                    error = numpy.inf
+                else:
+                    # variance of the batch values, and of their weighted mean
+                    variance = numpy.average((x - mean)**2, weights=w) * n / (n - 1)
+                    standard_error = numpy.sqrt(variance * (w**2).sum()) / w.sum()
+                    error = student_t.ppf(0.5 * (1 + self._confidence), n - 1) * standard_error
+                if value != 0:  relative_error = error / numpy.abs(value)
+                elif error == 0: relative_error = 0.0
+                else:           relative_error = numpy.inf
+            estimates[name] = {"value": value, "error": error, "relative_error": relative_error,
+                               "batch_values": values[:, j].copy()}
+        return estimates
@@ -20,6 +20,32 @@ class S4BeamlineElement(BeamlineElement):
     def get_movements(self): return self.__movements
     def set_movements(self, movements): self.__movements = movements
     def trace_beam(self, **params): raise NotImplementedError()
+
+    def trace_beam_with_profiler(self, profiler, **params):
+        """
+        Traces the beam (see trace_beam()) recording the wall time (split in phases), rays and memory in a
+        profiler.
+
+        Parameters
+        ----------
+        profiler : instance of S4BeamlineProfiler
+            The profiler.
+
+        params :
+            The parameters passed to trace_beam().
+
+        Returns
+        -------
+        tuple
+            (output_beam, footprint), as returned by trace_beam().
+
+        """
+        with profiler:
+            profiler.start_element(1, self.get_optical_element().get_name(), self.get_input_beam())
+            output_beam, footprint = self.trace_beam(**params)
+            profiler.end_element(output_beam)
+        return output_beam, footprint
+
     def info(self): return self.get_optical_element().info() + "\n" + self.get_coordinates().info()
     def to_python_code(self, **kwargs): raise NotImplementedError()
 
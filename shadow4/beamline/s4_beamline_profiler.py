@@ -0,0 +1,275 @@
+#
+# Instrumentation of the beamline tracing.
+#
+# A S4BeamlineProfiler is "active" inside a "with profiler:" block (or during S4Beamline.run_beamline(profiler=...)).
+# While active, the code of shadow4 reports:
+#   - the sub-phases of the tracing with "with profile_phase(name):" (transform, intercept, normal, reflectivity,
+#     boundaries, image-plane). Nested phases are included in the outermost one.
+#   - the bytes of the copied beams with profile_copy(nbytes).
+# S4Beamline reports the light source and each beamline element (wall time, rays in and out, peak memory).
+# When no profiler is active, these calls do nothing. The primitives profile_phase() and profile_copy() are in
+# shadow4.tools.profiler (imported here for compatibility), so that the low-level code does not depend on the
+# beamline package.
+#
+import json
+import time
+import tracemalloc
+
+from shadow4.tools.profiler import get_active_profiler, set_active_profiler, profile_phase, profile_copy
+
+class S4BeamlineProfiler(object):
+    """
+    Records where time and memory go while tracing a beamline.
+
+    Parameters
+    ----------
+    trace_memory : boolean, optional
+        If True, record the peak memory of each element using tracemalloc (it slows down the calculation).
+
+    Examples
+    --------
+    >>> profiler = S4BeamlineProfiler()
+    >>> output_beam, output_mirr = beamline.run_beamline(profiler=profiler)
+    >>> print(profiler.info())
+    >>> profiler.to_chrome_trace("trace.json") # open in chrome://tracing or https://ui.perfetto.dev
+
+    """
+    def __init__(self, trace_memory=False):
+        self._trace_memory = trace_memory
+        self._previous_profilers = []
+        self._started_tracemalloc = False
+        self.reset()
+
+    def reset(self):
+        """
+        Removes the recorded data.
+        """
+        self._t0 = time.perf_counter()
+        self._events = []
+        self._elements = []
+        self._current_element = None
+        self._phase_depth = 0
+        self._phase_start = None
+        self._phase_name = None
+        self._bytes_copied = 0
+
+    #
+    # activation
+    #
+    def __enter__(self):
+        self._previous_profilers.append(set_active_profiler(self))
+        if self._trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._current_element is not None: self.end_element()
+        set_active_profiler(self._previous_profilers.pop())
+        if self._started_tracemalloc and len(self._previous_profilers) == 0:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return False
+
+    #
+    # recording
+    #
+    def start_element(self, number, name, input_beam=None):
+        """
+        Starts the record of a beamline element (or the light source).
+
+        Parameters
+        ----------
+        number : int
+            The element number (0 for the light source).
+
+        name : str
+            The element name.
+
+        input_beam : instance of S4Beam, optional
+            The input beam (to count the incoming rays).
+
+        """
+        if self._current_element is not None: self.end_element()
+
+        if self._trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        else:
+            memory_start = None
+
+        self._current_element = {"number": number,
+                                 "name": name,
+                                 "start": self._now(),
+                                 "wall_time": None,
+                                 "phases": {},
+                                 "rays_in": None if input_beam is None else int(input_beam.get_number_of_rays(nolost=0)),
+                                 "good_rays_in": None if input_beam is None else int(input_beam.get_number_of_rays(nolost=1)),
+                                 "rays_out": None,
+                                 "good_rays_out": None,
+                                 "bytes_copied": 0,
+                                 "peak_memory": None,
+                                 "_memory_start": memory_start}
+
+    def end_element(self, output_beam=None):
+        """
+        Ends the record of the current beamline element.
+
+        Parameters
+        ----------
+        output_beam : instance of S4Beam, optional
+            The output beam (to count the outgoing rays).
+
+        """
+        element = self._current_element
+        if element is None: return
+        if self._phase_depth > 0: # an exception interrupted a phase
+            self._phase_depth = 1
+            self._end_phase()
+
+        element["wall_time"] = self._now() - element["start"]
+        if output_beam is not None:
+            element["rays_out"] = int(output_beam.get_number_of_rays(nolost=0))
+            element["good_rays_out"] = int(output_beam.get_number_of_rays(nolost=1))
+        memory_start = element.pop("_memory_start")
+        if memory_start is not None and tracemalloc.is_tracing():
+            element["peak_memory"] = tracemalloc.get_traced_memory()[1] - memory_start
+
+        self._elements.append(element)
+        self._events.append({"name": "%d: %s" % (element["number"], element["name"]), "category": "element",
+                             "start": element["start"], "duration": element["wall_time"], "element": element["number"]})
+        self._current_element = None
+
+    def add_copied_bytes(self, nbytes):
+        """
+        Adds the bytes of a copied beam.
+
+        Parameters
+        ----------
+        nbytes : int
+            The number of bytes.
+
+        """
+        self._bytes_copied += int(nbytes)
+        if self._current_element is not None: self._current_element["bytes_copied"] += int(nbytes)
+
+    def _start_phase(self, name):
+        self._phase_depth += 1
+        if self._phase_depth == 1:
+            self._phase_name = name
+            self._phase_start = self._now()
+
+    def _end_phase(self):
+        self._phase_depth -= 1
+        if self._phase_depth > 0: return
+
+        duration = self._now() - self._phase_start
+        element_number = None
+        if self._current_element is not None:
+            element_number = self._current_element["number"]
+            phases = self._current_element["phases"]
+            phases[self._phase_name] = phases.get(self._phase_name, 0.0) + duration
+        self._events.append({"name": self._phase_name, "category": "phase",
+                             "start": self._phase_start, "duration": duration, "element": element_number})
+
+    def _now(self):
+        return time.perf_counter() - self._t0
+
+    #
+    # report
+    #
+    def get_report(self):
+        """
+        Returns the recorded data.
+
+        Returns
+        -------
+        dict
+            With keys:
+            'elements': a list with a dict per traced element (in order), with keys 'number', 'name', 'start',
+            'wall_time' (s), 'phases' (dict with the time (s) of each phase), 'rays_in', 'good_rays_in',
+            'rays_out', 'good_rays_out', 'bytes_copied', 'peak_memory' (bytes, None if not traced);
+            'phases': the total time of each phase; 'total_time': the sum of the element times;
+            'bytes_copied': the total bytes of the copied beams.
+
+        """
+        phases = {}
+        for element in self._elements:
+            for name, value in element["phases"].items():
+                phases[name] = phases.get(name, 0.0) + value
+
+        return {"elements": [dict(element) for element in self._elements],
+                "phases": phases,
+                "total_time": sum([element["wall_time"] for element in self._elements]),
+                "bytes_copied": self._bytes_copied}
+
+    def info(self):
+        """
+        Returns a text with the recorded data (a line per element).
+
+        Returns
+        -------
+        str
+
+        """
+        report = self.get_report()
+        txt = "%4s %-30s %10s %10s %10s %12s %12s  %s\n" % \
+              ("#", "element", "time [s]", "rays in", "good out", "copied [MB]", "peak [MB]", "phases [s]")
+        for element in report["elements"]:
+            peak_memory = "-" if element["peak_memory"] is None else "%.1f" % (element["peak_memory"] / 2**20)
+            txt += "%4d %-30s %10.4f %10s %10s %12.1f %12s  %s\n" % \
+                   (element["number"], element["name"][:30], element["wall_time"],
+                    element["rays_in"], element["good_rays_out"], element["bytes_copied"] / 2**20, peak_memory,
+                    ", ".join(["%s=%.4f" % item for item in element["phases"].items()]))
+        txt += "total time: %.4f s, copied: %.1f MB\n" % (report["total_time"], report["bytes_copied"] / 2**20)
+        return txt
+
+    def to_json(self, filename=None):
+        """
+        Returns the report (see get_report()) as a JSON text, and optionally writes it to a file.
+
+        Parameters
+        ----------
+        filename : str, optional
+            The file name.
+
+        Returns
+        -------
+        str
+
+        """
+        txt = json.dumps(self.get_report(), indent=2)
+        if filename is not None:
+            with open(filename, "w") as f: f.write(txt)
+            print("File written to disk: %s" % filename)
+        return txt
+
+    def to_chrome_trace(self, filename=None):
+        """
+        Returns the recorded events in the Chrome trace event format (complete events, times in microseconds),
+        and optionally writes them to a file, that can be opened with chrome://tracing or https://ui.perfetto.dev.
+
+        Parameters
+        ----------
+        filename : str, optional
+            The file name.
+
+        Returns
+        -------
+        dict
+
+        """
+        events = []
+        for event in sorted(self._events, key=lambda event: (event["start"], event["category"] != "element")):
+            events.append({"name": event["name"], "cat": event["category"], "ph": "X",
+                           "ts": 1e6 * event["start"], "dur": 1e6 * event["duration"],
+                           "pid": 0, "tid": 0, "args": {"element": event["element"]}})
+        for element in self._elements:
+            events.append({"name": "good rays", "ph": "C", "ts": 1e6 * (element["start"] + element["wall_time"]),
+                           "pid": 0, "tid": 0, "args": {"good rays": element["good_rays_out"] or 0}})
+        trace = {"traceEvents": events, "displayTimeUnit": "ms"}
+        if filename is not None:
+            with open(filename, "w") as f: json.dump(trace, f)
+            print("File written to disk: %s" % filename)
+        return trace
+
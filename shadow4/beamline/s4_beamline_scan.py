@@ -0,0 +1,383 @@
+#
+# Parameter scans of a S4Beamline.
+#
+# The scan parameters are given as paths "<element number>.<attribute>.<attribute>..." (element number 0 is
+# the light source, e.g. "2.coordinates.q", "1.coordinates.angle_radial") or as functions f(beamline, value)
+# for changes that need more than setting an attribute (e.g., creating a new optical element with other
+# focal distances).
+#
+# The light source and the elements upstream of the first element modified by the scan are traced only once;
+# the scan points are traced from there, optionally in a pool of processes.
+#
+import copy
+import itertools
+import concurrent.futures
+
+import numpy
+
+from shadow4.beamline.s4_beamline import S4Beamline
+from shadow4.beamline.s4_beamline_cache import S4BeamlineCache
+from shadow4.beam.s4_beam_accumulators import S4BeamHistogramAccumulator
+
+class S4BeamlineScan(object):
+    """
+    Scans parameters of a beamline and calculates figures of merit of the output beam for each point.
+
+    Parameters
+    ----------
+    beamline : instance of S4Beamline
+        The beamline (it is not modified: the scan uses a copy).
+
+    parameters : dict
+        Maps the scanned parameters (paths or functions f(beamline, value), see the module comments) to
+        arrays with their values.
+
+    figures_of_merit : dict
+        Maps names to functions f(output_beam, output_mirr) returning a number, calculated for each point
+        (e.g., S4ScanFWHM, S4ScanCentroid, S4ScanIntensity).
+
+    mode : str, optional
+        'grid' (all the combinations of the parameter values) or 'zip' (the i-th point uses the i-th value
+        of every parameter; all the arrays must have the same length).
+
+    Notes
+    -----
+    To run in parallel, the functions must be picklable (i.e., defined at module level or instances of
+    classes like S4ScanFWHM).
+
+    """
+    def __init__(self, beamline, parameters, figures_of_merit, mode="grid"):
+        if mode not in ("grid", "zip"): raise Exception("mode must be 'grid' or 'zip'")
+        self._beamline = beamline
+        self._parameters = list(parameters.keys())
+        self._values = [numpy.atleast_1d(numpy.asarray(values)) for values in parameters.values()]
+        self._figures_of_merit = figures_of_merit
+        self._mode = mode
+
+        if mode == "zip" and len(set([values.size for values in self._values])) > 1:
+            raise Exception("All the parameter arrays must have the same length in 'zip' mode")
+
+    def get_parameter_names(self):
+        """
+        Returns the names of the scanned parameters (the paths, or the names of the functions).
+
+        Returns
+        -------
+        list
+
+        """
+        return [parameter if isinstance(parameter, str) else parameter.__name__ for parameter in self._parameters]
+
+    def get_points(self):
+        """
+        Returns the values of the parameters for each scan point.
+
+        Returns
+        -------
+        list
+            A list of tuples (one value per parameter).
+
+        """
+        if self._mode == "grid":
+            return list(itertools.product(*[values.tolist() for values in self._values]))
+        else:
+            return list(zip(*[values.tolist() for values in self._values]))
+
+    def run(self, n_workers=1, compact_lost_rays=False, verbose=True, **params):
+        """
+        Runs the scan.
+
+        Parameters
+        ----------
+        n_workers : int, optional
+            The number of processes (1: run in this process, None: number of cpus).
+
+        compact_lost_rays : boolean or list, optional
+            See S4Beamline.run_beamline().
+
+        verbose : boolean, optional
+            If True, print the beamline element the scan points are traced from.
+
+        params :
+            Other parameters passed to the light source and to the beamline elements.
+
+        Returns
+        -------
+        dict
+            A table with one column (numpy array) per parameter and per figure of merit, and one row per
+            scan point.
+
+        """
+        # copy of the beamline, without the input beams of the elements
+        memo = {id(element.get_input_beam()): None for element in self._beamline.get_beamline_elements()}
+        beamline = copy.deepcopy(self._beamline, memo)
+
+        points = self.get_points()
+        first_stage = self._get_first_modified_stage(beamline, points, compact_lost_rays, **params)
+        # if the scan changes nothing, the last element is traced for each point (for its footprint)
+        first_stage = min(first_stage, len(beamline.get_beamline_elements()))
+
+        if first_stage == 0: # the light source is scanned
+            output_beam = None
+        else:
+            upstream = S4Beamline(light_source=beamline.get_light_source(),
+                                  beamline_elements_list=beamline.get_beamline_elements()[:first_stage - 1])
+            output_beam, _ = upstream.run_beamline(compact_lost_rays=compact_lost_rays, **params)
+            if verbose: print(">>>>> S4BeamlineScan.run(): %d points, tracing from beamline element # %d" % (len(points), first_stage))
+
+        arguments = (beamline, self._parameters, output_beam, first_stage, self._figures_of_merit, compact_lost_rays, params)
+        if n_workers == 1:
+            results = [_trace_point(*arguments, point) for point in points]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers,
+                                                        initializer=_initialize_worker,
+                                                        initargs=arguments) as executor:
+                results = list(executor.map(_trace_point_in_worker, points))
+
+        table = {}
+        for j, name in enumerate(self.get_parameter_names()):
+            table[name] = numpy.array([point[j] for point in points])
+        for j, name in enumerate(self._figures_of_merit.keys()):
+            table[name] = numpy.array([result[j] for result in results], dtype=float)
+        return table
+
+    def _get_first_modified_stage(self, beamline, points, compact_lost_rays, **params):
+        # the first stage (0: light source, i: element i) whose hash changes for any of the scan points
+        keys0 = S4BeamlineCache.get_stage_keys(beamline, compact_lost_rays=compact_lost_rays, **params)
+        first_stage = len(keys0)
+        for point in points:
+            point_beamline = copy.deepcopy(beamline)
+            _set_parameters(point_beamline, self._parameters, point)
+            keys = S4BeamlineCache.get_stage_keys(point_beamline, compact_lost_rays=compact_lost_rays, **params)
+            for i in range(first_stage):
+                if keys[i] != keys0[i]:
+                    first_stage = i
+                    break
+            if first_stage == 0: break
+        return first_stage
+
+#
+# figures of merit
+#
+class S4ScanFigureOfMerit(object):
+    """
+    Base class of the figures of merit of S4BeamlineScan: a callable f(output_beam, output_mirr).
+    """
+    def __call__(self, beam, mirr):
+        raise NotImplementedError()
+
+    def get_batch_weight(self, beam, mirr):
+        """
+        Returns the weight of the value of a batch of rays in the mean over the batches (see S4BeamlineConvergence):
+        the intensity of the good rays of the output beam.
+        """
+        return beam.get_intensity(nolost=1)
+
+class S4ScanFWHM(S4ScanFigureOfMerit):
+    """
+    The FWHM of the histogram of a column (see S4Beam.histo1()); nan if it cannot be calculated.
+
+    Parameters
+    ----------
+    col : int
+        The column (1-based, as in S4Beam.histo1()).
+
+    nbins : int, optional
+        The number of bins.
+
+    xrange : tuple, optional
+        The histogram limits (default: the column limits).
+
+    nolost : int, optional
+        0=all rays, 1=good rays, 2=lost rays.
+
+    ref : int, optional
+        The weight column (0: none, 23: intensity).
+
+    use_footprint : boolean, optional
+        If True, use the footprint (output_mirr) instead of the output beam.
+
+    """
+    def __init__(self, col, nbins=100, xrange=None, nolost=1, ref=23, use_footprint=False):
+        self._col = col
+        self._nbins = nbins
+        self._xrange = xrange
+        self._nolost = nolost
+        self._ref = ref
+        self._use_footprint = use_footprint
+
+    def __call__(self, beam, mirr):
+        if self._use_footprint: beam = mirr
+        if beam.get_number_of_rays(nolost=self._nolost) == 0: return numpy.nan
+        fwhm = beam.histo1(self._col, xrange=self._xrange, nbins=self._nbins, nolost=self._nolost, ref=self._ref)['fwhm']
+        return numpy.nan if fwhm is None else fwhm
+
+    def get_batch_weight(self, beam, mirr):
+        """
+        Returns the weight of the histogram of a batch of rays: its intensity (or number of rays if ref=0).
+        """
+        return _get_weight(mirr if self._use_footprint else beam, self._nolost, self._ref)
+
+    def get_histogram_accumulator(self, beam, mirr):
+        """
+        Returns an empty S4BeamHistogramAccumulator with the histogram of this figure of merit, to calculate the FWHM
+        of the histogram of several beams (see S4BeamlineConvergence). Without xrange, the limits of the column in
+        the given beams are used.
+
+        Parameters
+        ----------
+        beam : instance of S4Beam
+            The output beam.
+
+        mirr : instance of S4Beam
+            The footprint.
+
+        Returns
+        -------
+        instance of S4BeamHistogramAccumulator or None
+            The accumulator (None if the beam has no rays to define the limits).
+
+        """
+        if self._use_footprint: beam = mirr
+        xrange = self._xrange
+        if xrange is None:
+            if beam.get_number_of_rays(nolost=self._nolost) == 0: return None
+            x = beam.get_column_view(self._col, nolost=self._nolost)
+            xrange = [x.min(), x.max()]
+        return S4BeamHistogramAccumulator(self._col, xrange, nbins=self._nbins, nolost=self._nolost, ref=self._ref)
+
+    def accumulate(self, accumulator, beam, mirr):
+        """
+        Adds the histogram of the output beam (or the footprint) to an accumulator of get_histogram_accumulator().
+        """
+        accumulator.accumulate(mirr if self._use_footprint else beam)
+
+class S4ScanCentroid(S4ScanFigureOfMerit):
+    """
+    The (weighted) mean of a column; nan if there are no rays.
+
+    Parameters
+    ----------
+    col : int
+        The column (1-based).
+
+    nolost : int, optional
+        0=all rays, 1=good rays, 2=lost rays.
+
+    ref : int, optional
+        The weight column (0: none, 23: intensity).
+
+    use_footprint : boolean, optional
+        If True, use the footprint (output_mirr) instead of the output beam.
+
+    """
+    def __init__(self, col, nolost=1, ref=23, use_footprint=False):
+        self._col = col
+        self._nolost = nolost
+        self._ref = ref
+        self._use_footprint = use_footprint
+
+    def __call__(self, beam, mirr):
+        if self._use_footprint: beam = mirr
+        x = beam.get_column_view(self._col, nolost=self._nolost)
+        if x.size == 0: return numpy.nan
+        if self._ref == 0: return x.mean()
+        w = beam.get_column_view(self._ref, nolost=self._nolost)
+        if w.sum() == 0: return numpy.nan
+        return numpy.average(x, weights=w)
+
+    def get_batch_weight(self, beam, mirr):
+        """
+        Returns the weight of the centroid of a batch of rays: its intensity (or number of rays if ref=0).
+        """
+        return _get_weight(mirr if self._use_footprint else beam, self._nolost, self._ref)
+
+class S4ScanIntensity(S4ScanFigureOfMerit):
+    """
+    The intensity (sum of column 23) of the output beam.
+
+    Parameters
+    ----------
+    nolost : int, optional
+        0=all rays, 1=good rays (transmitted intensity), 2=lost rays.
+
+    """
+    def __init__(self, nolost=1):
+        self._nolost = nolost
+
+    def __call__(self, beam, mirr):
+        return beam.get_intensity(nolost=self._nolost)
+
+    def get_batch_weight(self, beam, mirr):
+        """
+        Returns the weight of a batch of rays: its number of rays (the intensity is a sum over the source rays).
+        """
+        return beam.get_number_of_rays(nolost=0)
+
+class S4ScanTransmission(S4ScanFigureOfMerit):
+    """
+    The transmission: the intensity of the good rays of the output beam divided by the number of rays (the
+    rays of the light source have unit intensity). The lost rays must be kept (compact_lost_rays=False).
+    """
+    def __call__(self, beam, mirr):
+        nrays = beam.get_number_of_rays(nolost=0)
+        if nrays == 0: return numpy.nan
+        return beam.get_intensity(nolost=1) / nrays
+
+    def get_batch_weight(self, beam, mirr):
+        """
+        Returns the weight of a batch of rays: its number of rays (the transmission is a mean over the source rays).
+        """
+        return beam.get_number_of_rays(nolost=0)
+
+def _get_weight(beam, nolost, ref):
+    if ref == 0: return beam.get_number_of_rays(nolost=nolost)
+    return beam.get_column_view(ref, nolost=nolost).sum()
+
+#
+# scan points (in this process or in the process pool workers)
+#
+def _set_parameters(beamline, parameters, point):
+    for parameter, value in zip(parameters, point):
+        if isinstance(parameter, str):
+            _set_parameter(beamline, parameter, value)
+        else:
+            parameter(beamline, value)
+
+def _set_parameter(beamline, path, value):
+    tokens = path.split(".")
+    try:
+        element_number = int(tokens[0])
+    except:
+        raise Exception("Bad parameter path (must start with the element number): %s" % path)
+    obj = beamline.get_light_source() if element_number == 0 else beamline.get_beamline_elements()[element_number - 1]
+
+    for token in tokens[1:-1]:
+        if hasattr(obj, "get_" + token): obj = getattr(obj, "get_" + token)()
+        elif hasattr(obj, "_" + token):  obj = getattr(obj, "_" + token)
+        elif hasattr(obj, token):        obj = getattr(obj, token)
+        else: raise Exception("Bad parameter path (%s not found): %s" % (token, path))
+
+    token = tokens[-1]
+    if hasattr(obj, "set_" + token):                                      getattr(obj, "set_" + token)(value)
+    elif hasattr(obj, "_" + token):                                       setattr(obj, "_" + token, value)
+    elif hasattr(obj, token) and not callable(getattr(obj, token)):       setattr(obj, token, value)
+    else: raise Exception("Bad parameter path (%s not found): %s" % (token, path))
+
+def _trace_point(beamline, parameters, output_beam, first_stage, figures_of_merit, compact_lost_rays, params, point):
+    _set_parameters(beamline, parameters, point)
+    if first_stage == 0:
+        beam, mirr = beamline.run_beamline(compact_lost_rays=compact_lost_rays, **params)
+    else:
+        beam, mirr = beamline._trace_beamline_elements(output_beam, None, compact_lost_rays, False,
+                                                       first_element=first_stage - 1, **params)
+    return [figure_of_merit(beam, mirr) for figure_of_merit in figures_of_merit.values()]
+
+_WORKER_ARGUMENTS = None
+
+def _initialize_worker(*arguments):
+    global _WORKER_ARGUMENTS
+    _WORKER_ARGUMENTS = arguments
+
+def _trace_point_in_worker(point):
+    return _trace_point(*_WORKER_ARGUMENTS, point)
@@ -1,5 +1,6 @@
 import numpy
 import os
+import functools
 
 from syned.beamline.shape import Direction, Convexity
 from syned.beamline.shape import Sphere, SphericalCylinder
@@ -11,6 +12,27 @@ from syned.beamline.shape import Toroid, Conic, NumericalMesh, Plane, Side
 from shadow4.optical_surfaces.s4_conic import S4Conic
 from shadow4.optical_surfaces.s4_mesh import S4Mesh
 from shadow4.optical_surfaces.s4_toroid import S4Toroid
+from shadow4.beamline.s4_beamline_cache import S4BeamlineCache
+
+def cached_optical_surface(get_optical_surface_instance):
+    """
+    Decorator of the get_optical_surface_instance() methods: the optical surface is calculated once and stored
+    in the optical element. It is calculated again only when the optical element changes (the stored surface is
+    tagged with a hash of all the attributes of the optical element, see S4BeamlineCache.get_hash(), including
+    the contents of the mesh arrays and the modification time of the files).
+
+    The stored surface is shared by all the calls, so it must not be modified by the caller.
+    """
+    @functools.wraps(get_optical_surface_instance)
+    def wrapper(self):
+        key = S4BeamlineCache.get_hash(self) # the attribute _optical_surface_cache is not included
+        optical_surface_cache = getattr(self, "_optical_surface_cache", None)
+        if optical_surface_cache is not None and optical_surface_cache[0] == key: return optical_surface_cache[1]
+
+        optical_surface = get_optical_surface_instance(self)
+        self._optical_surface_cache = (key, optical_surface)
+        return optical_surface
+    return wrapper
 
 class S4OpticalElementDecorator(object):
 
@@ -42,6 +64,7 @@ class S4PlaneOpticalElementDecorator(S4OpticalElementDecorator):
     def get_surface_shape_instance(self):
         return self._plane_surface_shape
 
+    @cached_optical_surface
     def get_optical_surface_instance(self):
         return S4Conic.initialize_as_plane()
 
@@ -85,6 +108,7 @@ class S4SphereOpticalElementDecorator(S4CurvedOpticalElementDecorator):
 
         S4CurvedOpticalElementDecorator.__init__(self, surface_calculation, is_cylinder, curved_surface_shape)
 
+    @cached_optical_surface
     def get_optical_surface_instance(self):
         surface_shape = self.get_surface_shape_instance()
 
@@ -126,6 +150,7 @@ class S4EllipsoidOpticalElementDecorator(S4CurvedOpticalElementDecorator):
 
         S4CurvedOpticalElementDecorator.__init__(self, surface_calculation, is_cylinder, curved_surface_shape)
 
+    @cached_optical_surface
     def get_optical_surface_instance(self): # todo: update this one like hyperboloid
         surface_shape = self.get_surface_shape_instance()
 
@@ -171,6 +196,7 @@ class S4HyperboloidOpticalElementDecorator(S4CurvedOpticalElementDecorator):
 
         S4CurvedOpticalElementDecorator.__init__(self, surface_calculation, is_cylinder, curved_surface_shape)
 
+    @cached_optical_surface
     def get_optical_surface_instance(self):
         surface_shape = self.get_surface_shape_instance()
 
@@ -213,6 +239,7 @@ class S4ToroidOpticalElementDecorator(S4CurvedOpticalElementDecorator):
 
         self._f_torus = f_torus
 
+    @cached_optical_surface
     def get_optical_surface_instance(self):
         surface_shape = self.get_surface_shape_instance()
 
@@ -250,6 +277,7 @@ class S4ParaboloidOpticalElementDecorator(S4CurvedOpticalElementDecorator):
 
         S4CurvedOpticalElementDecorator.__init__(self, surface_calculation, is_cylinder, curved_surface_shape)
 
+    @cached_optical_surface
     def get_optical_surface_instance(self):
         surface_shape = self.get_surface_shape_instance()
 
@@ -283,6 +311,7 @@ class S4ConicOpticalElementDecorator(S4CurvedOpticalElementDecorator):
                                                  is_cylinder=False,
                                                  curved_surface_shape=None if conic_coefficients is None else Conic(conic_coefficients=conic_coefficients))
 
+    @cached_optical_surface
     def get_optical_surface_instance(self):
         surface_shape = self.get_surface_shape_instance()
         out = S4Conic.initialize_from_coefficients(surface_shape.get_conic_coefficients())
@@ -298,6 +327,7 @@ class S4NumericalMeshOpticalElementDecorator(S4CurvedOpticalElementDecorator):
                                                  is_cylinder=False,
                                                  curved_surface_shape = NumericalMesh(xx, yy, zz, surface_data_file))
 
+    @cached_optical_surface
     def get_optical_surface_instance(self):
         surface_shape = self.get_surface_shape_instance()
 
@@ -373,6 +403,7 @@ class S4RefractiveLensOpticalElementDecorator(S4CurvedOpticalElementDecorator):
 
         return [conic_coefficients_1, conic_coefficients_2]
 
+    @cached_optical_surface
     def get_optical_surface_instance(self):
         surface_shapes = self.get_surface_shape_instance()
 
@@ -2,6 +2,7 @@
 import numpy
 
 from shadow4.optical_surfaces.s4_optical_surface import S4OpticalSurface
+from shadow4.tools.profiler import profile_phase
 from shadow4.tools.arrayofvectors import vector_refraction, vector_scattering
 from shadow4.tools.arrayofvectors import vector_cross, vector_dot, vector_multiply_scalar, vector_sum, vector_diff
 from shadow4.tools.arrayofvectors import vector_modulus_square, vector_modulus, vector_norm, vector_rotate_around_axis
@@ -333,23 +334,17 @@ class S4Conic(S4OpticalSurface):
 
         # shape_x =  x.shape
 
-        # TODO: remove loop!
-        for i in range(AA.size):
-            if numpy.abs(AA[i])  < 1e-15:
-                TPAR1[i] = - CC[i] / BB[i]
-                TPAR2[i] = TPAR1[i]
-            else:
-
-                DENOM = 0.5 / AA[i]
-                DETER = BB[i] ** 2 - CC[i] * AA[i] * 4
+        ilinear = numpy.abs(AA) < 1e-15
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            DENOM = 0.5 / AA
+            DETER = BB ** 2 - CC * AA * 4
+            TPAR1 = numpy.where(ilinear, - CC / BB, -(BB + numpy.sqrt(DETER)) * DENOM)
+            TPAR2 = numpy.where(ilinear, TPAR1,     -(BB - numpy.sqrt(DETER)) * DENOM)
 
-                if DETER < 0.0:
-                    TPAR1[i] = 0.0
-                    TPAR2[i] = 0.0
-                    IFLAG[i] = -1
-                else:
-                    TPAR1[i] = -(BB[i] + numpy.sqrt(DETER)) * DENOM
-                    TPAR2[i] = -(BB[i] - numpy.sqrt(DETER)) * DENOM
+        icomplex = (~ilinear) & (DETER < 0.0)
+        TPAR1[icomplex] = 0.0
+        TPAR2[icomplex] = 0.0
+        IFLAG[icomplex] = -1
 
         if TPAR2.size == 1:
             TPAR2 = numpy.asscalar(TPAR2)
@@ -366,11 +361,7 @@ class S4Conic(S4OpticalSurface):
 
 
         if method == 0:
-            for i in range(TPAR1.size):
-                if ( numpy.abs(TPAR1[i]-reference_distance) <= numpy.abs(TPAR2[i]-reference_distance)):
-                   TPAR[i] = TPAR1[i]
-                else:
-                   TPAR[i] = TPAR2[i]
+            TPAR = numpy.where(numpy.abs(TPAR1 - reference_distance) <= numpy.abs(TPAR2 - reference_distance), TPAR1, TPAR2)
         elif method == 1:
             TPAR = TPAR1
         elif method == 2:
@@ -839,24 +830,25 @@ class S4Conic(S4OpticalSurface):
         # ; TRACING...
         # ;
 
-        x1 = newbeam.get_columns([1, 2, 3])  # numpy.array(a3.getshcol([1,2,3]))
-        v1 = newbeam.get_columns([4, 5, 6])  # numpy.array(a3.getshcol([4,5,6]))
+        x1 = newbeam.get_columns_view([1, 2, 3])  # numpy.array(a3.getshcol([1,2,3]))
+        v1 = newbeam.get_columns_view([4, 5, 6])  # numpy.array(a3.getshcol([4,5,6]))
         flag = newbeam.get_column(10)  # numpy.array(a3.getshonecol(10))
         optical_path = newbeam.get_column(13)
 
-        t1, t2, iflag = self.calculate_intercept(x1, v1)
-        reference_distance = -newbeam.get_column(2).mean() + newbeam.get_column(3).mean()
-        t = self.choose_solution(t1, t2, reference_distance=reference_distance)
+        with profile_phase("intercept"):
+            t1, t2, iflag = self.calculate_intercept(x1, v1)
+            reference_distance = -newbeam.get_column_view(2).mean() + newbeam.get_column_view(3).mean()
+            t = self.choose_solution(t1, t2, reference_distance=reference_distance)
 
         x2 = x1 + v1 * t
-        for i in range(flag.size):
-            if iflag[i] < 0: flag[i] = -100
+        flag[iflag < 0] = -100
 
         # ;
         # ; Calculates the normal at each intercept [see shadow's normal.F]
         # ;
 
-        normal = self.get_normal(x2)
+        with profile_phase("normal"):
+            normal = self.get_normal(x2)
 
         # ;
         # ; reflection
@@ -912,28 +904,29 @@ class S4Conic(S4OpticalSurface):
         # ;
         newbeam = beam.duplicate()
 
-        x1 = newbeam.get_columns([1, 2, 3])  # numpy.array(3, npoints)
-        v1 = newbeam.get_columns([4, 5, 6])  # numpy.array(3, npoints)
+        x1 = newbeam.get_columns_view([1, 2, 3])  # numpy.array(3, npoints)
+        v1 = newbeam.get_columns_view([4, 5, 6])  # numpy.array(3, npoints)
         flag = newbeam.get_column(10)
         k_in_mod = newbeam.get_column(11)
         optical_path = newbeam.get_column(13)
 
-        t1, t2, iflag = self.calculate_intercept(x1, v1)
-        reference_distance = -newbeam.get_column(2).mean() + newbeam.get_column(3).mean()
-        t = self.choose_solution(t1, t2, reference_distance=reference_distance)
+        with profile_phase("intercept"):
+            t1, t2, iflag = self.calculate_intercept(x1, v1)
+            reference_distance = -newbeam.get_column_view(2).mean() + newbeam.get_column_view(3).mean()
+            t = self.choose_solution(t1, t2, reference_distance=reference_distance)
 
         # for i in range(t.size):
         #     print(">>>> solutions: ",t1[i],t2[i],t[i])
 
         x2 = x1 + v1 * t
-        for i in range(flag.size):
-            if iflag[i] < 0: flag[i] = -100
+        flag[iflag < 0] = -100
 
         # ;
         # ; Calculates the normal at each intercept [see shadow's normal.F]
         # ;
 
-        normal = self.get_normal(x2)
+        with profile_phase("normal"):
+            normal = self.get_normal(x2)
 
         # if surface is convex normal_z > 0;  if concave normal_z < 0
         # we always want normal_z > 0:
@@ -1045,26 +1038,27 @@ class S4Conic(S4OpticalSurface):
 
         newbeam = beam.duplicate()
 
-        x1 = newbeam.get_columns([1, 2, 3])  # numpy.array(a3.getshcol([1,2,3]))
-        v1 = newbeam.get_columns([4, 5, 6])  # numpy.array(a3.getshcol([4,5,6]))
+        x1 = newbeam.get_columns_view([1, 2, 3])  # numpy.array(a3.getshcol([1,2,3]))
+        v1 = newbeam.get_columns_view([4, 5, 6])  # numpy.array(a3.getshcol([4,5,6]))
         flag = newbeam.get_column(10)  # numpy.array(a3.getshonecol(10))
         kin = newbeam.get_column(11) * 1e2 # in m^-1
         optical_path = newbeam.get_column(13)
         nrays = flag.size
 
-        t1, t2, iflag = self.calculate_intercept(x1, v1)
-        reference_distance = -newbeam.get_column(2).mean() + newbeam.get_column(3).mean()
-        t = self.choose_solution(t1, t2, reference_distance=reference_distance)
+        with profile_phase("intercept"):
+            t1, t2, iflag = self.calculate_intercept(x1, v1)
+            reference_distance = -newbeam.get_column_view(2).mean() + newbeam.get_column_view(3).mean()
+            t = self.choose_solution(t1, t2, reference_distance=reference_distance)
 
         x2 = x1 + v1 * t
-        for i in range(flag.size):
-            if iflag[i] < 0: flag[i] = -100
+        flag[iflag < 0] = -100
 
         # ;
         # ; Calculates the normal at each intercept [see shadow's normal.F]
         # ;
 
-        normal = self.get_normal(x2)
+        with profile_phase("normal"):
+            normal = self.get_normal(x2)
 
         # ;
         # ; reflection
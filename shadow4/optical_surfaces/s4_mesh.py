@@ -1,4 +1,5 @@
 from shadow4.optical_surfaces.s4_optical_surface import S4OpticalSurface
+from shadow4.tools.profiler import profile_phase
 
 # https://stackoverflow.com/questions/13360062/python-curves-intersection-with-fsolve-and-function-arguments-using-numpy
 
@@ -10,18 +11,38 @@ from scipy import interpolate
 from srxraylib.plot.gol import plot,plot_image, plot_surface, plot_scatter
 import sys
 import time
+import hashlib
 import numpy
+from collections import OrderedDict
+
+# spline coefficients cached per mesh content (shared by all S4Mesh instances), see S4Mesh.calculate_surface_from_mesh()
+_SPLINE_CACHE = OrderedDict()
+_SPLINE_CACHE_MAX_ENTRIES = 10
+
+_SPLINE_ORDER = {'linear': 1, 'cubic': 3, 'quintic': 5}
+
+
+def _linear_spline_slope(spline, x, y, axis=0):
+    # slope along an axis where the spline is piecewise linear: the difference between the values at the
+    # edges of the grid cell containing each point (exact, as the spline is linear in the cell along this axis)
+    knots = numpy.unique(spline.get_knots()[axis])
+    u = x if axis == 0 else y
+    i = numpy.clip(numpy.searchsorted(knots, u, side='right') - 1, 0, knots.size - 2)
+    u0 = knots[i]
+    u1 = knots[i + 1]
+    if axis == 0: return (spline.ev(u1, y) - spline.ev(u0, y)) / (u1 - u0)
+    else:         return (spline.ev(x, u1) - spline.ev(x, u0)) / (u1 - u0)
 
 
 class S4Mesh(S4OpticalSurface):
     def __init__(self, surface=None, mesh_x=None, mesh_y=None, mesh_z=None, kind='cubic'):
         self.__x0 = [0.0,0.0,0.0]
         self.__v0 = [0.0,0.0,0.0]
-        self.surface = surface # Surface must be the function defining height(x,y) or a scipy.interpolate.interp2d instance
+        self.surface = surface # Surface must be the function defining height(x,y) or a scipy.interpolate.RectBivariateSpline instance
         self.mesh_x = mesh_x # not used if surface is defined
         self.mesh_y = mesh_y # not used if surface is defined
         self.mesh_z = mesh_z # not used if surface is defined
-        self.kind = kind
+        self.kind = kind # spline order used for the mesh: 'linear', 'cubic' or 'quintic'
 
         if (surface is None) and (mesh_z is not None) and (mesh_x is not None) and (mesh_x is not None):
             self.calculate_surface_from_mesh()
@@ -31,14 +52,14 @@ class S4Mesh(S4OpticalSurface):
         self.__v0 = v0
 
     def set_surface(self, surface):
-        if isinstance(surface, interpolate.interp2d):
+        if isinstance(surface, (interpolate.BivariateSpline, interpolate.interp2d)):
             self.surface = surface
         else:
             try:
                 z = surface(0, 0)
                 self.surface = surface
             except:
-                raise Exception("Surface must be the function defining height(x,y) or a scipy.interpolate.interp2d instance")
+                raise Exception("Surface must be the function defining height(x,y) or a scipy.interpolate.RectBivariateSpline instance")
 
     def set_mesh(self, z, x, y):
         if (z.shape[0] != x.size) or (z.shape[1] != y.size):
@@ -54,11 +75,123 @@ class S4Mesh(S4OpticalSurface):
     def get_mesh_z(self):
         return self.mesh_z
 
+    def set_kind(self, kind='cubic'):
+        if kind not in _SPLINE_ORDER.keys():
+            raise Exception("Spline kind must be one of: %s" % repr(list(_SPLINE_ORDER.keys())))
+        self.kind = kind
+        if self.mesh_z is not None: self.calculate_surface_from_mesh()
+
     def calculate_surface_from_mesh(self):
-        self.surface = interpolate.interp2d(self.mesh_x, self.mesh_y, self.mesh_z.T, kind=self.kind)
+        # Fits a spline on the rectangular grid (mesh_x, mesh_y). The fitted spline is cached using a hash of
+        # the mesh data, so the same mesh (e.g., the same metrology file) is fitted only once.
+        key = self._get_mesh_hash()
+        if key in _SPLINE_CACHE:
+            _SPLINE_CACHE.move_to_end(key)
+            self.surface = _SPLINE_CACHE[key]
+            return
+
+        x = numpy.asarray(self.mesh_x, dtype=float)
+        y = numpy.asarray(self.mesh_y, dtype=float)
+        z = numpy.asarray(self.mesh_z, dtype=float)
+        ix = numpy.argsort(x)
+        iy = numpy.argsort(y)
+        k = _SPLINE_ORDER[self.kind]
+        self.surface = interpolate.RectBivariateSpline(x[ix], y[iy], z[ix, :][:, iy],
+                                                       kx=min(k, x.size - 1), ky=min(k, y.size - 1), s=0)
+
+        _SPLINE_CACHE[key] = self.surface
+        while len(_SPLINE_CACHE) > _SPLINE_CACHE_MAX_ENTRIES: _SPLINE_CACHE.popitem(last=False)
+
+    def _get_mesh_hash(self):
+        h = hashlib.sha1()
+        h.update(self.kind.encode())
+        for array in (self.mesh_x, self.mesh_y, self.mesh_z):
+            array = numpy.ascontiguousarray(array, dtype=float)
+            h.update(repr(array.shape).encode())
+            h.update(array.tobytes())
+        return h.hexdigest()
+
+    @classmethod
+    def clear_spline_cache(cls):
+        _SPLINE_CACHE.clear()
+
+    @classmethod
+    def set_spline_cache_size(cls, max_entries=10):
+        global _SPLINE_CACHE_MAX_ENTRIES
+        _SPLINE_CACHE_MAX_ENTRIES = max_entries
+        while len(_SPLINE_CACHE) > _SPLINE_CACHE_MAX_ENTRIES: _SPLINE_CACHE.popitem(last=False)
 
     def surface_height(self, x, y):
-        return self.surface(x, y)
+        if self._get_spline() is not None:
+            return self.surface_height_at_points(x, y)
+        else:
+            return self.surface(x, y)
+
+    def surface_height_at_points(self, x, y):
+        """
+        Returns the surface height at the points (x[i], y[i]), evaluated in a single vectorized call.
+
+        Parameters
+        ----------
+        x, y : numpy array
+            The coordinates of the points (arrays with the same shape).
+
+        Returns
+        -------
+        numpy array
+            The heights, with the shape of x.
+
+        """
+        x = numpy.asarray(x, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+        spline = self._get_spline()
+        if spline is not None:
+            return spline.ev(x, y)
+        else:
+            z = numpy.asarray(self.surface(x, y), dtype=float)
+            if z.shape != numpy.broadcast(x, y).shape: # not a vectorized function
+                z = numpy.vectorize(lambda xi, yi: float(numpy.asarray(self.surface(xi, yi)).reshape(-1)[0]))(x, y)
+            return z
+
+    def surface_slopes_at_points(self, x, y):
+        """
+        Returns the surface slopes (dz/dx, dz/dy) at the points (x[i], y[i]).
+
+        Parameters
+        ----------
+        x, y : numpy array
+            The coordinates of the points (arrays with the same shape).
+
+        Returns
+        -------
+        tuple
+            (dz/dx, dz/dy) numpy arrays with the shape of x.
+
+        """
+        x = numpy.asarray(x, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+        spline = self._get_spline()
+        if spline is not None:
+            kx, ky = spline.degrees
+            # fitpack cannot differentiate a linear spline along its linear direction: use the gradient of the cell
+            slope_x = _linear_spline_slope(spline, x, y, axis=0) if kx == 1 else spline.ev(x, y, dx=1)
+            slope_y = _linear_spline_slope(spline, x, y, axis=1) if ky == 1 else spline.ev(x, y, dy=1)
+            return slope_x, slope_y
+        else: # centered finite differences
+            hx = numpy.cbrt(sys.float_info.epsilon) * numpy.maximum(1.0, numpy.abs(x))
+            hy = numpy.cbrt(sys.float_info.epsilon) * numpy.maximum(1.0, numpy.abs(y))
+            slope_x = (self.surface_height_at_points(x + hx, y) - self.surface_height_at_points(x - hx, y)) / (2 * hx)
+            slope_y = (self.surface_height_at_points(x, y + hy) - self.surface_height_at_points(x, y - hy)) / (2 * hy)
+            return slope_x, slope_y
+
+    def _get_spline(self):
+        # returns the spline (with vectorized evaluation method ev) behind the surface, or None for user functions
+        if isinstance(self.surface, interpolate.BivariateSpline):
+            return self.surface
+        elif isinstance(self.surface, interpolate.interp2d): # legacy surfaces
+            return interpolate.BivariateSpline._from_tck(self.surface.tck)
+        else:
+            return None
 
 
     def add_to_mesh(self, z1):
@@ -136,7 +269,7 @@ class S4Mesh(S4OpticalSurface):
     def surface_vs_t(self,t):
         x1 = self.__x0[0] + self.__v0[0] * t
         y1 = self.__x0[1] + self.__v0[1] * t
-        return x1,y1,self.surface(x1,y1)
+        return x1,y1,self.surface_height_at_points(x1,y1)
 
     def equation_to_solve(self, t):
         # return self.surface_z_vs_t(t)-self.line_z(t)
@@ -146,13 +279,7 @@ class S4Mesh(S4OpticalSurface):
         x1 = self.__x0[0] + self.__v0[0] * t
         y1 = self.__x0[1] + self.__v0[1] * t
 
-        if t.size == 1:
-            z1 =  self.surface(x1,y1)
-        else:
-            z1 = numpy.zeros_like(x1)
-            for i in range(z1.size):
-                tmp = self.surface(x1[i],y1[i])
-                z1[i] = tmp
+        z1 = self.surface_height_at_points(x1, y1)
 
         # line vs t
         l1 = self.__x0[2] + self.__v0[2] * t
@@ -285,26 +412,34 @@ class S4Mesh(S4OpticalSurface):
 
         return x_coords, y_coords, z_values
 
-    def get_normal(self,x2):
+    def get_normal(self, x2, method=0):
         # ;
         # ; Calculates the normal at intercept points x2 [see shadow's normal.F]
         # ;
+        # method = 0: vectorized, using the derivatives of the interpolating spline (finite differences for user functions)
+        # method = 1: loop over points using forward finite differences
 
         normal = numpy.zeros_like(x2)
 
-        eps = 100 * sys.float_info.epsilon
-
         X_0 = x2[0,:]
         Y_0 = x2[1,:]
         Z_0 = x2[2,:]
 
-        N_0 = numpy.zeros_like(X_0)
-        N_1 = numpy.zeros_like(X_0)
-        N_2 = numpy.ones_like(X_0)
-        for i in range(X_0.size):
-            z00 = self.surface(X_0[i],Y_0[i])
-            N_0[i] = -1.0 * (self.surface(X_0[i]+eps,Y_0[i]) - z00) / eps
-            N_1[i] = -1.0 * (self.surface(X_0[i],Y_0[i]+eps) - z00) / eps
+        if method == 0:
+            slope_x, slope_y = self.surface_slopes_at_points(X_0, Y_0)
+            N_0 = -1.0 * slope_x
+            N_1 = -1.0 * slope_y
+            N_2 = numpy.ones_like(X_0)
+        else:
+            eps = 100 * sys.float_info.epsilon
+
+            N_0 = numpy.zeros_like(X_0)
+            N_1 = numpy.zeros_like(X_0)
+            N_2 = numpy.ones_like(X_0)
+            for i in range(X_0.size):
+                z00 = self.surface_height_at_points(X_0[i],Y_0[i])
+                N_0[i] = -1.0 * (self.surface_height_at_points(X_0[i]+eps,Y_0[i]) - z00) / eps
+                N_1[i] = -1.0 * (self.surface_height_at_points(X_0[i],Y_0[i]+eps) - z00) / eps
 
 
 
@@ -316,7 +451,11 @@ class S4Mesh(S4OpticalSurface):
 
         return normal
 
-    def calculate_intercept(self,XIN,VIN,keep=0):
+    def calculate_intercept(self, XIN, VIN, keep=0, method=0):
+        # method = 0: vectorized Newton iterations for all rays, with bracketing for the non-converged ones
+        # method = 1: loop over rays using scipy.optimize.root (slow)
+        if method == 0:
+            return self.calculate_intercept_vectorized(XIN, VIN)
 
         npoints = XIN.shape[1]
         answer = numpy.zeros(npoints)
@@ -339,6 +478,195 @@ class S4Mesh(S4OpticalSurface):
               (t1-t0, npoints, 1000 * (t1-t0) / npoints))
         return answer,i_flag
 
+    def calculate_intercept_vectorized(self, XIN, VIN, max_iterations=50, tolerance=1e-13, n_samples=101):
+        """
+        Calculates the intercept of all rays with the surface at once.
+
+        Newton iterations are run over all the rays simultaneously, starting from the intercept with a plane at
+        the mean surface height. The rays that do not converge are solved by bracketing: the ray parameter is
+        sampled along the region covered by the mesh, the first sign change is located and refined by bisection.
+
+        Parameters
+        ----------
+        XIN : numpy array
+            The ray starting points (3, npoints).
+        VIN : numpy array
+            The ray directions (3, npoints).
+        max_iterations : int, optional
+            The maximum number of Newton iterations.
+        tolerance : float, optional
+            The relative tolerance in the ray parameter t.
+        n_samples : int, optional
+            The number of points used to search a bracket for the non-converged rays.
+
+        Returns
+        -------
+        tuple
+            (t, i_flag) with t the travelled distances and i_flag the convergence flags:
+            1 (converged with Newton), 2 (converged with bracketing), -1 (no solution found).
+
+        """
+        x0, y0, z0 = XIN[0, :], XIN[1, :], XIN[2, :]
+        vx, vy, vz = VIN[0, :], VIN[1, :], VIN[2, :]
+
+        npoints = x0.size
+        answer = numpy.zeros(npoints)
+        i_flag = numpy.zeros(npoints)
+
+        # starting point: intercept with the plane at the mean surface height
+        if self.mesh_z is not None:
+            z_ref = numpy.mean(self.mesh_z)
+        else:
+            z_ref = float(numpy.mean(self.surface_height_at_points(numpy.zeros(1), numpy.zeros(1))))
+        igood = numpy.abs(vz) > 0
+        answer[igood] = (z_ref - z0[igood]) / vz[igood]
+        t_start = answer.copy()
+
+        #
+        # Newton iterations on the active rays
+        #
+        active = numpy.arange(npoints)
+        for iteration in range(max_iterations):
+            if active.size == 0: break
+            t = answer[active]
+            x1 = x0[active] + vx[active] * t
+            y1 = y0[active] + vy[active] * t
+            height = self.surface_height_at_points(x1, y1)
+            slope_x, slope_y = self.surface_slopes_at_points(x1, y1)
+
+            f  = height - (z0[active] + vz[active] * t)
+            df = slope_x * vx[active] + slope_y * vy[active] - vz[active]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                dt = f / df
+
+            finite = numpy.isfinite(dt)
+            answer[active[finite]] = t[finite] - dt[finite]
+            converged = finite & (numpy.abs(dt) <= tolerance * (1.0 + numpy.abs(t)))
+            i_flag[active[converged]] = 1
+            answer[active[~finite]] = t_start[active[~finite]]
+            active = active[finite & ~converged]
+
+        #
+        # bracketing for the rays not converged
+        #
+        ibad = numpy.where(i_flag == 0)[0]
+        if ibad.size > 0:
+            t_min, t_max = self._get_ray_parameter_interval(x0[ibad], y0[ibad], vx[ibad], vy[ibad], t_start[ibad])
+
+            def _f(t, index):
+                return self.surface_height_at_points(x0[index] + vx[index] * t, y0[index] + vy[index] * t) - \
+                       (z0[index] + vz[index] * t)
+
+            T = t_min + (t_max - t_min) * numpy.linspace(0.0, 1.0, n_samples)[:, None]
+            F = _f(T, ibad[None, :])
+            change = (numpy.sign(F[:-1]) * numpy.sign(F[1:])) <= 0
+            has_bracket = change.any(axis=0)
+            k = numpy.argmax(change, axis=0)
+            columns = numpy.arange(ibad.size)
+            a = T[k, columns]
+            b = T[k + 1, columns]
+            fa = F[k, columns]
+
+            for iteration in range(100):
+                m = 0.5 * (a + b)
+                fm = _f(m, ibad)
+                left = numpy.sign(fa) * numpy.sign(fm) <= 0
+                b = numpy.where(left, m, b)
+                a = numpy.where(left, a, m)
+                fa = numpy.where(left, fa, fm)
+                if numpy.all(numpy.abs(b - a) <= tolerance * (1.0 + numpy.abs(a))): break
+
+            answer[ibad] = numpy.where(has_bracket, 0.5 * (a + b), 0.0)
+            i_flag[ibad] = numpy.where(has_bracket, 2, -1)
+
+        return answer, i_flag
+
+    def _get_ray_parameter_interval(self, x0, y0, vx, vy, t_start):
+        # interval of the ray parameter t where the ray footprint is inside the mesh limits
+        # (or around t_start if the surface is not defined by a mesh)
+        if (self.mesh_x is None) or (self.mesh_y is None):
+            return t_start - numpy.maximum(1.0, numpy.abs(t_start)), t_start + numpy.maximum(1.0, numpy.abs(t_start))
+
+        t_min = numpy.full_like(t_start, -numpy.inf)
+        t_max = numpy.full_like(t_start, numpy.inf)
+        for p0, v, coordinate in ((x0, vx, self.mesh_x), (y0, vy, self.mesh_y)):
+            igood = numpy.abs(v) > 0
+            ta = (coordinate.min() - p0[igood]) / v[igood]
+            tb = (coordinate.max() - p0[igood]) / v[igood]
+            t_min[igood] = numpy.maximum(t_min[igood], numpy.minimum(ta, tb))
+            t_max[igood] = numpy.minimum(t_max[igood], numpy.maximum(ta, tb))
+
+        iunbounded = ~numpy.isfinite(t_min) | ~numpy.isfinite(t_max) | (t_max < t_min)
+        t_min[iunbounded] = t_start[iunbounded] - numpy.maximum(1.0, numpy.abs(t_start[iunbounded]))
+        t_max[iunbounded] = t_start[iunbounded] + numpy.maximum(1.0, numpy.abs(t_start[iunbounded]))
+        return t_min, t_max
+
+    def calculate_intercept_and_normal_perturbative(self, ideal_surface, XIN, VIN, reference_distance=10.0,
+                                                    n_iterations=1, tolerance=1e-12):
+        """
+        Calculates the intercepts and normals on a surface made by an ideal (analytic) surface plus the height
+        errors stored in this mesh, assuming that the errors are small.
+
+        The rays are first intercepted with the ideal surface. The intercept is then corrected using the local
+        error height (first order in the errors, optionally iterated) and the normal is obtained by adding the
+        error slopes to the slopes of the ideal surface.
+
+        Parameters
+        ----------
+        ideal_surface : instance of S4Conic or S4Toroid
+            The ideal surface.
+        XIN : numpy array
+            The ray starting points (3, npoints).
+        VIN : numpy array
+            The ray directions (3, npoints).
+        reference_distance : float, optional
+            The reference distance used to select the solution of the intercept with the ideal surface.
+        n_iterations : int, optional
+            The number of iterations of the perturbative correction.
+        tolerance : float, optional
+            The maximum residual height (in m) accepted at the corrected intercept.
+
+        Returns
+        -------
+        tuple
+            (t, normal, i_flag) with t the travelled distances, normal the (upwards) normals (3, npoints), and
+            i_flag: 1 (success), 0 (the tolerance check failed, an exact calculation is needed), -1 (no intercept).
+
+        """
+        t, i_flag = ideal_surface.calculate_intercept_and_choose_solution(XIN, VIN, reference_distance=reference_distance)
+        i_flag = numpy.where(i_flag < 0, -1, 1)
+
+        def _correction(x2):
+            normal = ideal_surface.get_normal(x2)
+            normal *= numpy.where(normal[2] < 0, -1.0, 1.0) # upwards normal
+            height = self.surface_height_at_points(x2[0], x2[1])
+            v_dot_n = VIN[0] * normal[0] + VIN[1] * normal[1] + VIN[2] * normal[2]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                dt = height * normal[2] / v_dot_n
+            return dt, normal, v_dot_n
+
+        t_ideal = t.copy()
+        dt = numpy.zeros_like(t)
+        for iteration in range(max(1, n_iterations)):
+            dt, normal, v_dot_n = _correction(XIN + VIN * (t_ideal + dt))
+        t = t_ideal + dt
+
+        # tolerance check: the height mismatch at the corrected intercept must be negligible
+        x2 = XIN + VIN * t
+        dt_next, normal, v_dot_n = _correction(x2)
+        residual = numpy.abs((dt_next - dt) * v_dot_n)
+        i_flag[(i_flag > 0) & ~(residual <= tolerance)] = 0
+
+        # normal: add error slopes to the ideal slopes
+        slope_x, slope_y = self.surface_slopes_at_points(x2[0], x2[1])
+        N_0 = normal[0] / normal[2] - slope_x
+        N_1 = normal[1] / normal[2] - slope_y
+        N_2 = numpy.ones_like(N_0)
+        n2 = numpy.sqrt(N_0**2 + N_1**2 + N_2**2)
+        normal = numpy.vstack((N_0 / n2, N_1 / n2, N_2 / n2))
+
+        return t, normal, i_flag
+
     def calculate_intercept_and_choose_solution(self, x1, v1, reference_distance=10.0, method=0):
         return self.calculate_intercept(x1, v1)
 
@@ -352,21 +680,22 @@ class S4Mesh(S4OpticalSurface):
         flag = newbeam.get_column(10)
         optical_path = newbeam.get_column(13)
 
-        t,iflag = self.calculate_intercept(x1,v1)
+        with profile_phase("intercept"):
+            t,iflag = self.calculate_intercept(x1,v1)
 
         x2 = numpy.zeros_like(x1)
         x2[0,:] = x1[0,:] + v1[0,:] * t
         x2[1,:] = x1[1,:] + v1[1,:] * t
         x2[2,:] = x1[2,:] + v1[2,:] * t
 
-        for i in range(flag.size):
-            if iflag[i] < 0: flag[i] = -100
+        flag[iflag < 0] = -100
 
         # # ;
         # # ; Calculates the normal at each intercept
         # # ;
 
-        normal = self.get_normal(x2)
+        with profile_phase("normal"):
+            normal = self.get_normal(x2)
 
         # ;
         # ; reflection
@@ -1,5 +1,6 @@
 import numpy
 from shadow4.optical_surfaces.s4_optical_surface import S4OpticalSurface
+from shadow4.tools.profiler import profile_phase
 
 class S4Toroid(S4OpticalSurface):
     def __init__(self,
@@ -118,7 +119,9 @@ class S4Toroid(S4OpticalSurface):
             return height
 
 
-    def calculate_intercept(self, XIN, VIN):
+    def calculate_intercept(self, XIN, VIN, method=0):
+        # method = 0: vectorized quartic solver (default)
+        # method = 1: loop over rays using numpy polyroots
 
         P1 = XIN[0,:]
         P2 = XIN[1,:]
@@ -191,29 +194,36 @@ class S4Toroid(S4OpticalSurface):
         CC.shape = -1
         DD.shape = -1
 
-
-        t0 = numpy.zeros_like(AA, dtype=complex)
-        t1 = numpy.zeros_like(AA, dtype=complex)
-        t2 = numpy.zeros_like(AA, dtype=complex)
-        t3 = numpy.zeros_like(AA, dtype=complex)
-        for k in range(AA.size):
-            h_output2 = numpy.polynomial.polynomial.polyroots([DD[k], CC[k], BB[k], AA[k], 1.0])
-            t0[k] = h_output2[0]
-            t1[k] = h_output2[1]
-            t2[k] = h_output2[2]
-            t3[k] = h_output2[3]
-            # print(">>>> solutions: ", k, t0[k], t1[k], t2[k], t3[k])
-
-        return t0, t1, t2, t3
-
-    def calculate_intercept_and_choose_solution(self, x1, v1, reference_distance=0.0):
-
-        t0, t1, t2, t3 = self.calculate_intercept(x1, v1)
-        out = self.choose_solution(t0, t1, t2, t3)
+        if method == 0: # vectorized: all rays at once
+            return solve_quartic_batch(DD, CC, BB, AA)
+        else: # loop over rays (reference implementation)
+            t0 = numpy.zeros_like(AA, dtype=complex)
+            t1 = numpy.zeros_like(AA, dtype=complex)
+            t2 = numpy.zeros_like(AA, dtype=complex)
+            t3 = numpy.zeros_like(AA, dtype=complex)
+            for k in range(AA.size):
+                h_output2 = numpy.polynomial.polynomial.polyroots([DD[k], CC[k], BB[k], AA[k], 1.0])
+                t0[k] = h_output2[0]
+                t1[k] = h_output2[1]
+                t2[k] = h_output2[2]
+                t3[k] = h_output2[3]
+                # print(">>>> solutions: ", k, t0[k], t1[k], t2[k], t3[k])
+
+            return t0, t1, t2, t3
+
+    def calculate_intercept_and_choose_solution(self, x1, v1, reference_distance=0.0, method=0):
+
+        t0, t1, t2, t3 = self.calculate_intercept(x1, v1, method=method)
+        out = self.choose_solution(t0, t1, t2, t3, method=method)
         return out
 
 
-    def choose_solution(self, t0, t1, t2, t3):
+    def choose_solution(self, t0, t1, t2, t3, method=0):
+        # method = 0: vectorized selection
+        # method = 1: loop over rays
+        if method == 0:
+            return self._choose_solution_vectorized(t0, t1, t2, t3)
+
         i_res  = numpy.ones( t0.size )
         answer = numpy.ones( t0.size )
 
@@ -256,6 +266,42 @@ class S4Toroid(S4OpticalSurface):
                     answer[k] = Answers[0]
         return answer, i_res
 
+    def _choose_solution_vectorized(self, t0, t1, t2, t3):
+        h_output = numpy.vstack((t0, t1, t2, t3)) # (4, nrays)
+        is_real = (h_output.imag == 0)
+        n_real = is_real.sum(axis=0)
+
+        # sort the real intercepts in ascending order, complex ones (set to nan) go to the end
+        Answers = numpy.sort(numpy.where(is_real, h_output.real, numpy.nan), axis=0)
+
+        i_res  = numpy.ones( t0.size )
+        answer = numpy.ones( t0.size )
+        index = numpy.arange(t0.size)
+
+        # pick the output according to F_TORUS
+        if self.f_torus == 0:
+            ok = n_real > 0
+            answer[ok] = Answers[n_real[ok] - 1, index[ok]]
+        elif self.f_torus == 1:
+            ok = n_real > 1
+            answer[ok] = Answers[n_real[ok] - 2, index[ok]]
+            i_res[~ok] = -1
+        elif self.f_torus == 2:
+            ok = n_real > 1
+            answer[ok] = Answers[1, index[ok]]
+            i_res[~ok] = -1
+        elif self.f_torus == 3:
+            ok = n_real > 0
+            answer[ok] = Answers[0, index[ok]]
+
+        all_complex = (n_real == 0)
+        if all_complex.any():
+            print("all the solutions are complex for %d rays" % all_complex.sum())
+            i_res[all_complex] = -1
+            answer[all_complex] = 0.0
+
+        return answer, i_res
+
     def set_cylindrical(self, CIL_ANG):
         raise Exception("Cannot set_cylindrical() in a Toroid")
 
@@ -283,26 +329,27 @@ class S4Toroid(S4OpticalSurface):
         # ; TRACING...
         # ;
 
-        x1 =   newbeam.get_columns([1,2,3]) # numpy.array(a3.getshcol([1,2,3]))
-        v1 =   newbeam.get_columns([4,5,6]) # numpy.array(a3.getshcol([4,5,6]))
+        x1 =   newbeam.get_columns_view([1,2,3]) # numpy.array(a3.getshcol([1,2,3]))
+        v1 =   newbeam.get_columns_view([4,5,6]) # numpy.array(a3.getshcol([4,5,6]))
         flag = newbeam.get_column(10)        # numpy.array(a3.getshonecol(10))
         optical_path = newbeam.get_column(13)
 
-        t, iflag = self.calculate_intercept_and_choose_solution(x1, v1)
+        with profile_phase("intercept"):
+            t, iflag = self.calculate_intercept_and_choose_solution(x1, v1)
 
         # print(">>>>>",x1,t)
         # for i in range(t.size):
         #     print(">>>>",x1[0:3,i],t[i],iflag[i])
 
         x2 = x1 + v1 * t
-        for i in range(flag.size):
-            if iflag[i] < 0: flag[i] = -100
+        flag[iflag < 0] = -100
 
 
         # ;
         # ; Calculates the normal at each intercept [see shadow's normal.F]
         # ;
-        normal = self.get_normal(x2)
+        with profile_phase("normal"):
+            normal = self.get_normal(x2)
 
         # for i in range(t.size):
         #     print(">>>>",t[i],normal[:,i])
@@ -328,6 +375,70 @@ class S4Toroid(S4OpticalSurface):
         return newbeam, normal
 
 
+#
+# batched quartic solver
+#
+def solve_quartic_batch(c0, c1, c2, c3, n_polish=2):
+    """
+    Solves the monic quartic equations t^4 + c3 t^3 + c2 t^2 + c1 t + c0 = 0 for arrays of coefficients.
+
+    The roots are the eigenvalues of the companion matrices (the same algorithm as numpy.polynomial.polynomial.polyroots),
+    computed for all the equations in a single batched call. The real roots are then polished with a few Newton
+    iterations, keeping the polished value only where the residual is reduced.
+
+    Parameters
+    ----------
+    c0, c1, c2, c3 : numpy array
+        The coefficients (all with the same size npoints).
+    n_polish : int, optional
+        The number of Newton iterations applied to the real roots.
+
+    Returns
+    -------
+    tuple
+        (t0, t1, t2, t3) complex arrays with the four roots of each equation.
+
+    """
+    c0 = numpy.asarray(c0, dtype=float).reshape(-1)
+    c1 = numpy.asarray(c1, dtype=float).reshape(-1)
+    c2 = numpy.asarray(c2, dtype=float).reshape(-1)
+    c3 = numpy.asarray(c3, dtype=float).reshape(-1)
+
+    # companion matrices, rotated like in polyroots for stability
+    mat = numpy.zeros((c0.size, 4, 4))
+    mat[:, 1, 0] = 1.0
+    mat[:, 2, 1] = 1.0
+    mat[:, 3, 2] = 1.0
+    mat[:, 0, 3] = -c0
+    mat[:, 1, 3] = -c1
+    mat[:, 2, 3] = -c2
+    mat[:, 3, 3] = -c3
+    roots = numpy.linalg.eigvals(mat[:, ::-1, ::-1])
+    roots.sort(axis=1)
+
+    # Newton polish of the real roots
+    is_real = (roots.imag == 0)
+    t = roots.real
+    C0, C1, C2, C3 = c0[:, None], c1[:, None], c2[:, None], c3[:, None]
+
+    def _poly(t):
+        return (((t + C3) * t + C2) * t + C1) * t + C0
+
+    residual = numpy.abs(_poly(t))
+    for i in range(n_polish):
+        dpoly = ((4 * t + 3 * C3) * t + 2 * C2) * t + C1
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            t_new = t - _poly(t) / dpoly
+        residual_new = numpy.abs(_poly(t_new))
+        better = is_real & numpy.isfinite(t_new) & (residual_new < residual)
+        t = numpy.where(better, t_new, t)
+        residual = numpy.where(better, residual_new, residual)
+
+    roots = numpy.where(is_real, t + 0j, roots)
+
+    return roots[:, 0], roots[:, 1], roots[:, 2], roots[:, 3]
+
+
 if __name__ == "__main__":
 
     t = S4Toroid()
@@ -8,6 +8,8 @@ import numpy
 import scipy.constants as codata
 from xoppylib.crystals.bragg_preprocessor_file_io import bragg_preprocessor_file_v1_read
 
+from shadow4.physical_models.preprocessor_cache import get_preprocessor_data
+
 class Bragg(object):
     def __init__(self, preprocessor_file=None, preprocessor_dictionary=None):
         self._preprocessor_file = preprocessor_file
@@ -34,9 +36,12 @@ class Bragg(object):
         out.load_preprocessor_file()
         return out
 
-    def load_preprocessor_file(self):
-        out_dict = bragg_preprocessor_file_v1_read(self._preprocessor_file)
-        self._preprocessor_dictionary = out_dict
+    def load_preprocessor_file(self, use_cache=True):
+        # the data are taken from the process-wide preprocessor cache (see shadow4.physical_models.preprocessor_cache)
+        self._preprocessor_dictionary, parsed = get_preprocessor_data(self._preprocessor_file,
+                                                                      bragg_preprocessor_file_v1_read,
+                                                                      kind="bragg", use_cache=use_cache)
+        return parsed
 
     #
     # extract values
@@ -19,6 +19,8 @@ tocm = codata.h*codata.c/codata.e*1e2 # 12398.419739640718e-8
 
 from srxraylib.util.h5_simple_writer import H5SimpleWriter
 
+from shadow4.physical_models.preprocessor_cache import get_preprocessor_data
+
 try:
     import xraylib
 except:
@@ -31,7 +33,31 @@ class MLayer(object):
         self.using_pre_mlayer = False
         self.pre_mlayer_dict = None
 
-    def read_preprocessor_file(self,filename):
+    def read_preprocessor_file(self, filename, use_cache=True):
+        """
+        Loads the data of a file created by the pre_mlayer preprocessor.
+
+        Parameters
+        ----------
+        filename : str
+            The file name.
+
+        use_cache : boolean, optional
+            If True, the data are taken from the process-wide preprocessor cache (the file is parsed only if
+            it is new or was modified, see shadow4.physical_models.preprocessor_cache).
+
+        Returns
+        -------
+        boolean
+            True if the file was parsed, False if the data were taken from the cache.
+
+        """
+        self.pre_mlayer_dict, parsed = get_preprocessor_data(filename, self._parse_preprocessor_file,
+                                                             kind="pre_mlayer", use_cache=use_cache)
+        return parsed
+
+    @classmethod
+    def _parse_preprocessor_file(cls, filename):
 
         out_dict = {}
 
@@ -143,7 +169,7 @@ class MLayer(object):
             out_dict["a2"] = a2
             out_dict["a3"] = a3
 
-        self.pre_mlayer_dict = out_dict
+        return out_dict
 
     #
     # this is copied from shadow3 python preprocessors
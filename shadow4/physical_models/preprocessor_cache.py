@@ -0,0 +1,102 @@
+#
+# Process-wide cache of the parsed preprocessor files (PreRefl, MLayer, Bragg).
+#
+# The beamline elements read their preprocessor files at each trace (e.g. S4MirrorElement with f_refl=0,
+# S4ScreenElement with i_abs=1, the refractors). The parsed data are kept here, keyed by the kind of file, the
+# absolute path and the modification time and size of the file, so an edited file is parsed again.
+# The cache keeps the most recently used entries (see set_preprocessor_cache_size()). The numpy arrays of the
+# cached data are read-only, as they are shared by all the objects using the same file.
+#
+import os
+from collections import OrderedDict
+
+import numpy
+
+_PREPROCESSOR_CACHE = OrderedDict()
+_PREPROCESSOR_CACHE_MAX_ENTRIES = 32
+_PREPROCESSOR_CACHE_STATISTICS = {"hits": 0, "misses": 0}
+
+def get_preprocessor_data(filename, reader, kind="", use_cache=True):
+    """
+    Returns the data of a preprocessor file, parsed by reader or taken from the cache.
+
+    Parameters
+    ----------
+    filename : str
+        The preprocessor file name.
+
+    reader : function
+        The parser: reader(filename) returns a dict with the data.
+
+    kind : str, optional
+        The kind of preprocessor file (e.g. 'prerefl'), part of the key, as the same file could be parsed by
+        several readers.
+
+    use_cache : boolean, optional
+        If False, the file is parsed and the cache is not used.
+
+    Returns
+    -------
+    tuple
+        (data, parsed): the dict with the data (a copy of the cached dict) and True if the file was parsed
+        (False if the data were found in the cache).
+
+    """
+    if not use_cache: return reader(filename), True
+
+    stat = os.stat(filename)
+    key = (kind, os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+    if key in _PREPROCESSOR_CACHE:
+        _PREPROCESSOR_CACHE.move_to_end(key)
+        _PREPROCESSOR_CACHE_STATISTICS["hits"] += 1
+        return dict(_PREPROCESSOR_CACHE[key]), False
+
+    data = reader(filename)
+    for value in data.values():
+        if isinstance(value, numpy.ndarray): value.setflags(write=False)
+    _PREPROCESSOR_CACHE_STATISTICS["misses"] += 1
+
+    # drop the entries of previous versions of the file
+    for old_key in [old_key for old_key in _PREPROCESSOR_CACHE.keys() if old_key[:2] == key[:2]]:
+        del _PREPROCESSOR_CACHE[old_key]
+    _PREPROCESSOR_CACHE[key] = data
+    while len(_PREPROCESSOR_CACHE) > _PREPROCESSOR_CACHE_MAX_ENTRIES: _PREPROCESSOR_CACHE.popitem(last=False)
+    return dict(data), True
+
+def clear_preprocessor_cache():
+    """
+    Removes all the entries of the preprocessor cache and resets its statistics.
+    """
+    _PREPROCESSOR_CACHE.clear()
+    _PREPROCESSOR_CACHE_STATISTICS["hits"] = 0
+    _PREPROCESSOR_CACHE_STATISTICS["misses"] = 0
+
+def set_preprocessor_cache_size(max_entries=32):
+    """
+    Sets the maximum number of files kept in the preprocessor cache (the least recently used are removed).
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        The maximum number of entries (0 disables the cache).
+
+    """
+    global _PREPROCESSOR_CACHE_MAX_ENTRIES
+    _PREPROCESSOR_CACHE_MAX_ENTRIES = max_entries
+    while len(_PREPROCESSOR_CACHE) > _PREPROCESSOR_CACHE_MAX_ENTRIES: _PREPROCESSOR_CACHE.popitem(last=False)
+
+def get_preprocessor_cache_info():
+    """
+    Returns the state of the preprocessor cache.
+
+    Returns
+    -------
+    dict
+        With keys 'entries', 'max_entries', 'hits', 'misses' and 'files' (the list of cached files).
+
+    """
+    return {"entries": len(_PREPROCESSOR_CACHE),
+            "max_entries": _PREPROCESSOR_CACHE_MAX_ENTRIES,
+            "hits": _PREPROCESSOR_CACHE_STATISTICS["hits"],
+            "misses": _PREPROCESSOR_CACHE_STATISTICS["misses"],
+            "files": [key[1] for key in _PREPROCESSOR_CACHE.keys()]}
@@ -9,6 +9,8 @@ TODO: vectorization
 import numpy
 import scipy.constants as codata
 
+from shadow4.physical_models.preprocessor_cache import get_preprocessor_data
+
 tocm = codata.h * codata.c / codata.e * 1e2 # 12398.419739640718e-8
 
 class PreRefl(object):
@@ -17,7 +19,31 @@ class PreRefl(object):
 
         self.prerefl_dict = None
 
-    def read_preprocessor_file(self,filename):
+    def read_preprocessor_file(self, filename, use_cache=True):
+        """
+        Loads the data of a file created by the prerefl preprocessor.
+
+        Parameters
+        ----------
+        filename : str
+            The file name.
+
+        use_cache : boolean, optional
+            If True, the data are taken from the process-wide preprocessor cache (the file is parsed only if
+            it is new or was modified, see shadow4.physical_models.preprocessor_cache).
+
+        Returns
+        -------
+        boolean
+            True if the file was parsed, False if the data were taken from the cache.
+
+        """
+        self.prerefl_dict, parsed = get_preprocessor_data(filename, self._parse_preprocessor_file,
+                                                          kind="prerefl", use_cache=use_cache)
+        return parsed
+
+    @classmethod
+    def _parse_preprocessor_file(cls, filename):
 
         fp = open(filename) # Open file on read mode
         lines = fp.read().split("\n") # Create a list containing all lines
@@ -43,7 +69,7 @@ class PreRefl(object):
             index_pointer += 1
             ZF2[i] = float(lines[index_pointer])
 
-        self.prerefl_dict = {"QMIN":QMIN,"QMAX":QMAX,"QSTEP":QSTEP,"DEPTH0":DEPTH0,"NREFL":NREFL,"ZF1":ZF1,"ZF2":ZF2}
+        return {"QMIN":QMIN,"QMAX":QMAX,"QSTEP":QSTEP,"DEPTH0":DEPTH0,"NREFL":NREFL,"ZF1":ZF1,"ZF2":ZF2}
 
     def preprocessor_info(self,verbose=False):
 
@@ -13,6 +13,39 @@ from syned.storage_ring.electron_beam import ElectronBeam
 from shadow4.sources.bending_magnet.s4_bending_magnet import S4BendingMagnet
 from shadow4.beam.s4_beam import S4Beam
 from shadow4.sources.s4_light_source import S4LightSource
+from shadow4.sources.s4_electron_beam_sampling import sample_electron_beam_at_distance
+
+def _get_sampled_2d(sampler, random0, random1):
+    # vectorized Sampler2D.get_sampled(): the same inverse of the cdfs (including the use of the cdf row
+    # index0+1 for axis 1), for all the points at once. The rows of the conditional cdfs are stacked (row i
+    # shifted by 2*i) so that they are inverted in one interpolation.
+    cdf2, cdf1 = sampler.cdf()
+    x0, x1 = sampler.abscissas()
+
+    sampled0 = numpy.interp(random0, cdf1, x0)
+    index0 = numpy.maximum(numpy.searchsorted(cdf1, random0, side='left') - 1, 0)
+    row = numpy.minimum(index0 + 1, cdf1.size - 1)
+
+    cdf2 = cdf2.copy()
+    cdf2[~numpy.isfinite(cdf2).all(axis=1), :] = numpy.linspace(0.0, 1.0, x1.size) # rows without flux
+    rows = 2.0 * numpy.arange(cdf2.shape[0])[:, numpy.newaxis]
+    sampled1 = numpy.interp(random1 + 2.0 * row, (cdf2 + rows).ravel(), numpy.tile(x1, cdf2.shape[0]))
+    return sampled0, sampled1
+
+def _interpolate_regular_grid(table, x0, x1, points0, points1):
+    # bilinear interpolation of table[i, j] (at x0[i], x1[j], equally spaced abscissas) at the points (points0, points1)
+    def _index_and_weight(x, points):
+        if x.size == 1: return numpy.zeros(points.size, dtype=int), numpy.zeros(points.size)
+        u = numpy.clip((points - x[0]) / (x[1] - x[0]), 0, x.size - 1)
+        index = numpy.minimum(u.astype(int), x.size - 2)
+        return index, u - index
+    i0, w0 = _index_and_weight(x0, points0)
+    i1, w1 = _index_and_weight(x1, points1)
+    j0 = numpy.minimum(i0 + 1, x0.size - 1)
+    j1 = numpy.minimum(i1 + 1, x1.size - 1)
+    return (table[i0, i1] * (1 - w0) + table[j0, i1] * w0) * (1 - w1) + \
+           (table[i0, j1] * (1 - w0) + table[j0, j1] * w0) * w1
+
 
 class S4BendingMagnetLightSource(S4LightSource):
 
@@ -34,13 +67,27 @@ class S4BendingMagnetLightSource(S4LightSource):
                        EPSI_DX=0.0, EPSI_DZ=0.0,
                        psi_interval_in_units_one_over_gamma=None,
                        psi_interval_number_of_points=1001,
+                       method=0,
                        verbose=False):
+        """
+        Creates the beam of the bending magnet light source.
+
+        Parameters
+        ----------
+        method : int, optional
+            0=vectorized ray generation (all the rays at once), 1=loop over rays (reference implementation).
 
+        Returns
+        -------
+        instance of S4Beam
+
+        """
         return S4Beam.initialize_from_array(self.__calculate_rays(F_COHER=F_COHER,
                                                                   EPSI_DX=EPSI_DX,
                                                                   EPSI_DZ=EPSI_DZ,
                                                                   psi_interval_in_units_one_over_gamma=psi_interval_in_units_one_over_gamma,
                                                                   psi_interval_number_of_points=psi_interval_number_of_points,
+                                                                  method=method,
                                                                   verbose=verbose))
 
 
@@ -81,18 +128,19 @@ class S4BendingMagnetLightSource(S4LightSource):
                          EPSI_DX=0.0, EPSI_DZ=0.0,
                          psi_interval_in_units_one_over_gamma=None,
                          psi_interval_number_of_points=1001,
+                         method=0,
                          verbose=False):
         """
         compute the rays in SHADOW matrix (shape (npoints,18) )
         :param F_COHER: set this flag for coherent beam
         :param user_unit_to_m: default 1.0 (m)
+        :param method: 0=vectorized (all the rays at once), 1=loop over rays (reference)
         :return: rays, a numpy.array((npoits,18))
         """
 
         NRAYS = self.get_nrays()
 
-        if self.get_seed() != 0:
-            numpy.random.seed(self.get_seed())
+        rng = self.get_random_generator()
 
         rays = numpy.zeros((NRAYS,18))
 
@@ -179,7 +227,10 @@ class S4BendingMagnetLightSource(S4LightSource):
             sampler_angle = Sampler1D(angular_distribution_s+angular_distribution_p,angle_array_mrad*1e-3)
             if verbose:
                 print(">>> calculate_rays: get_n_sampled_points (angle)")
-            sampled_angle = sampler_angle.get_n_sampled_points(NRAYS)
+            if method == 0: # inverse of the cdf, for all the rays at once
+                sampled_angle = numpy.interp(rng.random(NRAYS), sampler_angle.cdf(), sampler_angle.cdf_abscissas())
+            else:
+                sampled_angle = sampler_angle.get_sampled(rng.random(NRAYS))
             if verbose:
                 print(">>> calculate_rays: DONE get_n_sampled_points (angle)  %d points"%(sampled_angle.size))
 
@@ -238,208 +289,246 @@ class S4BendingMagnetLightSource(S4LightSource):
 
 
             sampler2 = Sampler2D(fm1,angle_array_mrad*1e-3,photon_energy_array)
-            sampled_angle,sampled_photon_energy = sampler2.get_n_sampled_points(NRAYS)
-
 
-            Angle_array_mrad = numpy.outer(angle_array_mrad,numpy.ones_like(photon_energy_array))
-            Photon_energy_array = numpy.outer(numpy.ones_like(angle_array_mrad),photon_energy_array)
-            Pi = numpy.array([Angle_array_mrad.flatten()*1e-3, Photon_energy_array.flatten()]).transpose()
+            if method == 0: # vectorized: inverse of the cdfs and regular-grid interpolation of the polarization
+                sampled_angle,sampled_photon_energy = _get_sampled_2d(sampler2, rng.random(NRAYS), rng.random(NRAYS))
 
-            P = numpy.array([sampled_angle, sampled_photon_energy]).transpose()
-            sampled_polarization = interpolate.griddata(Pi, (fm_s/fm).flatten(), P, method = "cubic")
-
-        for itik in range(NRAYS):
-            # ! Synchrontron depth
-            ANGLE  =  numpy.random.random() * (HDIV1 + HDIV2) - HDIV2
-            EPSI_PATH =  numpy.abs(r_aladdin) * ANGLE
-
-            if self.get_magnetic_structure()._FLAG_EMITTANCE:
-                sigma_x, sigma_xp, sigma_z, sigma_zp = self.get_electron_beam().get_sigmas_all()
+                fm_pol = numpy.zeros_like(fm)
+                numpy.divide(fm_s, fm, out=fm_pol, where=fm != 0.0)
+                sampled_polarization = _interpolate_regular_grid(fm_pol, angle_array_mrad*1e-3, photon_energy_array,
+                                                                 sampled_angle, sampled_photon_energy)
+            else:
+                sampled_angle,sampled_photon_energy = sampler2.get_sampled(rng.random(NRAYS), rng.random(NRAYS))
 
-                # ! calculation of the electrom beam moments at the current position
-                # ! (sX,sZ) = (epsi_wx,epsi_ez):
-                # ! <x2> = sX^2 + sigmaX^2
-                # ! <x x'> = sX sigmaXp^2
-                # ! <x'2> = sigmaXp^2                 (same for Z)
 
-                epsi_wX = EPSI_DX + EPSI_PATH # sigma_x * sigma_xp
+                Angle_array_mrad = numpy.outer(angle_array_mrad,numpy.ones_like(photon_energy_array))
+                Photon_energy_array = numpy.outer(numpy.ones_like(angle_array_mrad),photon_energy_array)
+                Pi = numpy.array([Angle_array_mrad.flatten()*1e-3, Photon_energy_array.flatten()]).transpose()
 
+                P = numpy.array([sampled_angle, sampled_photon_energy]).transpose()
+                sampled_polarization = interpolate.griddata(Pi, (fm_s/fm).flatten(), P, method = "cubic")
 
-                # ! C
-                # ! C Compute the actual distance (EPSI_W*) from the orbital focus
-                # ! C
-                # EPSI_WX = EPSI_DX + EPSI_PATH
-                # EPSI_WZ = EPSI_DZ + EPSI_PATH
+        if method == 0: # vectorized: all the rays at once
+            # ! Synchrontron depth
+            ANGLE = rng.random(NRAYS) * (HDIV1 + HDIV2) - HDIV2
+            EPSI_PATH = numpy.abs(r_aladdin) * ANGLE
 
-                rSigmaX = numpy.sqrt( (epsi_wX**2) * (sigma_xp**2) + sigma_x**2 )
-                rSigmaXp = sigma_xp
-                if rSigmaX * rSigmaXp != 0.0:
-                    rhoX = epsi_wX * sigma_xp**2 / (rSigmaX * rSigmaXp)
-                else:
-                    rhoX = 0.0
-                mean = [0, 0]
-                cov = [[rSigmaX**2, rhoX*rSigmaX*rSigmaXp], [rhoX*rSigmaX*rSigmaXp, rSigmaXp**2]]  # diagonal covariance
-                sampled_x, sampled_xp = numpy.random.multivariate_normal(mean, cov, 1).T
-                # plot_scatter(sampled_x,sampled_xp,title="X")
-                XXX = sampled_x
-                E_BEAM1 = sampled_xp
-
-
-                epsi_wZ = EPSI_DZ + EPSI_PATH # sigma_z * sigma_zp
-                rSigmaZ = numpy.sqrt( (epsi_wZ**2) * (sigma_zp**2) + sigma_z**2 )
-                rSigmaZp = sigma_zp
-                if rSigmaZ * rSigmaZp != 0.0:
-                    rhoZ = epsi_wZ * sigma_zp**2 / (rSigmaZ * rSigmaZp)
-                else:
-                    rhoZ = 0.0
-                mean = [0, 0]
-                cov = [[rSigmaZ**2, rhoZ*rSigmaZ*rSigmaZp], [rhoZ*rSigmaZ*rSigmaZp, rSigmaZp**2]]  # diagonal covariance
-                sampled_z, sampled_zp = numpy.random.multivariate_normal(mean, cov, 1).T
-                # plot_scatter(sampled_z,sampled_zp,title="Z")
-                ZZZ = sampled_z
-                E_BEAM3 = sampled_zp
-
-                # print(">>>>>>>>>",sampled_x,sampled_z)
+            if self.get_magnetic_structure()._FLAG_EMITTANCE: # see the comments in the loop below
+                sigma_x, sigma_xp, sigma_z, sigma_zp = self.get_electron_beam().get_sigmas_all()
+                XXX, E_BEAM1 = sample_electron_beam_at_distance(sigma_x, sigma_xp, EPSI_DX + EPSI_PATH, rng, position_at_distance=True)
+                ZZZ, E_BEAM3 = sample_electron_beam_at_distance(sigma_z, sigma_zp, EPSI_DZ + EPSI_PATH, rng, position_at_distance=True)
             else:
-                sigma_x, sigma_xp, sigma_z, sigma_zp = (0.0, 0.0, 0.0, 0.0)
-                rhoX = 0.0
-                XXX = 0.0
-                E_BEAM1 = 0.0
-                ZZZ = 0.0
-                E_BEAM3 = 0.0
-
-
-            # ! C
-            # ! C Synchrotron depth distribution
-            # ! C
-            # 440	CONTINUE
-            # ! CC	R_ALADDIN NEGATIVE FOR COUNTER-CLOCKWISE SOURCE
-            # IF (R_ALADDIN.LT.0) THEN
-            # YYY = (ABS(R_ALADDIN) + XXX) * SIN(ANGLE)
-            # ELSE
-            # YYY = ( R_ALADDIN - XXX) * SIN(ANGLE)
-            # END IF
-            # XXX  =   COS(ANGLE) * XXX + R_ALADDIN * (1.0D0 - COS(ANGLE))
-
+                XXX = E_BEAM1 = ZZZ = E_BEAM3 = numpy.zeros(NRAYS)
 
             # Synchrotron depth distribution
             # R_ALADDIN NEGATIVE FOR COUNTER-CLOCKWISE SOURCE
             if r_aladdin < 0:
-                YYY = numpy.abs(r_aladdin + XXX) * numpy.sin(ANGLE)
+                rays[:,1] = numpy.abs(r_aladdin + XXX) * numpy.sin(ANGLE)
             else:
-                YYY = numpy.abs(r_aladdin - XXX) * numpy.sin(ANGLE)
-
-            XXX = numpy.cos(ANGLE) * XXX + r_aladdin * (1.0 - numpy.cos(ANGLE))
-
-            rays[itik,0] = XXX
-            rays[itik,1] = YYY
-            rays[itik,2] = ZZZ
-
-            # ! C
-            # ! C Synchrotron source
-            # ! C Note. The angle of emission IN PLANE is the same as the one used
-            # ! C before. This will give rise to a source curved along the orbit.
-            # ! C The elevation angle is instead characteristic of the SR distribution.
-            # ! C The electron beam emittance is included at this stage. Note that if
-            # ! C EPSI = 0, we'll have E_BEAM = 0.0, with no changes.
-            # ! C
-            # ANGLEX =   ANGLE + E_BEAM(1)
-            # DIREC(1)  =   TAN(ANGLEX)
-            # IF (R_ALADDIN.LT.0.0D0) DIREC(1) = - DIREC(1)
-            # DIREC(2)  =   1.0D0
-            # ARG_ANG  =   GRID(6,ITIK)
+                rays[:,1] = numpy.abs(r_aladdin - XXX) * numpy.sin(ANGLE)
+            rays[:,0] = numpy.cos(ANGLE) * XXX + r_aladdin * (1.0 - numpy.cos(ANGLE))
+            rays[:,2] = ZZZ
 
             ANGLEX = ANGLE + E_BEAM1
-            DIREC1 = numpy.tan(ANGLEX)
+            ANGLEV = sampled_angle + E_BEAM3
+            DIREC = numpy.array([numpy.tan(ANGLEX), numpy.ones(NRAYS), numpy.tan(ANGLEV) / numpy.cos(ANGLEX)]).T
             if r_aladdin < 0:
-                DIREC1 *= -1.0
-            DIREC2 = 1.0
-            ARG_ANG = numpy.random.random()
-
-            # ! C
-            # ! C In the case of SR, we take into account the fact that the electron
-            # ! C trajectory is not orthogonal to the field. This will give a correction
-            # ! C to the photon energy.  We can write it as a correction to the
-            # ! C magnetic field strength; this will linearly shift the critical energy
-            # ! C and, with it, the energy of the emitted photon.
-            # ! C
-            # E_TEMP(3) =   TAN(E_BEAM(3))/COS(E_BEAM(1))
-            # E_TEMP(2) =   1.0D0
-            # E_TEMP(1) =   TAN(E_BEAM(1))
-            # CALL NORM (E_TEMP,E_TEMP)
-            # CORREC =   SQRT(1.0D0-E_TEMP(3)**2)
-            # 4400 CONTINUE
-            E_TEMP3 = numpy.tan(E_BEAM3) / numpy.cos(E_BEAM1)
-            E_TEMP2 = 1.0
-            E_TEMP1 = numpy.tan(E_BEAM1)
-            E_TEMP_MOD = numpy.sqrt(E_TEMP1**2 + E_TEMP2**2 + E_TEMP3**2)
-            E_TEMP3 /= E_TEMP_MOD
-            E_TEMP2 /= E_TEMP_MOD
-            E_TEMP1 /= E_TEMP_MOD
-
-            # IF (FDISTR.EQ.6) THEN ! exect synchtotron
-            #     CALL ALADDIN1 (ARG_ANG,ANGLEV,F_POL,IER)
-            #     Q_WAVE =   TWOPI*PHOTON(1)/TOCM*CORREC
-            #     POL_DEG =   ARG_ANG
-            # ELSE IF (FDISTR.EQ.4) THEN  ! synchrotron
-            #     print*,"R_MAGNET, DIREC",R_MAGNET,DIREC
-            #     ARG_ENER =   WRAN (ISTAR1)
-            #     RAD_MIN =   ABS(R_MAGNET)
-            #
-            #     i1 = 1
-            #     arg_ener = 0.5
-            #     arg_ang = 0.5
-            #     CALL WHITE (RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG,i1)
-            #
-            #     print*,"RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG",RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG
-            #     !Q_WAVE =   TWOPI*PHOTON(1)/TOCM*CORREC
-            #     print*,"ENER,ANGLEV: ",Q_WAVE*TOCM/TWOPI,ANGLEV
-            # END IF
+                DIREC[:,0] *= -1.0
+            rays[:,3:6] = self.__norm(DIREC)
+
+        else: # loop over rays (reference)
+            for itik in range(NRAYS):
+                # ! Synchrontron depth
+                ANGLE  =  rng.random() * (HDIV1 + HDIV2) - HDIV2
+                EPSI_PATH =  numpy.abs(r_aladdin) * ANGLE
+
+                if self.get_magnetic_structure()._FLAG_EMITTANCE:
+                    sigma_x, sigma_xp, sigma_z, sigma_zp = self.get_electron_beam().get_sigmas_all()
+
+                    # ! calculation of the electrom beam moments at the current position
+                    # ! (sX,sZ) = (epsi_wx,epsi_ez):
+                    # ! <x2> = sX^2 + sigmaX^2
+                    # ! <x x'> = sX sigmaXp^2
+                    # ! <x'2> = sigmaXp^2                 (same for Z)
+
+                    epsi_wX = EPSI_DX + EPSI_PATH # sigma_x * sigma_xp
+
+
+                    # ! C
+                    # ! C Compute the actual distance (EPSI_W*) from the orbital focus
+                    # ! C
+                    # EPSI_WX = EPSI_DX + EPSI_PATH
+                    # EPSI_WZ = EPSI_DZ + EPSI_PATH
+
+                    rSigmaX = numpy.sqrt( (epsi_wX**2) * (sigma_xp**2) + sigma_x**2 )
+                    rSigmaXp = sigma_xp
+                    if rSigmaX * rSigmaXp != 0.0:
+                        rhoX = epsi_wX * sigma_xp**2 / (rSigmaX * rSigmaXp)
+                    else:
+                        rhoX = 0.0
+                    mean = [0, 0]
+                    cov = [[rSigmaX**2, rhoX*rSigmaX*rSigmaXp], [rhoX*rSigmaX*rSigmaXp, rSigmaXp**2]]  # diagonal covariance
+                    sampled_x, sampled_xp = rng.multivariate_normal(mean, cov, 1).T
+                    # plot_scatter(sampled_x,sampled_xp,title="X")
+                    XXX = sampled_x[0]
+                    E_BEAM1 = sampled_xp[0]
+
+
+                    epsi_wZ = EPSI_DZ + EPSI_PATH # sigma_z * sigma_zp
+                    rSigmaZ = numpy.sqrt( (epsi_wZ**2) * (sigma_zp**2) + sigma_z**2 )
+                    rSigmaZp = sigma_zp
+                    if rSigmaZ * rSigmaZp != 0.0:
+                        rhoZ = epsi_wZ * sigma_zp**2 / (rSigmaZ * rSigmaZp)
+                    else:
+                        rhoZ = 0.0
+                    mean = [0, 0]
+                    cov = [[rSigmaZ**2, rhoZ*rSigmaZ*rSigmaZp], [rhoZ*rSigmaZ*rSigmaZp, rSigmaZp**2]]  # diagonal covariance
+                    sampled_z, sampled_zp = rng.multivariate_normal(mean, cov, 1).T
+                    # plot_scatter(sampled_z,sampled_zp,title="Z")
+                    ZZZ = sampled_z[0]
+                    E_BEAM3 = sampled_zp[0]
+
+                    # print(">>>>>>>>>",sampled_x,sampled_z)
+                else:
+                    sigma_x, sigma_xp, sigma_z, sigma_zp = (0.0, 0.0, 0.0, 0.0)
+                    rhoX = 0.0
+                    XXX = 0.0
+                    E_BEAM1 = 0.0
+                    ZZZ = 0.0
+                    E_BEAM3 = 0.0
 
-            # interpolate for the photon energy,vertical angle,and the degree of polarization.
 
-            wavelength = codata.h * codata.c / codata.e / sampled_photon_energy[itik]
-            Q_WAVE = 2 * numpy.pi / (wavelength*1e2)
-            ANGLEV = sampled_angle[itik]
-            POL_DEG = sampled_polarization[itik]
+                # ! C
+                # ! C Synchrotron depth distribution
+                # ! C
+                # 440	CONTINUE
+                # ! CC	R_ALADDIN NEGATIVE FOR COUNTER-CLOCKWISE SOURCE
+                # IF (R_ALADDIN.LT.0) THEN
+                # YYY = (ABS(R_ALADDIN) + XXX) * SIN(ANGLE)
+                # ELSE
+                # YYY = ( R_ALADDIN - XXX) * SIN(ANGLE)
+                # END IF
+                # XXX  =   COS(ANGLE) * XXX + R_ALADDIN * (1.0D0 - COS(ANGLE))
+
+
+                # Synchrotron depth distribution
+                # R_ALADDIN NEGATIVE FOR COUNTER-CLOCKWISE SOURCE
+                if r_aladdin < 0:
+                    YYY = numpy.abs(r_aladdin + XXX) * numpy.sin(ANGLE)
+                else:
+                    YYY = numpy.abs(r_aladdin - XXX) * numpy.sin(ANGLE)
+
+                XXX = numpy.cos(ANGLE) * XXX + r_aladdin * (1.0 - numpy.cos(ANGLE))
 
+                rays[itik,0] = XXX
+                rays[itik,1] = YYY
+                rays[itik,2] = ZZZ
 
-            # IF (ANGLEV.LT.0.0) I_CHANGE = -1
-            # ANGLEV =   ANGLEV + E_BEAM(3)
-            if ANGLEV < 0:
-                I_CHANGE = -1
-            ANGLEV += E_BEAM3
+                # ! C
+                # ! C Synchrotron source
+                # ! C Note. The angle of emission IN PLANE is the same as the one used
+                # ! C before. This will give rise to a source curved along the orbit.
+                # ! C The elevation angle is instead characteristic of the SR distribution.
+                # ! C The electron beam emittance is included at this stage. Note that if
+                # ! C EPSI = 0, we'll have E_BEAM = 0.0, with no changes.
+                # ! C
+                # ANGLEX =   ANGLE + E_BEAM(1)
+                # DIREC(1)  =   TAN(ANGLEX)
+                # IF (R_ALADDIN.LT.0.0D0) DIREC(1) = - DIREC(1)
+                # DIREC(2)  =   1.0D0
+                # ARG_ANG  =   GRID(6,ITIK)
+
+                ANGLEX = ANGLE + E_BEAM1
+                DIREC1 = numpy.tan(ANGLEX)
+                if r_aladdin < 0:
+                    DIREC1 *= -1.0
+                DIREC2 = 1.0
+                ARG_ANG = rng.random()
 
-            # ------ NOT LONGER DONE ------
-            # ! C
-            # ! C Test if the ray is within the specified limits
-            # ! C
-            # IF (FGRID.EQ.0.OR.FGRID.EQ.2) THEN
-            #     IF (ANGLEV.GT.VDIV1.OR.ANGLEV.LT.-VDIV2) THEN
-            #         ARG_ANG = WRAN(ISTAR1)
-            #         ! C
-            #         ! C If it is outside the range, then generate another ray.
-            #         ! C
-            #         GO TO 4400
-            #     END IF
-            # END IF
+                # ! C
+                # ! C In the case of SR, we take into account the fact that the electron
+                # ! C trajectory is not orthogonal to the field. This will give a correction
+                # ! C to the photon energy.  We can write it as a correction to the
+                # ! C magnetic field strength; this will linearly shift the critical energy
+                # ! C and, with it, the energy of the emitted photon.
+                # ! C
+                # E_TEMP(3) =   TAN(E_BEAM(3))/COS(E_BEAM(1))
+                # E_TEMP(2) =   1.0D0
+                # E_TEMP(1) =   TAN(E_BEAM(1))
+                # CALL NORM (E_TEMP,E_TEMP)
+                # CORREC =   SQRT(1.0D0-E_TEMP(3)**2)
+                # 4400 CONTINUE
+                E_TEMP3 = numpy.tan(E_BEAM3) / numpy.cos(E_BEAM1)
+                E_TEMP2 = 1.0
+                E_TEMP1 = numpy.tan(E_BEAM1)
+                E_TEMP_MOD = numpy.sqrt(E_TEMP1**2 + E_TEMP2**2 + E_TEMP3**2)
+                E_TEMP3 /= E_TEMP_MOD
+                E_TEMP2 /= E_TEMP_MOD
+                E_TEMP1 /= E_TEMP_MOD
+
+                # IF (FDISTR.EQ.6) THEN ! exect synchtotron
+                #     CALL ALADDIN1 (ARG_ANG,ANGLEV,F_POL,IER)
+                #     Q_WAVE =   TWOPI*PHOTON(1)/TOCM*CORREC
+                #     POL_DEG =   ARG_ANG
+                # ELSE IF (FDISTR.EQ.4) THEN  ! synchrotron
+                #     print*,"R_MAGNET, DIREC",R_MAGNET,DIREC
+                #     ARG_ENER =   WRAN (ISTAR1)
+                #     RAD_MIN =   ABS(R_MAGNET)
+                #
+                #     i1 = 1
+                #     arg_ener = 0.5
+                #     arg_ang = 0.5
+                #     CALL WHITE (RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG,i1)
+                #
+                #     print*,"RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG",RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG
+                #     !Q_WAVE =   TWOPI*PHOTON(1)/TOCM*CORREC
+                #     print*,"ENER,ANGLEV: ",Q_WAVE*TOCM/TWOPI,ANGLEV
+                # END IF
+
+                # interpolate for the photon energy,vertical angle,and the degree of polarization.
+
+                wavelength = codata.h * codata.c / codata.e / sampled_photon_energy[itik]
+                Q_WAVE = 2 * numpy.pi / (wavelength*1e2)
+                ANGLEV = sampled_angle[itik]
+                POL_DEG = sampled_polarization[itik]
+
+
+                # IF (ANGLEV.LT.0.0) I_CHANGE = -1
+                # ANGLEV =   ANGLEV + E_BEAM(3)
+                if ANGLEV < 0:
+                    I_CHANGE = -1
+                ANGLEV += E_BEAM3
+
+                # ------ NOT LONGER DONE ------
+                # ! C
+                # ! C Test if the ray is within the specified limits
+                # ! C
+                # IF (FGRID.EQ.0.OR.FGRID.EQ.2) THEN
+                #     IF (ANGLEV.GT.VDIV1.OR.ANGLEV.LT.-VDIV2) THEN
+                #         ARG_ANG = WRAN(ISTAR1)
+                #         ! C
+                #         ! C If it is outside the range, then generate another ray.
+                #         ! C
+                #         GO TO 4400
+                #     END IF
+                # END IF
 
 
-            # DIREC(3)  =   TAN(ANGLEV)/COS(ANGLEX)
-            # CALL NORM (DIREC,DIREC)
+                # DIREC(3)  =   TAN(ANGLEV)/COS(ANGLEX)
+                # CALL NORM (DIREC,DIREC)
 
-            DIREC3 = numpy.tan(ANGLEV) / numpy.cos(ANGLEX)
+                DIREC3 = numpy.tan(ANGLEV) / numpy.cos(ANGLEX)
 
-            DIREC_MOD = numpy.sqrt(DIREC1**2 + DIREC2**2 + DIREC3**2)
-            DIREC3 /= DIREC_MOD
-            DIREC2 /= DIREC_MOD
-            DIREC1 /= DIREC_MOD
+                DIREC_MOD = numpy.sqrt(DIREC1**2 + DIREC2**2 + DIREC3**2)
+                DIREC3 /= DIREC_MOD
+                DIREC2 /= DIREC_MOD
+                DIREC1 /= DIREC_MOD
 
-            # print(">>>>DIREC,FGRID,R_ALADDIN: ",itik,DIREC1,DIREC2,DIREC3)
+                # print(">>>>DIREC,FGRID,R_ALADDIN: ",itik,DIREC1,DIREC2,DIREC3)
 
-            rays[itik,3] = DIREC1
-            rays[itik,4] = DIREC2
-            rays[itik,5] = DIREC3
+                rays[itik,3] = DIREC1
+                rays[itik,4] = DIREC2
+                rays[itik,5] = DIREC3
 
 
             #
@@ -509,7 +598,7 @@ class S4BendingMagnetLightSource(S4LightSource):
         if F_COHER == 1:
             PHASEX = 0.0
         else:
-            PHASEX = numpy.random.random(NRAYS) * 2 * numpy.pi
+            PHASEX = rng.random(NRAYS) * 2 * numpy.pi
 
         # PHASEZ = PHASEX + POL_ANGLE * numpy.sign(ANGLEV)
 
@@ -540,7 +629,7 @@ class S4BendingMagnetLightSource(S4LightSource):
         if F_COHER == 1:
             PHASEX = 0.0
         else:
-            PHASEX = numpy.random.random(NRAYS) * 2 * numpy.pi
+            PHASEX = rng.random(NRAYS) * 2 * numpy.pi
 
         PHASEZ = PHASEX + POL_ANGLE * numpy.sign(ANGLEV)
 
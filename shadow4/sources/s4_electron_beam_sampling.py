@@ -0,0 +1,47 @@
+#
+# Sampling of the electron beam emittance for the synchrotron light sources.
+#
+# The wiggler and the bending magnet sample, for each ray, the electron position and direction (in one plane) at a
+# distance from the waist of the electron beam: a bivariate normal with correlation
+# rho = distance * sigma_prime / r_sigma, r_sigma = sqrt(distance**2 * sigma_prime**2 + sigma**2).
+# The two codes differ in the width of the sampled positions: the bending magnet uses the beam size at the distance
+# (r_sigma) while the wiggler uses the size at the waist (sigma). This is selected with position_at_distance.
+#
+import numpy
+
+def sample_electron_beam_at_distance(sigma, sigma_prime, distance, random_generator, position_at_distance=False):
+    """
+    Samples the electron positions and directions (in one plane) at distances from the waist of the electron beam.
+
+    Parameters
+    ----------
+    sigma : float
+        The size (standard deviation) of the electron beam at the waist.
+
+    sigma_prime : float
+        The divergence (standard deviation) of the electron beam.
+
+    distance : numpy array
+        The distance from the waist of each sample.
+
+    random_generator : instance of numpy.random.Generator
+        The generator (two standard normal arrays are drawn from it).
+
+    position_at_distance : boolean, optional
+        If True, the width of the positions is the beam size at the distance, r_sigma (as in
+        S4BendingMagnetLightSource). If False, it is the size at the waist, sigma (as in S4WigglerLightSource).
+
+    Returns
+    -------
+    tuple
+        (positions, directions), numpy arrays with the size of distance.
+
+    """
+    distance = numpy.asarray(distance, dtype=float)
+    r_sigma = numpy.sqrt(distance**2 * sigma_prime**2 + sigma**2)
+    rho = numpy.zeros_like(distance)
+    numpy.divide(distance * sigma_prime, r_sigma, out=rho, where=r_sigma * sigma_prime != 0.0)
+    n1 = random_generator.standard_normal(distance.size)
+    n2 = random_generator.standard_normal(distance.size)
+    positions = (r_sigma if position_at_distance else sigma) * n1
+    return positions, sigma_prime * (rho * n1 + numpy.sqrt(1.0 - rho**2) * n2)
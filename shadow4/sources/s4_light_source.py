@@ -1,6 +1,7 @@
 from syned.storage_ring.light_source import LightSource
+from shadow4.sources.s4_random_streams import S4RandomStreams
 
-class S4LightSource(LightSource):
+class S4LightSource(LightSource, S4RandomStreams):
 
     def __init__(self,
                  name="Undefined",
@@ -13,6 +14,7 @@ class S4LightSource(LightSource):
 
         self.__nrays = nrays
         self.__seed = seed
+        self.set_seed_sequence(None)
 
     def set_nrays(self, nrays):
         self.__nrays = nrays
@@ -22,6 +24,7 @@ class S4LightSource(LightSource):
 
     def set_seed(self, seed):
         self.__seed = seed
+        self.set_seed_sequence(None)
 
     def get_seed(self):
         return self.__seed
@@ -1,15 +1,17 @@
 from syned.storage_ring.empty_light_source import EmptyLightSource
+from shadow4.sources.s4_random_streams import S4RandomStreams
 
 #
 
 # this is an abstract class to support non synchrotron light sources (e.g. geometrical source)
 
-class S4LightSourceBase(EmptyLightSource):
+class S4LightSourceBase(EmptyLightSource, S4RandomStreams):
 
     def __init__(self, name="Undefined", nrays=5000, seed=1234567):
         super().__init__(name=name)
         self.__nrays = nrays
         self.__seed = seed
+        self.set_seed_sequence(None)
 
     def set_nrays(self, nrays):
         self.__nrays = nrays
@@ -19,6 +21,7 @@ class S4LightSourceBase(EmptyLightSource):
 
     def set_seed(self, seed):
         self.__seed = seed
+        self.set_seed_sequence(None)
 
     def get_seed(self):
         return self.__seed
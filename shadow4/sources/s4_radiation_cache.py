@@ -0,0 +1,186 @@
+#
+# Persistent (on-disk) cache of the radiation tables of the light sources.
+#
+# S4UndulatorLightSource (the 'radiation' dictionary of undul_phot) and S4WigglerLightSource (the trajectory and
+# the wiggler_cdf dictionary) can store the results of their emission calculation in a S4RadiationCache (see
+# set_radiation_cache()), so that another light source with the same electron beam, magnetic structure and grids
+# (e.g. a new session, a copy of the beamline or a process of S4Beamline.run_beamline_in_parallel()) loads them
+# instead of calculating them again. The number of rays and the seed are not part of the key.
+#
+# The keys are hashes of the inputs of the calculation (see S4BeamlineCache.get_hash(); for the files, e.g. the
+# magnetic field of a wiggler, the modification time and size are included). Each entry is a HDF5 file in the
+# cache directory; the least recently used files are removed to keep the number of files and their total size
+# below the limits.
+#
+import os
+
+import numpy
+import h5py
+
+from shadow4.beamline.s4_beamline_cache import S4BeamlineCache
+
+class S4RadiationCache(object):
+    """
+    Stores dictionaries of results (numpy arrays, numbers, strings and nested dictionaries) in HDF5 files, with
+    least-recently-used eviction.
+
+    Parameters
+    ----------
+    directory : str
+        The cache directory (created if it does not exist).
+
+    max_entries : int, optional
+        The maximum number of files.
+
+    max_bytes : int, optional
+        The maximum total size of the files (in bytes).
+
+    """
+    def __init__(self, directory, max_entries=100, max_bytes=2**30):
+        self._directory = directory
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def get_directory(self):
+        return self._directory
+
+    def __contains__(self, key):
+        return os.path.exists(self._get_filename(key))
+
+    def get(self, key):
+        """
+        Returns the dictionary stored with a key.
+
+        Parameters
+        ----------
+        key : str
+            The key (see get_key()).
+
+        Returns
+        -------
+        dict or None
+            The dictionary (None if the key is not in the cache or the file cannot be read).
+
+        """
+        filename = self._get_filename(key)
+        if not os.path.exists(filename): return None
+        try:
+            with h5py.File(filename, 'r') as f:
+                dictionary = _read_group(f)
+        except (OSError, KeyError):
+            return None
+        os.utime(filename) # most recently used
+        return dictionary
+
+    def put(self, key, dictionary):
+        """
+        Stores a dictionary and removes the least recently used files if the limits are exceeded.
+
+        Parameters
+        ----------
+        key : str
+            The key (see get_key()).
+
+        dictionary : dict
+            The dictionary: the values are numpy arrays, numbers, strings or dictionaries of them.
+
+        """
+        filename = self._get_filename(key)
+        tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+        with h5py.File(tmp_filename, 'w') as f:
+            f.attrs['creator'] = "shadow4"
+            _write_group(f, dictionary)
+        os.replace(tmp_filename, filename) # other processes never see a partial file
+        self._evict()
+
+    def clear(self):
+        """
+        Removes all the files of the cache.
+        """
+        for filename in self._get_filenames():
+            os.remove(filename)
+
+    def get_info(self):
+        """
+        Returns the state of the cache.
+
+        Returns
+        -------
+        dict
+            With keys 'directory', 'entries', 'bytes', 'max_entries' and 'max_bytes'.
+
+        """
+        filenames = self._get_filenames()
+        return {"directory": self._directory,
+                "entries": len(filenames),
+                "bytes": sum([os.path.getsize(filename) for filename in filenames]),
+                "max_entries": self._max_entries,
+                "max_bytes": self._max_bytes}
+
+    @classmethod
+    def get_key(cls, *objects):
+        """
+        Returns the key of the inputs of a calculation: a hash of their contents (see S4BeamlineCache.get_hash()).
+
+        Parameters
+        ----------
+        objects :
+            The inputs (numbers, strings, arrays, dictionaries, instances like the electron beam...).
+
+        Returns
+        -------
+        str
+
+        """
+        return S4BeamlineCache.get_hash(*objects)
+
+    def _get_filename(self, key):
+        return os.path.join(self._directory, "s4radiation_%s.h5" % key)
+
+    def _get_filenames(self):
+        return [os.path.join(self._directory, filename) for filename in os.listdir(self._directory)
+                if filename.startswith("s4radiation_") and filename.endswith(".h5")]
+
+    def _evict(self):
+        files = []
+        for filename in self._get_filenames():
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError: # removed by another process
+                continue
+            files.append((stat.st_mtime_ns, stat.st_size, filename))
+        files.sort()
+        nbytes = sum([size for _, size, _ in files])
+        while len(files) > 0 and (len(files) > self._max_entries or nbytes > self._max_bytes):
+            _, size, filename = files.pop(0)
+            nbytes -= size
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+
+#
+# HDF5 (de)serialization of the dictionaries: arrays are datasets, dictionaries are groups, numbers and
+# strings are attributes.
+#
+def _write_group(group, dictionary):
+    for key, value in dictionary.items():
+        if isinstance(value, dict):
+            _write_group(group.create_group(key), value)
+        elif isinstance(value, numpy.ndarray):
+            group.create_dataset(key, data=value)
+        elif isinstance(value, (bool, int, float, complex, str, numpy.generic)):
+            group.attrs[key] = value
+        else:
+            raise Exception("Cannot store %s (type %s) in the radiation cache" % (key, type(value).__name__))
+
+def _read_group(group):
+    dictionary = {}
+    for key, value in group.attrs.items():
+        if group.name == "/" and key == "creator": continue
+        dictionary[key] = value.item() if isinstance(value, numpy.generic) else value
+    for key, value in group.items():
+        if isinstance(value, h5py.Group): dictionary[key] = _read_group(value)
+        else:                             dictionary[key] = value[()]
+    return dictionary
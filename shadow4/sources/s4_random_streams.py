@@ -0,0 +1,122 @@
+#
+# Random number streams of the light sources.
+#
+# Each light source draws its random numbers from a numpy.random.Generator created from a numpy.random.SeedSequence:
+#   - by default, the sequence is SeedSequence(seed) (seed=0: non-reproducible, fresh entropy at each run).
+#   - get_random_generator() returns a new generator at each call (e.g. get_beam() is reproducible), while
+#     get_shared_random_generator() returns one generator per light source, for the stand-alone sampling methods.
+#   - sub-streams (independent and reproducible) are children of that sequence: spawn(n) returns the sequences
+#     of the sub-streams 0..n-1, and "with light_source.random_stream(i):" makes the light source use sub-stream i.
+# The chunks and shards of S4Beamline.run_beamline_in_chunks() and S4Beamline.run_beamline_in_parallel() use
+# sub-stream i for chunk i, so the result does not depend on the number of processes.
+#
+import contextlib
+
+import numpy
+
+class S4RandomStreams(object):
+    """
+    Mixin for the light sources (S4LightSourceBase, S4LightSource): the random number streams. The class using
+    it must define get_seed().
+    """
+    def get_seed_sequence(self):
+        """
+        Returns the seed sequence of the light source.
+
+        Returns
+        -------
+        instance of numpy.random.SeedSequence
+            The sequence set with set_seed_sequence(), or else SeedSequence(seed) (with fresh entropy if seed is 0).
+
+        """
+        seed_sequence = getattr(self, "_seed_sequence", None)
+        if seed_sequence is not None: return seed_sequence
+        seed = self.get_seed()
+        return numpy.random.SeedSequence(None if seed == 0 else seed)
+
+    def set_seed_sequence(self, seed_sequence=None):
+        """
+        Sets the seed sequence of the light source (e.g. a sub-stream from spawn()).
+
+        Parameters
+        ----------
+        seed_sequence : instance of numpy.random.SeedSequence, optional
+            The seed sequence (None: use the seed).
+
+        """
+        self._seed_sequence = seed_sequence
+        self._shared_random_generator = None
+
+    def get_random_generator(self):
+        """
+        Returns a new random generator (numpy.random.Generator) initialized with the seed sequence.
+
+        Returns
+        -------
+        instance of numpy.random.Generator
+
+        """
+        return numpy.random.default_rng(self.get_seed_sequence())
+
+    def get_shared_random_generator(self):
+        """
+        Returns the random generator shared by the calls that do not receive a generator (e.g.
+        SourceGaussian.get_arrays_real_space()), so that consecutive calls draw different numbers. It is created
+        from the seed sequence at the first call and reset by set_seed() and set_seed_sequence().
+
+        Returns
+        -------
+        instance of numpy.random.Generator
+
+        """
+        if getattr(self, "_shared_random_generator", None) is None:
+            self._shared_random_generator = self.get_random_generator()
+        return self._shared_random_generator
+
+    def spawn(self, n_streams, first_stream=0):
+        """
+        Returns the seed sequences of sub-streams of the light source. Unlike SeedSequence.spawn(), the result
+        depends only on the stream indices (not on the previous calls).
+
+        Parameters
+        ----------
+        n_streams : int
+            The number of sub-streams.
+
+        first_stream : int, optional
+            The index of the first sub-stream.
+
+        Returns
+        -------
+        list
+            The seed sequences (numpy.random.SeedSequence) of the sub-streams first_stream...first_stream+n_streams-1.
+
+        """
+        seed_sequence = self.get_seed_sequence()
+        return [numpy.random.SeedSequence(seed_sequence.entropy,
+                                          spawn_key=seed_sequence.spawn_key + (i,),
+                                          pool_size=seed_sequence.pool_size)
+                for i in range(first_stream, first_stream + n_streams)]
+
+    @contextlib.contextmanager
+    def random_stream(self, index):
+        """
+        Context manager: inside the "with" block, the light source uses the sub-stream index.
+
+        Parameters
+        ----------
+        index : int
+            The index of the sub-stream.
+
+        Examples
+        --------
+        >>> with light_source.random_stream(3):
+        >>>     beam = light_source.get_beam()
+
+        """
+        previous = getattr(self, "_seed_sequence", None)
+        self.set_seed_sequence(self.spawn(1, first_stream=index)[0])
+        try:
+            yield self
+        finally:
+            self.set_seed_sequence(previous)
@@ -10,7 +10,7 @@ class DistributionGeneric(SynedObject):
     def get_dimension(self):
         raise Exception("To be implemented in the subclasses")
 
-    def get_sampled_points(self):
+    def get_sampled_points(self,N,random_generator=None):
         raise Exception("To be implemented in the subclasses")
 
 #
@@ -48,7 +48,7 @@ class Point2D(Distribution2D):
                     ("v_center"         , "v (center) ", "" ),
             ] )
 
-    def get_sampled_points(self,N):
+    def get_sampled_points(self,N,random_generator=None):
         return numpy.zeros(N)+self._h_center,numpy.zeros(N)+self._v_center
 
 
@@ -69,12 +69,13 @@ class Rectangle2D(Distribution2D):
         # return ["Point","Rectangle","Ellipse","Gaussian"]
         # return ["Flat","Uniform","Gaussian","Cone"]
 
-    def get_sampled_points(self,N):
-        return Uniform1D.sample(N,self._h_min,self._h_max),Uniform1D.sample(N,self._v_min,self._v_max)
+    def get_sampled_points(self,N,random_generator=None):
+        return Uniform1D.sample(N,self._h_min,self._h_max,random_generator=random_generator),\
+               Uniform1D.sample(N,self._v_min,self._v_max,random_generator=random_generator)
 
     @classmethod
-    def sample(cls,N,h_min,h_max,v_min,v_max):
-        return Rectangle2D(h_min,h_max,v_min,v_max).get_sampled_points(N)
+    def sample(cls,N,h_min,h_max,v_min,v_max,random_generator=None):
+        return Rectangle2D(h_min,h_max,v_min,v_max).get_sampled_points(N,random_generator=random_generator)
 
 
 class Ellipse2D(Distribution2D):
@@ -94,20 +95,21 @@ class Ellipse2D(Distribution2D):
         # return ["Point","Rectangle","Ellipse","Gaussian"]
         # return ["Flat","Uniform","Gaussian","Cone"]
 
-    def get_sampled_points(self,N):
+    def get_sampled_points(self,N,random_generator=None):
         # ! C
         # ! C Elliptical source **
         # ! C Uses a transformation algorithm to generate a uniform variate distribution
         # ! C
-        phi = numpy.pi * 2 * numpy.random.random(N)
-        radius = numpy.sqrt(numpy.random.random(N))
+        rng = _get_random_generator(random_generator)
+        phi = numpy.pi * 2 * rng.random(N)
+        radius = numpy.sqrt(rng.random(N))
         x = 0.5 *(self._h_max+self._h_min) + 0.5 * (self._h_max-self._h_min) * radius * numpy.cos(phi)
         y = 0.5 *(self._v_max+self._v_min) + 0.5 * (self._v_max-self._v_min) * radius * numpy.sin(phi)
         return x,y
 
     @classmethod
-    def sample(cls,N,h_min,h_max,v_min,v_max):
-        return Ellipse2D(h_min,h_max,v_min,v_max).get_sampled_points(N)
+    def sample(cls,N,h_min,h_max,v_min,v_max,random_generator=None):
+        return Ellipse2D(h_min,h_max,v_min,v_max).get_sampled_points(N,random_generator=random_generator)
 
 class Gaussian2D(Distribution2D):
     def __init__(self, sigma_h,sigma_v):
@@ -123,12 +125,13 @@ class Gaussian2D(Distribution2D):
         # return ["Point","Rectangle","Ellipse","Gaussian"]
         # return ["Flat","Uniform","Gaussian","Cone"]
 
-    def get_sampled_points(self,N):
-        return Gaussian1D.sample(N,self._sigma_h),Gaussian1D.sample(N,self._sigma_v)
+    def get_sampled_points(self,N,random_generator=None):
+        return Gaussian1D.sample(N,self._sigma_h,random_generator=random_generator),\
+               Gaussian1D.sample(N,self._sigma_v,random_generator=random_generator)
 
     @classmethod
-    def sample(cls,N,sigma_h,sigma_v):
-        return Gaussian2D(sigma_h,sigma_v).get_sampled_points(N)
+    def sample(cls,N,sigma_h,sigma_v,random_generator=None):
+        return Gaussian2D(sigma_h,sigma_v).get_sampled_points(N,random_generator=random_generator)
 
 
 #
@@ -159,16 +162,17 @@ class Uniform2D(Distribution2D):
         # return ["Point","Rectangle","Ellipse","Gaussian"]
         # return ["Flat","Uniform","Gaussian","Cone"]
 
-    def get_sampled_points(self,N):
+    def get_sampled_points(self,N,random_generator=None):
         # ! C
         # ! C   Uniform distribution ( Isotrope emitter )
         # ! C
+        rng = _get_random_generator(random_generator)
         XMAX1 =   numpy.tan(self._h_min)
         XMAX2 =   numpy.tan(self._h_max)
         ZMAX1 =   numpy.tan(self._v_min)
         ZMAX2 =   numpy.tan(self._v_max)
-        XRAND = numpy.random.random(N) * (XMAX1 - XMAX2) + XMAX2
-        ZRAND = numpy.random.random(N) * (ZMAX1 - ZMAX2) + ZMAX2
+        XRAND = rng.random(N) * (XMAX1 - XMAX2) + XMAX2
+        ZRAND = rng.random(N) * (ZMAX1 - ZMAX2) + ZMAX2
         THETAR  = numpy.arctan(numpy.sqrt(XRAND**2+ZRAND**2))
         PHIR = numpy.arctan2(ZRAND,XRAND)
         DIREC1  = numpy.cos(PHIR) * numpy.sin(THETAR)
@@ -177,8 +181,8 @@ class Uniform2D(Distribution2D):
         return DIREC1,DIREC3
 
     @classmethod
-    def sample(cls,N,h_min,h_max,v_min,v_max):
-        return Uniform2D(h_min,h_max,v_min,v_max).get_sampled_points(N)
+    def sample(cls,N,h_min,h_max,v_min,v_max,random_generator=None):
+        return Uniform2D(h_min,h_max,v_min,v_max).get_sampled_points(N,random_generator=random_generator)
 
 
 
@@ -193,7 +197,7 @@ class Cone2D(Distribution2D):
                     ("cone_min"         , "max angle for cone semiaperture  ", "" ),
             ] )
 
-    def get_sampled_points(self,N):
+    def get_sampled_points(self,N,random_generator=None):
         # ! C   Now generates a set of rays along a cone centered about the normal,
         # ! C   plus a ray along the normal itself.
         # ! C
@@ -211,8 +215,9 @@ class Cone2D(Distribution2D):
         # DIREC(2) =   COS(ANG_CONE)
         # DIREC(3) =   SIN(ANG_CONE)*SIN(ANGLE)
 
-        ANGLE = 2 * numpy.pi * numpy.random.random(N)
-        ANG_CONE = numpy.cos(self._cone_min) - numpy.random.random(N) * \
+        rng = _get_random_generator(random_generator)
+        ANGLE = 2 * numpy.pi * rng.random(N)
+        ANG_CONE = numpy.cos(self._cone_min) - rng.random(N) * \
                                                (numpy.cos(self._cone_min)-numpy.cos(self._cone_max))
         ANG_CONE = numpy.arccos(ANG_CONE)
         DIREC1 = numpy.sin(ANG_CONE) * numpy.cos(ANGLE)
@@ -222,8 +227,8 @@ class Cone2D(Distribution2D):
         return DIREC1,DIREC3
 
     @classmethod
-    def sample(cls,N,cone_max=10e-6,cone_min=0.0):
-        return Cone2D(cone_max=cone_max,cone_min=cone_min).get_sampled_points(N)
+    def sample(cls,N,cone_max=10e-6,cone_min=0.0,random_generator=None):
+        return Cone2D(cone_max=cone_max,cone_min=cone_min).get_sampled_points(N,random_generator=random_generator)
 
 
 
@@ -254,12 +259,12 @@ class Uniform1D(Distribution1D):
                     ("x_max"         , "maximum (signed)", "" ),
             ] )
 
-    def get_sampled_points(self,N):
-        return numpy.random.random(N) * (self._x_max-self._x_min) + self._x_min
+    def get_sampled_points(self,N,random_generator=None):
+        return _get_random_generator(random_generator).random(N) * (self._x_max-self._x_min) + self._x_min
 
     @classmethod
-    def sample(cls,N=1000,x_min=-0.010, x_max=0.010):
-        return Uniform1D(x_min=x_min, x_max=x_max).get_sampled_points(N)
+    def sample(cls,N=1000,x_min=-0.010, x_max=0.010,random_generator=None):
+        return Uniform1D(x_min=x_min, x_max=x_max).get_sampled_points(N,random_generator=random_generator)
 
 class Gaussian1D(Distribution1D):
     def __init__(self, sigma=1e-3, center=0.0):
@@ -275,12 +280,18 @@ class Gaussian1D(Distribution1D):
                     ("center"        , "center", "" ),
             ] )
 
-    def get_sampled_points(self,N):
-        return numpy.random.normal(loc=self._center, scale=self._sigma, size=N)
+    def get_sampled_points(self,N,random_generator=None):
+        return _get_random_generator(random_generator).normal(loc=self._center, scale=self._sigma, size=N)
 
     @classmethod
-    def sample(cls,N=1000,sigma=0.25,center=0.0):
-        return Gaussian1D(sigma=sigma,center=center).get_sampled_points(N)
+    def sample(cls,N=1000,sigma=0.25,center=0.0,random_generator=None):
+        return Gaussian1D(sigma=sigma,center=center).get_sampled_points(N,random_generator=random_generator)
+
+#
+# the samplers use the given random generator (numpy.random.Generator), or the global numpy.random state if None
+#
+def _get_random_generator(random_generator):
+    return numpy.random if random_generator is None else random_generator
 
 if __name__=="__main__":
 
@@ -32,9 +32,6 @@ class SourceGaussian(S4LightSourceBase):
         self._direction_space_center = direction_space_center
         # self._seed = seed
 
-        if seed != 0:
-            numpy.random.seed(seed)
-
 
     @classmethod
     def initialize_from_keywords(cls,
@@ -116,57 +113,61 @@ class SourceGaussian(S4LightSourceBase):
     def get_sigmas_direction_space(self):
         return self._sigmaXprime,self._sigmaZprime
 
-    def get_arrays_real_space(self):
+    def get_arrays_real_space(self, random_generator=None):
+        rng = self.get_shared_random_generator() if random_generator is None else random_generator
 
         if self._sigmaX > 0.0:
-            x = numpy.random.normal(self._real_space_center[0],self._sigmaX,self.get_number_of_points())
+            x = rng.normal(self._real_space_center[0],self._sigmaX,self.get_number_of_points())
         else:
             x = numpy.zeros(self.get_number_of_points())
 
         if self._sigmaY > 0.0:
-            y = numpy.random.normal(self._real_space_center[1],self._sigmaY,self.get_number_of_points())
+            y = rng.normal(self._real_space_center[1],self._sigmaY,self.get_number_of_points())
         else:
             y = numpy.zeros(self.get_number_of_points())
 
         if self._sigmaZ > 0.0:
-            z = numpy.random.normal(self._real_space_center[2],self._sigmaZ,self.get_number_of_points())
+            z = rng.normal(self._real_space_center[2],self._sigmaZ,self.get_number_of_points())
         else:
             z = numpy.zeros(self.get_number_of_points())
 
         return x,y,z
 
-    def get_arrays_direction_space(self):
+    def get_arrays_direction_space(self, random_generator=None):
+        rng = self.get_shared_random_generator() if random_generator is None else random_generator
         if self._sigmaXprime > 0:
-            x = numpy.random.normal(self._direction_space_center[0],self._sigmaXprime,self.get_number_of_points())
+            x = rng.normal(self._direction_space_center[0],self._sigmaXprime,self.get_number_of_points())
         else:
             x = numpy.zeros(self.get_number_of_points())
 
         if self._sigmaZprime > 0:
-            z = numpy.random.normal(self._direction_space_center[1],self._sigmaZprime,self.get_number_of_points())
+            z = rng.normal(self._direction_space_center[1],self._sigmaZprime,self.get_number_of_points())
         else:
             z = numpy.zeros(self.get_number_of_points())
         return x,z
 
 
 
-    def get_volume_divergences(self):
+    def get_volume_divergences(self, random_generator=None):
         """
         Returns an array (3,npoints) with xp,yp,zp (first index 0,1,2, respectively) with the
         direction vectors
+        :param random_generator: the random generator (numpy.random.Generator, default: the shared generator of the source)
         :return: xpypzp array
         """
-        XP,ZP = self.get_arrays_direction_space()
+        XP,ZP = self.get_arrays_direction_space(random_generator=random_generator)
         YP = numpy.sqrt(1 - XP**2 - ZP**2 )
         tmp = numpy.vstack((XP.flatten(),YP.flatten(),ZP.flatten()))
         return tmp
 
-    def get_volume_real_space(self):
+    def get_volume_real_space(self, random_generator=None):
         """
         Returns an array (3,npoints) with x,y,z (first index 0,1,2, respectively) with the
         spatial coordinates
+        :param random_generator: the random generator (numpy.random.Generator, default: the shared generator of the source)
         :return: xyz
         """
-        X,Y,Z = self.get_arrays_real_space()
+        X,Y,Z = self.get_arrays_real_space(random_generator=random_generator)
         return numpy.vstack((X.flatten(),Y.flatten(),Z.flatten()))
 
     def get_volume(self):
@@ -176,11 +177,10 @@ class SourceGaussian(S4LightSourceBase):
         :return: xyzxpypzp array
         """
 
-        if self.get_seed() != 0:
-            numpy.random.seed(self.get_seed())
+        rng = self.get_random_generator()
 
-        v1 = self.get_volume_real_space()
-        v2 = self.get_volume_divergences()
+        v1 = self.get_volume_real_space(random_generator=rng)
+        v2 = self.get_volume_divergences(random_generator=rng)
 
         V1x = v1[0,:].copy().flatten()
         V1y = v1[1,:].copy().flatten()
@@ -332,8 +332,7 @@ class SourceGeometrical(S4LightSourceBase):
 
     def calculate_rays(self):
 
-        if self.get_seed() != 0:
-            numpy.random.seed(self.get_seed())
+        rng = self.get_random_generator()
 
         N = self.get_nrays()
 
@@ -351,17 +350,20 @@ class SourceGeometrical(S4LightSourceBase):
                                     -0.5*self.__wxsou,
                                     +0.5*self.__wxsou,
                                     -0.5*self.__wzsou,
-                                    +0.5*self.__wzsou)
+                                    +0.5*self.__wzsou,
+                                    random_generator=rng)
         elif self.spatial_type == "Ellipse":
             rays[:,0],rays[:,2] = Ellipse2D.sample(N,
                                     -0.5*self.__wxsou,
                                     +0.5*self.__wxsou,
                                     -0.5*self.__wzsou,
-                                    +0.5*self.__wzsou)
+                                    +0.5*self.__wzsou,
+                                    random_generator=rng)
         elif self.spatial_type == "Gaussian":
             rays[:,0],rays[:,2] = Gaussian2D.sample(N,
                                     self.__sigmax,
-                                    self.__sigmaz)
+                                    self.__sigmaz,
+                                    random_generator=rng)
         else:
             raise Exception("Bad value of spatial_type")
 
@@ -373,9 +375,9 @@ class SourceGeometrical(S4LightSourceBase):
         if self.depth_distribution == "Off":
             pass
         elif self.depth_distribution == "Uniform":
-            rays[:,1] = (numpy.random.rand(N) - 0.5) * self.__wysou
+            rays[:,1] = (rng.random(N) - 0.5) * self.__wysou
         elif self.depth_distribution == "Gaussian":
-            rays[:,1] = numpy.random.normal(loc=0.0, scale=self.__wysou, size=N)
+            rays[:,1] = rng.normal(loc=0.0, scale=self.__wysou, size=N)
         else:
             raise Exception("Bad value of depth_distribution")
 
@@ -390,24 +392,28 @@ class SourceGeometrical(S4LightSourceBase):
                                     self.__hdiv1,
                                     self.__hdiv2,
                                     self.__vdiv1,
-                                    self.__vdiv2)
+                                    self.__vdiv2,
+                                    random_generator=rng)
             rays[:,4] = numpy.sqrt(-rays[:,3]**2 - rays[:,5]**2 + 1.0)
         elif self.angular_distribution == "Uniform":
             rays[:,3],rays[:,5] = Uniform2D.sample(N,
                                     self.__hdiv1,
                                     self.__hdiv2,
                                     self.__vdiv1,
-                                    self.__vdiv2)
+                                    self.__vdiv2,
+                                    random_generator=rng)
             rays[:,4] = numpy.sqrt(-rays[:,3]**2 - rays[:,5]**2 + 1.0)
         elif self.angular_distribution == "Gaussian":
             rays[:,3],rays[:,5] = Gaussian2D.sample(N,
                                     self.__sigdix,
-                                    self.__sigdiz)
+                                    self.__sigdiz,
+                                    random_generator=rng)
             rays[:,4] = numpy.sqrt(-rays[:,3]**2 - rays[:,5]**2 + 1.0)
         elif self.angular_distribution == "Cone":
             rays[:,3],rays[:,5] = Cone2D.sample(N,
                                     self.__cone_max,
-                                    self.__cone_min)
+                                    self.__cone_min,
+                                    random_generator=rng)
             rays[:,4] = numpy.sqrt(-rays[:,3]**2 - rays[:,5]**2 + 1.0)
         else:
             raise Exception("Bad value of angular_distribution")
@@ -427,7 +433,7 @@ class SourceGeometrical(S4LightSourceBase):
                 rays[:,10] = self._wavelength_to_wavenumber(self.__ph[0] * 1e-10)
         elif self.energy_distribution == "Several lines":
             values = numpy.array(self.__ph)
-            n_test =   (numpy.random.random(N) * values.size).astype(int)
+            n_test =   (rng.random(N) * values.size).astype(int)
             sampled_values = values[n_test]
             if self.__f_phot == 0:
                 rays[:,10] = self._energy_to_wavenumber(sampled_values)
@@ -456,7 +462,7 @@ class SourceGeometrical(S4LightSourceBase):
 
             sampled_values = numpy.zeros(N)
             for i in range(N):
-                DPS_RAN3 = numpy.random.random()
+                DPS_RAN3 = rng.random()
                 if (DPS_RAN3 > 0. and DPS_RAN3 <= relative_intensities[0]):
                     sampled_values[i] = values[0]
 
@@ -469,20 +475,20 @@ class SourceGeometrical(S4LightSourceBase):
             else:
                 rays[:,10] = self._wavelength_to_wavenumber(sampled_values * 1e-10)
         elif self.energy_distribution == "Uniform":
-            sampled_values = self.__ph[0] + (self.__ph[1]-self.__ph[0]) * numpy.random.rand(N)
+            sampled_values = self.__ph[0] + (self.__ph[1]-self.__ph[0]) * rng.random(N)
             if self.__f_phot == 0:
                 rays[:,10] = self._energy_to_wavenumber(sampled_values)
             else:
                 rays[:,10] = self._wavelength_to_wavenumber(sampled_values * 1e-10)
         elif self.energy_distribution == "Gaussian":
-            sampled_values = numpy.random.normal(loc=self.__ph[0], scale=self.__ph[1], size=N)
+            sampled_values = rng.normal(loc=self.__ph[0], scale=self.__ph[1], size=N)
             if self.__f_phot == 0:
                 rays[:,10] = self._energy_to_wavenumber(sampled_values)
             else:
                 rays[:,10] = self._wavelength_to_wavenumber(sampled_values * 1e-10)
         elif self.energy_distribution == "User defined":
             sampler = Sampler1D(self.__ph_spectrum_ordinates,self.__ph_spectrum_abscissas)
-            sampled_values = sampler.get_n_sampled_points(N)
+            sampled_values = sampler.get_sampled(rng.random(N))
             # sampled_values, hy, hx = sampler.get_n_sampled_points_and_histogram(N)
             # plot(hx,hy)
 
@@ -555,7 +561,7 @@ class SourceGeometrical(S4LightSourceBase):
         if self.__f_foher == 1:
             PHASEX = 0.0
         else:
-            PHASEX = numpy.random.random(N) * 2 * numpy.pi
+            PHASEX = rng.random(N) * 2 * numpy.pi
 
         PHASEZ = PHASEX + self.__pol_angle
 
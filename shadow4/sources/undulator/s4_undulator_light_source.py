@@ -34,9 +34,9 @@ from shadow4.sources.s4_electron_beam import S4ElectronBeam
 
 from shadow4.beam.s4_beam import S4Beam
 
-from shadow4.sources.undulator.source_undulator_factory import calculate_undulator_emission # SourceUndulatorFactory
-from shadow4.sources.undulator.source_undulator_factory_srw import calculate_undulator_emission_SRW # SourceUndulatorFactorySrw
-from shadow4.sources.undulator.source_undulator_factory_pysru import calculate_undulator_emission_pySRU # SourceUndulatorFactoryPysru
+# the SRW and pySRU codes are optional: they are imported only when used (see get_calculate_undulator_emission_function)
+from shadow4.sources.undulator.source_undulator_factory_parallel import calculate_undulator_emission_in_parallel
+from shadow4.sources.undulator.source_undulator_factory_parallel import get_calculate_undulator_emission_function
 
 from shadow4.sources.undulator.s4_undulator import S4Undulator
 
@@ -70,6 +70,7 @@ class S4UndulatorLightSource(S4LightSource):
         self.__result_radiation = None
         self.__result_photon_size_distribution = None
         self.__result_photon_size_sigma = None
+        self._radiation_cache = None
 
     def get_beam(self):
         user_unit_to_m = 1.0
@@ -125,7 +126,48 @@ class S4UndulatorLightSource(S4LightSource):
     #     return self._EMIN,self._EMAX,self._NG_E
 
 
-    def __calculate_radiation(self):
+    def set_radiation_cache(self, radiation_cache=None):
+        """
+        Sets a persistent cache for the radiation (see shadow4.sources.s4_radiation_cache).
+
+        Parameters
+        ----------
+        radiation_cache : instance of S4RadiationCache, optional
+            The cache (None: no cache, calculate always).
+
+        """
+        self._radiation_cache = radiation_cache
+
+    def get_radiation_cache(self):
+        return getattr(self, "_radiation_cache", None)
+
+    def calculate_radiation(self, n_workers=1, n_chunks=None, progress_callback=None):
+        """
+        Calculates (or recalculates) the radiation used to sample the rays, optionally in a pool of processes.
+        If a radiation cache is set (see set_radiation_cache()), the radiation is loaded from it when available.
+
+        Parameters
+        ----------
+        n_workers : int, optional
+            The number of processes (1: calculate in this process, None: number of cpus). The photon energies are
+            distributed over the processes (see source_undulator_factory_parallel).
+
+        n_chunks : int, optional
+            The number of chunks of photon energies for the processes (None: one chunk per energy).
+
+        progress_callback : function, optional
+            A function f(i_energy, n_energies, photon_energy) reporting the progress (None: print it).
+
+        Returns
+        -------
+        dict
+            The radiation dictionary (see get_result_dictionary()).
+
+        """
+        self.__calculate_radiation(n_workers=n_workers, n_chunks=n_chunks, progress_callback=progress_callback)
+        return self.__result_radiation
+
+    def __calculate_radiation(self, n_workers=1, n_chunks=None, progress_callback=None):
         """
         Calculates the radiation (emission) as a function of theta (elevation angle) and phi (azimuthal angle)
         This radiation will be sampled to create the source
@@ -150,38 +192,7 @@ class S4UndulatorLightSource(S4LightSource):
         self.__result_radiation = None
 
         # undul_phot
-        if undulator.code_undul_phot == 'internal':
-            undul_phot_dict = calculate_undulator_emission(
-                electron_energy= syned_electron_beam.energy(),
-                electron_current= syned_electron_beam.current(),
-                undulator_period= undulator.period_length(),
-                undulator_nperiods= undulator.number_of_periods(),
-                K         = undulator.K(),
-                photon_energy= undulator._EMIN,
-                EMAX      = undulator._EMAX,
-                NG_E      = undulator._NG_E,
-                MAXANGLE  = undulator._MAXANGLE,
-                number_of_points= undulator._NG_T,
-                NG_P      = undulator._NG_P,
-                number_of_trajectory_points = undulator._NG_J,
-                )
-
-        elif undulator.code_undul_phot == 'pysru' or  undulator.code_undul_phot == 'pySRU':
-            undul_phot_dict = calculate_undulator_emission_pySRU(
-                electron_energy= syned_electron_beam.energy(),
-                electron_current= syned_electron_beam.current(),
-                undulator_period= undulator.period_length(),
-                undulator_nperiods= undulator.number_of_periods(),
-                K         = undulator.K(),
-                photon_energy= undulator._EMIN,
-                EMAX      = undulator._EMAX,
-                NG_E      = undulator._NG_E,
-                MAXANGLE  = undulator._MAXANGLE,
-                number_of_points= undulator._NG_T,
-                NG_P      = undulator._NG_P,
-                )
-        elif undulator.code_undul_phot == 'srw' or  undulator.code_undul_phot == 'SRW':
-            undul_phot_dict = calculate_undulator_emission_SRW(
+        kwargs = dict(
                 electron_energy= syned_electron_beam.energy(),
                 electron_current= syned_electron_beam.current(),
                 undulator_period= undulator.period_length(),
@@ -194,8 +205,27 @@ class S4UndulatorLightSource(S4LightSource):
                 number_of_points= undulator._NG_T,
                 NG_P      = undulator._NG_P,
                 )
-        else:
-            raise Exception("Not implemented undul_phot code: "+undulator.code_undul_phot)
+        if undulator.code_undul_phot == 'internal':
+            kwargs["number_of_trajectory_points"] = undulator._NG_J
+        calculate_emission = get_calculate_undulator_emission_function(undulator.code_undul_phot)
+
+        # the persistent cache, if any
+        radiation_cache = self.get_radiation_cache()
+        undul_phot_dict = None
+        if radiation_cache is not None:
+            key = radiation_cache.get_key("undulator_radiation", undulator.code_undul_phot, kwargs)
+            undul_phot_dict = radiation_cache.get(key)
+
+        if undul_phot_dict is None:
+            if n_workers == 1:
+                undul_phot_dict = calculate_emission(progress_callback=progress_callback, **kwargs)
+            else:
+                undul_phot_dict = calculate_undulator_emission_in_parallel(code_undul_phot=undulator.code_undul_phot,
+                                                                           n_workers=n_workers,
+                                                                           n_chunks=n_chunks,
+                                                                           progress_callback=progress_callback,
+                                                                           **kwargs)
+            if radiation_cache is not None: radiation_cache.put(key, undul_phot_dict)
 
         # add some info
         undul_phot_dict["code_undul_phot"] = undulator.code_undul_phot
@@ -353,10 +383,10 @@ class S4UndulatorLightSource(S4LightSource):
         syned_electron_beam = self.get_electron_beam()
         undulator = self.get_magnetic_structure()
 
-        sampled_photon_energy,sampled_theta,sampled_phi = self._sample_photon_energy_theta_and_phi(NRAYS)
+        rng = self.get_random_generator()
 
-        if self.get_seed() != 0:
-            numpy.random.seed(self.get_seed())
+        sampled_photon_energy,sampled_theta,sampled_phi = self._sample_photon_energy_theta_and_phi(NRAYS,
+                                                                                 random_generator=rng)
 
 
         sigmas = syned_electron_beam.get_sigmas_all()
@@ -369,9 +399,9 @@ class S4UndulatorLightSource(S4LightSource):
 
 
         if undulator._FLAG_EMITTANCE:
-            x_electron = numpy.random.normal(loc=0.0,scale=sigmas[0],size=NRAYS)
+            x_electron = rng.normal(loc=0.0,scale=sigmas[0],size=NRAYS)
             y_electron = 0.0
-            z_electron = numpy.random.normal(loc=0.0,scale=sigmas[2],size=NRAYS)
+            z_electron = rng.normal(loc=0.0,scale=sigmas[2],size=NRAYS)
         else:
             x_electron = 0.0
             y_electron = 0.0
@@ -405,7 +435,7 @@ class S4UndulatorLightSource(S4LightSource):
             cov = [[s_phot_corrected**2, 0], [0, s_phot_corrected**2]]
             mean = [0.0,0.0]
 
-            tmp = numpy.random.multivariate_normal(mean, cov, NRAYS)
+            tmp = rng.multivariate_normal(mean, cov, NRAYS)
             x_photon = tmp[:,0]
             y_photon = 0.0
             z_photon = tmp[:,1]
@@ -453,8 +483,8 @@ class S4UndulatorLightSource(S4LightSource):
             # #########################################################
 
             sampler_radial = Sampler1D(yy*numpy.abs(xx),xx)
-            r,hy,hx = sampler_radial.get_n_sampled_points_and_histogram(NRAYS,bins=101)
-            angle = numpy.random.random(NRAYS) * 2 * numpy.pi
+            r,hy,hx = sampler_radial.get_sampled_and_histogram(rng.random(NRAYS),bins=101)
+            angle = rng.random(NRAYS) * 2 * numpy.pi
 
             x_photon = r / numpy.sqrt(2.0) * numpy.sin(angle)
             y_photon = 0.0
@@ -481,14 +511,14 @@ class S4UndulatorLightSource(S4LightSource):
         THETABM = A_Z
         PHI  = A_X
         # ! C Decide in which quadrant THETA and PHI are.
-        myrand = numpy.random.random(NRAYS)
+        myrand = rng.random(NRAYS)
         THETABM[numpy.where(myrand < 0.5)] *= -1.0
-        myrand = numpy.random.random(NRAYS)
+        myrand = rng.random(NRAYS)
         PHI[numpy.where(myrand < 0.5)] *= -1.0
 
         if undulator._FLAG_EMITTANCE:
-            EBEAM1 = numpy.random.normal(loc=0.0,scale=sigmas[1],size=NRAYS)
-            EBEAM3 = numpy.random.normal(loc=0.0,scale=sigmas[3],size=NRAYS)
+            EBEAM1 = rng.normal(loc=0.0,scale=sigmas[1],size=NRAYS)
+            EBEAM3 = rng.normal(loc=0.0,scale=sigmas[3],size=NRAYS)
             ANGLEX = EBEAM1 + PHI
             ANGLEV = EBEAM3 + THETABM
         else:
@@ -613,7 +643,7 @@ class S4UndulatorLightSource(S4LightSource):
         if F_COHER == 1:
             PHASEX = 0.0
         else:
-            PHASEX = numpy.random.random(NRAYS) * 2 * numpy.pi
+            PHASEX = rng.random(NRAYS) * 2 * numpy.pi
 
         PHASEZ = PHASEX + POL_ANGLE * numpy.sign(ANGLEV)
 
@@ -711,11 +741,12 @@ class S4UndulatorLightSource(S4LightSource):
             u_norm[:,i] = uu
         return u / u_norm
 
-    def _sample_photon_energy_theta_and_phi(self,NRAYS):
+    def _sample_photon_energy_theta_and_phi(self,NRAYS,random_generator=None):
 
         #
         # sample divergences
         #
+        rng = self.get_random_generator() if random_generator is None else random_generator
 
         theta = self.__result_radiation["theta"]
         phi = self.__result_radiation["phi"]
@@ -742,7 +773,7 @@ class S4UndulatorLightSource(S4LightSource):
             # plot_image(tmp_theta,theta,phi,aspect='auto')
 
             s2d = Sampler2D(tmp,theta,phi)
-            sampled_theta,sampled_phi = s2d.get_n_sampled_points(NRAYS)
+            sampled_theta,sampled_phi = s2d.get_sampled(rng.random(NRAYS), rng.random(NRAYS))
 
             sampled_photon_energy = self.get_magnetic_structure()._EMIN
 
@@ -759,7 +790,8 @@ class S4UndulatorLightSource(S4LightSource):
 
             s3d = Sampler3D(tmp,photon_energy,theta,phi)
 
-            sampled_photon_energy,sampled_theta,sampled_phi = s3d.get_n_sampled_points(NRAYS)
+            sampled_photon_energy,sampled_theta,sampled_phi = s3d.get_sampled(rng.random(NRAYS), rng.random(NRAYS),
+                                                                              rng.random(NRAYS))
 
 
         return sampled_photon_energy,sampled_theta,sampled_phi
@@ -771,6 +803,9 @@ class S4UndulatorLightSource(S4LightSource):
 
         NRAYS = self.get_nrays()
 
+        # sub-streams: 0 for the Gaussian source, 1 for the photon energy
+        seed_sequences = self.spawn(2)
+
         if self.get_magnetic_structure().get_flag_emittance():
             sigma_x, sigdi_x, sigma_z, sigdi_z = self.get_electron_beam().get_sigmas_all()
             Sx, Sz, Spx, Spz = self.get_undulator_photon_beam_sizes_by_convolution(
@@ -807,12 +842,13 @@ class S4UndulatorLightSource(S4LightSource):
                                                         nrays=NRAYS,
                                                         seed=self.get_seed())
 
+        a.set_seed_sequence(seed_sequences[0])
         print(a.info())
         beam = a.get_beam()
         if emax == emin:
             e = numpy.zeros(NRAYS) + emin
         else:
-            e = numpy.random.random(NRAYS) * (emax - emin) + emin
+            e = numpy.random.default_rng(seed_sequences[1]).random(NRAYS) * (emax - emin) + emin
 
         beam.set_photon_energy_eV(e)
 
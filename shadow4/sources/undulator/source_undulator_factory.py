@@ -29,6 +29,10 @@ import numpy as np
 import scipy.constants as codata
 import scipy.integrate
 
+# numpy>=2 renamed trapz to trapezoid, scipy>=1.14 removed cumtrapz (renamed cumulative_trapezoid)
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz
+_cumulative_trapezoid = getattr(scipy.integrate, "cumulative_trapezoid", None) or scipy.integrate.cumtrapz
+
 # class SourceUndulatorFactory(object):
 #
 #     #
@@ -96,8 +100,8 @@ def _pysru_energy_radiated_approximation_and_farfield(omega=2.53465927101*10**17
     # trajectory_a_y = trajectory[8]
     # trajectory_a_z = trajectory[9]
 
-    E = np.zeros((3,), dtype=np.complex)
-    integrand = np.zeros((3, N), dtype=np.complex)
+    E = np.zeros((3,), dtype=complex)
+    integrand = np.zeros((3, N), dtype=complex)
     A1 = (n_chap[1] * trajectory_v_z - n_chap[2] * trajectory_v_y)
     A2 = (-n_chap[0] * trajectory_v_z + n_chap[2] * trajectory_v_x)
     A3 = (n_chap[0] * trajectory_v_y - n_chap[1] * trajectory_v_x)
@@ -112,10 +116,10 @@ def _pysru_energy_radiated_approximation_and_farfield(omega=2.53465927101*10**17
 
     for k in range(3):
         # E[k] = np.trapz(integrand[k], self.trajectory.t)
-        E[k] = np.trapz(integrand[k], trajectory_t)
+        E[k] = _trapezoid(integrand[k], trajectory_t)
     E *= omega * 1j
 
-    terme_bord = np.full((3), 0. + 1j * 0., dtype=np.complex)
+    terme_bord = np.full((3), 0. + 1j * 0., dtype=complex)
     Alpha_1 = (1.0 / (1.0 - n_chap[0] * trajectory_v_x[-1]
                       - n_chap[1] * trajectory_v_y[-1] - n_chap[2] * trajectory_v_z[-1]))
     Alpha_0 = (1.0 / (1.0 - n_chap[0] * trajectory_v_x[0]
@@ -129,13 +133,102 @@ def _pysru_energy_radiated_approximation_and_farfield(omega=2.53465927101*10**17
     E *= c6**0.5
     return E
 
+# vectorized version of _pysru_energy_radiated_approximation_and_farfield() (with D given): the field at many
+# points (x[i], y[i]) at once, broadcasting over the trajectory points. Returns E with shape (3, npoints).
+def _pysru_energy_radiated_approximation_and_farfield_vectorized(omega=2.53465927101*10**17, electron_current=1.0,
+                                                                 trajectory=np.zeros((11,10)), x=np.zeros(1), y=np.zeros(1), D=100.0):
+
+    c6 = codata.e * electron_current * 1e-9 / (8.0 * np.pi ** 2 * codata.epsilon_0 * codata.c * codata.h)
+    c6 /= D**2
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    X = np.sqrt(x ** 2 + y ** 2 + D ** 2)
+    n_chap = np.array([x / X, y / X, D / X]) # (3, npoints)
+
+    trajectory_t   = trajectory[0]
+    trajectory_x   = trajectory[1]
+    trajectory_y   = trajectory[2]
+    trajectory_z   = trajectory[3]
+    trajectory_v   = trajectory[4:7]
+
+    # the phase is omega * (t + X/c - n.r): the term X/c (constant along the trajectory, and much larger than the
+    # others) is applied at the end as a phase factor per point, so the exponential is evaluated for small
+    # arguments (faster, and without the rounding of the large sum)
+    Alpha2 = np.exp(
+        0. + 1j * omega * ((trajectory_t - n_chap[2][:, np.newaxis] * trajectory_z)
+                           - n_chap[0][:, np.newaxis] * trajectory_x - n_chap[1][:, np.newaxis] * trajectory_y))
+
+    # A = n x v is linear in v, so the trapezoidal integrals of A * Alpha2 are obtained from the integrals of
+    # v * Alpha2 (one matrix product with the trapezoid weights)
+    dt = np.diff(trajectory_t)
+    weights = np.zeros_like(trajectory_t)
+    weights[:-1] += 0.5 * dt
+    weights[1:] += 0.5 * dt
+    integral_v = Alpha2 @ (weights * trajectory_v).T # (npoints, 3)
+
+    def _n_cross(v): # n x v, for v with shape (npoints, 3)
+        return np.array([n_chap[1] * v[:, 2] - n_chap[2] * v[:, 1],
+                         -n_chap[0] * v[:, 2] + n_chap[2] * v[:, 0],
+                         n_chap[0] * v[:, 1] - n_chap[1] * v[:, 0]])
+
+    A = _n_cross(integral_v) # integrals of A1, A2, A3 (times Alpha2)
+    E = -_n_cross(A.T)
+    E *= omega * 1j
+
+    Alpha_1 = (1.0 / (1.0 - n_chap.T @ trajectory_v[:, -1]))
+    Alpha_0 = (1.0 / (1.0 - n_chap.T @ trajectory_v[:, 0]))
+    A_1 = _n_cross(np.tile(trajectory_v[:, -1], (X.size, 1)))
+    A_0 = _n_cross(np.tile(trajectory_v[:, 0], (X.size, 1)))
+
+    # as in pySRU, the same edge term is added to the three components
+    terme_bord = ((n_chap[1] * A_1[2] - n_chap[2] * A_1[1]) * Alpha_1 * Alpha2[:, -1])
+    terme_bord -= ((n_chap[1] * A_0[2] - n_chap[2] * A_0[1]) * Alpha_0 * Alpha2[:, 0])
+    E += terme_bord
+    E *= np.exp(1j * omega * X / codata.c)
+    E *= c6**0.5
+    return E
+
+# bytes used per (point, trajectory point) by _pysru_energy_radiated_approximation_and_farfield_vectorized()
+# (the phases and their complex exponentials, with temporaries), to set the slab size from the memory limit
+_BYTES_PER_POINT_AND_TRAJECTORY_POINT = 48
+
+def _undul_phot_one_energy(photon_energy, omega, INTENSITY, T, theta, phi, D=100.0, memory_limit_in_MB=200.0):
+    # the intensity and polarization (arrays (theta.size, phi.size)) at one photon energy, computed in slabs of
+    # (theta, phi) points whose size is set by the memory limit
+    THETA, PHI = np.meshgrid(theta, phi, indexing='ij')
+    R = D / np.cos(THETA.ravel())
+    r = R * np.sin(THETA.ravel())
+    X = r * np.cos(PHI.ravel())
+    Y = r * np.sin(PHI.ravel())
+
+    slab = max(1, int(memory_limit_in_MB * 2**20 / (_BYTES_PER_POINT_AND_TRAJECTORY_POINT * T.shape[1])))
+    ElecField = np.zeros((3, X.size), dtype=complex)
+    for i in range(0, X.size, slab):
+        ElecField[:, i:i+slab] = _pysru_energy_radiated_approximation_and_farfield_vectorized(
+            omega=omega, electron_current=INTENSITY, trajectory=T, x=X[i:i+slab], y=Y[i:i+slab], D=D)
+
+    with np.errstate(invalid='ignore'):
+        pol_deg = np.abs(ElecField[0]) / (np.abs(ElecField[0]) + np.abs(ElecField[1])) # SHADOW definition
+    intensity = (np.abs(ElecField[0]) ** 2 + np.abs(ElecField[1]) ** 2 + np.abs(ElecField[2]) ** 2)
+
+    #  Conversion from pySRU units (photons/mm^2/0.1%bw) to SHADOW units (photons/rad^2/eV)
+    intensity *= (D*1e3)**2 # photons/mm^2 -> photons/rad^2
+    intensity /= 1e-3 * photon_energy # photons/o.1%bw -> photons/eV
+
+    return intensity.reshape(THETA.shape), pol_deg.reshape(THETA.shape)
 
 #
 # now, the different versions of undul_phot
 #
 # @staticmethod
 def undul_phot(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_T,NG_P,
-               number_of_trajectory_points=20):
+               number_of_trajectory_points=20, method=0, memory_limit_in_MB=200.0, progress_callback=None):
+    # progress_callback: a function f(i_energy, n_energies, photon_energy) called before calculating each energy
+    #                    (None: print the progress)
+    # method = 0: vectorized: for each energy, the field is computed for slabs of (theta, phi) points at once,
+    #             broadcasting over the trajectory points. The slab size is set by memory_limit_in_MB.
+    # method = 1: loop over energy, theta and phi (reference)
 
 
     #
@@ -164,7 +257,14 @@ def undul_phot(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_
     Z2 = np.zeros((omega_array.size,theta.size,phi.size))
     POL_DEG = np.zeros_like(Z2)
     for o in range(omega_array.size):
-        print("Calculating energy %8.3f eV (%d of %d)"%(E[o],o+1,omega_array.size))
+        if progress_callback is None:
+            print("Calculating energy %8.3f eV (%d of %d)"%(E[o],o+1,omega_array.size))
+        else:
+            progress_callback(o, omega_array.size, E[o])
+        if method == 0:
+            Z2[o], POL_DEG[o] = _undul_phot_one_energy(E[o], omega_array[o], INTENSITY, T, theta, phi, D=D,
+                                                       memory_limit_in_MB=memory_limit_in_MB)
+            continue
         for t in range(theta.size):
             for p in range(phi.size):
                 R = D / np.cos(theta[t])
@@ -200,7 +300,10 @@ def calculate_undulator_emission(
                      MAXANGLE                     = 0.1,
                      number_of_points             = 100,
                      NG_P                         = 100,
-                     number_of_trajectory_points  = 100):
+                     number_of_trajectory_points  = 100,
+                     method                       = 0,
+                     memory_limit_in_MB           = 200.0,
+                     progress_callback            = None):
     # E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_T,NG_P,number_of_trajectory_points=20
     return undul_phot(electron_energy,
                         electron_current,
@@ -213,7 +316,10 @@ def calculate_undulator_emission(
                         MAXANGLE,
                         number_of_points,
                         NG_P,
-                        number_of_trajectory_points=number_of_trajectory_points)
+                        number_of_trajectory_points=number_of_trajectory_points,
+                        method=method,
+                        memory_limit_in_MB=memory_limit_in_MB,
+                        progress_callback=progress_callback)
 
 #
 # undul_cdf
@@ -252,12 +358,12 @@ def undul_cdf(undul_phot_dict,method='trapz'):
             TWO = numpy.array([0.0])
 
     else:
-        RN1 = numpy.trapz(YRN0,axis=2) * (P[1]-P[0])                            # RN1(e,t)
-        RN2 = numpy.trapz(RN1,axis=1)  * (T[1]-T[0])                            # RN2(e)
-        ZERO  = scipy.integrate.cumtrapz(RN0,initial=0,axis=2)  * (P[1] - P[0]) # CDF(e,t,p)
-        ONE   = scipy.integrate.cumtrapz(RN1,initial=0,axis=1)  * (T[1] - T[0]) # CDF(e,t)
+        RN1 = _trapezoid(YRN0,axis=2) * (P[1]-P[0])                            # RN1(e,t)
+        RN2 = _trapezoid(RN1,axis=1)  * (T[1]-T[0])                            # RN2(e)
+        ZERO  = _cumulative_trapezoid(RN0,initial=0,axis=2)  * (P[1] - P[0]) # CDF(e,t,p)
+        ONE   = _cumulative_trapezoid(RN1,initial=0,axis=1)  * (T[1] - T[0]) # CDF(e,t)
         if NG_E > 1:
-            TWO   = scipy.integrate.cumtrapz(RN2,initial=0)         * (E[1] - E[0]) # CDF(e)
+            TWO   = _cumulative_trapezoid(RN2,initial=0)         * (E[1] - E[0]) # CDF(e)
         else:
             TWO = numpy.array([0.0])
 
@@ -0,0 +1,122 @@
+#
+# Undulator radiation (undul_phot) calculated in a pool of processes.
+#
+# The radiation at each photon energy is independent of the other energies, for the three codes (internal, pySRU
+# and SRW). The photon energy array numpy.linspace(EMIN, EMAX, NG_E) is split in chunks of consecutive energies,
+# each chunk is calculated by a worker process with the calculate_undulator_emission* function of the code, and
+# the 'radiation' and 'polarization' arrays of the chunks are joined. The result dictionary is the same as the one
+# of the serial calculation.
+#
+# The progress is reported in this process with a function progress_callback(i_energy, n_energies, photon_energy),
+# called for each energy when its chunk is done (i_energy is the index of the energy, so the calls may not be in
+# order). The workers do not print the progress.
+#
+import concurrent.futures
+
+import numpy
+
+def calculate_undulator_emission_in_parallel(code_undul_phot="internal",
+                                             n_workers=None,
+                                             n_chunks=None,
+                                             progress_callback=None,
+                                             photon_energy=2000.0,
+                                             EMAX=20000.0,
+                                             NG_E=10,
+                                             **kwargs):
+    """
+    Calculates the undulator radiation distributing the photon energies over a pool of processes.
+
+    Parameters
+    ----------
+    code_undul_phot : str, optional
+        The code: 'internal', 'pysru' or 'srw'.
+
+    n_workers : int, optional
+        The number of processes (None: number of cpus).
+
+    n_chunks : int, optional
+        The number of chunks of photon energies (None: one chunk per energy).
+
+    progress_callback : function, optional
+        A function f(i_energy, n_energies, photon_energy) called when the radiation at each energy is done.
+
+    photon_energy : float, optional
+        The minimum photon energy in eV (EMIN).
+
+    EMAX : float, optional
+        The maximum photon energy in eV.
+
+    NG_E : int, optional
+        The number of photon energy points.
+
+    kwargs :
+        The other parameters of the calculate_undulator_emission* function of the code (electron_energy,
+        electron_current, undulator_period, undulator_nperiods, K, MAXANGLE, number_of_points, NG_P, ...).
+
+    Returns
+    -------
+    dict
+        The dictionary of calculate_undulator_emission* (keys 'radiation', 'polarization', 'photon_energy', 'theta',
+        'phi', ...).
+
+    """
+    energies = numpy.linspace(photon_energy, EMAX, NG_E, dtype=float)
+    if n_chunks is None: n_chunks = NG_E
+    n_chunks = max(1, min(int(n_chunks), NG_E))
+    chunks = [chunk for chunk in numpy.array_split(numpy.arange(NG_E), n_chunks) if chunk.size > 0]
+
+    results = [None] * len(chunks)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {}
+        for ichunk, chunk in enumerate(chunks):
+            chunk_kwargs = dict(kwargs,
+                                photon_energy=energies[chunk[0]], EMAX=energies[chunk[-1]], NG_E=chunk.size)
+            futures[executor.submit(_calculate_chunk, code_undul_phot, chunk_kwargs)] = ichunk
+
+        for future in concurrent.futures.as_completed(futures):
+            ichunk = futures[future]
+            results[ichunk] = future.result()
+            if progress_callback is not None:
+                for i_energy in chunks[ichunk]:
+                    progress_callback(int(i_energy), NG_E, energies[i_energy])
+
+    undul_phot_dict = dict(results[0])
+    undul_phot_dict["radiation"]     = numpy.concatenate([result["radiation"] for result in results], axis=0)
+    undul_phot_dict["polarization"]  = numpy.concatenate([result["polarization"] for result in results], axis=0)
+    undul_phot_dict["photon_energy"] = energies
+    return undul_phot_dict
+
+def get_calculate_undulator_emission_function(code_undul_phot="internal"):
+    """
+    Returns the calculate_undulator_emission* function of a code (the optional packages are imported here).
+
+    Parameters
+    ----------
+    code_undul_phot : str, optional
+        The code: 'internal', 'pysru' or 'srw'.
+
+    Returns
+    -------
+    function
+
+    """
+    if code_undul_phot == 'internal':
+        from shadow4.sources.undulator.source_undulator_factory import calculate_undulator_emission
+        return calculate_undulator_emission
+    elif code_undul_phot == 'pysru' or code_undul_phot == 'pySRU':
+        from shadow4.sources.undulator.source_undulator_factory_pysru import calculate_undulator_emission_pySRU
+        return calculate_undulator_emission_pySRU
+    elif code_undul_phot == 'srw' or code_undul_phot == 'SRW':
+        from shadow4.sources.undulator.source_undulator_factory_srw import calculate_undulator_emission_SRW
+        return calculate_undulator_emission_SRW
+    else:
+        raise Exception("Not implemented undul_phot code: " + code_undul_phot)
+
+#
+# in the pool workers
+#
+def _no_progress(i_energy, n_energies, photon_energy):
+    pass
+
+def _calculate_chunk(code_undul_phot, kwargs):
+    return get_calculate_undulator_emission_function(code_undul_phot)(progress_callback=_no_progress, **kwargs)
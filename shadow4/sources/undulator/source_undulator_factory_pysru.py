@@ -30,7 +30,9 @@ try:
 except:
     raise ImportError("pySRU not imported")
 
-def undul_phot_pySRU(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_T,NG_P):
+def undul_phot_pySRU(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_T,NG_P,progress_callback=None):
+    # progress_callback: a function f(i_energy, n_energies, photon_energy) called before calculating each energy
+    #                    (None: print the progress)
 
     myelectronbeam = PysruElectronBeam(Electron_energy=E_ENERGY, I_current=INTENSITY)
     myundulator = PysruUndulator(K=K, period_length=LAMBDAU, length=LAMBDAU*NPERIODS)
@@ -54,7 +56,10 @@ def undul_phot_pySRU(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANG
     Y = (D / np.cos(THETA)) * np.sin(THETA) * np.sin(PHI)
 
     for ie,e in enumerate(photon_energy):
-        print("Calculating energy %g eV (%d of %d)"%(e,ie+1,photon_energy.size))
+        if progress_callback is None:
+            print("Calculating energy %g eV (%d of %d)"%(e,ie+1,photon_energy.size))
+        else:
+            progress_callback(ie, photon_energy.size, e)
         simulation_test = create_simulation(magnetic_structure=myundulator,electron_beam=myelectronbeam,
                                             magnetic_field=None, photon_energy=e,
                                             traj_method=TRAJECTORY_METHOD_ANALYTIC,Nb_pts_trajectory=None,
@@ -101,7 +106,8 @@ def calculate_undulator_emission_pySRU(
                      MAXANGLE                     = 0.1,
                      number_of_points             = 100,
                      NG_P                         = 100,
-                     number_of_trajectory_points  = 100):
+                     number_of_trajectory_points  = 100,
+                     progress_callback            = None):
     #(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_T,NG_P)
     return undul_phot_pySRU(
                         electron_energy,
@@ -116,4 +122,5 @@ def calculate_undulator_emission_pySRU(
                         number_of_points,
                         NG_P,
                         # number_of_trajectory_points=number_of_trajectory_points,
+                        progress_callback=progress_callback,
                         )
\ No newline at end of file
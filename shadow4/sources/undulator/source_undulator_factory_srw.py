@@ -185,7 +185,9 @@ def _srw_interpol(x,y,z,x1,y1):
         z1 = tck(x1,y1)
         return z1
 
-def undul_phot_SRW(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_T,NG_P):
+def undul_phot_SRW(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_T,NG_P,progress_callback=None):
+    # progress_callback: a function f(i_energy, n_energies, photon_energy) called after the interpolation of each
+    #                    energy on the polar grid (SRW calculates all the energies at once)
 
     lambdau = LAMBDAU
     k = K
@@ -323,6 +325,7 @@ def undul_phot_SRW(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE
 
           Z2[ie,itheta,iphi] = tmp
           POL_DEG[ie,itheta,iphi] = tck_pol_deg(X,Y)
+      if progress_callback is not None: progress_callback(ie, e.size, e[ie])
 
     # !C SHADOW defines the degree of polarization by |E| instead of |E|^2
     # !C i.e.  P = |Ex|/(|Ex|+|Ey|)   instead of   |Ex|^2/(|Ex|^2+|Ey|^2)
@@ -344,7 +347,8 @@ def calculate_undulator_emission_SRW(
                      MAXANGLE                     = 0.1,
                      number_of_points             = 100,
                      NG_P                         = 100,
-                     number_of_trajectory_points  = 100):
+                     number_of_trajectory_points  = 100,
+                     progress_callback            = None):
     # (E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_T,NG_P)
     return undul_phot_SRW(
                         electron_energy,
@@ -359,5 +363,6 @@ def calculate_undulator_emission_SRW(
                         number_of_points,
                         NG_P,
                         # number_of_trajectory_points=number_of_trajectory_points,
+                        progress_callback=progress_callback,
                         )
 
@@ -23,6 +23,7 @@ import scipy.constants as codata
 
 from shadow4.sources.s4_electron_beam import S4ElectronBeam
 from shadow4.sources.s4_light_source import S4LightSource
+from shadow4.sources.s4_electron_beam_sampling import sample_electron_beam_at_distance
 from shadow4.sources.wiggler.s4_wiggler import S4Wiggler
 from shadow4.beam.s4_beam import S4Beam
 
@@ -91,6 +92,49 @@ def sync_f_sigma_and_pi(rAngle, rEnergy):
     efe_pi = rAngle * scipy.special.kv(1.0 / 3.0, ji) / numpy.sqrt(1.0 + rAngle ** 2) * (1.0 + rAngle ** 2)
     return efe_sigma**2,efe_pi**2
 
+def _sample_vertical_angles(reduced_energy, angle, gamma, random_generator, points_per_decade=50):
+    # samples the vertical angles (and the degree of polarization at these angles) for photons of given reduced
+    # energies (energy / critical energy). The cdfs of the angular distribution are tabulated (2D table, reduced
+    # energy x angle) on a logarithmic grid of reduced energies, and each ray uses one of the two nearest grid rows,
+    # chosen with probability given by the distance in log(reduced energy) (i.e., the pdfs are interpolated).
+    # The inverse of the cdfs is calculated for all the rays in one interpolation, by stacking the rows.
+    nrays = reduced_energy.size
+    reduced_energy = numpy.minimum(reduced_energy, 1e3) # above, the emission underflows to zero at all angles
+
+    log_min = numpy.log10(reduced_energy.min())
+    log_max = numpy.log10(reduced_energy.max())
+    npoints = 1 if log_max == log_min else max(2, int(numpy.ceil((log_max - log_min) * points_per_decade)) + 1)
+    grid = numpy.logspace(log_min, log_max, npoints)
+
+    fm_s, fm_p = sync_f_sigma_and_pi(angle[numpy.newaxis, :] * gamma, grid[:, numpy.newaxis])
+    fm = fm_s + fm_p
+    fm_pol = numpy.zeros_like(fm)
+    numpy.divide(fm_s, fm, out=fm_pol, where=fm != 0.0)
+
+    # cdfs as in Sampler1D
+    cdf = numpy.cumsum(fm, axis=1)
+    cdf -= cdf[:, 0:1]
+    constant = fm.max(axis=1) == fm.min(axis=1) # cannot compute divergence: angle 0
+    cdf[constant, :] = numpy.linspace(0.0, 1.0, angle.size)
+    cdf /= cdf[:, -1:]
+
+    if npoints == 1:
+        row = numpy.zeros(nrays, dtype=int)
+    else:
+        u = (numpy.log10(reduced_energy) - log_min) / (log_max - log_min) * (npoints - 1)
+        row = numpy.floor(u).astype(int)
+        row += random_generator.random(nrays) < (u - row)
+        row = numpy.clip(row, 0, npoints - 1)
+
+    rows = numpy.arange(npoints)[:, numpy.newaxis]
+    theta = numpy.interp(random_generator.random(nrays) + 2 * row, (cdf + 2 * rows).ravel(), numpy.tile(angle, npoints))
+    theta[constant[row]] = 0.0
+
+    width = 2 * (angle.max() - angle.min()) + 1.0
+    pol_deg = numpy.interp(theta + width * row, (angle + width * rows).ravel(), fm_pol.ravel())
+
+    return theta, pol_deg
+
 
 class S4WigglerLightSource(S4LightSource):
 
@@ -111,47 +155,81 @@ class S4WigglerLightSource(S4LightSource):
         self.__result_trajectory = None
         self.__result_parameters = None
         self.__result_cdf = None
+        self._radiation_cache = None
 
 
     def get_trajectory(self):
         return self.__result_trajectory, self.__result_parameters
 
 
+    def set_radiation_cache(self, radiation_cache=None):
+        """
+        Sets a persistent cache for the trajectory and the cdf (see shadow4.sources.s4_radiation_cache).
+
+        Parameters
+        ----------
+        radiation_cache : instance of S4RadiationCache, optional
+            The cache (None: no cache, calculate always).
+
+        """
+        self._radiation_cache = radiation_cache
+
+    def get_radiation_cache(self):
+        return getattr(self, "_radiation_cache", None)
+
     def __calculate_radiation(self):
 
         wiggler = self.get_magnetic_structure()
         electron_beam = self.get_electron_beam()
 
         if wiggler._magnetic_field_periodic == 1:
-
-            (traj, pars) = wiggler_trajectory(b_from=0,
-                                                     inData="",
-                                                     nPer=wiggler.number_of_periods(),
-                                                     nTrajPoints=wiggler._NG_J,
-                                                     ener_gev=electron_beam._energy_in_GeV,
-                                                     per=wiggler.period_length(),
-                                                     kValue=wiggler.K_vertical(),
-                                                     trajFile="",
-                                                     shift_x_flag=wiggler._shift_x_flag,
-                                                     shift_x_value=wiggler._shift_x_value,
-                                                     shift_betax_flag=wiggler._shift_betax_flag,
-                                                     shift_betax_value=wiggler._shift_betax_value, )
+            trajectory_kwargs = dict(b_from=0,
+                                     inData="",
+                                     nPer=wiggler.number_of_periods(),
+                                     nTrajPoints=wiggler._NG_J,
+                                     ener_gev=electron_beam._energy_in_GeV,
+                                     per=wiggler.period_length(),
+                                     kValue=wiggler.K_vertical(),
+                                     trajFile="",
+                                     shift_x_flag=wiggler._shift_x_flag,
+                                     shift_x_value=wiggler._shift_x_value,
+                                     shift_betax_flag=wiggler._shift_betax_flag,
+                                     shift_betax_value=wiggler._shift_betax_value, )
 
         elif wiggler._magnetic_field_periodic == 0:
+            trajectory_kwargs = dict(b_from=1,
+                                     inData=wiggler._file_with_magnetic_field,
+                                     nPer=1,
+                                     nTrajPoints=wiggler._NG_J,
+                                     ener_gev=electron_beam._energy_in_GeV,
+                                     # per=self.syned_wiggler.period_length(),
+                                     # kValue=self.syned_wiggler.K_vertical(),
+                                     trajFile="",
+                                     shift_x_flag       = wiggler._shift_x_flag     ,
+                                     shift_x_value      = wiggler._shift_x_value    ,
+                                     shift_betax_flag   = wiggler._shift_betax_flag ,
+                                     shift_betax_value  = wiggler._shift_betax_value,)
+
+        cdf_kwargs = dict(enerMin=wiggler._EMIN,
+                          enerMax=wiggler._EMAX,
+                          enerPoints=wiggler._NG_E,
+                          outFile="tmp.cdf",
+                          elliptical=False)
 
-            (traj, pars) = wiggler_trajectory(b_from=1,
-                                                     inData=wiggler._file_with_magnetic_field,
-                                                     nPer=1,
-                                                     nTrajPoints=wiggler._NG_J,
-                                                     ener_gev=electron_beam._energy_in_GeV,
-                                                     # per=self.syned_wiggler.period_length(),
-                                                     # kValue=self.syned_wiggler.K_vertical(),
-                                                     trajFile="",
-                                                     shift_x_flag       = wiggler._shift_x_flag     ,
-                                                     shift_x_value      = wiggler._shift_x_value    ,
-                                                     shift_betax_flag   = wiggler._shift_betax_flag ,
-                                                     shift_betax_value  = wiggler._shift_betax_value,)
-
+        # the persistent cache, if any
+        radiation_cache = self.get_radiation_cache()
+        if radiation_cache is not None:
+            # (the cdf output file is rewritten at each calculation, its modification time must not change the key)
+            key = radiation_cache.get_key("wiggler_trajectory_and_cdf", trajectory_kwargs,
+                                          dict(cdf_kwargs, outFile=""))
+            cached = radiation_cache.get(key)
+            if cached is not None:
+                self.__result_trajectory = cached["trajectory"]
+                self.__result_parameters = cached["parameters"]
+                self.__result_cdf = cached["cdf"]
+                return
+
+        (traj, pars) = wiggler_trajectory(**trajectory_kwargs)
 
         self.__result_trajectory = traj
         self.__result_parameters = pars
@@ -178,22 +256,25 @@ class S4WigglerLightSource(S4LightSource):
         # calculate cdf and write file for Shadow/Source
         #
 
-        self.__result_cdf = wiggler_cdf(self.__result_trajectory,
-                                        enerMin=wiggler._EMIN,
-                                        enerMax=wiggler._EMAX,
-                                        enerPoints=wiggler._NG_E,
-                                        outFile="tmp.cdf",
-                                        elliptical=False)
+        self.__result_cdf = wiggler_cdf(self.__result_trajectory, **cdf_kwargs)
+
+        if radiation_cache is not None:
+            radiation_cache.put(key, {"trajectory": self.__result_trajectory,
+                                      "parameters": self.__result_parameters,
+                                      "cdf": self.__result_cdf})
 
 
     def __calculate_rays(self,user_unit_to_m=1.0,F_COHER=0,EPSI_DX=0.0,EPSI_DZ=0.0,
                        psi_interval_in_units_one_over_gamma=None,
                        psi_interval_number_of_points=1001,
+                       method=0,
                        verbose=True):
         """
         compute the rays in SHADOW matrix (shape (npoints,18) )
         :param F_COHER: set this flag for coherent beam
         :param user_unit_to_m: default 1.0 (m)
+        :param method: 0=vectorized (all the rays at once, the vertical angles are sampled from a table of cdfs
+                       versus the reduced photon energy), 1=loop over rays (reference)
         :return: rays, a numpy.array((npoits,18))
         """
 
@@ -217,8 +298,7 @@ class S4WigglerLightSource(S4LightSource):
         if verbose:
             print(">>> sampled sampled_photon_energy,sampled_theta,sampled_phi:  ",sampled_photon_energy,sampled_theta,sampled_phi)
 
-        if self.get_seed() != 0:
-            numpy.random.seed(self.get_seed())
+        rng = self.get_random_generator()
 
 
         sigmas = syned_electron_beam.get_sigmas_all()
@@ -237,9 +317,9 @@ class S4WigglerLightSource(S4LightSource):
                 wiggler._FLAG_EMITTANCE = False
 
         if wiggler._FLAG_EMITTANCE:
-            x_electron = numpy.random.normal(loc=0.0,scale=sigmas[0],size=NRAYS)
+            x_electron = rng.normal(loc=0.0,scale=sigmas[0],size=NRAYS)
             y_electron = 0.0
-            z_electron = numpy.random.normal(loc=0.0,scale=sigmas[2],size=NRAYS)
+            z_electron = rng.normal(loc=0.0,scale=sigmas[2],size=NRAYS)
         else:
             x_electron = 0.0
             y_electron = 0.0
@@ -318,7 +398,10 @@ class S4WigglerLightSource(S4LightSource):
         ws_flux_per_ev = ws_f / (ws_ev*1e-3)
         samplerE = Sampler1D(ws_flux_per_ev,ws_ev)
 
-        sampled_energies,h,h_center = samplerE.get_n_sampled_points_and_histogram(NRAYS)
+        if method == 0: # inverse of the cdf, for all the rays at once
+            sampled_energies = numpy.interp(rng.random(NRAYS), samplerE.cdf(), samplerE.cdf_abscissas())
+        else:
+            sampled_energies,h,h_center = samplerE.get_sampled_and_histogram(rng.random(NRAYS))
 
 
         ###############################################
@@ -378,331 +461,349 @@ class S4WigglerLightSource(S4LightSource):
 
 
 
-        for itik in range(NRAYS):
-
-            #     ARG_Y = GRID(2,ITIK)
-            #     CALL SPL_INT (SEED_Y, NP_SY,   ARG_Y,  Y_TRAJ,    IER)
-            arg_y = numpy.random.random() # ARG_Y[itik]
-            Y_TRAJ = SEED_Y(arg_y)
-
-
-            #     ! srio@esrf.eu 2014-05-19
-            #     ! in wiggler some problems arise because spl_int
-            #     ! does not return a Y value in the correct range.
-            #     ! In those cases, we make a linear interpolation instead.
-            #     if ((y_traj.le.y_temp(1)).or.(y_traj.gt.y_temp(NP_SY))) then
-            #         y_traj_old = y_traj
-            #         CALL LIN_INT (SEED_Y, NP_SY,   ARG_Y,  Y_TRAJ,    IER)
-            #         print*,'SOURCESYNC: bad y_traj from SPL_INT, corrected with LIN_SPL: ',y_traj_old,'=>',y_traj
-            #     endif
-            #
-            #     CALL SPL_INT (Y_X,    NP_TRAJ, Y_TRAJ, X_TRAJ,    IER)
-            #     CALL SPL_INT (Y_XPRI, NP_TRAJ, Y_TRAJ, ANGLE,     IER)
-            #     CALL SPL_INT (Y_CURV, NP_TRAJ, Y_TRAJ, CURV,      IER)
-            #     CALL SPL_INT (Y_PATH, NP_TRAJ, Y_TRAJ, EPSI_PATH, IER)
-            # END IF
-
+        if method == 0: # vectorized: all the rays at once
+            Y_TRAJ = SEED_Y(rng.random(NRAYS))
             X_TRAJ = Y_X(Y_TRAJ)
             ANGLE = Y_XPRI(Y_TRAJ)
             CURV = Y_CURV(Y_TRAJ)
-            EPSI_PATH = Y_PATH(Y_TRAJ)
-
-            # print("\n>>><<<",arg_y,Y_TRAJ,X_TRAJ,ANGLE,CURV,EPSI_PATH)
-
-
-            # EPSI_PATH = EPSI_PATH - PATH0 ! now refer to wiggler's origin
-            # IF (CURV.LT.0) THEN
-            #     POL_ANGLE = 90.0D0  ! instant orbit is CW
-            # ELSE
-            #     POL_ANGLE = -90.0D0  !     CCW
-            # END IF
-            # IF (CURV.EQ.0) THEN
-            #     R_MAGNET = 1.0D+20
-            # ELSE
-            #     R_MAGNET = ABS(1.0D0/CURV)
-            # END IF
-            # POL_ANGLE  = TORAD*POL_ANGLE
-
-            EPSI_PATH = EPSI_PATH - PATH0 # now refer to wiggler's origin
-            if CURV < 0:
-                POL_ANGLE = 90.0 # instant orbit is CW
-            else:
-                POL_ANGLE = -90.0 # CCW
-
-            if CURV == 0.0:
-                R_MAGNET = 1.0e20
-            else:
-                R_MAGNET = numpy.abs(1.0/CURV)
+            EPSI_PATH = Y_PATH(Y_TRAJ) - PATH0 # now refer to wiggler's origin
 
-            POL_ANGLE  = POL_ANGLE * numpy.pi / 180.0
+            with numpy.errstate(divide='ignore'):
+                R_MAGNET = numpy.where(CURV == 0.0, 1.0e20, numpy.abs(1.0 / CURV))
 
-            # ! C
-            # ! C Compute the actual distance (EPSI_W*) from the orbital focus
-            # ! C
             EPSI_WX = EPSI_DX + EPSI_PATH
             EPSI_WZ = EPSI_DZ + EPSI_PATH
 
+            if wiggler._FLAG_EMITTANCE: # see the comments in the loop below
+                sigmaX, sigmaXp, sigmaZ, sigmaZp = syned_electron_beam.get_sigmas_all()
+                XXX, E_BEAM1 = sample_electron_beam_at_distance(sigmaX, sigmaXp, EPSI_WX, rng, position_at_distance=False)
+                ZZZ, E_BEAM3 = sample_electron_beam_at_distance(sigmaZ, sigmaZp, EPSI_WZ, rng, position_at_distance=False)
+            else:
+                XXX = E_BEAM1 = ZZZ = E_BEAM3 = numpy.zeros(NRAYS)
 
-            # ! BUG srio@esrf.eu found that these routine does not make the
-            # ! calculation correctly. Changed to new one BINORMAL
-            # !CALL GAUSS (SIGMAX, EPSI_X, EPSI_WX, XXX, E_BEAM(1), istar1)
-            # !CALL GAUSS (SIGMAZ, EPSI_Z, EPSI_WZ, ZZZ, E_BEAM(3), istar1)
-            # !
-            # ! calculation of the electrom beam moments at the current position
-            # ! (sX,sZ) = (epsi_wx,epsi_ez):
-            # ! <x2> = sX^2 + sigmaX^2
-            # ! <x x'> = sX sigmaXp^2
-            # ! <x'2> = sigmaXp^2                 (same for Z)
-            #
-            # ! then calculate the new recalculated sigmas (rSigmas) and correlation rho of the
-            # ! normal bivariate distribution at the point in the electron trajectory
-            # ! rsigmaX  = sqrt(<x2>)
-            # ! rsigmaXp = sqrt(<x'2>)
-            # ! rhoX =  <x x'>/ (rsigmaX rsigmaXp)      (same for Z)
-            #
-            # if (abs(sigmaX) .lt. 1e-15) then  !no emittance
-            #     sigmaXp = 0.0d0
-            #     XXX = 0.0
-            #     E_BEAM(1) = 0.0
-            # else
-            #     sigmaXp = epsi_Xold/sigmaX    ! true only at waist, use epsi_xOld as it has been redefined :(
-            #     rSigmaX = sqrt( (epsi_wX**2) * (sigmaXp**2) + sigmaX**2 )
-            #     rSigmaXp = sigmaXp
-            #     if (abs(rSigmaX*rSigmaXp) .lt. 1e-15) then  !no emittance
-            #         rhoX = 0.0
-            #     else
-            #         rhoX = epsi_wx * sigmaXp**2 / (rSigmaX * rSigmaXp)
-            #     endif
-            #
-            #     CALL BINORMAL (rSigmaX, rSigmaXp, rhoX, XXX, E_BEAM(1), istar1)
-            # endif
-            #
-
-            if wiggler._FLAG_EMITTANCE:
-                #     CALL BINORMAL (rSigmaX, rSigmaXp, rhoX, XXX, E_BEAM(1), istar1)
-                #     [  c11  c12  ]     [  sigma1^2           rho*sigma1*sigma2   ]
-                #     [  c21  c22  ]  =  [  rho*sigma1*sigma2  sigma2^2            ]
-                sigmaX,sigmaXp,sigmaZ,sigmaZp = syned_electron_beam.get_sigmas_all()
-
-                rSigmaX = numpy.sqrt( (EPSI_WX**2) * (sigmaXp**2) + sigmaX**2 )
-                rSigmaXp = sigmaXp
-                rhoX = EPSI_WX * sigmaXp**2 / (rSigmaX * rSigmaXp)
-                mean = [0, 0]
-                cov = [[sigmaX**2, rhoX*sigmaX*sigmaXp], [rhoX*sigmaX*sigmaXp, sigmaXp**2]]  # diagonal covariance
-                sampled_x, sampled_xp = numpy.random.multivariate_normal(mean, cov, 1).T
-                XXX = sampled_x
-                E_BEAM1 = sampled_xp
-
-                rSigmaZ = numpy.sqrt( (EPSI_WZ**2) * (sigmaZp**2) + sigmaZ**2 )
-                rSigmaZp = sigmaZp
-                rhoZ = EPSI_WZ * sigmaZp**2 / (rSigmaZ * rSigmaZp)
-                mean = [0, 0]
-                cov = [[sigmaZ**2, rhoZ*sigmaZ*sigmaZp], [rhoZ*sigmaZ*sigmaZp, sigmaZp**2]]  # diagonal covariance
-                sampled_z, sampled_zp = numpy.random.multivariate_normal(mean, cov, 1).T
-                ZZZ = sampled_z
-                E_BEAM3 = sampled_zp
+            rays[:,0] = X_TRAJ + XXX * numpy.cos(ANGLE)
+            rays[:,1] = Y_TRAJ - XXX * numpy.sin(ANGLE)
+            rays[:,2] = ZZZ
 
-            else:
-                XXX = 0.0
-                E_BEAM1 = 0.0
-                ZZZ = 0.0
-                E_BEAM3 = 0.0
-
-            #
-            # ! C
-            # ! C For normal wiggler, XXX is perpendicular to the electron trajectory at
-            # ! C the point defined by (X_TRAJ,Y_TRAJ,0).
-            # ! C
-            # IF (F_WIGGLER.EQ.1) THEN   ! normal wiggler
-            #     YYY = Y_TRAJ - XXX*SIN(ANGLE)
-            #     XXX = X_TRAJ + XXX*COS(ANGLE)
-
-            YYY = Y_TRAJ - XXX * numpy.sin(ANGLE)
-            XXX = X_TRAJ + XXX * numpy.cos(ANGLE)
-
-            rays[itik,0] = XXX
-            rays[itik,1] = YYY
-            rays[itik,2] = ZZZ
-
-            #
-            # directions
-            #
-
-            #     ! C
-            #     ! C Synchrotron source
-            #     ! C Note. The angle of emission IN PLANE is the same as the one used
-            #     ! C before. This will give rise to a source curved along the orbit.
-            #     ! C The elevation angle is instead characteristic of the SR distribution.
-            #     ! C The electron beam emittance is included at this stage. Note that if
-            #     ! C EPSI = 0, we'll have E_BEAM = 0.0, with no changes.
-            #     ! C
-            #     IF (F_WIGGLER.EQ.3) ANGLE=0        ! Elliptical Wiggler.
-            #     ANGLEX =   ANGLE + E_BEAM(1)
-            #     DIREC(1)  =   TAN(ANGLEX)
-            #     IF (R_ALADDIN.LT.0.0D0) DIREC(1) = - DIREC(1)
-            #     DIREC(2)  =   1.0D0
-            #     ARG_ANG  =   GRID(6,ITIK)
+            critical_energy = TOANGS * 3.0 * numpy.power(gamma, 3) / 4.0 / numpy.pi / 1.0e10 * (1.0 / R_MAGNET)
+            sampled_theta, sampled_pol_deg = _sample_vertical_angles(sampled_energies / critical_energy,
+                                                                     a * 1e-3, gamma, rng)
 
             ANGLEX = ANGLE + E_BEAM1
-            DIREC1 = numpy.tan(ANGLEX)
-            DIREC2 = 1.0
-
-
-            #     ! C
-            #     ! C In the case of SR, we take into account the fact that the electron
-            #     ! C trajectory is not orthogonal to the field. This will give a correction
-            #     ! C to the photon energy.  We can write it as a correction to the
-            #     ! C magnetic field strength; this will linearly shift the critical energy
-            #     ! C and, with it, the energy of the emitted photon.
-            #     ! C
-            #     E_TEMP(3) =   TAN(E_BEAM(3))/COS(E_BEAM(1))
-            #     E_TEMP(2) =   1.0D0
-            #     E_TEMP(1) =   TAN(E_BEAM(1))
-            #     CALL NORM (E_TEMP,E_TEMP)
-            #     CORREC =   SQRT(1.0D0-E_TEMP(3)**2)
-            #     4400 CONTINUE
-
-            E_TEMP3 = numpy.tan(E_BEAM3)/numpy.cos(E_BEAM1)
-            E_TEMP2 = 1.0
-            E_TEMP1 = numpy.tan(E_BEAM1)
-
-            e_temp_norm = numpy.sqrt( E_TEMP1**2 + E_TEMP2**2 + E_TEMP3**2)
-
-            E_TEMP3 /= e_temp_norm
-            E_TEMP2 /= e_temp_norm
-            E_TEMP1 /= e_temp_norm
-
-
-            CORREC = numpy.sqrt(1.0 - E_TEMP3**2)
-
-
-            #     IF (FDISTR.EQ.6) THEN
-            #         CALL ALADDIN1 (ARG_ANG,ANGLEV,F_POL,IER)
-            #         Q_WAVE =   TWOPI*PHOTON(1)/TOCM*CORREC
-            #         POL_DEG =   ARG_ANG
-            #     ELSE IF (FDISTR.EQ.4) THEN
-            #         ARG_ENER =   WRAN (ISTAR1)
-            #         RAD_MIN =   ABS(R_MAGNET)
-            #
-            #         i1 = 1
-            #         CALL WHITE  &
-            #         (RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG,i1)
-            #     END IF
-
-            RAD_MIN = numpy.abs(R_MAGNET)
-
-
-            # CALL WHITE (RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG,i1)
-            ARG_ANG = numpy.random.random()
-            ARG_ENER = numpy.random.random()
-
-
-            # print("   >> R_MAGNET, DIREC",R_MAGNET,DIREC1,DIREC2)
-            # print("   >> RAD_MIN,CORREC,ARG_ENER,ARG_ANG,",RAD_MIN,CORREC,ARG_ENER,ARG_ANG)
-
-#######################################################################
-            # gamma = self.syned_electron_beam.gamma()
-            # m2ev = codata.c * codata.h / codata.e
-            # TOANGS = m2ev * 1e10
-            # critical_energy = TOANGS*3.0*numpy.power(gamma,3)/4.0/numpy.pi/1.0e10*(1.0/RAD_MIN)
-
-            # sampled_photon_energy = sampled_energies[itik]
-            # wavelength = codata.h * codata.c / codata.e /sampled_photon_energy
-            # Q_WAVE = 2 * numpy.pi / (wavelength*1e2)
-            # print("   >> PHOTON ENERGY, Ec, lambda, Q: ",sampled_photon_energy,critical_energy,wavelength*1e10,Q_WAVE)
-###################################################################################
-            sampled_photon_energy = sampled_energies[itik]
-            # wavelength = codata.h * codata.c / codata.e /sampled_photon_energy
-            critical_energy = TOANGS * 3.0 * numpy.power(gamma, 3) / 4.0 / numpy.pi / 1.0e10 * (1.0 / RAD_MIN)
-            eene = sampled_photon_energy / critical_energy
-
-            # TODO: remove old after testing...
-            method = "new"
-
-            if method == "old":
-                # fm = sync_f(a*1e-3*self.syned_electron_beam.gamma(),eene,polarization=0) * \
-                #     numpy.power(eene,2)*a8*self.syned_electron_beam._current*hdiv_mrad * \
-                #     numpy.power(self.syned_electron_beam._energy_in_GeV,2)
-
-                fm_s = sync_f(a*1e-3*self.syned_electron_beam.gamma(),eene,polarization=1) * \
-                    numpy.power(eene,2)*a8*self.syned_electron_beam._current*hdiv_mrad * \
-                    numpy.power(self.syned_electron_beam._energy_in_GeV,2)
-
-                fm_p = sync_f(a*1e-3*self.syned_electron_beam.gamma(),eene,polarization=2) * \
-                    numpy.power(eene,2)*a8*self.syned_electron_beam._current*hdiv_mrad * \
-                    numpy.power(self.syned_electron_beam._energy_in_GeV,2)
-            else:
+            ANGLEV = sampled_theta + E_BEAM3
+            DIREC = numpy.array([numpy.tan(ANGLEX), numpy.ones(NRAYS), numpy.tan(ANGLEV) / numpy.cos(ANGLEX)]).T
+            rays[:,3:6] = self._norm(DIREC)
+
+        else: # loop over rays (reference)
+            for itik in range(NRAYS):
+
+                #     ARG_Y = GRID(2,ITIK)
+                #     CALL SPL_INT (SEED_Y, NP_SY,   ARG_Y,  Y_TRAJ,    IER)
+                arg_y = rng.random() # ARG_Y[itik]
+                Y_TRAJ = SEED_Y(arg_y)
+
+
+                #     ! srio@esrf.eu 2014-05-19
+                #     ! in wiggler some problems arise because spl_int
+                #     ! does not return a Y value in the correct range.
+                #     ! In those cases, we make a linear interpolation instead.
+                #     if ((y_traj.le.y_temp(1)).or.(y_traj.gt.y_temp(NP_SY))) then
+                #         y_traj_old = y_traj
+                #         CALL LIN_INT (SEED_Y, NP_SY,   ARG_Y,  Y_TRAJ,    IER)
+                #         print*,'SOURCESYNC: bad y_traj from SPL_INT, corrected with LIN_SPL: ',y_traj_old,'=>',y_traj
+                #     endif
+                #
+                #     CALL SPL_INT (Y_X,    NP_TRAJ, Y_TRAJ, X_TRAJ,    IER)
+                #     CALL SPL_INT (Y_XPRI, NP_TRAJ, Y_TRAJ, ANGLE,     IER)
+                #     CALL SPL_INT (Y_CURV, NP_TRAJ, Y_TRAJ, CURV,      IER)
+                #     CALL SPL_INT (Y_PATH, NP_TRAJ, Y_TRAJ, EPSI_PATH, IER)
+                # END IF
+
+                X_TRAJ = Y_X(Y_TRAJ)
+                ANGLE = Y_XPRI(Y_TRAJ)
+                CURV = Y_CURV(Y_TRAJ)
+                EPSI_PATH = Y_PATH(Y_TRAJ)
+
+                # print("\n>>><<<",arg_y,Y_TRAJ,X_TRAJ,ANGLE,CURV,EPSI_PATH)
+
+
+                # EPSI_PATH = EPSI_PATH - PATH0 ! now refer to wiggler's origin
+                # IF (CURV.LT.0) THEN
+                #     POL_ANGLE = 90.0D0  ! instant orbit is CW
+                # ELSE
+                #     POL_ANGLE = -90.0D0  !     CCW
+                # END IF
+                # IF (CURV.EQ.0) THEN
+                #     R_MAGNET = 1.0D+20
+                # ELSE
+                #     R_MAGNET = ABS(1.0D0/CURV)
+                # END IF
+                # POL_ANGLE  = TORAD*POL_ANGLE
+
+                EPSI_PATH = EPSI_PATH - PATH0 # now refer to wiggler's origin
+                if CURV < 0:
+                    POL_ANGLE = 90.0 # instant orbit is CW
+                else:
+                    POL_ANGLE = -90.0 # CCW
+
+                if CURV == 0.0:
+                    R_MAGNET = 1.0e20
+                else:
+                    R_MAGNET = numpy.abs(1.0/CURV)
+
+                POL_ANGLE  = POL_ANGLE * numpy.pi / 180.0
+
+                # ! C
+                # ! C Compute the actual distance (EPSI_W*) from the orbital focus
+                # ! C
+                EPSI_WX = EPSI_DX + EPSI_PATH
+                EPSI_WZ = EPSI_DZ + EPSI_PATH
+
+
+                # ! BUG srio@esrf.eu found that these routine does not make the
+                # ! calculation correctly. Changed to new one BINORMAL
+                # !CALL GAUSS (SIGMAX, EPSI_X, EPSI_WX, XXX, E_BEAM(1), istar1)
+                # !CALL GAUSS (SIGMAZ, EPSI_Z, EPSI_WZ, ZZZ, E_BEAM(3), istar1)
+                # !
+                # ! calculation of the electrom beam moments at the current position
+                # ! (sX,sZ) = (epsi_wx,epsi_ez):
+                # ! <x2> = sX^2 + sigmaX^2
+                # ! <x x'> = sX sigmaXp^2
+                # ! <x'2> = sigmaXp^2                 (same for Z)
+                #
+                # ! then calculate the new recalculated sigmas (rSigmas) and correlation rho of the
+                # ! normal bivariate distribution at the point in the electron trajectory
+                # ! rsigmaX  = sqrt(<x2>)
+                # ! rsigmaXp = sqrt(<x'2>)
+                # ! rhoX =  <x x'>/ (rsigmaX rsigmaXp)      (same for Z)
+                #
+                # if (abs(sigmaX) .lt. 1e-15) then  !no emittance
+                #     sigmaXp = 0.0d0
+                #     XXX = 0.0
+                #     E_BEAM(1) = 0.0
+                # else
+                #     sigmaXp = epsi_Xold/sigmaX    ! true only at waist, use epsi_xOld as it has been redefined :(
+                #     rSigmaX = sqrt( (epsi_wX**2) * (sigmaXp**2) + sigmaX**2 )
+                #     rSigmaXp = sigmaXp
+                #     if (abs(rSigmaX*rSigmaXp) .lt. 1e-15) then  !no emittance
+                #         rhoX = 0.0
+                #     else
+                #         rhoX = epsi_wx * sigmaXp**2 / (rSigmaX * rSigmaXp)
+                #     endif
+                #
+                #     CALL BINORMAL (rSigmaX, rSigmaXp, rhoX, XXX, E_BEAM(1), istar1)
+                # endif
+                #
+
+                if wiggler._FLAG_EMITTANCE:
+                    #     CALL BINORMAL (rSigmaX, rSigmaXp, rhoX, XXX, E_BEAM(1), istar1)
+                    #     [  c11  c12  ]     [  sigma1^2           rho*sigma1*sigma2   ]
+                    #     [  c21  c22  ]  =  [  rho*sigma1*sigma2  sigma2^2            ]
+                    sigmaX,sigmaXp,sigmaZ,sigmaZp = syned_electron_beam.get_sigmas_all()
+
+                    rSigmaX = numpy.sqrt( (EPSI_WX**2) * (sigmaXp**2) + sigmaX**2 )
+                    rSigmaXp = sigmaXp
+                    rhoX = EPSI_WX * sigmaXp**2 / (rSigmaX * rSigmaXp)
+                    mean = [0, 0]
+                    cov = [[sigmaX**2, rhoX*sigmaX*sigmaXp], [rhoX*sigmaX*sigmaXp, sigmaXp**2]]  # diagonal covariance
+                    sampled_x, sampled_xp = rng.multivariate_normal(mean, cov, 1).T
+                    XXX = sampled_x[0]
+                    E_BEAM1 = sampled_xp[0]
+
+                    rSigmaZ = numpy.sqrt( (EPSI_WZ**2) * (sigmaZp**2) + sigmaZ**2 )
+                    rSigmaZp = sigmaZp
+                    rhoZ = EPSI_WZ * sigmaZp**2 / (rSigmaZ * rSigmaZp)
+                    mean = [0, 0]
+                    cov = [[sigmaZ**2, rhoZ*sigmaZ*sigmaZp], [rhoZ*sigmaZ*sigmaZp, sigmaZp**2]]  # diagonal covariance
+                    sampled_z, sampled_zp = rng.multivariate_normal(mean, cov, 1).T
+                    ZZZ = sampled_z[0]
+                    E_BEAM3 = sampled_zp[0]
+
+                else:
+                    XXX = 0.0
+                    E_BEAM1 = 0.0
+                    ZZZ = 0.0
+                    E_BEAM3 = 0.0
+
+                #
+                # ! C
+                # ! C For normal wiggler, XXX is perpendicular to the electron trajectory at
+                # ! C the point defined by (X_TRAJ,Y_TRAJ,0).
+                # ! C
+                # IF (F_WIGGLER.EQ.1) THEN   ! normal wiggler
+                #     YYY = Y_TRAJ - XXX*SIN(ANGLE)
+                #     XXX = X_TRAJ + XXX*COS(ANGLE)
+
+                YYY = Y_TRAJ - XXX * numpy.sin(ANGLE)
+                XXX = X_TRAJ + XXX * numpy.cos(ANGLE)
+
+                rays[itik,0] = XXX
+                rays[itik,1] = YYY
+                rays[itik,2] = ZZZ
+
+                #
+                # directions
+                #
+
+                #     ! C
+                #     ! C Synchrotron source
+                #     ! C Note. The angle of emission IN PLANE is the same as the one used
+                #     ! C before. This will give rise to a source curved along the orbit.
+                #     ! C The elevation angle is instead characteristic of the SR distribution.
+                #     ! C The electron beam emittance is included at this stage. Note that if
+                #     ! C EPSI = 0, we'll have E_BEAM = 0.0, with no changes.
+                #     ! C
+                #     IF (F_WIGGLER.EQ.3) ANGLE=0        ! Elliptical Wiggler.
+                #     ANGLEX =   ANGLE + E_BEAM(1)
+                #     DIREC(1)  =   TAN(ANGLEX)
+                #     IF (R_ALADDIN.LT.0.0D0) DIREC(1) = - DIREC(1)
+                #     DIREC(2)  =   1.0D0
+                #     ARG_ANG  =   GRID(6,ITIK)
+
+                ANGLEX = ANGLE + E_BEAM1
+                DIREC1 = numpy.tan(ANGLEX)
+                DIREC2 = 1.0
+
+
+                #     ! C
+                #     ! C In the case of SR, we take into account the fact that the electron
+                #     ! C trajectory is not orthogonal to the field. This will give a correction
+                #     ! C to the photon energy.  We can write it as a correction to the
+                #     ! C magnetic field strength; this will linearly shift the critical energy
+                #     ! C and, with it, the energy of the emitted photon.
+                #     ! C
+                #     E_TEMP(3) =   TAN(E_BEAM(3))/COS(E_BEAM(1))
+                #     E_TEMP(2) =   1.0D0
+                #     E_TEMP(1) =   TAN(E_BEAM(1))
+                #     CALL NORM (E_TEMP,E_TEMP)
+                #     CORREC =   SQRT(1.0D0-E_TEMP(3)**2)
+                #     4400 CONTINUE
+
+                E_TEMP3 = numpy.tan(E_BEAM3)/numpy.cos(E_BEAM1)
+                E_TEMP2 = 1.0
+                E_TEMP1 = numpy.tan(E_BEAM1)
+
+                e_temp_norm = numpy.sqrt( E_TEMP1**2 + E_TEMP2**2 + E_TEMP3**2)
+
+                E_TEMP3 /= e_temp_norm
+                E_TEMP2 /= e_temp_norm
+                E_TEMP1 /= e_temp_norm
+
+
+                CORREC = numpy.sqrt(1.0 - E_TEMP3**2)
+
+
+                #     IF (FDISTR.EQ.6) THEN
+                #         CALL ALADDIN1 (ARG_ANG,ANGLEV,F_POL,IER)
+                #         Q_WAVE =   TWOPI*PHOTON(1)/TOCM*CORREC
+                #         POL_DEG =   ARG_ANG
+                #     ELSE IF (FDISTR.EQ.4) THEN
+                #         ARG_ENER =   WRAN (ISTAR1)
+                #         RAD_MIN =   ABS(R_MAGNET)
+                #
+                #         i1 = 1
+                #         CALL WHITE  &
+                #         (RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG,i1)
+                #     END IF
+
+                RAD_MIN = numpy.abs(R_MAGNET)
+
+
+                # CALL WHITE (RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG,i1)
+                ARG_ANG = rng.random()
+                ARG_ENER = rng.random()
+
+
+                # print("   >> R_MAGNET, DIREC",R_MAGNET,DIREC1,DIREC2)
+                # print("   >> RAD_MIN,CORREC,ARG_ENER,ARG_ANG,",RAD_MIN,CORREC,ARG_ENER,ARG_ANG)
+
+    #######################################################################
+                # gamma = self.syned_electron_beam.gamma()
+                # m2ev = codata.c * codata.h / codata.e
+                # TOANGS = m2ev * 1e10
+                # critical_energy = TOANGS*3.0*numpy.power(gamma,3)/4.0/numpy.pi/1.0e10*(1.0/RAD_MIN)
+
+                # sampled_photon_energy = sampled_energies[itik]
+                # wavelength = codata.h * codata.c / codata.e /sampled_photon_energy
+                # Q_WAVE = 2 * numpy.pi / (wavelength*1e2)
+                # print("   >> PHOTON ENERGY, Ec, lambda, Q: ",sampled_photon_energy,critical_energy,wavelength*1e10,Q_WAVE)
+    ###################################################################################
+                sampled_photon_energy = sampled_energies[itik]
+                # wavelength = codata.h * codata.c / codata.e /sampled_photon_energy
+                critical_energy = TOANGS * 3.0 * numpy.power(gamma, 3) / 4.0 / numpy.pi / 1.0e10 * (1.0 / RAD_MIN)
+                eene = sampled_photon_energy / critical_energy
+
                 fm_s , fm_p = sync_f_sigma_and_pi(a*1e-3*syned_electron_beam.gamma(),eene)
                 cte = eene ** 2 * a8 * syned_electron_beam._current * hdiv_mrad * syned_electron_beam._energy_in_GeV ** 2
                 fm_s *= cte
                 fm_p *= cte
 
-            fm = fm_s + fm_p
+                fm = fm_s + fm_p
 
-            fm_pol = numpy.zeros_like(fm)
-            for i in range(fm_pol.size):
-                if fm[i] == 0.0:
-                    fm_pol[i] = 0
-                else:
-                    fm_pol[i] = fm_s[i] / fm[i]
+                fm_pol = numpy.zeros_like(fm)
+                for i in range(fm_pol.size):
+                    if fm[i] == 0.0:
+                        fm_pol[i] = 0
+                    else:
+                        fm_pol[i] = fm_s[i] / fm[i]
 
-            fm.shape = -1
-            fm_s.shape = -1
-            fm_pol.shape = -1
+                fm.shape = -1
+                fm_s.shape = -1
+                fm_pol.shape = -1
 
 
-            pol_deg_interpolator = interp1d(a*1e-3,fm_pol)
+                pol_deg_interpolator = interp1d(a*1e-3,fm_pol)
 
-            samplerAng = Sampler1D(fm,a*1e-3)
+                samplerAng = Sampler1D(fm,a*1e-3)
 
-            # samplerPol = Sampler1D(fm_s/fm,a*1e-3)
+                # samplerPol = Sampler1D(fm_s/fm,a*1e-3)
 
-            # plot(a*1e-3,fm_s/fm)
+                # plot(a*1e-3,fm_s/fm)
 
-            if fm.min() == fm.max():
-                print("Warning: cannot compute divergence for ray index %d"%itik)
-                sampled_theta = 0.0
-            else:
-                sampled_theta = samplerAng.get_sampled(ARG_ENER)
-
-            sampled_pol_deg = pol_deg_interpolator(sampled_theta)
-
-
-            # print("sampled_theta: ",sampled_theta, "sampled_energy: ",sampled_photon_energy, "sampled pol ",sampled_pol_deg)
-
-            ANGLEV = sampled_theta
-            ANGLEV += E_BEAM3
-            #     IF (ANGLEV.LT.0.0) I_CHANGE = -1
-            #     ANGLEV =   ANGLEV + E_BEAM(3)
-            #     ! C
-            #     ! C Test if the ray is within the specified limits
-            #     ! C
-            #     IF (FGRID.EQ.0.OR.FGRID.EQ.2) THEN
-            #         IF (ANGLEV.GT.VDIV1.OR.ANGLEV.LT.-VDIV2) THEN
-            #             ARG_ANG = WRAN(ISTAR1)
-            #             ! C
-            #             ! C If it is outside the range, then generate another ray.
-            #             ! C
-            #             GO TO 4400
-            #         END IF
-            #     END IF
-            #     DIREC(3)  =   TAN(ANGLEV)/COS(ANGLEX)
-
-            DIREC3 = numpy.tan(ANGLEV) / numpy.cos(ANGLEX)
-            #     IF (F_WIGGLER.EQ.3) THEN
-            #         CALL ROTATE (DIREC, ANGLE3,ANGLE2,ANGLE1,DIREC)
-            #     END IF
-            #     CALL NORM (DIREC,DIREC)
-
-            direc_norm = numpy.sqrt(DIREC1**2 + DIREC2**2 + DIREC3**2)
-
-            DIREC1 /= direc_norm
-            DIREC2 /= direc_norm
-            DIREC3 /= direc_norm
-
-            rays[itik,3] = DIREC1 # VX
-            rays[itik,4] = DIREC2 # VY
-            rays[itik,5] = DIREC3 # VZ
+                if fm.min() == fm.max():
+                    print("Warning: cannot compute divergence for ray index %d"%itik)
+                    sampled_theta = 0.0
+                else:
+                    sampled_theta = samplerAng.get_sampled(ARG_ENER)
+
+                sampled_pol_deg = pol_deg_interpolator(sampled_theta)
+
+
+                # print("sampled_theta: ",sampled_theta, "sampled_energy: ",sampled_photon_energy, "sampled pol ",sampled_pol_deg)
+
+                ANGLEV = sampled_theta
+                ANGLEV += E_BEAM3
+                #     IF (ANGLEV.LT.0.0) I_CHANGE = -1
+                #     ANGLEV =   ANGLEV + E_BEAM(3)
+                #     ! C
+                #     ! C Test if the ray is within the specified limits
+                #     ! C
+                #     IF (FGRID.EQ.0.OR.FGRID.EQ.2) THEN
+                #         IF (ANGLEV.GT.VDIV1.OR.ANGLEV.LT.-VDIV2) THEN
+                #             ARG_ANG = WRAN(ISTAR1)
+                #             ! C
+                #             ! C If it is outside the range, then generate another ray.
+                #             ! C
+                #             GO TO 4400
+                #         END IF
+                #     END IF
+                #     DIREC(3)  =   TAN(ANGLEV)/COS(ANGLEX)
+
+                DIREC3 = numpy.tan(ANGLEV) / numpy.cos(ANGLEX)
+                #     IF (F_WIGGLER.EQ.3) THEN
+                #         CALL ROTATE (DIREC, ANGLE3,ANGLE2,ANGLE1,DIREC)
+                #     END IF
+                #     CALL NORM (DIREC,DIREC)
+
+                direc_norm = numpy.sqrt(DIREC1**2 + DIREC2**2 + DIREC3**2)
+
+                DIREC1 /= direc_norm
+                DIREC2 /= direc_norm
+                DIREC3 /= direc_norm
+
+                rays[itik,3] = DIREC1 # VX
+                rays[itik,4] = DIREC2 # VY
+                rays[itik,5] = DIREC3 # VZ
 
         if user_unit_to_m != 1.0:
             rays[:,0] /= user_unit_to_m
@@ -784,7 +885,7 @@ class S4WigglerLightSource(S4LightSource):
         if F_COHER == 1:
             PHASEX = 0.0
         else:
-            PHASEX = numpy.random.random(NRAYS) * 2 * numpy.pi
+            PHASEX = rng.random(NRAYS) * 2 * numpy.pi
 
         # PHASEZ = PHASEX + POL_ANGLE * numpy.sign(ANGLEV)
 
@@ -842,8 +943,20 @@ class S4WigglerLightSource(S4LightSource):
     ############################################################################
     #
     ############################################################################
-    def get_beam(self):
+    def get_beam(self, method=0):
+        """
+        Creates the beam of the wiggler light source.
+
+        Parameters
+        ----------
+        method : int, optional
+            0=vectorized ray generation (all the rays at once), 1=loop over rays (reference implementation).
 
+        Returns
+        -------
+        instance of S4Beam
+
+        """
         user_unit_to_m = 1.0
         F_COHER = 0
         EPSI_DX = self.get_magnetic_structure()._EPSI_DX
@@ -859,6 +972,7 @@ class S4WigglerLightSource(S4LightSource):
             EPSI_DZ=EPSI_DZ,
             psi_interval_in_units_one_over_gamma=psi_interval_in_units_one_over_gamma,
             psi_interval_number_of_points=psi_interval_number_of_points,
+            method=method,
             verbose=verbose))
 
     def calculate_spectrum(self, output_file=""):
@@ -0,0 +1,77 @@
+#
+# Profiling primitives, used by the low-level code (beam, optical surfaces, optical elements) to report to the
+# active profiler (a S4BeamlineProfiler, see shadow4.beamline.s4_beamline_profiler):
+#   - the sub-phases of the tracing with "with profile_phase(name):" (transform, intercept, normal, reflectivity,
+#     boundaries, image-plane). Nested phases are included in the outermost one.
+#   - the bytes of the copied beams with profile_copy(nbytes).
+# When no profiler is active, these calls do nothing.
+#
+import contextlib
+
+_ACTIVE_PROFILER = None
+
+def get_active_profiler():
+    """
+    Returns the active profiler (None if there is no active profiler).
+    """
+    return _ACTIVE_PROFILER
+
+def set_active_profiler(profiler):
+    """
+    Sets the active profiler.
+
+    Parameters
+    ----------
+    profiler : instance of S4BeamlineProfiler or None
+        The profiler (None to deactivate the profiling).
+
+    Returns
+    -------
+    instance of S4BeamlineProfiler or None
+        The previous active profiler.
+
+    """
+    global _ACTIVE_PROFILER
+    previous_profiler = _ACTIVE_PROFILER
+    _ACTIVE_PROFILER = profiler
+    return previous_profiler
+
+def profile_phase(name):
+    """
+    Returns a context manager that records a sub-phase of the tracing in the active profiler (it does
+    nothing if there is no active profiler).
+
+    Parameters
+    ----------
+    name : str
+        The phase name (e.g. 'transform', 'intercept', 'normal', 'reflectivity', 'boundaries', 'image-plane').
+
+    """
+    if _ACTIVE_PROFILER is None: return _NULL_CONTEXT
+    return _Phase(_ACTIVE_PROFILER, name)
+
+def profile_copy(nbytes):
+    """
+    Adds the bytes of a copied beam to the active profiler (it does nothing if there is no active profiler).
+
+    Parameters
+    ----------
+    nbytes : int
+        The number of bytes.
+
+    """
+    if _ACTIVE_PROFILER is not None: _ACTIVE_PROFILER.add_copied_bytes(nbytes)
+
+class _Phase(object):
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._profiler._start_phase(self._name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._profiler._end_phase()
+        return False
+
+_NULL_CONTEXT = contextlib.nullcontext()
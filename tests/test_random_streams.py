@@ -0,0 +1,46 @@
+#
+# Random number streams of the light sources (shadow4.sources.s4_random_streams).
+#
+import numpy
+
+from shadow4.sources.source_geometrical.source_gaussian import SourceGaussian
+
+def _get_source(seed=12345):
+    return SourceGaussian.initialize_from_keywords(sigmaX=1e-6, sigmaY=0.0, sigmaZ=1e-6,
+                                                   sigmaXprime=1e-6, sigmaZprime=1e-6, nrays=1000, seed=seed)
+
+def test_real_and_direction_space_are_independent():
+    source = _get_source()
+    x, y, z = source.get_arrays_real_space()
+    xp, zp = source.get_arrays_direction_space()
+    assert not numpy.array_equal(x, xp)
+    assert not numpy.array_equal(z, zp)
+    assert abs(numpy.corrcoef(x, xp)[0, 1]) < 0.2
+
+def test_consecutive_calls_draw_different_numbers():
+    source = _get_source()
+    x1 = source.get_volume_real_space()
+    x2 = source.get_volume_real_space()
+    assert not numpy.array_equal(x1, x2)
+
+def test_set_seed_resets_the_shared_generator():
+    source = _get_source()
+    x1, _, _ = source.get_arrays_real_space()
+    source.get_arrays_direction_space()
+    source.set_seed(12345)
+    x2, _, _ = source.get_arrays_real_space()
+    numpy.testing.assert_array_equal(x1, x2)
+
+def test_get_beam_is_reproducible():
+    source = _get_source()
+    numpy.testing.assert_array_equal(source.get_beam().rays, source.get_beam().rays)
+
+def test_random_streams_are_reproducible_and_independent():
+    source = _get_source()
+    with source.random_stream(3):
+        rays3 = source.get_beam().rays
+    with source.random_stream(4):
+        rays4 = source.get_beam().rays
+    with source.random_stream(3):
+        numpy.testing.assert_array_equal(source.get_beam().rays, rays3)
+    assert not numpy.array_equal(rays3, rays4)
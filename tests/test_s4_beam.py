@@ -0,0 +1,110 @@
+#
+# S4Beam: cached columns and masks, storage.
+#
+import copy
+import pickle
+
+import numpy
+import pytest
+
+from shadow4.beam.s4_beam import S4Beam
+
+def _get_beam(storage="rows", nrays=1000):
+    rng = numpy.random.default_rng(1)
+    rays = rng.normal(size=(nrays, 18))
+    rays[:, 9] = numpy.where(rng.random(nrays) < 0.8, 1.0, -1.0) # flag
+    rays[:, 10] = 5e8 * (1 + rng.random(nrays))                    # wavenumber
+    rays[:, 11] = numpy.arange(nrays) + 1                          # index
+    return S4Beam.initialize_from_array(rays, storage=storage)
+
+@pytest.mark.parametrize("storage", ["rows", "columns"])
+def test_write_through_retained_reference_invalidates_the_cache(storage):
+    beam = _get_beam(storage)
+    rays = beam.rays
+    intensity = beam.get_column(23)
+    total = beam.get_intensity()
+    rays[:, 6] = 2.0
+    assert not numpy.array_equal(beam.get_column(23), intensity)
+    assert beam.get_intensity() != total
+    numpy.testing.assert_allclose(beam.get_column(23), 4.0 + (beam.get_columns([16, 17, 18]) ** 2).sum(axis=0) +
+                                  (beam.get_columns([8, 9]) ** 2).sum(axis=0))
+
+@pytest.mark.parametrize("storage", ["rows", "columns"])
+def test_write_through_retained_column_view_invalidates_the_cache(storage):
+    beam = _get_beam(storage)
+    column = beam.rays[:, 6]
+    beam.get_column(23)
+    column *= 3.0
+    numpy.testing.assert_allclose(beam.get_column(23), _get_beam(storage).get_column(23) +
+                                  8.0 * _get_beam(storage).get_column(7) ** 2)
+
+@pytest.mark.parametrize("storage", ["rows", "columns"])
+def test_flag_mask_follows_the_flags(storage):
+    beam = _get_beam(storage)
+    n_good = beam.get_number_of_rays(nolost=1)
+    beam.rays[:, 9] = 1.0
+    assert beam.get_number_of_rays(nolost=1) == beam.get_number_of_rays(nolost=0) > n_good
+    beam.rays[:10, 9] = -1.0
+    assert beam.get_number_of_rays(nolost=2) == 10
+
+@pytest.mark.parametrize("storage", ["rows", "columns"])
+def test_reading_rays_keeps_the_cache(storage):
+    beam = _get_beam(storage)
+    intensity = beam.get_column_view(23)
+    beam.rays
+    beam.rays[:, 6].sum()
+    assert numpy.shares_memory(beam.get_column_view(23), intensity)
+
+@pytest.mark.parametrize("storage", ["rows", "columns"])
+def test_copies_are_tracked_separately(storage):
+    beam = _get_beam(storage)
+    for beam2 in (beam.duplicate(), pickle.loads(pickle.dumps(beam)), copy.deepcopy(beam)):
+        intensity = beam.get_column_view(23)
+        beam2.get_column(23)
+        beam2.rays[:, 6] = 0.0
+        assert numpy.shares_memory(beam.get_column_view(23), intensity)
+        assert not numpy.array_equal(beam2.get_column(23), intensity)
+
+def _uncounted_writes():
+    return [
+        lambda rays: numpy.asarray(rays).__setitem__((slice(None), 0), 1.0),
+        lambda rays: rays.view(numpy.ndarray).__imul__(2.0),
+        lambda rays: numpy.copyto(rays[:, 0], 1.0),
+        lambda rays: rays.sort(axis=0),
+        lambda rays: numpy.put(rays, [0], 1.0),
+    ]
+
+@pytest.mark.parametrize("write", _uncounted_writes())
+def test_uncounted_writes_raise(write):
+    beam = _get_beam("rows")
+    column = beam.get_column(1)
+    with pytest.raises(ValueError):
+        write(beam.rays)
+    numpy.testing.assert_array_equal(beam.get_column(1), column)
+    numpy.testing.assert_array_equal(beam.rays, _get_beam("rows").rays)
+
+def test_uncounted_writes_to_a_column_raise():
+    beam = _get_beam("columns")
+    with pytest.raises(ValueError):
+        numpy.copyto(beam.rays[:, 0], 1.0)
+    with pytest.raises(ValueError):
+        numpy.asarray(beam.rays[:, 0])[:] = 1.0
+
+@pytest.mark.parametrize("storage", ["rows", "columns"])
+def test_counted_writes_and_copies(storage):
+    beam = _get_beam(storage)
+    beam.get_column(23)
+    beam.rays[:, 6] *= 3.0
+    numpy.add(beam.rays[:, 6], 0.0, out=beam.rays[:, 6])
+    column = beam.get_column(7)
+    column[:] = 0.0 # get_column returns a writeable copy
+    numpy.testing.assert_allclose(beam.get_column(23), _get_beam(storage).get_column(23) +
+                                  8.0 * _get_beam(storage).get_column(7) ** 2)
+
+def test_assigned_array_is_copied():
+    rays = _get_beam("rows").rays.copy()
+    beam = S4Beam()
+    beam.rays = rays
+    beam.get_column(23)
+    rays[:, 6] = 0.0
+    numpy.testing.assert_array_equal(beam.get_column(23), _get_beam("rows").get_column(23))
@@ -0,0 +1,86 @@
+#
+# Accumulators of S4Beamline.run_beamline_in_chunks(): the same results as with the full beam.
+#
+import numpy
+
+from syned.beamline.element_coordinates import ElementCoordinates
+from syned.beamline.shape import Rectangle
+
+from shadow4.beamline.s4_beamline import S4Beamline
+from shadow4.beamline.optical_elements.absorbers.s4_screen import S4Screen, S4ScreenElement
+from shadow4.beam.s4_beam_accumulators import S4BeamHistogramAccumulator, S4BeamHistogram2DAccumulator, \
+    S4BeamMomentsAccumulator, S4BeamFileSink
+from shadow4.sources.source_geometrical.source_geometrical import SourceGeometrical
+
+XRANGE = [-8e-4, 8e-4]
+YRANGE = [-2e-4, 2e-4]
+
+def _get_beamline():
+    light_source = SourceGeometrical(nrays=2500, seed=5676561)
+    light_source.set_spatial_type_gaussian(sigma_h=5e-6, sigma_v=1e-6)
+    light_source.set_angular_distribution_gaussian(sigdix=1e-4, sigdiz=1e-5)
+    light_source.set_energy_distribution_singleline(10000.0, unit='eV')
+    light_source.set_polarization(polarization_degree=0.8)
+    screen = S4ScreenElement(optical_element=S4Screen(boundary_shape=Rectangle(-5e-4, 5e-4, -5e-4, 5e-4), i_stop=False),
+                             coordinates=ElementCoordinates(p=10.0, q=0.0))
+    return S4Beamline(light_source=light_source, beamline_elements_list=[screen])
+
+def _get_full_beam():
+    # the chunks joined (see S4Beamline.run_beamline_in_parallel)
+    beam, _ = _get_beamline().run_beamline_in_parallel(nrays_shard=1000, n_workers=1)
+    return beam
+
+def test_histograms_equal_full_beam():
+    histogram = S4BeamHistogramAccumulator(1, XRANGE, nbins=40, nolost=1, ref=23)
+    histogram2d = S4BeamHistogram2DAccumulator(1, 3, XRANGE, YRANGE, nbins_h=20, nbins_v=10, nolost=1, ref=23)
+    _get_beamline().run_beamline_in_chunks(nrays_chunk=1000, accumulators={1: [histogram, histogram2d]})
+    beam = _get_full_beam()
+
+    ticket = histogram.get_ticket()
+    reference = beam.histo1(1, xrange=XRANGE, nbins=40, nolost=1, ref=23)
+    numpy.testing.assert_allclose(ticket["histogram"], reference["histogram"], rtol=1e-12)
+    numpy.testing.assert_allclose(ticket["histogram_sigma"], reference["histogram_sigma"], rtol=1e-9, atol=1e-12)
+    numpy.testing.assert_allclose(ticket["intensity"], reference["intensity"], rtol=1e-12)
+    assert ticket["fwhm"] == reference["fwhm"]
+    assert (ticket["nrays"], ticket["good_rays"]) == (reference["nrays"], reference["good_rays"])
+
+    ticket = histogram2d.get_ticket()
+    x, y, w = beam.get_columns([1, 3, 23], nolost=1)
+    reference, _, _ = numpy.histogram2d(x, y, bins=[20, 10], range=[XRANGE, YRANGE], weights=w)
+    numpy.testing.assert_allclose(ticket["histogram"], reference, rtol=1e-12)
+    numpy.testing.assert_allclose(ticket["intensity"], beam.get_intensity(nolost=1), rtol=1e-12)
+
+def test_moments_equal_full_beam():
+    moments = S4BeamMomentsAccumulator(columns=[1, 3, 4, 6], nolost=1, ref=23)
+    _get_beamline().run_beamline_in_chunks(nrays_chunk=1000, accumulators={1: moments})
+    beam = _get_full_beam()
+
+    weights = beam.get_column(23, nolost=1)
+    for col in [1, 3, 4, 6]:
+        x = beam.get_column(col, nolost=1)
+        mean = numpy.average(x, weights=weights)
+        numpy.testing.assert_allclose(moments.get_mean(col), mean, rtol=1e-10)
+        numpy.testing.assert_allclose(moments.get_standard_deviation(col),
+                                      numpy.sqrt(numpy.average((x - mean)**2, weights=weights)), rtol=1e-10)
+    numpy.testing.assert_allclose(moments.get_intensity(), beam.get_intensity(nolost=1), rtol=1e-12)
+    assert moments.get_number_of_rays(nolost=0) == beam.get_number_of_rays(nolost=0)
+    assert moments.get_number_of_rays(nolost=1) == beam.get_number_of_rays(nolost=1)
+
+def test_merged_accumulators_equal_one_accumulator():
+    beam = _get_full_beam()
+    one = S4BeamMomentsAccumulator(nolost=1)
+    one.accumulate(beam)
+    merged = S4BeamMomentsAccumulator(nolost=1)
+    for rows in numpy.array_split(numpy.arange(beam.get_number_of_rays()), 3):
+        part = S4BeamMomentsAccumulator(nolost=1)
+        part.accumulate(beam.__class__.initialize_from_array(beam.rays[rows]))
+        merged.merge(part)
+    for col in [1, 3, 4, 6]:
+        numpy.testing.assert_allclose(merged.get_mean(col), one.get_mean(col), rtol=1e-10)
+        numpy.testing.assert_allclose(merged.get_standard_deviation(col), one.get_standard_deviation(col), rtol=1e-10)
+
+def test_file_sink_stores_the_full_beam(tmp_path):
+    sink = S4BeamFileSink(str(tmp_path / "rays.h5"), nolost=0)
+    _get_beamline().run_beamline_in_chunks(nrays_chunk=1000, accumulators={1: sink})
+    assert sink.get_number_of_rays() == 2500
+    numpy.testing.assert_array_equal(sink.get_beam().rays, _get_full_beam().rays)
@@ -0,0 +1,87 @@
+#
+# S4BeamlineCache: hits, invalidation and sources that cannot be cached.
+#
+import numpy
+import pytest
+
+from syned.beamline.element_coordinates import ElementCoordinates
+from syned.beamline.shape import Rectangle
+from syned.storage_ring.electron_beam import ElectronBeam
+
+from shadow4.beamline.s4_beamline import S4Beamline
+from shadow4.beamline.s4_beamline_cache import S4BeamlineCache
+from shadow4.beamline.optical_elements.absorbers.s4_screen import S4Screen, S4ScreenElement
+from shadow4.sources.source_geometrical.source_geometrical import SourceGeometrical
+from shadow4.sources.wiggler.s4_wiggler import S4Wiggler
+from shadow4.sources.wiggler.s4_wiggler_light_source import S4WigglerLightSource
+
+@pytest.fixture
+def traced_elements(monkeypatch):
+    # counts the screens traced
+    traced = []
+    trace_beam = S4ScreenElement.trace_beam
+    def counting_trace_beam(self, **params):
+        traced.append(self)
+        return trace_beam(self, **params)
+    monkeypatch.setattr(S4ScreenElement, "trace_beam", counting_trace_beam)
+    return traced
+
+def _get_geometrical_source(seed=5676561):
+    light_source = SourceGeometrical(nrays=2000, seed=seed)
+    light_source.set_spatial_type_gaussian(sigma_h=5e-6, sigma_v=1e-6)
+    light_source.set_angular_distribution_gaussian(sigdix=1e-4, sigdiz=1e-5)
+    light_source.set_energy_distribution_singleline(10000.0, unit='eV')
+    return light_source
+
+def _get_wiggler_source():
+    electron_beam = ElectronBeam(energy_in_GeV=1.9, current=0.4,
+                                 moment_xx=(39e-6)**2, moment_xpxp=(2000e-12 / 51e-6)**2,
+                                 moment_yy=(31e-6)**2, moment_ypyp=(30e-12 / 31e-6)**2)
+    wiggler = S4Wiggler(magnetic_field_periodic=1, K_vertical=10.0, period_length=0.1, number_of_periods=10,
+                        emin=10000.0, emax=10100.0, ng_e=11, ng_j=51, flag_emittance=1)
+    return S4WigglerLightSource(name="", electron_beam=electron_beam, magnetic_structure=wiggler,
+                                nrays=2000, seed=12345)
+
+def _get_screen(p=10.0, size=1e-3):
+    return S4ScreenElement(optical_element=S4Screen(boundary_shape=Rectangle(-size, size, -size, size), i_stop=False),
+                           coordinates=ElementCoordinates(p=p, q=0.0))
+
+def _get_beamline(light_source):
+    return S4Beamline(light_source=light_source, beamline_elements_list=[_get_screen(10.0), _get_screen(5.0)])
+
+def test_second_run_hits(traced_elements):
+    beamline = _get_beamline(_get_geometrical_source())
+    cache = S4BeamlineCache()
+    beam1, _ = beamline.run_beamline(cache=cache)
+    assert len(traced_elements) == 2
+    beam2, _ = beamline.run_beamline(cache=cache)
+    assert len(traced_elements) == 2
+    numpy.testing.assert_array_equal(beam1.rays, beam2.rays)
+
+def test_changed_element_is_retraced(traced_elements):
+    beamline = _get_beamline(_get_geometrical_source())
+    cache = S4BeamlineCache()
+    beamline.run_beamline(cache=cache)
+    beamline.get_beamline_elements()[1].get_coordinates()._p = 7.0
+    beamline.run_beamline(cache=cache)
+    assert len(traced_elements) == 3 # only the second screen is traced again
+
+def test_stage_keys_do_not_depend_on_calculated_results(traced_elements, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # the wiggler writes its cdf file in the working directory
+    beamline = _get_beamline(_get_wiggler_source())
+    keys = S4BeamlineCache.get_stage_keys(beamline)
+    cache = S4BeamlineCache()
+    beamline.run_beamline(cache=cache)
+    assert S4BeamlineCache.get_stage_keys(beamline) == keys
+    beamline.run_beamline(cache=cache)
+    assert len(traced_elements) == 2
+    assert len(cache._entries) == 3
+
+def test_non_reproducible_source_is_not_cached(traced_elements):
+    beamline = _get_beamline(_get_geometrical_source(seed=0))
+    cache = S4BeamlineCache()
+    beam1, _ = beamline.run_beamline(cache=cache)
+    beam2, _ = beamline.run_beamline(cache=cache)
+    assert len(traced_elements) == 4
+    assert len(cache._entries) == 0
+    assert not numpy.array_equal(beam1.rays, beam2.rays)
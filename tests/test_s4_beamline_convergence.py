@@ -0,0 +1,77 @@
+#
+# S4BeamlineConvergence: estimates of the figures of merit.
+#
+import numpy
+
+from syned.beamline.element_coordinates import ElementCoordinates
+from syned.beamline.shape import Rectangle
+
+from shadow4.beamline.s4_beamline import S4Beamline
+from shadow4.beamline.s4_beamline_convergence import S4BeamlineConvergence
+from shadow4.beamline.s4_beamline_scan import S4ScanFWHM, S4ScanCentroid, S4ScanTransmission
+from shadow4.beamline.optical_elements.absorbers.s4_screen import S4Screen, S4ScreenElement
+from shadow4.sources.source_geometrical.source_geometrical import SourceGeometrical
+
+def _get_beamline(aperture=1e-2):
+    light_source = SourceGeometrical(nrays=1000, seed=5676561)
+    light_source.set_spatial_type_gaussian(sigma_h=5e-6, sigma_v=1e-6)
+    light_source.set_angular_distribution_gaussian(sigdix=1e-4, sigdiz=1e-5)
+    light_source.set_energy_distribution_singleline(10000.0, unit='eV')
+    screen = S4ScreenElement(optical_element=S4Screen(boundary_shape=Rectangle(-aperture, aperture, -aperture, aperture), i_stop=False),
+                             coordinates=ElementCoordinates(p=10.0, q=0.0))
+    return S4Beamline(light_source=light_source, beamline_elements_list=[screen])
+
+def _run(xrange):
+    convergence = S4BeamlineConvergence(_get_beamline(),
+                                        {"fwhm": S4ScanFWHM(1, nbins=100, xrange=xrange),
+                                         "centroid": S4ScanCentroid(1)},
+                                        target_relative_error=1e-6, nrays_batch=500, min_batches=2, max_rays=4000)
+    return convergence.run(keep_beam=True, verbose=False)
+
+def test_fwhm_is_the_fwhm_of_the_accumulated_histogram():
+    results = _run(xrange=[-5e-3, 5e-3])
+    assert results["nbatches"] == 8
+    fwhm = results["figures_of_merit"]["fwhm"]
+    ticket = results["beam"].histo1(1, xrange=[-5e-3, 5e-3], nbins=100, nolost=1, ref=23)
+    assert fwhm["value"] == ticket["fwhm"]
+    assert fwhm["value"] != numpy.mean(fwhm["batch_values"])
+    assert 0 < fwhm["error"] < numpy.inf
+
+def test_fwhm_without_xrange_uses_the_limits_of_the_first_batch():
+    results = _run(xrange=None)
+    beam = results["beam"]
+    x = beam.get_column(1, nolost=1)[:500]
+    ticket = beam.histo1(1, xrange=[x.min(), x.max()], nbins=100, nolost=1, ref=23)
+    assert results["figures_of_merit"]["fwhm"]["value"] == ticket["fwhm"]
+
+def test_centroid_is_the_mean_of_the_batches():
+    results = _run(xrange=[-5e-3, 5e-3])
+    centroid = results["figures_of_merit"]["centroid"]
+    numpy.testing.assert_allclose(centroid["value"], numpy.mean(centroid["batch_values"]), rtol=1e-12)
+
+def test_batches_are_weighted_by_intensity():
+    # the aperture cuts ~70% of the rays: the batches have different intensities
+    convergence = S4BeamlineConvergence(_get_beamline(aperture=4e-4),
+                                        {"centroid": S4ScanCentroid(1), "transmission": S4ScanTransmission()},
+                                        target_relative_error=1e-6, nrays_batch=500, min_batches=2, max_rays=4000)
+    results = convergence.run(keep_beam=True, verbose=False)
+    beam = results["beam"]
+    centroid = results["figures_of_merit"]["centroid"]
+    x = beam.get_column(1, nolost=1)
+    w = beam.get_column(23, nolost=1)
+    numpy.testing.assert_allclose(centroid["value"], numpy.average(x, weights=w), rtol=1e-12)
+    assert centroid["value"] != numpy.mean(centroid["batch_values"])
+    transmission = results["figures_of_merit"]["transmission"]
+    numpy.testing.assert_allclose(transmission["value"], beam.get_intensity(nolost=1) / 4000, rtol=1e-12)
+
+def test_centroid_near_zero_converges_with_absolute_target():
+    figures_of_merit = {"centroid": S4ScanCentroid(1)}
+    results = S4BeamlineConvergence(_get_beamline(), figures_of_merit, target_relative_error=1e-2,
+                                    nrays_batch=500, min_batches=4, max_rays=4000).run(verbose=False)
+    assert not results["converged"]
+    results = S4BeamlineConvergence(_get_beamline(), figures_of_merit, target_relative_error=1e-2,
+                                    target_absolute_error=1e-4,
+                                    nrays_batch=500, min_batches=4, max_rays=4000).run(verbose=False)
+    centroid = results["figures_of_merit"]["centroid"]
+    assert results["converged"] and results["nbatches"] == 4
+    assert centroid["error"] <= 1e-4 and centroid["relative_error"] > 1e-2
@@ -0,0 +1,39 @@
+#
+# S4Beamline.run_beamline_in_parallel(): bit-identical to the serial run.
+#
+import numpy
+
+from syned.beamline.element_coordinates import ElementCoordinates
+from syned.beamline.shape import Rectangle
+
+from shadow4.beamline.s4_beamline import S4Beamline
+from shadow4.beamline.optical_elements.absorbers.s4_screen import S4Screen, S4ScreenElement
+from shadow4.sources.source_geometrical.source_geometrical import SourceGeometrical
+
+def _get_beamline():
+    light_source = SourceGeometrical(nrays=2500, seed=5676561)
+    light_source.set_spatial_type_gaussian(sigma_h=5e-6, sigma_v=1e-6)
+    light_source.set_angular_distribution_gaussian(sigdix=1e-4, sigdiz=1e-5)
+    light_source.set_energy_distribution_singleline(10000.0, unit='eV')
+    screen = S4ScreenElement(optical_element=S4Screen(boundary_shape=Rectangle(-5e-4, 5e-4, -5e-4, 5e-4), i_stop=False),
+                             coordinates=ElementCoordinates(p=10.0, q=0.0))
+    return S4Beamline(light_source=light_source, beamline_elements_list=[screen])
+
+def test_beamline_in_parallel_equals_serial():
+    beam1, mirr1 = _get_beamline().run_beamline_in_parallel(nrays_shard=1000, n_workers=1)
+    beam2, mirr2 = _get_beamline().run_beamline_in_parallel(nrays_shard=1000, n_workers=2)
+    beam3, _ = _get_beamline().run_beamline_in_parallel(nrays_shard=1000, n_workers=3)
+    assert beam1.get_number_of_rays() == 2500
+    assert 0 < beam1.get_number_of_rays(nolost=1) < 2500 # the screen cuts some rays
+    numpy.testing.assert_array_equal(beam1.rays, beam2.rays)
+    numpy.testing.assert_array_equal(beam1.rays, beam3.rays)
+    numpy.testing.assert_array_equal(mirr1.rays, mirr2.rays)
+    numpy.testing.assert_array_equal(beam1.get_column(12), numpy.arange(2500) + 1)
+
+def test_beamline_in_parallel_equals_chunks():
+    from shadow4.beam.s4_beam_accumulators import S4BeamMomentsAccumulator
+    beam, _ = _get_beamline().run_beamline_in_parallel(nrays_shard=1000, n_workers=2)
+    moments = S4BeamMomentsAccumulator(columns=[1, 3], nolost=1)
+    _get_beamline().run_beamline_in_chunks(nrays_chunk=1000, accumulators={1: moments})
+    assert moments.get_number_of_rays(nolost=1) == beam.get_number_of_rays(nolost=1)
+    numpy.testing.assert_allclose(moments.get_mean(1), beam.get_column(1, nolost=1).mean(), rtol=1e-12)
@@ -0,0 +1,50 @@
+#
+# S4BeamlineScan: the scan points equal full reruns of the beamline.
+#
+import copy
+
+import numpy
+import pytest
+
+from syned.beamline.element_coordinates import ElementCoordinates
+from syned.beamline.shape import Rectangle
+
+from shadow4.beamline.s4_beamline import S4Beamline
+from shadow4.beamline.s4_beamline_scan import S4BeamlineScan, S4ScanFWHM, S4ScanCentroid, S4ScanTransmission
+from shadow4.beamline.s4_beamline_scan import _set_parameters
+from shadow4.beamline.optical_elements.absorbers.s4_screen import S4Screen, S4ScreenElement
+from shadow4.sources.source_geometrical.source_geometrical import SourceGeometrical
+
+def _get_beamline():
+    light_source = SourceGeometrical(nrays=2000, seed=5676561)
+    light_source.set_spatial_type_gaussian(sigma_h=5e-6, sigma_v=1e-6)
+    light_source.set_angular_distribution_gaussian(sigdix=1e-4, sigdiz=1e-5)
+    light_source.set_energy_distribution_singleline(10000.0, unit='eV')
+    screen1 = S4ScreenElement(optical_element=S4Screen(boundary_shape=Rectangle(-5e-4, 5e-4, -5e-4, 5e-4), i_stop=False),
+                              coordinates=ElementCoordinates(p=5.0, q=0.0))
+    screen2 = S4ScreenElement(optical_element=S4Screen(boundary_shape=Rectangle(-5e-4, 5e-4, -5e-4, 5e-4), i_stop=False),
+                              coordinates=ElementCoordinates(p=5.0, q=0.0))
+    return S4Beamline(light_source=light_source, beamline_elements_list=[screen1, screen2])
+
+def _get_figures_of_merit():
+    return {"fwhm": S4ScanFWHM(1, nbins=50, xrange=[-5e-4, 5e-4]),
+            "footprint_fwhm": S4ScanFWHM(1, nbins=50, xrange=[-5e-4, 5e-4], use_footprint=True),
+            "centroid": S4ScanCentroid(1),
+            "transmission": S4ScanTransmission()}
+
+def _rerun(parameters, point):
+    beamline = _get_beamline()
+    _set_parameters(beamline, parameters, point)
+    beam, mirr = beamline.run_beamline()
+    return [figure_of_merit(beam, mirr) for figure_of_merit in _get_figures_of_merit().values()]
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+@pytest.mark.parametrize("values", [[1.0, 3.0, 5.0], [5.0]]) # [5.0]: the scan changes nothing
+def test_scan_equals_full_reruns(n_workers, values):
+    scan = S4BeamlineScan(_get_beamline(), {"2.coordinates.p": values}, _get_figures_of_merit())
+    table = scan.run(n_workers=n_workers, verbose=False)
+    for i, point in enumerate(scan.get_points()):
+        expected = _rerun(["2.coordinates.p"], point)
+        for j, name in enumerate(_get_figures_of_merit().keys()):
+            assert table[name][i] == expected[j] or (numpy.isnan(table[name][i]) and numpy.isnan(expected[j]))
+    assert numpy.all(numpy.isfinite(table["footprint_fwhm"]))
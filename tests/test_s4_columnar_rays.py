@@ -0,0 +1,79 @@
+#
+# S4ColumnarRays: the columnar storage of S4Beam gives the same results as the row storage.
+#
+import numpy
+import pytest
+
+from syned.beamline.element_coordinates import ElementCoordinates
+from syned.beamline.shape import Rectangle
+
+from shadow4.beam.s4_beam import S4Beam
+from shadow4.beam.s4_columnar_rays import S4ColumnarRays
+from shadow4.beamline.optical_elements.absorbers.s4_screen import S4Screen, S4ScreenElement
+from shadow4.beamline.optical_elements.mirrors.s4_ellipsoid_mirror import S4EllipsoidMirror, S4EllipsoidMirrorElement
+from shadow4.sources.source_geometrical.source_geometrical import SourceGeometrical
+
+def _get_source_beam(nrays=2000):
+    light_source = SourceGeometrical(nrays=nrays, seed=5676561)
+    light_source.set_spatial_type_gaussian(sigma_h=5e-6, sigma_v=1e-6)
+    light_source.set_angular_distribution_gaussian(sigdix=1e-4, sigdiz=1e-5)
+    light_source.set_energy_distribution_singleline(10000.0, unit='eV')
+    light_source.set_polarization(polarization_degree=0.8)
+    return light_source.get_beam()
+
+def _trace(beam):
+    mirror = S4EllipsoidMirrorElement(
+        optical_element=S4EllipsoidMirror(boundary_shape=Rectangle(-0.01, 0.01, -0.1, 0.1), surface_calculation=0,
+                                          is_cylinder=0, convexity=1, p_focus=10.0, q_focus=6.0,
+                                          grazing_angle=0.003, f_reflec=1, f_refl=1,
+                                          refraction_index=1.0 - 1.5e-5 + 1.0e-7j),
+        coordinates=ElementCoordinates(p=10.0, q=6.0, angle_radial=numpy.pi / 2 - 0.003),
+        input_beam=beam)
+    beam, mirr = mirror.trace_beam()
+    screen = S4ScreenElement(optical_element=S4Screen(boundary_shape=Rectangle(-2e-5, 2e-5, -2e-5, 2e-5), i_stop=False),
+                             coordinates=ElementCoordinates(p=0.0, q=0.0), input_beam=beam)
+    beam, _ = screen.trace_beam()
+    return beam, mirr
+
+def test_array_interface():
+    rays = _get_source_beam(100).rays
+    columnar = S4ColumnarRays(array=rays)
+    assert columnar.shape == rays.shape
+    numpy.testing.assert_array_equal(numpy.asarray(columnar), rays)
+    numpy.testing.assert_array_equal(columnar[:, 3], rays[:, 3])
+    numpy.testing.assert_array_equal(columnar[10:20, [0, 2]], rays[10:20, [0, 2]])
+    numpy.testing.assert_array_equal(columnar[rays[:, 0] > 0], rays[rays[:, 0] > 0])
+    columnar[:, 3] *= 2.0
+    rays[:, 3] *= 2.0
+    columnar[5] = rays[0]
+    rays[5] = rays[0]
+    numpy.testing.assert_array_equal(numpy.asarray(columnar), rays)
+    numpy.testing.assert_array_equal(numpy.asarray(columnar.take(numpy.arange(0, 100, 3))), rays[::3])
+
+def test_tracing_with_columns_equals_rows():
+    beam_rows = _get_source_beam()
+    beam_columns = _get_source_beam()
+    beam_columns.set_storage("columns")
+    assert beam_columns.get_storage() == "columns"
+
+    beam_rows, mirr_rows = _trace(beam_rows)
+    beam_columns, mirr_columns = _trace(beam_columns)
+    assert beam_columns.get_storage() == "columns"
+    assert 0 < beam_rows.get_number_of_rays(nolost=1) < beam_rows.get_number_of_rays()
+    numpy.testing.assert_allclose(numpy.asarray(beam_columns.rays), beam_rows.rays, rtol=1e-12, atol=1e-15)
+    numpy.testing.assert_allclose(numpy.asarray(mirr_columns.rays), mirr_rows.rays, rtol=1e-12, atol=1e-15)
+    for column in [20, 23, 24, 25, 26]:
+        numpy.testing.assert_allclose(beam_columns.get_column(column, nolost=1), beam_rows.get_column(column, nolost=1),
+                                      rtol=1e-12, atol=1e-15)
+
+def test_tracing_with_float32_columns():
+    beam_rows, _ = _trace(_get_source_beam())
+    beam = _get_source_beam()
+    beam.set_storage("columns", precision="float32")
+    beam, _ = _trace(beam)
+    assert beam.get_precision() == "float32"
+    numpy.testing.assert_array_equal(beam.get_column(10), beam_rows.get_column(10))
+    numpy.testing.assert_array_equal(beam.get_column(12), beam_rows.get_column(12))
+    numpy.testing.assert_allclose(beam.get_column(23, nolost=1), beam_rows.get_column(23, nolost=1), rtol=1e-4)
+    numpy.testing.assert_allclose(beam.get_column(1, nolost=1), beam_rows.get_column(1, nolost=1),
+                                  atol=1e-4 * numpy.abs(beam_rows.get_column(1, nolost=1)).max())
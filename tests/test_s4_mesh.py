@@ -0,0 +1,111 @@
+#
+# S4Mesh: spline kinds, slopes and tracing through a numerical mesh mirror.
+#
+import numpy
+import pytest
+
+from syned.beamline.element_coordinates import ElementCoordinates
+from syned.beamline.shape import Rectangle
+
+from shadow4.optical_surfaces.s4_mesh import S4Mesh
+from shadow4.sources.source_geometrical.source_geometrical import SourceGeometrical
+from shadow4.beamline.optical_elements.mirrors.s4_numerical_mesh_mirror import S4NumericalMeshMirror, S4NumericalMeshMirrorElement
+
+def _get_mesh_arrays(amplitude=1e-7):
+    xx = numpy.linspace(-0.02, 0.02, 41)
+    yy = numpy.linspace(-0.2, 0.2, 201)
+    zz = amplitude * numpy.outer(numpy.cos(2 * numpy.pi * xx / 0.04), numpy.sin(2 * numpy.pi * yy / 0.05)) # (nx, ny)
+    return xx, yy, zz
+
+@pytest.mark.parametrize("kind", ["linear", "cubic", "quintic"])
+def test_slopes_match_finite_differences(kind):
+    xx, yy, zz = _get_mesh_arrays()
+    mesh = S4Mesh()
+    mesh.set_mesh(zz, xx, yy)
+    mesh.set_kind(kind)
+
+    rng = numpy.random.default_rng(0)
+    x = rng.uniform(-0.019, 0.019, 100)
+    y = rng.uniform(-0.19, 0.19, 100)
+    slope_x, slope_y = mesh.surface_slopes_at_points(x, y)
+    h = 1e-7
+    fd_x = (mesh.surface_height_at_points(x + h, y) - mesh.surface_height_at_points(x - h, y)) / (2 * h)
+    fd_y = (mesh.surface_height_at_points(x, y + h) - mesh.surface_height_at_points(x, y - h)) / (2 * h)
+    numpy.testing.assert_allclose(slope_x, fd_x, atol=1e-6 * numpy.abs(fd_x).max())
+    numpy.testing.assert_allclose(slope_y, fd_y, atol=1e-6 * numpy.abs(fd_y).max())
+
+def _trace(kind):
+    xx, yy, zz = _get_mesh_arrays()
+    light_source = SourceGeometrical(nrays=2000, seed=5676561)
+    light_source.set_spatial_type_gaussian(sigma_h=5e-6, sigma_v=1e-6)
+    light_source.set_angular_distribution_gaussian(sigdix=1e-4, sigdiz=1e-5)
+    light_source.set_energy_distribution_singleline(10000.0, unit='eV')
+    element = S4NumericalMeshMirrorElement(
+        optical_element=S4NumericalMeshMirror(boundary_shape=Rectangle(-0.01, 0.01, -0.1, 0.1),
+                                              xx=xx, yy=yy, zz=zz.T),
+        coordinates=ElementCoordinates(p=10.0, q=6.0, angle_radial=numpy.pi / 2 - 0.003),
+        input_beam=light_source.get_beam())
+    element.get_optical_element().get_optical_surface_instance().set_kind(kind)
+    return element.trace_beam()
+
+def test_trace_linear_mesh():
+    beam_linear, mirr_linear = _trace("linear")
+    beam_cubic, mirr_cubic = _trace("cubic")
+    assert numpy.isfinite(beam_linear.rays).all()
+    assert beam_linear.get_number_of_rays(nolost=1) > 0
+    numpy.testing.assert_array_equal(beam_linear.get_column(10), beam_cubic.get_column(10))
+    # the linear and cubic interpolations of a smooth mesh give nearly the same footprint and image
+    numpy.testing.assert_allclose(mirr_linear.get_column(2), mirr_cubic.get_column(2), atol=1e-6)
+    numpy.testing.assert_allclose(beam_linear.get_column(3), beam_cubic.get_column(3), atol=5e-5)
+
+def _trace_additional_mesh(f_perturbative, perturbative_tolerance=1e-12, perturbative_iterations=1, amplitude=1e-7):
+    from shadow4.beamline.optical_elements.mirrors.s4_plane_mirror import S4PlaneMirror
+    from shadow4.beamline.optical_elements.mirrors.s4_additional_numerical_mesh_mirror import \
+        S4AdditionalNumericalMeshMirror, S4AdditionalNumericalMeshMirrorElement
+    xx, yy, zz = _get_mesh_arrays(amplitude)
+    light_source = SourceGeometrical(nrays=2000, seed=5676561)
+    light_source.set_spatial_type_gaussian(sigma_h=5e-6, sigma_v=1e-6)
+    light_source.set_angular_distribution_gaussian(sigdix=1e-4, sigdiz=1e-5)
+    light_source.set_energy_distribution_singleline(10000.0, unit='eV')
+    boundary_shape = Rectangle(-0.01, 0.01, -0.1, 0.1)
+    optical_element = S4AdditionalNumericalMeshMirror(
+        ideal_mirror=S4PlaneMirror(boundary_shape=boundary_shape),
+        numerical_mesh_mirror=S4NumericalMeshMirror(boundary_shape=boundary_shape, xx=xx, yy=yy, zz=zz.T),
+        f_perturbative=f_perturbative, perturbative_tolerance=perturbative_tolerance,
+        perturbative_iterations=perturbative_iterations)
+    element = S4AdditionalNumericalMeshMirrorElement(optical_element=optical_element,
+        coordinates=ElementCoordinates(p=10.0, q=6.0, angle_radial=numpy.pi / 2 - 0.003),
+        input_beam=light_source.get_beam())
+    return element, element.trace_beam()
+
+def test_perturbative_exact_rays_are_counted(capsys):
+    from shadow4.beamline.s4_beamline_cache import S4BeamlineCache
+    element, (beam_exact, _) = _trace_additional_mesh(f_perturbative=0)
+    assert element.get_optical_element().get_perturbative_exact_rays() is None
+
+    element, (beam, _) = _trace_additional_mesh(f_perturbative=1, perturbative_tolerance=0.0)
+    key = S4BeamlineCache.get_hash(element.get_optical_element())
+    capsys.readouterr()
+    beam, _ = element.trace_beam()
+    assert "perturbative" not in capsys.readouterr().out
+    assert element.get_optical_element().get_perturbative_exact_rays() == beam.get_number_of_rays(nolost=0)
+    assert S4BeamlineCache.get_hash(element.get_optical_element()) == key
+    numpy.testing.assert_allclose(beam.get_column(3), beam_exact.get_column(3), atol=1e-9)
+
+@pytest.mark.parametrize("amplitude, perturbative_iterations", [(1e-9, 1), (1e-7, 3)])
+def test_perturbative_equals_exact_for_small_errors(amplitude, perturbative_iterations):
+    tolerance = 1e-12
+    grazing_angle = 0.003
+    _, (beam_exact, mirr_exact) = _trace_additional_mesh(f_perturbative=0, amplitude=amplitude)
+    element, (beam, mirr) = _trace_additional_mesh(f_perturbative=1, perturbative_tolerance=tolerance,
+                                                   perturbative_iterations=perturbative_iterations, amplitude=amplitude)
+    assert element.get_optical_element().get_perturbative_exact_rays() == 0
+    numpy.testing.assert_array_equal(mirr.get_column(10), mirr_exact.get_column(10))
+    # the heights agree within the tolerance, the positions along the mirror within tolerance / grazing angle
+    numpy.testing.assert_allclose(mirr.get_column(3), mirr_exact.get_column(3), rtol=0, atol=tolerance)
+    for col in (1, 2):
+        numpy.testing.assert_allclose(mirr.get_column(col), mirr_exact.get_column(col), rtol=0, atol=tolerance / grazing_angle)
+    for col in (1, 3):
+        numpy.testing.assert_allclose(beam.get_column(col), beam_exact.get_column(col), rtol=0, atol=tolerance / grazing_angle)
+    for col in (4, 5, 6):
+        numpy.testing.assert_allclose(beam.get_column(col), beam_exact.get_column(col), rtol=0, atol=tolerance)
@@ -0,0 +1,62 @@
+#
+# cached_optical_surface: the optical surface instances are stored and rebuilt when the optical element changes.
+#
+import numpy
+
+from syned.beamline.shape import Rectangle
+
+from shadow4.beamline.optical_elements.mirrors.s4_sphere_mirror import S4SphereMirror
+from shadow4.beamline.optical_elements.mirrors.s4_numerical_mesh_mirror import S4NumericalMeshMirror
+from shadow4.beamline.optical_elements.mirrors.s4_additional_numerical_mesh_mirror import S4AdditionalNumericalMeshMirror
+
+def _get_mesh_arrays():
+    xx = numpy.linspace(-0.02, 0.02, 41)
+    yy = numpy.linspace(-0.2, 0.2, 201)
+    zz = 1e-7 * numpy.outer(numpy.sin(2 * numpy.pi * yy / 0.05), numpy.cos(2 * numpy.pi * xx / 0.04)) # (ny, nx)
+    return xx, yy, zz
+
+def test_repeated_calls_return_the_same_instance():
+    mirror = S4SphereMirror(radius=10.0)
+    surface = mirror.get_optical_surface_instance()
+    assert mirror.get_optical_surface_instance() is surface
+
+def test_geometry_change_rebuilds_the_surface():
+    mirror = S4SphereMirror(radius=10.0)
+    surface = mirror.get_optical_surface_instance()
+    ccc = numpy.array(surface.ccc)
+    mirror.get_surface_shape_instance()._radius = 20.0
+    surface2 = mirror.get_optical_surface_instance()
+    assert surface2 is not surface
+    assert not numpy.array_equal(surface2.ccc, ccc)
+    numpy.testing.assert_array_equal(surface2.ccc, S4SphereMirror(radius=20.0).get_optical_surface_instance().ccc)
+    assert mirror.get_optical_surface_instance() is surface2
+
+def test_mesh_change_rebuilds_the_surface():
+    xx, yy, zz = _get_mesh_arrays()
+    mirror = S4NumericalMeshMirror(xx=xx, yy=yy, zz=zz)
+    surface = mirror.get_optical_surface_instance()
+    height = surface.surface_height_at_points(numpy.array([0.005]), numpy.array([0.01]))
+    zz += 1e-7 # in place: the arrays of the surface shape are modified
+    surface2 = mirror.get_optical_surface_instance()
+    assert surface2 is not surface
+    numpy.testing.assert_allclose(surface2.surface_height_at_points(numpy.array([0.005]), numpy.array([0.01])),
+                                  height + 1e-7, rtol=1e-10)
+    assert mirror.get_optical_surface_instance() is surface2
+
+def test_ideal_plus_errors_mesh_does_not_modify_the_cached_mesh():
+    xx, yy, zz = _get_mesh_arrays()
+    boundary_shape = Rectangle(-0.01, 0.01, -0.1, 0.1)
+    mirror = S4AdditionalNumericalMeshMirror(
+        ideal_mirror=S4SphereMirror(boundary_shape=boundary_shape, radius=100.0),
+        numerical_mesh_mirror=S4NumericalMeshMirror(boundary_shape=boundary_shape, xx=xx, yy=yy, zz=zz))
+    error_mesh = mirror.get_optical_surface_instance()
+    mesh_z = numpy.array(error_mesh.mesh_z)
+    x, y = numpy.array([0.005, -0.003]), numpy.array([0.01, 0.07])
+    height = error_mesh.surface_height_at_points(x, y)
+
+    numerical_mesh = mirror._get_ideal_plus_errors_mesh()
+    assert numerical_mesh is not error_mesh
+    assert mirror.get_optical_surface_instance() is error_mesh
+    numpy.testing.assert_array_equal(error_mesh.mesh_z, mesh_z)
+    numpy.testing.assert_array_equal(error_mesh.surface_height_at_points(x, y), height)
+    assert not numpy.allclose(numerical_mesh.surface_height_at_points(x, y), height)
@@ -0,0 +1,95 @@
+#
+# S4RadiationCache: storage, eviction, and the radiation of the wiggler loaded from the cache.
+#
+import os
+
+import numpy
+import pytest
+
+from syned.storage_ring.electron_beam import ElectronBeam
+
+import shadow4.sources.wiggler.s4_wiggler_light_source as s4_wiggler_light_source
+from shadow4.sources.s4_radiation_cache import S4RadiationCache
+from shadow4.sources.wiggler.s4_wiggler import S4Wiggler
+from shadow4.sources.wiggler.s4_wiggler_light_source import S4WigglerLightSource
+
+@pytest.fixture
+def calculated_trajectories(monkeypatch):
+    # counts the wiggler trajectories calculated (not loaded from the cache)
+    calculated = []
+    wiggler_trajectory = s4_wiggler_light_source.wiggler_trajectory
+    def counting_wiggler_trajectory(**kwargs):
+        calculated.append(kwargs)
+        return wiggler_trajectory(**kwargs)
+    monkeypatch.setattr(s4_wiggler_light_source, "wiggler_trajectory", counting_wiggler_trajectory)
+    return calculated
+
+def _get_wiggler_source(K_vertical=10.0, nrays=1000, seed=12345):
+    electron_beam = ElectronBeam(energy_in_GeV=1.9, current=0.4,
+                                 moment_xx=(39e-6)**2, moment_xpxp=(2000e-12 / 51e-6)**2,
+                                 moment_yy=(31e-6)**2, moment_ypyp=(30e-12 / 31e-6)**2)
+    wiggler = S4Wiggler(magnetic_field_periodic=1, K_vertical=K_vertical, period_length=0.1, number_of_periods=10,
+                        emin=10000.0, emax=10100.0, ng_e=11, ng_j=51, flag_emittance=1)
+    return S4WigglerLightSource(name="", electron_beam=electron_beam, magnetic_structure=wiggler,
+                                nrays=nrays, seed=seed)
+
+def test_put_and_get(tmp_path):
+    cache = S4RadiationCache(str(tmp_path))
+    dictionary = {"radiation": numpy.arange(12.0).reshape(3, 4), "n": 3, "x": 1.5, "name": "und",
+                  "polarization": {"s": numpy.ones(3), "flag": 1}}
+    key = cache.get_key("test", {"K": 1.0})
+    assert key not in cache
+    assert cache.get(key) is None
+    cache.put(key, dictionary)
+    assert key in cache
+    loaded = cache.get(key)
+    numpy.testing.assert_array_equal(loaded["radiation"], dictionary["radiation"])
+    assert (loaded["n"], loaded["x"], loaded["name"]) == (3, 1.5, "und")
+    numpy.testing.assert_array_equal(loaded["polarization"]["s"], numpy.ones(3))
+    assert loaded["polarization"]["flag"] == 1
+    assert cache.get_key("test", {"K": 1.0}) == key
+    assert cache.get_key("test", {"K": 1.1}) != key
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = S4RadiationCache(str(tmp_path), max_entries=2)
+    keys = [cache.get_key(i) for i in range(3)]
+    cache.put(keys[0], {"a": numpy.zeros(10)})
+    cache.put(keys[1], {"a": numpy.zeros(10)})
+    os.utime(cache._get_filename(keys[0]), ns=(1, 1))
+    os.utime(cache._get_filename(keys[1]), ns=(2, 2))
+    cache.get(keys[0]) # now the most recently used
+    cache.put(keys[2], {"a": numpy.zeros(10)})
+    assert keys[0] in cache and keys[2] in cache
+    assert keys[1] not in cache
+    assert cache.get_info()["entries"] == 2
+    cache.clear()
+    assert cache.get_info()["entries"] == 0
+
+def test_wiggler_radiation_is_loaded_from_the_cache(tmp_path, monkeypatch, calculated_trajectories):
+    monkeypatch.chdir(tmp_path)
+    cache = S4RadiationCache(str(tmp_path / "cache"))
+
+    light_source = _get_wiggler_source()
+    light_source.set_radiation_cache(cache)
+    beam1 = light_source.get_beam()
+    assert len(calculated_trajectories) == 1
+    assert cache.get_info()["entries"] == 1
+
+    # another source with the same inputs (other number of rays and seed) loads the radiation
+    light_source = _get_wiggler_source(nrays=500, seed=54321)
+    light_source.set_radiation_cache(cache)
+    light_source.get_beam()
+    assert len(calculated_trajectories) == 1
+
+    # same inputs and seed: the same beam as the calculated one
+    light_source = _get_wiggler_source()
+    light_source.set_radiation_cache(cache)
+    numpy.testing.assert_array_equal(light_source.get_beam().rays, beam1.rays)
+    assert len(calculated_trajectories) == 1
+
+    # other inputs: calculated and stored
+    light_source = _get_wiggler_source(K_vertical=9.0)
+    light_source.set_radiation_cache(cache)
+    light_source.get_beam()
+    assert len(calculated_trajectories) == 2
+    assert cache.get_info()["entries"] == 2
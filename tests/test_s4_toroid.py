@@ -0,0 +1,56 @@
+#
+# S4Toroid: vectorized quartic intercept and root choice, compared with the loop over rays (method=1).
+#
+import numpy
+import pytest
+
+from shadow4.optical_surfaces.s4_toroid import S4Toroid, solve_quartic_batch
+
+def _get_rays(r_maj, r_min, nrays=500):
+    # rays nearly along z, through the torus tube (4 or 2 real roots) or missing it (no real roots)
+    rng = numpy.random.default_rng(0)
+    x1 = numpy.zeros((3, nrays))
+    x1[0] = rng.uniform(-1.5 * r_min, 1.5 * r_min, nrays)
+    x1[1] = rng.uniform(-1.2 * (r_maj + r_min), 1.2 * (r_maj + r_min), nrays)
+    x1[2] = -3.0 * (r_maj + r_min)
+    v1 = numpy.zeros((3, nrays))
+    v1[0] = rng.normal(scale=1e-3, size=nrays)
+    v1[1] = rng.normal(scale=1e-3, size=nrays)
+    v1[2] = 1.0
+    return x1, v1 / numpy.sqrt((v1**2).sum(axis=0))
+
+def _sorted_roots(t0, t1, t2, t3):
+    roots = numpy.vstack((t0, t1, t2, t3)).T
+    return numpy.sort_complex(roots)
+
+def test_solve_quartic_batch_equals_polyroots():
+    rng = numpy.random.default_rng(1)
+    c = rng.normal(size=(4, 200))
+    roots = _sorted_roots(*solve_quartic_batch(*c))
+    for k in range(200):
+        expected = numpy.sort_complex(numpy.polynomial.polynomial.polyroots([c[0, k], c[1, k], c[2, k], c[3, k], 1.0]))
+        numpy.testing.assert_allclose(roots[k], expected, rtol=1e-8, atol=1e-10)
+
+@pytest.mark.parametrize("f_torus", [0, 1, 2, 3])
+def test_vectorized_intercept_equals_loop(f_torus):
+    toroid = S4Toroid(r_maj=1.0, r_min=0.2, f_torus=f_torus)
+    x1, v1 = _get_rays(1.0, 0.2)
+
+    roots0 = toroid.calculate_intercept(x1, v1, method=0)
+    roots1 = toroid.calculate_intercept(x1, v1, method=1)
+    n_real0 = (numpy.vstack(roots0).imag == 0).sum(axis=0)
+    n_real1 = (numpy.vstack(roots1).imag == 0).sum(axis=0)
+    numpy.testing.assert_array_equal(n_real0, n_real1)
+    assert set(n_real1) == {0, 2, 4} # rays through the tube, through one side only, and missing the torus
+    numpy.testing.assert_allclose(_sorted_roots(*roots0), _sorted_roots(*roots1), rtol=1e-9, atol=1e-12)
+
+    answer0, i_res0 = toroid.choose_solution(*roots1, method=0)
+    answer1, i_res1 = toroid.choose_solution(*roots1, method=1)
+    numpy.testing.assert_array_equal(i_res0, i_res1)
+    numpy.testing.assert_array_equal(answer0, answer1)
+    assert (i_res1[n_real1 == 0] == -1).all()
+    assert (answer1[n_real1 == 0] == 0.0).all()
+
+    answer, i_res = toroid.calculate_intercept_and_choose_solution(x1, v1)
+    numpy.testing.assert_array_equal(i_res, i_res1)
+    numpy.testing.assert_allclose(answer, answer1, rtol=1e-9)
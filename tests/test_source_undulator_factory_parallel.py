@@ -0,0 +1,20 @@
+#
+# Undulator radiation calculated in a pool of processes: bit-identical to the serial calculation.
+#
+import numpy
+
+from shadow4.sources.undulator.source_undulator_factory import calculate_undulator_emission
+from shadow4.sources.undulator.source_undulator_factory_parallel import calculate_undulator_emission_in_parallel
+
+def test_undulator_emission_in_parallel_equals_serial():
+    kwargs = dict(electron_energy=6.0, electron_current=0.2, undulator_period=0.018, undulator_nperiods=50, K=1.0,
+                  photon_energy=10000.0, EMAX=11000.0, NG_E=5, MAXANGLE=3e-5, number_of_points=21, NG_P=11,
+                  number_of_trajectory_points=101)
+    serial = calculate_undulator_emission(**kwargs)
+    progress = []
+    parallel = calculate_undulator_emission_in_parallel(code_undul_phot="internal", n_workers=2, n_chunks=3,
+                                    progress_callback=lambda i, n, energy: progress.append(i), **kwargs)
+    assert sorted(progress) == list(range(5))
+    assert sorted(serial.keys()) == sorted(parallel.keys())
+    for key in serial.keys():
+        numpy.testing.assert_array_equal(parallel[key], serial[key], err_msg=key)